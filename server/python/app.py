@@ -5,12 +5,19 @@ FastAPI 主應用
 """
 
 import os
+import re
 import sys
+import copy
 import json
+import time
+import gc
+import asyncio
 import logging
+import threading
+from contextlib import asynccontextmanager
 from datetime import datetime
 from pathlib import Path
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, AsyncIterator, ContextManager, Optional, Sequence, Tuple
 
 # 載入 .env 文件（必須在所有其他 import 之前）
 from dotenv import load_dotenv
@@ -18,7 +25,7 @@ load_dotenv(dotenv_path="/etc/secrets/.env", override=False)
 from fastapi import FastAPI, HTTPException, Request, Query, UploadFile, File
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.middleware.gzip import GZipMiddleware
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, Response, StreamingResponse, RedirectResponse
 from pydantic import BaseModel
 
 # 確保可以導入本地模塊
@@ -48,6 +55,51 @@ from services import (
     normalize_agent_messages,
     # Google 搜索
     reverse_image_search,
+    # 商品目錄
+    CatalogGeneration,
+    CatalogStore,
+    CatalogConflictError,
+    encode_cursor,
+    decode_cursor,
+    # 批量導入
+    IngestError,
+    IngestRegistry,
+    CatalogBuilder,
+    iter_json_array,
+    # 變更日誌
+    CatalogJournal,
+    build_upsert,
+    # 規則意圖預分類
+    IntentRules,
+    is_follow_up,
+    # 對話會話
+    SessionStore,
+    # 請求合併
+    SingleFlight,
+    SharedStream,
+    # 延遲預算
+    LatencyTracker,
+    RequestDeadline,
+    # 模板回覆
+    detect_language,
+    confident_match,
+    render_product_reply,
+    # 圖片縮略圖代理
+    ThumbnailService,
+    ImageProxyError,
+    split_image_urls,
+    snap_width,
+    choose_format,
+    image_resizing_available,
+    IMAGE_CONTENT_TYPES,
+    # 預序列化響應
+    EncodedPayload,
+    etag_matches,
+    # 運行時統計
+    read_process_memory,
+    # 數據下載
+    CatalogDownloadError,
+    download_catalog,
 )
 
 
@@ -67,10 +119,57 @@ PRODUCTS_FILE = os.getenv('PRODUCTS_JSON_PATH') or str(DATA_DIR / 'products.json
 # 遠端數據 URL（Hugging Face）
 REMOTE_DATA_URL = os.getenv('PRODUCTS_DATA_URL') or 'https://huggingface.co/datasets/yixiannn/luxury-products-data/resolve/main/products.json'
 REMOTE_DATA_BEARER = os.getenv('PRODUCTS_DATA_BEARER') or os.getenv('HF_DATA_TOKEN') or ''
+# 可選：期望的 SHA-256（為空時使用響應頭中的校驗和）
+REMOTE_DATA_SHA256 = os.getenv('PRODUCTS_DATA_SHA256') or ''
+# 既未配置校驗和、響應頭（含重定向）中也沒有 SHA-256 時拒絕下載（默認只記錄警告）
+REMOTE_DATA_REQUIRE_CHECKSUM = (os.getenv('PRODUCTS_DATA_REQUIRE_CHECKSUM') or '').lower() in ('1', 'true', 'yes')
+# 定期檢查遠端數據更新的間隔（秒），0 表示不刷新
+REMOTE_REFRESH_INTERVAL = int(os.getenv('PRODUCTS_REFRESH_INTERVAL') or 0)
+# 監視本地數據文件變更的間隔（秒），0 表示不監視
+PRODUCTS_WATCH_INTERVAL = int(os.getenv('PRODUCTS_WATCH_INTERVAL') or 10)
+# 商品目錄首次載入失敗後的重試間隔（秒），0 表示不重試
+CATALOG_RETRY_INTERVAL = int(os.getenv('CATALOG_RETRY_INTERVAL') or 15)
+
+# 每個世代預序列化的熱門品牌數（/api/products?brand=...&slim=true）
+PRECOMPUTED_BRANDS = int(os.getenv('PRECOMPUTED_BRANDS') or 10)
+# 單條修改後延遲多少秒再預計算響應（期間的連續修改合併為一次）
+CATALOG_WARM_DEBOUNCE = float(os.getenv('CATALOG_WARM_DEBOUNCE') or 2)
+
+# 變更日誌壓縮：檢查間隔（秒）與觸發閾值（未壓縮記錄數 / 日誌字節數）
+JOURNAL_COMPACT_INTERVAL = int(os.getenv('JOURNAL_COMPACT_INTERVAL') or 30)
+JOURNAL_COMPACT_RECORDS = int(os.getenv('JOURNAL_COMPACT_RECORDS') or 500)
+JOURNAL_COMPACT_BYTES = int(os.getenv('JOURNAL_COMPACT_BYTES') or 8 * 1024 * 1024)
+
+# 圖片縮略圖代理（/api/img）：磁盤緩存目錄與容量、原圖下載超時、允許的圖片域名（逗號分隔，空表示不限）
+IMAGE_CACHE_DIR = os.getenv('IMAGE_CACHE_DIR') or str(DATA_DIR / 'image_cache')
+IMAGE_CACHE_MAX_BYTES = int(os.getenv('IMAGE_CACHE_MAX_MB') or 512) * 1024 * 1024
+IMAGE_FETCH_TIMEOUT = float(os.getenv('IMAGE_FETCH_TIMEOUT') or 10)
+IMAGE_ALLOWED_HOSTS = [h.strip() for h in (os.getenv('IMAGE_ALLOWED_HOSTS') or '').split(',') if h.strip()]
+# 允許代理內網地址（僅用於本地測試）
+IMAGE_ALLOW_PRIVATE = (os.getenv('IMAGE_ALLOW_PRIVATE') or '').lower() in ('1', 'true', 'yes')
+
+# 管理員密鑰（請求頭 x-admin-key）
+ADMIN_KEY = os.getenv('ADMIN_KEY') or ''
 
 # 最大查詢長度
 MAX_QUERY_LENGTH = 300
 
+# 對話會話（請求帶 session_id 時啟用，歷史保存在當前 worker 的內存中）：
+# 最大會話數（0 表示關閉）、空閒超時（秒）、內存上限、每個會話保留的消息數
+AGENT_SESSION_MAX = int(os.getenv('AGENT_SESSION_MAX') or 10000)
+AGENT_SESSION_TTL = float(os.getenv('AGENT_SESSION_TTL') or 1800)
+AGENT_SESSION_MAX_BYTES = int(os.getenv('AGENT_SESSION_MAX_MB') or 64) * 1024 * 1024
+AGENT_SESSION_HISTORY = int(os.getenv('AGENT_SESSION_HISTORY') or 20)
+
+# 模板回覆：本地首個候選分數不低於該值（120 = 參考號完全匹配）時直接用模板回覆，不調用 DeepSeek
+AGENT_TEMPLATE_MIN_SCORE = int(os.getenv('AGENT_TEMPLATE_MIN_SCORE') or 120)
+
+# 單次調用模式：先按預處理後的查詢做本地搜索，再用一次結構化輸出同時完成意圖分類和回覆
+AGENT_SINGLE_CALL = (os.getenv('AGENT_SINGLE_CALL') or '').lower() in ('1', 'true', 'yes')
+
+# 智能助手請求的整體截止時間（秒）：意圖分類和回覆生成各自的預算（DEEPSEEK_*_DEADLINE）不超過剩餘時間
+AGENT_DEADLINE = float(os.getenv('AGENT_DEADLINE') or 30)
+
 # Feel Europe 介紹關鍵詞
 ABOUT_FEEL_KEYWORDS = [
     'feel europe', 'feel-europe', 'feeleurope', '介绍feel', 'feel介绍',
@@ -96,6 +195,8 @@ class Message(BaseModel):
 class AgentRequest(BaseModel):
     query: Optional[str] = None
     messages: Optional[List[Message]] = []
+    # 會話 id：空字符串表示新建會話；已有會話時只需發送 query
+    session_id: Optional[str] = None
 
 
 class AgentResponse(BaseModel):
@@ -106,6 +207,9 @@ class AgentResponse(BaseModel):
     reference: Optional[str] = None
     matched: Optional[bool] = None
     online: Optional[bool] = None
+    session_id: Optional[str] = None
+    # 生成回覆的 DeepSeek 調用的提示詞 token 數：estimated 本地估算，reported API 返回（未返回時為 None）
+    prompt_tokens: Optional[Dict[str, Optional[int]]] = None
 
 
 class NormalizeFamilleRequest(BaseModel):
@@ -119,10 +223,39 @@ class NormalizeFamilleResponse(BaseModel):
 
 # ============ FastAPI 應用 ============
 
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """
+    應用生命週期
+
+    啟動時立即綁定端口，商品目錄在後台線程中下載並載入，
+    載入成功前 /api/ready 與搜索端點返回 503，失敗時按間隔重試
+    """
+    loader = asyncio.create_task(_load_catalog_until_ready(CATALOG_RETRY_INTERVAL))
+    background = []
+    if REMOTE_REFRESH_INTERVAL > 0:
+        background.append(asyncio.create_task(_refresh_catalog_periodically(REMOTE_REFRESH_INTERVAL)))
+    if PRODUCTS_WATCH_INTERVAL > 0:
+        background.append(asyncio.create_task(_watch_products_file(PRODUCTS_WATCH_INTERVAL)))
+    # 多 worker 共享變更日誌：只由搶到壓縮鎖的 worker 執行壓縮
+    if JOURNAL_COMPACT_INTERVAL > 0 and catalog_journal.claim_compactor():
+        background.append(asyncio.create_task(_compact_journal_periodically(JOURNAL_COMPACT_INTERVAL)))
+    yield
+    for task in background:
+        task.cancel()
+    if not loader.done():
+        logger.info("商品目錄仍在載入中，應用關閉")
+        loader.cancel()
+    catalog_journal.close()
+    await thumbnail_service.aclose()
+    await deepseek_client.aclose()
+
+
 app = FastAPI(
     title="Feel Europe Luxury API",
     description="奢侈品價格查詢智能助手 API",
     version="1.0.0",
+    lifespan=lifespan,
 )
 
 # GZip 壓縮中間件 - 自動壓縮大於 500 字節的響應
@@ -135,6 +268,7 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["ETag", "X-Catalog-Version", "X-Catalog-Generation"],
 )
 
 
@@ -163,98 +297,308 @@ async def log_ip_middleware(request: Request, call_next):
         pass
     return await call_next(request)
 
-# 全局產品緩存（啟動時一次載入，常駐內存）
-_products_cache: List[Dict[str, Any]] = []
-_products_loaded = False
+# 商品目錄：不可變世代，後台構建後原子切換（常駐內存）
+# 單條修改追加寫入變更日誌，載入時在數據文件上重放
+catalog_journal = CatalogJournal(PRODUCTS_FILE)
+catalog_store = CatalogStore(journal=catalog_journal)
+
+# 商品目錄載入進度（後台線程寫入，/api/ready 讀取）
+_catalog_state: Dict[str, Any] = {
+    'status': 'pending',  # pending / downloading / parsing / normalizing / ready / failed
+    'loaded': 0,
+    'total': 0,
+    'error': None,
+    'started_at': None,
+    'ready_at': None,
+    'reloaded_at': None,
+}
+_catalog_lock = threading.Lock()
+
+
+def get_cached_products() -> Sequence[Dict[str, Any]]:
+    """獲取當前世代的商品數據（載入完成後無磁盤IO）"""
+    gen = catalog_store.current
+    return gen.products if gen is not None else ()
+
+
+def _set_catalog_state(**fields) -> None:
+    """更新商品目錄載入狀態"""
+    _catalog_state.update(fields)
+
+
+def is_catalog_ready() -> bool:
+    """商品目錄是否已載入完成"""
+    return catalog_store.is_ready
+
+
+def require_catalog_ready() -> None:
+    """商品目錄未就緒時返回 503，提示客戶端稍後重試"""
+    if not catalog_store.is_ready:
+        raise HTTPException(
+            status_code=503,
+            detail="catalog_loading",
+            headers={"Retry-After": "5"},
+        )
+
 
-def get_cached_products() -> List[Dict[str, Any]]:
-    """獲取內存中的商品數據（啟動時已載入，無磁盤IO）"""
-    return _products_cache
+def _normalize_progress(done: int, total: int) -> None:
+    _set_catalog_state(status='normalizing', loaded=done, total=total)
 
 
 def _load_products_into_memory():
-    """將商品數據載入內存並規範化（只在啟動時調用一次）"""
-    global _products_cache, _products_loaded
-    import time
-    
+    """
+    將商品數據載入內存並規範化（首次載入）
+
+    讀取或解析失敗時直接拋出，不發布空世代：目錄保持未就緒，由調用方標記失敗並重試
+    """
     start = time.time()
-    raw = []
+    _set_catalog_state(status='parsing')
+    gen = catalog_store.load_file(PRODUCTS_FILE, progress=_normalize_progress)
+    elapsed = time.time() - start
+    _set_catalog_state(status='ready', loaded=len(gen), ready_at=datetime.now().isoformat())
+    logger.info(f"✅ 商品數據已載入內存: {len(gen)} 條，耗時 {elapsed:.2f}s")
+    warm_catalog_payloads(gen)
+
+
+def load_catalog() -> None:
+    """後台任務：下載數據 → 載入內存（只執行一次）"""
+    if not _catalog_lock.acquire(blocking=False):
+        return
     try:
-        if os.path.exists(PRODUCTS_FILE):
-            with open(PRODUCTS_FILE, 'r', encoding='utf-8') as f:
-                raw = json.load(f)
+        if catalog_store.is_ready:
+            return
+        _set_catalog_state(status='downloading', started_at=datetime.now().isoformat(), error=None)
+        ensure_data_file()
+        _load_products_into_memory()
     except Exception as e:
-        logger.error(f"讀取商品數據失敗: {e}")
-    
-    # 一次性規範化所有 Famille
-    _products_cache = [
-        {**p, 'Famille': normalize_famille(p.get('Famille', ''))}
-        for p in raw
-    ]
-    _products_loaded = True
+        logger.error(f"商品目錄載入失敗: {e}")
+        _set_catalog_state(status='failed', error=str(e))
+    finally:
+        _catalog_lock.release()
+
+
+async def _load_catalog_until_ready(retry_interval: int) -> None:
+    """後台載入商品目錄，失敗時每隔 retry_interval 秒重試，直到載入成功"""
+    while True:
+        await asyncio.to_thread(load_catalog)
+        if catalog_store.is_ready or retry_interval <= 0:
+            return
+        logger.info(f"商品目錄未就緒，{retry_interval} 秒後重試載入")
+        await asyncio.sleep(retry_interval)
+
+
+def preload_catalog(workers: int = 1) -> None:
+    """
+    多 worker 部署：在 fork 之前同步載入商品目錄（見 gunicorn.conf.py）
+
+    載入後凍結 GC 堆，避免 worker 中的 GC 掃描改寫對象頭；
+    請求處理中的引用計數仍會寫入商品對象，共享頁隨流量逐步被複製，
+    穩態時每個 worker 仍接近持有一份目錄（實測數據見 gunicorn.conf.py），
+    主要收益是 worker 無需各自解析目錄
+
+    Args:
+        workers: worker 數，大於 1 時提示按進程保存的狀態
+    """
+    if workers > 1:
+        logger.warning(
+            f"以 {workers} 個 worker 運行：對話會話、意圖緩存、DeepSeek 併發上限與熔斷按進程保存，"
+            f"會話需按 session_id 粘性路由；商品修改在其他 worker 上最多延遲 {PRODUCTS_WATCH_INTERVAL} 秒可見"
+        )
+        if PRODUCTS_WATCH_INTERVAL <= 0:
+            logger.warning("PRODUCTS_WATCH_INTERVAL=0：其他 worker 的商品修改只在下次寫入或重啟時同步")
+    load_catalog()
+    gc.collect()
+    gc.freeze()
+    logger.info(f"商品目錄已預載入並凍結堆: {gc.get_freeze_count()} 個對象")
+
+
+def reload_catalog(reason: str = 'manual') -> Dict[str, Any]:
+    """
+    熱重載：在請求路徑之外構建新世代後原子切換
+
+    進行中的請求繼續使用舊世代，排空後舊世代被釋放；
+    讀取或解析失敗時保留當前世代
+    """
+    start = time.time()
+    gen = catalog_store.load_file(PRODUCTS_FILE)
     elapsed = time.time() - start
-    logger.info(f"✅ 商品數據已載入內存: {len(_products_cache)} 條，耗時 {elapsed:.2f}s")
+    _set_catalog_state(status='ready', loaded=len(gen), total=len(gen), reloaded_at=datetime.now().isoformat())
+    logger.info(f"🔄 商品目錄已重載（{reason}）: 世代 {gen.generation}, {len(gen)} 條，耗時 {elapsed:.2f}s")
+    warm_catalog_payloads(gen)
+    return {'generation': gen.generation, 'total': len(gen), 'elapsed': round(elapsed, 3)}
+
+
+async def _watch_products_file(interval: int) -> None:
+    """
+    監視 PRODUCTS_FILE，文件變更後自動熱重載
+
+    同時監視變更日誌：其他 worker 寫入的單條修改在下一輪檢查時應用到本進程
+    """
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            if catalog_store.is_stale(PRODUCTS_FILE):
+                await asyncio.to_thread(reload_catalog, 'file_changed')
+            elif catalog_store.is_ready and catalog_journal.changed_on_disk():
+                gen = await asyncio.to_thread(catalog_store.sync_journal)
+                if gen is not None:
+                    schedule_catalog_warm()
+        except Exception as e:
+            logger.error(f"商品數據文件變更後重載失敗: {e}")
 
 
 # ============ 工具函數 ============
 
-def ensure_data_file():
-    """確保數據文件存在，如果不存在則從遠端下載"""
-    import requests
-    
-    if os.path.exists(PRODUCTS_FILE):
+def _download_progress(done: int, total: Optional[int]) -> None:
+    _set_catalog_state(loaded=done, total=total or 0)
+
+
+def ensure_data_file(refresh: bool = False) -> bool:
+    """
+    確保數據文件存在，如果不存在則從遠端下載
+
+    Args:
+        refresh: 文件已存在時也向遠端發送條件請求檢查更新
+
+    Returns:
+        本地文件是否被更新
+    """
+    if os.path.exists(PRODUCTS_FILE) and not refresh:
         logger.info(f"數據文件已存在: {PRODUCTS_FILE}")
-        return
+        return False
     
     if not REMOTE_DATA_URL:
         logger.warning("數據文件不存在且 PRODUCTS_DATA_URL 未設置")
-        return
+        return False
     
     try:
         logger.info(f"正在從 {REMOTE_DATA_URL} 下載數據...")
-        headers = {}
-        if REMOTE_DATA_BEARER:
-            headers['Authorization'] = f'Bearer {REMOTE_DATA_BEARER}'
-        
-        response = requests.get(REMOTE_DATA_URL, headers=headers, timeout=60)
-        response.raise_for_status()
-        
-        # 確保目錄存在
-        os.makedirs(os.path.dirname(PRODUCTS_FILE), exist_ok=True)
-        
-        # 寫入文件
-        with open(PRODUCTS_FILE, 'wb') as f:
-            f.write(response.content)
-        
-        logger.info(f"數據文件下載成功: {PRODUCTS_FILE}")
-    except Exception as e:
+        result = download_catalog(
+            REMOTE_DATA_URL,
+            PRODUCTS_FILE,
+            bearer=REMOTE_DATA_BEARER,
+            expected_sha256=REMOTE_DATA_SHA256 or None,
+            progress=None if refresh else _download_progress,
+            require_checksum=REMOTE_DATA_REQUIRE_CHECKSUM,
+        )
+        return result['status'] == 'downloaded'
+    except CatalogDownloadError as e:
         logger.error(f"下載數據文件失敗: {e}")
+        return False
+
 
+def refresh_catalog() -> bool:
+    """檢查遠端數據是否更新，有更新時熱重載"""
+    if not ensure_data_file(refresh=True):
+        return False
+    reload_catalog('remote_refresh')
+    return True
 
-# 應用啟動時：下載數據 → 載入內存
-ensure_data_file()
-_load_products_into_memory()
 
-# 初始化服務（ProductSearcher 直接使用內存數據）
-product_searcher = ProductSearcher(products=_products_cache)
+async def _refresh_catalog_periodically(interval: int) -> None:
+    """後台定期刷新：遠端未變更時每次只花費一個 304 請求"""
+    while True:
+        await asyncio.sleep(interval)
+        if not is_catalog_ready():
+            continue
+        try:
+            await asyncio.to_thread(refresh_catalog)
+        except Exception as e:
+            logger.error(f"刷新商品數據失敗: {e}")
+
+
+# 初始化服務（ProductSearcher 始終讀取當前世代）
+product_searcher = ProductSearcher(data_file=PRODUCTS_FILE, store=catalog_store)
 deepseek_client = DeepSeekClient()
 
 
-def read_products() -> List[Dict[str, Any]]:
+def _is_known_ref(token: str) -> bool:
+    gen = catalog_store.current
+    return gen is not None and gen.get_by_produit(token) is not None
+
+
+def _is_intent_cached(query: str) -> bool:
+    return deepseek_client.intent_cache_key(query) in deepseek_client.intent_cache
+
+
+# 有把握的查詢（參考號、問候、在線查詢）直接按規則分類，不調用 DeepSeek
+# （意圖緩存已有的查詢不計入節省的調用數）
+intent_rules = IntentRules(is_known_ref=_is_known_ref, is_cached=_is_intent_cached)
+
+# 對話會話（多 worker 部署時需按 session_id 粘性路由，否則會話經常未命中，客戶端需重發完整歷史）
+agent_sessions = SessionStore(
+    max_sessions=AGENT_SESSION_MAX,
+    ttl=AGENT_SESSION_TTL,
+    max_bytes=AGENT_SESSION_MAX_BYTES,
+    max_history=AGENT_SESSION_HISTORY,
+)
+
+# 圖片縮略圖代理（/api/img）
+thumbnail_service = ThumbnailService(
+    cache_dir=IMAGE_CACHE_DIR,
+    max_cache_bytes=IMAGE_CACHE_MAX_BYTES,
+    timeout=IMAGE_FETCH_TIMEOUT,
+    allow_private=IMAGE_ALLOW_PRIVATE,
+    allowed_hosts=IMAGE_ALLOWED_HOSTS,
+)
+
+
+def read_products() -> Sequence[Dict[str, Any]]:
     """讀取商品數據（從內存緩存）"""
     return get_cached_products()
 
 
-def write_products(data: List[Dict[str, Any]]) -> bool:
-    """寫入商品數據"""
-    try:
-        os.makedirs(os.path.dirname(PRODUCTS_FILE), exist_ok=True)
-        with open(PRODUCTS_FILE, 'w', encoding='utf-8') as f:
-            json.dump(data, f, ensure_ascii=False, indent=2)
-        return True
-    except Exception as e:
-        logger.error(f"寫入商品數據失敗: {e}")
-        return False
+def compact_journal() -> None:
+    """未壓縮的變更達到閾值時，把當前世代寫成新的數據文件快照並截斷日誌"""
+    if catalog_store.is_ready and catalog_journal.changed_on_disk():
+        # 其他 worker 追加的記錄計入待壓縮數
+        catalog_store.sync_journal()
+    if catalog_journal.pending == 0:
+        return
+    if catalog_journal.pending < JOURNAL_COMPACT_RECORDS and catalog_journal.size_bytes() < JOURNAL_COMPACT_BYTES:
+        return
+    catalog_store.compact()
+
+
+async def _compact_journal_periodically(interval: int) -> None:
+    """後台定期壓縮變更日誌"""
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            await asyncio.to_thread(compact_journal)
+        except Exception as e:
+            logger.error(f"壓縮變更日誌失敗: {e}")
+
+
+_warm_task: Optional[asyncio.Task] = None
+
+
+async def _warm_current_catalog() -> None:
+    """
+    預計算當前世代的響應；期間又有新世代發布時繼續處理最新的一個
+
+    每輪先等待 CATALOG_WARM_DEBOUNCE 秒：連續修改只為最後一個世代預計算
+    """
+    warmed = None
+    while catalog_store.current is not warmed:
+        await asyncio.sleep(CATALOG_WARM_DEBOUNCE)
+        warmed = catalog_store.current
+        await asyncio.to_thread(warm_catalog_payloads, warmed)
+
+
+def schedule_catalog_warm() -> None:
+    """連續修改時合併預計算（防抖），只處理最新世代，不阻塞修改請求"""
+    global _warm_task
+    if _warm_task is None or _warm_task.done():
+        _warm_task = asyncio.create_task(_warm_current_catalog())
+
+
+def require_admin(request: Request) -> None:
+    """校驗管理員密鑰（請求頭 x-admin-key）"""
+    if not ADMIN_KEY:
+        raise HTTPException(status_code=503, detail="admin_key_not_configured")
+    if request.headers.get('x-admin-key') != ADMIN_KEY:
+        raise HTTPException(status_code=401, detail="invalid_admin_key")
 
 
 def is_about_feel(query: str) -> bool:
@@ -267,10 +611,112 @@ def is_about_feel(query: str) -> bool:
 
 @app.get("/api/health")
 def health_check():
-    """健康檢查端點"""
+    """存活檢查端點（不依賴商品目錄）"""
     return {"ok": True}
 
 
+@app.get("/api/ready")
+def readiness_check():
+    """就緒檢查端點：返回商品目錄載入進度，未就緒時狀態碼為 503"""
+    state = dict(_catalog_state)
+    state['ready'] = is_catalog_ready()
+    gen = catalog_store.current
+    state['generation'] = gen.generation if gen else None
+    state['draining'] = catalog_store.retired_status()
+    headers = {"Cache-Control": "no-store"}
+    if not state['ready']:
+        headers["Retry-After"] = str(CATALOG_RETRY_INTERVAL or 5)
+    return JSONResponse(
+        content=state,
+        status_code=200 if state['ready'] else 503,
+        headers=headers,
+    )
+
+
+@app.get("/api/metrics")
+def metrics():
+    """運行指標：當前 worker 的內存佔用與商品目錄世代"""
+    gen = catalog_store.current
+    return JSONResponse(
+        content={
+            'pid': os.getpid(),
+            'memory': read_process_memory(),
+            'catalog': {
+                'generation': gen.generation if gen else None,
+                'products': len(gen) if gen else 0,
+                'gc_frozen_objects': gc.get_freeze_count(),
+                'journal': catalog_journal.stats(),
+            },
+            'images': thumbnail_service.stats(),
+            'intent_cache': deepseek_client.intent_cache.stats(),
+            'prompt_tokens': deepseek_client.prompt_builder.stats(),
+            'llm_bulkhead': deepseek_client.bulkhead.stats(),
+            'latency': {'agent': agent_latency.stats(), 'llm': deepseek_client.latency.stats()},
+            'hedging': deepseek_client.hedger.stats(),
+            'intent_rules': intent_rules.stats(),
+            'speculative_search': dict(_speculation_stats),
+            'single_call': dict(_single_call_stats),
+            'replies': _reply_metrics(),
+            'sessions': {**agent_sessions.stats(), **_session_stats},
+            'coalescing': {**agent_flight.stats(), **_coalesce_stats},
+        },
+        headers={"Cache-Control": "no-store"},
+    )
+
+
+@app.post("/api/admin/reload")
+async def admin_reload(request: Request):
+    """管理端點：從 PRODUCTS_FILE 熱重載商品目錄（不中斷進行中的請求）"""
+    require_admin(request)
+    require_catalog_ready()
+    try:
+        result = await asyncio.to_thread(reload_catalog, 'admin')
+    except (OSError, ValueError) as e:
+        logger.error(f"商品目錄重載失敗: {e}")
+        raise HTTPException(status_code=500, detail=f"reload_failed: {e}")
+    return result
+
+
+@app.get("/api/img")
+async def image_thumbnail(
+    request: Request,
+    url: str = Query(..., max_length=8192, description="圖片 URL（可直接傳商品圖片字段，多個 URL 以逗號分隔）"),
+    i: int = Query(0, ge=0, description="字段中有多個 URL 時取第幾個"),
+    w: int = Query(384, ge=16, le=4096, description="目標寬度（向上取整到固定檔位）"),
+    fmt: str = Query('auto', alias='format', pattern='^(auto|webp|jpeg)$', description="輸出格式，auto 按 Accept 選擇"),
+):
+    """
+    圖片縮略圖代理
+
+    原圖只下載一次，縮放並重新編碼後存入磁盤緩存；
+    響應可長期緩存（同一 URL + 寬度 + 格式的內容不變）
+    """
+    urls = split_image_urls(url)
+    if i >= len(urls):
+        raise HTTPException(status_code=404, detail="image_not_found")
+    target = urls[i]
+    if not image_resizing_available():
+        # 未安裝 Pillow：退回原圖
+        return RedirectResponse(target, status_code=307)
+
+    width = snap_width(w)
+    out_fmt = choose_format(fmt, request.headers.get('accept'))
+    headers = {"Cache-Control": "public, max-age=31536000, immutable"}
+    if fmt == 'auto':
+        headers["Vary"] = "Accept"
+    etag = f'"{thumbnail_service.thumbnail_key(target, width, out_fmt)[:32]}"'
+    headers["ETag"] = etag
+    if etag_matches(request.headers.get('if-none-match'), etag):
+        return Response(status_code=304, headers=headers)
+
+    try:
+        data, _ = await thumbnail_service.thumbnail(target, width, out_fmt)
+    except ImageProxyError as e:
+        logger.warning(f"[ImageProxy] {e.detail}: {target[:120]}")
+        raise HTTPException(status_code=e.status_code, detail=e.detail)
+    return Response(content=data, media_type=IMAGE_CONTENT_TYPES[out_fmt], headers=headers)
+
+
 @app.post("/api/reverse-image-search")
 async def reverse_image_search_endpoint(file: UploadFile = File(...)):
     """
@@ -296,50 +742,197 @@ LIST_FIELDS = {
     'Perso_Lien_Photo', 'image_url', 'Lien_Externe', 'Motif', 'Matiere', 'Dimension',
 }
 
-def _slim_product(p: Dict[str, Any]) -> Dict[str, Any]:
-    """只返回前端列表需要的字段，減少傳輸量"""
-    return {k: v for k, v in p.items() if k in LIST_FIELDS}
+# 常用字段組合：每個世代發布後預計算投影並預序列化完整列表
+FIELD_PRESETS = {
+    'list': tuple(sorted(LIST_FIELDS)),  # 商品網格（slim=true）
+    'admin': ('Marque', 'Prix_Vente', 'designation', 'produit'),  # 管理後台表格
+    'price': ('Marque', 'Prix_Vente', 'designation', 'prix_achat', 'produit'),  # 價格表
+}
+
+# fields= 參數限制
+MAX_FIELDS = 40
+_FIELD_NAME_RE = re.compile(r'^[A-Za-z0-9_]{1,64}$')
+
+
+def _resolve_fields(fields: Optional[str], slim: bool) -> Optional[Tuple[str, ...]]:
+    """
+    解析字段投影參數
+
+    - fields=a,b,c：只返回指定字段（優先於 slim）
+    - slim=true：等同於列表字段 LIST_FIELDS
+    - 都未提供：返回完整商品（None）
+    """
+    if fields:
+        names = {f.strip() for f in fields.split(',') if f.strip()}
+        if not names or len(names) > MAX_FIELDS or not all(_FIELD_NAME_RE.match(n) for n in names):
+            raise HTTPException(status_code=400, detail="invalid_fields")
+        return tuple(sorted(names))
+    if slim:
+        return FIELD_PRESETS['list']
+    return None
+
+
+def _catalog_payload(gen, brand: Optional[str], fields: Optional[Tuple[str, ...]]) -> Optional[EncodedPayload]:
+    """
+    獲取世代內預序列化、預壓縮的完整商品列表
+
+    只緩存完整商品和常用字段組合；其他字段組合返回 None
+    """
+    if fields is not None and fields not in FIELD_PRESETS.values():
+        return None
+    brand_key = (brand or '').lower().strip()
+    if brand_key and brand_key not in gen.by_brand:
+        brand_key = '\0'  # 所有未知品牌共用同一個空結果
+
+    def build() -> EncodedPayload:
+        products = gen.get_by_brand(brand_key) if brand_key else gen.products
+        return EncodedPayload(gen.project(products, fields), fast=gen.derived)
+
+    return gen.memo(('payload', brand_key, fields), build)
+
+
+def warm_catalog_payloads(gen) -> None:
+    """
+    新世代發布後預先計算常用投影，序列化並壓縮最常見的響應
+
+    單條修改派生的世代只預編碼不帶參數的全量響應（快速壓縮級別），
+    其他響應在首次請求時按需生成；投影由上一世代增量繼承
+    """
+    start = time.time()
+    for preset in FIELD_PRESETS.values():
+        gen.projection(preset, force=True)
+    if gen.derived:
+        _catalog_payload(gen, None, None)
+        logger.info(f"預序列化全量商品響應完成（增量世代 {gen.generation}），耗時 {time.time() - start:.2f}s")
+        return
+    for fields in (FIELD_PRESETS['list'], None):
+        _catalog_payload(gen, None, fields)
+    for brand in gen.top_brands(PRECOMPUTED_BRANDS):
+        _catalog_payload(gen, brand, FIELD_PRESETS['list'])
+    logger.info(f"預序列化商品列表響應完成（世代 {gen.generation}），耗時 {time.time() - start:.2f}s")
+
+
+def _catalog_version(gen) -> str:
+    """世代對應的客戶端版本號（用於 /api/products/changes 增量同步）"""
+    return catalog_store.changes.version_token(gen.generation)
+
+
+def _encoded_response(request: Request, payload: EncodedPayload, cache_control: str, version: str) -> Response:
+    """
+    按 Accept-Encoding 返回預編碼的字節，If-None-Match 命中時返回 304
+
+    每種編碼使用各自的 ETag 變體，If-None-Match 帶任一變體都視為命中
+    """
+    body, encoding = payload.select(request.headers.get('accept-encoding'))
+    headers = {
+        "ETag": payload.etag_for(encoding),
+        "Cache-Control": cache_control,
+        "Vary": "Accept-Encoding",
+        "X-Catalog-Version": version,
+    }
+    if etag_matches(request.headers.get('if-none-match'), payload.etag):
+        return Response(status_code=304, headers=headers)
+    if encoding:
+        headers["Content-Encoding"] = encoding
+    return Response(content=body, media_type="application/json", headers=headers)
+
+
+# NDJSON 導出時每次寫出的商品條數（限制緩衝大小）
+NDJSON_BATCH_SIZE = 200
+
+
+def _stream_ndjson(
+    lease: ContextManager[CatalogGeneration],
+    gen: CatalogGeneration,
+    brand: Optional[str],
+    fields: Optional[Tuple[str, ...]],
+):
+    """
+    逐行輸出商品（每行一個 JSON 對象）
+
+    整個導出期間持有調用方取得的同一世代（與響應頭中的世代一致），
+    熱重載不會導致導出內容前後不一致，導出結束或客戶端斷開時釋放；
+    每批最多 NDJSON_BATCH_SIZE 條，內存佔用與目錄大小無關
+    """
+    try:
+        products = gen.get_by_brand(brand) if brand else gen.products
+        for start in range(0, len(products), NDJSON_BATCH_SIZE):
+            batch = gen.project(products[start:start + NDJSON_BATCH_SIZE], fields)
+            lines = [json.dumps(p, ensure_ascii=False, separators=(',', ':')) for p in batch]
+            yield ('\n'.join(lines) + '\n').encode('utf-8')
+    finally:
+        lease.__exit__(None, None, None)
+
+
+def _ndjson_response(brand: Optional[str], fields: Optional[Tuple[str, ...]]) -> StreamingResponse:
+    lease = catalog_store.lease()
+    gen = lease.__enter__()
+    return StreamingResponse(
+        _stream_ndjson(lease, gen, brand, fields),
+        media_type="application/x-ndjson",
+        headers={
+            "Cache-Control": "no-store",
+            "X-Catalog-Generation": str(gen.generation),
+        },
+    )
 
 
 @app.get("/api/products")
 def get_products(
+    request: Request,
     page: int = Query(None, ge=1, description="頁碼，從 1 開始"),
     limit: int = Query(None, ge=1, le=500, description="每頁數量，最大 500"),
     brand: str = Query(None, description="按品牌篩選"),
     slim: bool = Query(False, description="是否返回精簡字段"),
+    fields: str = Query(None, description="只返回指定字段，逗號分隔（優先於 slim）"),
+    fmt: str = Query('json', alias='format', pattern='^(json|ndjson)$', description="json 或 ndjson（逐行流式導出）"),
+    cursor: str = Query(None, description="游標分頁：首頁傳空字符串，之後傳上一頁的 next_cursor"),
 ):
     """
     獲取商品列表
-    
-    - 不帶參數：返回所有商品（向後兼容）
+
+    - 不帶參數：返回所有商品（向後兼容，預序列化並壓縮，支持 ETag）
     - page + limit：分頁返回
     - brand：按品牌篩選
     - slim=true：只返回列表顯示所需字段
+    - fields=produit,Marque,Prix_Vente：只返回指定字段
+    - format=ndjson：流式導出全部商品，每行一個商品
+    - cursor (+ limit)：按 produit 排序的游標分頁，翻頁不重複、不遺漏
     """
-    products = get_cached_products()
-    
+    require_catalog_ready()
+    projection = _resolve_fields(fields, slim)
+    if fmt == 'ndjson':
+        return _ndjson_response(brand, projection)
+    with catalog_store.lease() as gen:
+        if cursor is not None:
+            return _build_products_cursor_page(gen, cursor, limit or 50, brand, projection)
+        # 如果沒有分頁參數，返回全部（向後兼容）
+        if page is None or limit is None:
+            payload = _catalog_payload(gen, brand, projection)
+            if payload is not None:
+                return _encoded_response(request, payload, "public, max-age=300", _catalog_version(gen))  # 瀏覽器緩存 5 分鐘
+            products = gen.get_by_brand(brand) if brand else gen.products
+            return JSONResponse(
+                content=gen.project(products, projection),
+                headers={"Cache-Control": "public, max-age=300", "X-Catalog-Version": _catalog_version(gen)},
+            )
+        return _build_products_page(gen, page, limit, brand, projection)
+
+
+def _build_products_page(gen, page, limit, brand, fields) -> JSONResponse:
+    """在持有世代期間構建分頁響應"""
+    products = gen.products
+
     # 品牌篩選
     if brand:
-        brand_lower = brand.lower().strip()
-        products = [p for p in products if p.get('Marque', '').lower().strip() == brand_lower]
-    
-    # 精簡字段
-    if slim:
-        products = [_slim_product(p) for p in products]
-    
-    # 如果沒有分頁參數，返回全部（向後兼容）
-    if page is None or limit is None:
-        return JSONResponse(
-            content=products,
-            headers={"Cache-Control": "public, max-age=300"}  # 瀏覽器緩存 5 分鐘
-        )
-    
+        products = gen.get_by_brand(brand)
+
     # 分頁
     total = len(products)
     start = (page - 1) * limit
     end = start + limit
-    items = products[start:end]
-    
+    items = gen.project(products[start:end], fields)
+
     return JSONResponse(
         content={
             "items": items,
@@ -348,24 +941,246 @@ def get_products(
             "limit": limit,
             "pages": (total + limit - 1) // limit
         },
-        headers={"Cache-Control": "public, max-age=300"}
+        headers={"Cache-Control": "public, max-age=300", "X-Catalog-Version": _catalog_version(gen)}
     )
 
 
+def _build_products_cursor_page(gen, cursor: str, limit: int, brand, fields) -> JSONResponse:
+    """
+    鍵集游標分頁：每頁耗時 O(log n + limit)
+
+    游標記錄上一頁最後一條商品的排序鍵；目錄在翻頁期間更新時，
+    從新世代中相同排序位置之後繼續，已返回的商品不會重複
+    """
+    brand_key = (brand or '').lower().strip()
+    after = None
+    generation_changed = False
+    if cursor:
+        try:
+            decoded = decode_cursor(cursor)
+        except ValueError:
+            raise HTTPException(status_code=400, detail="invalid_cursor")
+        if decoded['brand'] != brand_key:
+            raise HTTPException(status_code=400, detail="cursor_brand_mismatch")
+        after = decoded['key']
+        generation_changed = decoded['generation'] != gen.generation
+
+    items, next_key, total = gen.page_after(after, limit, brand_key)
+
+    return JSONResponse(
+        content={
+            "items": gen.project(items, fields),
+            "next_cursor": encode_cursor(gen.generation, next_key, brand_key) if next_key else None,
+            "limit": limit,
+            "total": total,
+            "generation": gen.generation,
+            "generation_changed": generation_changed,
+        },
+        headers={"Cache-Control": "no-store", "X-Catalog-Version": _catalog_version(gen)},
+    )
+
+
+@app.get("/api/products/changes")
+def get_product_changes(
+    since: str = Query(..., description="客戶端持有的目錄版本號（X-Catalog-Version）"),
+    slim: bool = Query(False, description="是否返回精簡字段"),
+    fields: str = Query(None, description="只返回指定字段，逗號分隔（優先於 slim）"),
+):
+    """
+    增量同步：返回指定版本之後新增/修改和刪除的商品
+
+    版本號已被壓縮或不屬於當前進程時返回 full_resync=true，客戶端應重新拉取全量列表
+    """
+    require_catalog_ready()
+    projection = _resolve_fields(fields, slim)
+    with catalog_store.lease() as gen:
+        version = _catalog_version(gen)
+        since_generation = catalog_store.changes.parse_token(since)
+        delta = None
+        if since_generation is not None and since_generation <= gen.generation:
+            delta = catalog_store.changes.changes_since(since_generation)
+        if delta is None:
+            return JSONResponse(
+                content={"version": version, "full_resync": True, "upserted": [], "deleted": []},
+                headers={"Cache-Control": "no-store"},
+            )
+        upserted_refs, deleted = delta
+        upserted = [gen.by_ref[ref] for ref in sorted(upserted_refs) if ref in gen.by_ref]
+        return JSONResponse(
+            content={
+                "version": version,
+                "full_resync": False,
+                "upserted": gen.project(upserted, projection),
+                "deleted": sorted(deleted.values()),
+            },
+            headers={"Cache-Control": "no-store"},
+        )
+
+
+@app.get("/api/products/export")
+def export_products(
+    brand: str = Query(None, description="按品牌篩選"),
+    slim: bool = Query(False, description="是否返回精簡字段"),
+    fields: str = Query(None, description="只返回指定字段，逗號分隔（優先於 slim）"),
+):
+    """流式導出全部商品（NDJSON，每行一個商品）"""
+    require_catalog_ready()
+    return _ndjson_response(brand, _resolve_fields(fields, slim))
+
+
+# 批量導入任務（進度查詢）與互斥鎖
+ingest_jobs = IngestRegistry()
+_ingest_lock = asyncio.Lock()
+
+# 每批交給後台線程處理的記錄數
+INGEST_BATCH_SIZE = 1000
+
+
+async def _abort_ingest(builder: Optional[CatalogBuilder], job, error: str) -> None:
+    """導入失敗：標記任務失敗，刪除已創建的臨時文件（構建器創建失敗時為 None）"""
+    job.status, job.error, job.finished_at = 'failed', error, time.time()
+    if builder is not None:
+        await asyncio.to_thread(builder.abort)
+
+
+@app.post("/api/products")
+async def ingest_products(request: Request):
+    """
+    批量導入商品（管理端點）
+
+    請求體為商品 JSON 數組，邊接收邊解析、校驗、規範化（Famille / 品牌名），
+    已存在的 produit 跳過；以當前世代為基礎增量構建下一世代，
+    寫入臨時文件後原子替換 PRODUCTS_FILE。可帶 x-ingest-id 請求頭，
+    並通過 GET /api/products/ingest/{job_id} 查詢進度
+    """
+    require_admin(request)
+    require_catalog_ready()
+    if _ingest_lock.locked():
+        raise HTTPException(status_code=409, detail="ingest_in_progress")
+    
+    async with _ingest_lock:
+        job = ingest_jobs.create(request.headers.get('x-ingest-id'))
+        logger.info(f"[Ingest] 開始導入任務 {job.id}")
+        with catalog_store.lease() as base:
+            builder = None
+            try:
+                builder = await asyncio.to_thread(CatalogBuilder, base, PRODUCTS_FILE, job)
+                batch = []
+                async for record in iter_json_array(request.stream()):
+                    batch.append(record)
+                    if len(batch) >= INGEST_BATCH_SIZE:
+                        await asyncio.to_thread(builder.add_many, batch)
+                        batch = []
+                if batch:
+                    await asyncio.to_thread(builder.add_many, batch)
+                
+                def build(generation: int):
+                    # 新快照已包含日誌中的全部變更
+                    through = catalog_journal.last_seq
+                    new_gen = builder.commit(generation)
+                    catalog_journal.mark_snapshot(new_gen.source_signature, through)
+                    return new_gen
+
+                gen = await asyncio.to_thread(
+                    catalog_store.publish_if_current,
+                    base,
+                    build,
+                    (builder.inserted_refs, {}),
+                )
+            except IngestError as e:
+                await _abort_ingest(builder, job, str(e))
+                raise HTTPException(status_code=400, detail=str(e))
+            except CatalogConflictError:
+                await _abort_ingest(builder, job, 'catalog_changed')
+                raise HTTPException(status_code=409, detail="catalog_changed_during_ingest")
+            except Exception as e:
+                await _abort_ingest(builder, job, str(e))
+                logger.error(f"[Ingest] 導入失敗: {e}")
+                raise HTTPException(status_code=500, detail=f"ingest_failed: {e}")
+    
+    job.generation = gen.generation
+    job.status, job.finished_at = 'done', time.time()
+    logger.info(f"[Ingest] 任務 {job.id} 完成: {job.to_dict()}")
+    await asyncio.to_thread(warm_catalog_payloads, gen)
+    return job.to_dict()
+
+
+@app.get("/api/products/ingest/{job_id}")
+def get_ingest_status(job_id: str, request: Request):
+    """查詢批量導入進度"""
+    require_admin(request)
+    job = ingest_jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="ingest_job_not_found")
+    return job.to_dict()
+
+
 @app.get("/api/products/{produit}")
 def get_product_by_produit(produit: str):
     """根據 produit 獲取商品"""
-    products = read_products()
-    prod_lower = produit.lower().strip()
-    
-    for product in products:
-        product_prod = str(product.get('produit', '')).lower().strip()
-        if product_prod == prod_lower:
-            return product
+    require_catalog_ready()
+    with catalog_store.lease() as gen:
+        product = gen.get_by_produit(produit)
+    if product is not None:
+        return product
     
     raise HTTPException(status_code=404, detail="商品未找到")
 
 
+@app.patch("/api/products/{produit}")
+async def update_product(produit: str, request: Request):
+    """
+    修改單條商品（管理端點）
+
+    請求體為要修改的字段（produit 不可修改）；立即生效並寫入變更日誌，
+    不重寫整個數據文件
+    """
+    require_admin(request)
+    require_catalog_ready()
+    try:
+        changes = await request.json()
+    except ValueError:
+        raise HTTPException(status_code=400, detail="invalid_json")
+    if not isinstance(changes, dict):
+        raise HTTPException(status_code=400, detail="expected_json_object")
+
+    def make_ops(base):
+        existing = base.get_by_produit(produit)
+        if existing is None:
+            raise LookupError(produit)
+        return [{'op': 'upsert', 'item': build_upsert(existing, changes)}]
+
+    try:
+        gen, _, _ = await asyncio.to_thread(catalog_store.apply_changes, make_ops)
+    except LookupError:
+        raise HTTPException(status_code=404, detail="商品未找到")
+    schedule_catalog_warm()
+    return {'product': gen.get_by_produit(produit), 'generation': gen.generation}
+
+
+@app.delete("/api/brands/{brand}")
+async def delete_brand(brand: str, request: Request):
+    """刪除品牌下的全部商品（管理端點）"""
+    require_admin(request)
+    require_catalog_ready()
+    brand_key = brand.lower().strip()
+    base_total = 0
+
+    def make_ops(base):
+        nonlocal base_total
+        if not brand_key or brand_key not in base.by_brand:
+            raise LookupError(brand)
+        base_total = len(base)
+        return [{'op': 'delete_brand', 'brand': brand_key}]
+
+    try:
+        gen, _, _ = await asyncio.to_thread(catalog_store.apply_changes, make_ops)
+    except LookupError:
+        raise HTTPException(status_code=404, detail="brand_not_found")
+    schedule_catalog_warm()
+    return {'removed': base_total - len(gen), 'total': len(gen), 'generation': gen.generation}
+
+
 @app.post("/api/normalize-famille")
 def normalize_famille_endpoint(request: NormalizeFamilleRequest):
     """標準化 Famille 字段"""
@@ -375,15 +1190,319 @@ def normalize_famille_endpoint(request: NormalizeFamilleRequest):
     )
 
 
-@app.post("/api/agent")
-async def agent_endpoint(request: AgentRequest):
+# 推測性本地搜索統計
+_speculation_stats = {'reused': 0, 'rerun': 0, 'discarded': 0}
+# 單次調用模式統計：一次完成 / 需要第二次調用生成回覆 / 調用失敗回退到兩次調用
+_single_call_stats = {'single': 0, 'second_call': 0, 'fallback': 0}
+# 會話追問直接複用上一輪候選商品的次數
+_session_stats = {'follow_ups_reused': 0}
+# 回覆來源統計：模板 / 固定文本（查詢過長、Feel Europe 介紹）/ DeepSeek 生成 / DeepSeek 失敗後的兜底
+_reply_stats = {'template': 0, 'fixed': 0, 'llm': 0, 'fallback': 0}
+# 智能助手各階段延遲：plan（生成回覆之前）/ total（/api/agent 完整請求）
+agent_latency = LatencyTracker()
+
+
+def _count_reply(source: str) -> None:
+    _reply_stats[source] += 1
+
+
+def _reply_metrics() -> Dict[str, Any]:
+    total = sum(_reply_stats.values())
+    without_llm = _reply_stats['template'] + _reply_stats['fixed']
+    return {
+        **_reply_stats,
+        'answered_without_llm': round(without_llm / total, 4) if total else 0.0,
+    }
+
+
+def _lookup_query(text: str) -> str:
+    """本地搜索使用的查詢（品牌標準化 + 小寫）"""
+    return normalize_brand_in_query(text).lower()
+
+
+async def _search_local(lookup_query: str) -> List[Dict[str, Any]]:
+    """在當前世代中查找候選商品（全量打分是 CPU 密集操作，放到線程中避免阻塞事件循環）"""
+    with catalog_store.lease() as gen:
+        logger.info(f"[Agent] 本地商品總數: {len(gen)}（世代 {gen.generation}）")
+        return await asyncio.to_thread(find_top_product_candidates, gen.products, lookup_query, 5)
+
+
+def _start_speculative_search(lookup_query: str) -> Tuple[str, asyncio.Task]:
+    """與意圖分類併發啟動本地搜索"""
+    return lookup_query, asyncio.create_task(_search_local(lookup_query))
+
+
+def _ignore_result(task: asyncio.Task) -> None:
+    """不再等待的任務：線程中的打分無法中斷，只忽略其結果（包括異常）"""
+    task.add_done_callback(lambda t: t.cancelled() or t.exception())
+
+
+def _discard_speculative_search(speculative: Tuple[str, asyncio.Task]) -> None:
+    """意圖不需要本地搜索：丟棄推測結果"""
+    _ignore_result(speculative[1])
+    _speculation_stats['discarded'] += 1
+
+
+def _cancel_speculative_search(speculative: Tuple[str, asyncio.Task]) -> None:
+    """意圖分類失敗或請求被取消：取消推測搜索，避免任務無人等待"""
+    speculative[1].cancel()
+    _discard_speculative_search(speculative)
+
+
+async def _resolve_local_search(
+    speculative: Optional[Tuple[str, asyncio.Task]],
+    lookup_query: str,
+) -> List[Dict[str, Any]]:
+    """hint 與推測查詢相同時複用推測結果，否則按 hint 重新搜索"""
+    if speculative is not None:
+        speculative_query, task = speculative
+        if speculative_query == lookup_query:
+            _speculation_stats['reused'] += 1
+            return await task
+        _ignore_result(task)
+        _speculation_stats['rerun'] += 1
+        logger.info(f"[Agent] hint 與推測查詢不同，重新搜索: \"{speculative_query}\" → \"{lookup_query}\"")
+    return await _search_local(lookup_query)
+
+
+# chat / other 意圖在 DeepSeek 不可用時的兜底回覆
+CHAT_FALLBACK = '\n'.join([
+    '您好！我是 Feel 智能助手',
+    '',
+    '我可以幫您：',
+    '• 查詢奢侈品價格（輸入商品名稱或編號）',
+    '• 在線搜索品牌新品（說"在線查詢XX品牌商品"）',
+    '',
+    '請問有什麼可以幫您的？',
+])
+OTHER_FALLBACK = '\n'.join([
+    '抱歉，我暫時無法理解您的問題',
+    '',
+    '您可以嘗試：',
+    '• 輸入具體商品名稱，如"Dior Lady Dior包"',
+    '• 輸入商品編號/參考號',
+    '• 說"在線查詢Gucci裙子"進行網絡搜索',
+    '',
+    '如有其他問題，歡迎隨時諮詢！',
+])
+
+
+class AgentPlan:
     """
-    智能助手主端點
-    
-    處理用戶查詢，返回商品價格信息或對話回覆
+    一次智能助手請求的處理結果（生成回覆之前）
+
+    包含意圖、本地匹配的商品和調用 DeepSeek 生成回覆所需的上下文；
+    message 不為空時表示無需調用 DeepSeek（如查詢過長、介紹 Feel Europe、模板回覆），
+    reply_source 記錄其來源
+    """
+
+    def __init__(
+        self,
+        intent: str,
+        raw_query: str = '',
+        history: Optional[List[Dict[str, str]]] = None,
+        intent_message: str = '',
+        top_matches: Optional[List[Dict[str, Any]]] = None,
+        online: Optional[bool] = None,
+        message: Optional[str] = None,
+        reply_source: str = 'fixed',
+    ):
+        self.intent = intent
+        self.raw_query = raw_query
+        self.history = history or []
+        self.intent_message = intent_message
+        self.online = online
+        self.message = message
+        self.reply_source = reply_source
+        self.online_results = ''
+        self.session = None
+        self.deadline: Optional[RequestDeadline] = None
+        # 本請求生成回覆時的提示詞 token 數（調用 DeepSeek 時寫入）
+        self.prompt_tokens: Dict[str, Any] = {}
+
+        # chat / other / 提前返回時不做本地匹配，響應中不帶商品字段
+        self.has_product_fields = top_matches is not None
+        top_matches = top_matches or []
+        self.top_matches = top_matches
+        self.candidates = to_candidate_brief(top_matches)
+        matched = top_matches[0]['item'] if top_matches else None
+        self.matched = matched
+        self.product_name = (
+            matched.get('designation') or matched.get('descriptif') or matched.get('produit') or '該商品'
+        ) if matched else ''
+        self.price = matched.get('Prix_Vente') or matched.get('prix_achat') or '未知' if matched else '未知'
+        self.reference = matched.get('produit', '') if matched else ''
+        self.product_link = matched.get('Lien_Externe', '') if matched else ''
+
+    @property
+    def needs_llm(self) -> bool:
+        return self.message is None
+
+    def chat_kwargs(self) -> Dict[str, Any]:
+        """DeepSeekClient.chat / chat_stream 的參數"""
+        return {
+            'user_query': self.raw_query,
+            'history': self.history,
+            'intent': self.intent,
+            'candidates': self.candidates,
+            'online_results': self.online_results,
+            'deadline': self.deadline,
+            'usage': self.prompt_tokens,
+        }
+
+    def fallback_message(self) -> str:
+        """DeepSeek 不可用或未返回內容時的回覆"""
+        if self.intent == 'chat':
+            return self.intent_message or CHAT_FALLBACK
+        if self.intent == 'other':
+            return self.intent_message or OTHER_FALLBACK
+        if self.matched:
+            return (
+                f"您好！為您查詢到 **{self.product_name}**\n💰 價格：{self.price}€\n📦 參考號：{self.reference}"
+                + (f"\n🔗 {self.product_link}" if self.product_link else '')
+            )
+        if self.intent == 'query_price_online':
+            return '抱歉，暫未找到相關商品。您可以嘗試提供更具體的商品名稱/參考號，或說"在線查詢{品牌}{商品}"我幫您搜索官網。'
+        return '抱歉，暫未找到相關商品。您可以說"在線查詢{品牌}{商品}"我幫您搜索官網。'
+
+    def fields(self) -> Dict[str, Any]:
+        """結構化字段（不含回覆文本）"""
+        fields: Dict[str, Any] = {'intent': self.intent}
+        if self.has_product_fields:
+            fields.update({
+                'product': self.product_name,
+                'price': self.price,
+                'reference': self.reference,
+                'matched': bool(self.matched),
+                'online': self.online,
+            })
+        if self.session is not None:
+            fields['session_id'] = self.session.session_id
+        if self.prompt_tokens:
+            fields['prompt_tokens'] = dict(self.prompt_tokens)
+        return fields
+
+    def response(self, message: str) -> AgentResponse:
+        return AgentResponse(message=message, **self.fields())
+
+    def for_session(self, session) -> 'AgentPlan':
+        """合併請求共享的處理結果用於另一個請求（各請求寫入自己的會話）"""
+        plan = copy.copy(self)
+        plan.session = session
+        return plan
+
+    def remember(self, message: str) -> None:
+        """把本輪對話寫入會話；本輪做了本地匹配時同時更新候選商品"""
+        if self.session is None or not self.raw_query:
+            return
+        candidates = None
+        if self.has_product_fields:
+            candidates = [(m['item'].get('produit'), m['score']) for m in self.top_matches]
+        agent_sessions.record_turn(self.session, self.raw_query, message, candidates)
+
+
+def _candidate_refs(top_matches: List[Dict[str, Any]]) -> List[str]:
+    return [m['item'].get('produit') for m in top_matches]
+
+
+async def _plan_single_call(
+    raw_query: str,
+    history: List[Dict[str, str]],
+    enhanced_query: str,
+    speculative: Tuple[str, asyncio.Task],
+    deadline: Optional[RequestDeadline] = None,
+) -> Optional[AgentPlan]:
+    """
+    單次調用模式：候選商品按預處理後的查詢預先搜索，一次調用同時得到意圖和回覆
+
+    hint 改變了相關候選（按 hint 重新搜索的結果不同）時丟棄回覆，由調用方再生成一次
+    （響應中的提示詞 token 數隨之換成第二次調用的）；
+    調用失敗時返回 None，回退到意圖分類 + 對話的兩次調用流程（推測搜索結果仍可複用）
+    """
+    lookup_query, task = speculative
+    top_matches = await task
+    usage: Dict[str, Any] = {}
+    result = await deepseek_client.classify_and_reply(
+        user_query=raw_query,
+        history=history,
+        candidates=to_candidate_brief(top_matches),
+        deadline=deadline,
+        usage=usage,
+    )
+    if result is None:
+        _single_call_stats['fallback'] += 1
+        return None
+
+    intent = result['intent']
+    message = result['message'] or None
+    if intent in ('chat', 'other'):
+        _single_call_stats['single' if message else 'second_call'] += 1
+        plan = AgentPlan(intent, raw_query, history, message=message, reply_source='llm')
+        plan.prompt_tokens = usage
+        return plan
+
+    # 未提取到 hint 時 _parse_intent 返回用戶原話，此時沿用預處理後的查詢
+    hint = result['hint'] if result['hint'] != raw_query else enhanced_query
+    hint_query = _lookup_query(hint)
+    if hint_query != lookup_query:
+        hint_matches = await _search_local(hint_query)
+        if _candidate_refs(hint_matches) != _candidate_refs(top_matches):
+            logger.info(f"[Agent] hint 改變了候選商品，重新生成回覆: \"{lookup_query}\" → \"{hint_query}\"")
+            top_matches = hint_matches
+            message = None
+    _single_call_stats['single' if message else 'second_call'] += 1
+    plan = AgentPlan(
+        intent, raw_query, history, '', top_matches,
+        online=intent == 'query_price_online', message=message, reply_source='llm',
+    )
+    plan.prompt_tokens = usage
+    return plan
+
+
+def _session_matches(session) -> List[Dict[str, Any]]:
+    """從當前世代取出會話中上一輪的候選商品（已刪除的商品跳過）"""
+    with catalog_store.lease() as gen:
+        matches = []
+        for produit, score in session.candidates:
+            item = gen.get_by_produit(produit)
+            if item is not None:
+                matches.append({'score': score, 'item': item})
+        return matches
+
+
+def _local_price_plan(
+    raw_query: str,
+    history: List[Dict[str, str]],
+    intent_message: str,
+    top_matches: List[Dict[str, Any]],
+) -> AgentPlan:
+    """query_price 意圖：高置信度命中時回覆內容已完全確定，直接用模板生成"""
+    item = confident_match(top_matches, AGENT_TEMPLATE_MIN_SCORE)
+    if item is not None:
+        logger.info("[Agent] 📝 高置信度命中，使用模板回覆")
+        message = render_product_reply(item, detect_language(raw_query, history))
+        return AgentPlan(
+            'query_price', raw_query, history, intent_message, top_matches,
+            online=False, message=message, reply_source='template',
+        )
+    return AgentPlan('query_price', raw_query, history, intent_message, top_matches, online=False)
+
+
+def _resolve_agent_input(request: AgentRequest):
+    """
+    解析智能助手請求：當前查詢、標準化後的歷史（最後一條為當前查詢）和會話
+
+    Returns:
+        (raw_query, normalized_messages, session)
+
+    Raises:
+        HTTPException: 目錄未就緒 / 查詢為空 / 會話已失效且未附帶歷史
     """
     log_prefix = '[Agent]'
-    logger.info(f"{log_prefix} ========== 收到新的 Agent 請求 ==========")
+    require_catalog_ready()
+    
+    use_session = request.session_id is not None and agent_sessions.enabled
+    session = agent_sessions.get(request.session_id) if use_session and request.session_id else None
     
     # 提取查詢
     incoming_messages = request.messages or []
@@ -402,12 +1521,35 @@ async def agent_endpoint(request: AgentRequest):
     if not raw_query:
         raise HTTPException(status_code=400, detail="query_required")
     
+    if use_session and session is None:
+        # 會話不存在（新對話 / 已失效 / 在其他 worker 上）：需要客戶端附帶完整歷史重建
+        if request.session_id and not normalized_messages:
+            raise HTTPException(status_code=409, detail="session_not_found")
+        seed = normalized_messages
+        if seed and seed[-1].get('role') == 'user' and seed[-1].get('content') == raw_query:
+            seed = seed[:-1]
+        session = agent_sessions.create(seed)
+    if session is not None:
+        # 服務端保存的歷史已標準化，忽略請求中的 messages
+        normalized_messages = session.history + [{'role': 'user', 'content': raw_query}]
+    return raw_query, normalized_messages, session
+
+
+async def _plan_query(
+    raw_query: str,
+    normalized_messages: List[Dict[str, str]],
+    session,
+    deadline: Optional[RequestDeadline] = None,
+) -> AgentPlan:
+    """處理智能助手請求直到生成回覆之前：預處理、意圖分類、本地匹配"""
+    log_prefix = '[Agent]'
+    
     # 輸入長度限制
     if len(raw_query) > MAX_QUERY_LENGTH:
         logger.warning(f"{log_prefix} 查詢過長: {len(raw_query)} 字符")
-        return AgentResponse(
+        return AgentPlan(
+            intent='error',
             message='您的查詢內容過長，請精簡後重試。建議直接輸入品牌名稱和商品類型，例如"Dior裙子"或"Gucci包"。',
-            intent='error'
         )
     
     # 輸入預處理
@@ -417,7 +1559,15 @@ async def agent_endpoint(request: AgentRequest):
     # 檢測 Feel Europe 介紹請求
     if is_about_feel(cleaned_query):
         logger.info(f"{log_prefix} ✅ 檢測到 Feel Europe 介紹請求")
-        return AgentResponse(message=FEEL_INTRO, intent='about_feel')
+        return AgentPlan('about_feel', raw_query, normalized_messages, message=FEEL_INTRO)
+    
+    # 會話追問（如"那个多少钱"）：直接複用上一輪的候選商品，無需意圖分類和本地搜索
+    if session is not None and session.candidates and is_follow_up(cleaned_query):
+        top_matches = _session_matches(session)
+        if top_matches:
+            logger.info(f"{log_prefix} 🔁 會話追問，複用上一輪候選: {top_matches[0]['item'].get('produit')}")
+            _session_stats['follow_ups_reused'] += 1
+            return _local_price_plan(raw_query, normalized_messages, '', top_matches)
     
     # 品牌名標準化
     normalized_query = normalize_brand_in_query(cleaned_query)
@@ -429,188 +1579,214 @@ async def agent_endpoint(request: AgentRequest):
     
     # 意圖分類
     logger.info(f"{log_prefix} 開始意圖分類...")
-    intent_result = deepseek_client.classify_intent_sync(enhanced_query)
+    speculative = None
+    intent_result = intent_rules.classify(enhanced_query)
+    if intent_result is not None:
+        logger.info(f"{log_prefix} ⚡ 規則預分類命中，跳過 DeepSeek 意圖分類")
+    else:
+        # 分類期間先按未經 LLM 的查詢做本地搜索（hint 通常與之相同）
+        speculative = _start_speculative_search(_lookup_query(enhanced_query))
+        try:
+            if AGENT_SINGLE_CALL:
+                plan = await _plan_single_call(raw_query, normalized_messages, enhanced_query, speculative, deadline)
+                if plan is not None:
+                    return plan
+            intent_result = await deepseek_client.classify_intent(enhanced_query, deadline)
+        except BaseException:
+            _cancel_speculative_search(speculative)
+            raise
     intent = intent_result.get('intent', 'query_price')
     hint = (intent_result.get('hint') or enhanced_query).strip()
     intent_message = intent_result.get('message', '')
     
     logger.info(f"{log_prefix} 意圖分類結果: intent={intent}, hint={hint}")
     
-    # 處理 chat 意圖
-    if intent == 'chat':
-        logger.info(f"{log_prefix} 💬 處理 chat 意圖（閒聊/問候）")
-        message = deepseek_client.chat(
-            user_query=raw_query,
-            history=normalized_messages,
-            intent=intent,
-            candidates=[],
-            online_results='',
-        )
-        if not message:
-            message = intent_message or '\n'.join([
-                '您好！我是 Feel 智能助手',
-                '',
-                '我可以幫您：',
-                '• 查詢奢侈品價格（輸入商品名稱或編號）',
-                '• 在線搜索品牌新品（說"在線查詢XX品牌商品"）',
-                '',
-                '請問有什麼可以幫您的？',
-            ])
-        return AgentResponse(message=message, intent=intent)
+    # 處理 chat / other 意圖（閒聊/問候/其他情況）：無需本地匹配
+    if intent in ('chat', 'other'):
+        if speculative is not None:
+            _discard_speculative_search(speculative)
+        logger.info(f"{log_prefix} 💬 處理 {intent} 意圖")
+        return AgentPlan(intent, raw_query, normalized_messages, intent_message)
     
-    # 處理 other 意圖
-    if intent == 'other':
-        logger.info(f"{log_prefix} ❓ 處理 other 意圖（其他情況）")
-        message = deepseek_client.chat(
-            user_query=raw_query,
-            history=normalized_messages,
-            intent=intent,
-            candidates=[],
-            online_results='',
-        )
-        if not message:
-            message = intent_message or '\n'.join([
-                '抱歉，我暫時無法理解您的問題',
-                '',
-                '您可以嘗試：',
-                '• 輸入具體商品名稱，如"Dior Lady Dior包"',
-                '• 輸入商品編號/參考號',
-                '• 說"在線查詢Gucci裙子"進行網絡搜索',
-                '',
-                '如有其他問題，歡迎隨時諮詢！',
-            ])
-        return AgentResponse(message=message, intent=intent)
-    
-    # 使用內存緩存的商品數據（無磁盤 IO）
-    products = get_cached_products()
-    lookup_query = normalize_brand_in_query(hint).lower()
+    lookup_query = _lookup_query(hint)
     logger.info(f"{log_prefix} 本地查詢關鍵詞: \"{lookup_query}\"")
-    logger.info(f"{log_prefix} 本地商品總數: {len(products)}")
     
-    # 查找匹配商品
-    top_matches = find_top_product_candidates(products, lookup_query, 5)
-    matched = top_matches[0]['item'] if top_matches else None
-    candidates = to_candidate_brief(top_matches)
+    # 查找匹配商品（使用內存中的當前世代，無磁盤 IO）；hint 與推測查詢一致時直接複用結果
+    top_matches = await _resolve_local_search(speculative, lookup_query)
     
-    if matched:
-        logger.info(f"{log_prefix} ✅ 本地匹配成功: {matched.get('reference')}")
+    if top_matches:
+        logger.info(f"{log_prefix} ✅ 本地匹配成功: {top_matches[0]['item'].get('produit')}")
     else:
         logger.info(f"{log_prefix} ⚠️ 本地未找到匹配商品")
     
-    # 提取商品信息
-    product_name = (
-        matched.get('designation') or matched.get('descriptif') or matched.get('produit') or '該商品'
-    ) if matched else ''
-    price = matched.get('Prix_Vente') or matched.get('prix_achat') or '未知' if matched else '未知'
-    reference = matched.get('produit', '') if matched else ''
-    product_link = matched.get('Lien_Externe', '') if matched else ''
-    
-    # 處理 query_price_online 意圖
     if intent == 'query_price_online':
+        # 在線查詢意圖
         logger.info(f"{log_prefix} 🌐 處理 query_price_online 意圖（在線查詢）")
-        
-        # 執行在線搜索
         search_query = enhance_product_type_in_query(hint or enhanced_query)
         logger.info(f"{log_prefix} 準備在線搜索: \"{search_query}\"")
-        online_results = ''
-        
-        # 生成回覆
-        try:
-            reply = deepseek_client.chat(
-                user_query=raw_query,
-                history=normalized_messages,
-                intent=intent,
-                candidates=candidates,
-                online_results=online_results,
-            )
-            
-            message = reply or (
-                f"您好！為您查詢到 **{product_name}**\n💰 價格：{price}€\n📦 參考號：{reference}"
-                + (f"\n🔗 {product_link}" if product_link else '')
-                if matched else
-                '抱歉，暫未找到相關商品。您可以嘗試提供更具體的商品名稱/參考號，或說"在線查詢{品牌}{商品}"我幫您搜索官網。'
-            )
-            
-            return AgentResponse(
-                message=message,
-                intent=intent,
-                product=product_name,
-                price=price,
-                reference=reference,
-                matched=bool(matched),
-                online=True,
-            )
-            
-        except Exception as e:
-            logger.error(f"{log_prefix} ❌ DeepSeek 回覆失敗: {e}")
-            message = (
-                f"您好！為您查詢到 **{product_name}**\n💰 價格：{price}€\n📦 參考號：{reference}"
-                + (f"\n🔗 {product_link}" if product_link else '')
-                if matched else
-                '抱歉，在線搜索暫時無法生成結果。建議您稍後重試或直接訪問品牌官網。'
-            )
-            return AgentResponse(
-                message=message,
-                intent=intent,
-                product=product_name,
-                price=price,
-                reference=reference,
-                matched=bool(matched),
-                online=True,
-            )
+        return AgentPlan(intent, raw_query, normalized_messages, intent_message, top_matches, online=True)
     
     # 處理 query_price 意圖（本地查詢）
     logger.info(f"{log_prefix} 🔍 處理 query_price 意圖（本地查詢）")
+    return _local_price_plan(raw_query, normalized_messages, intent_message, top_matches)
+
+
+# 相同查詢、無對話歷史的併發請求共享同一次處理（意圖分類、本地匹配、回覆生成）
+agent_flight = SingleFlight()
+# 生成中的共享流式回覆：合併鍵 -> (處理結果, 共享流)
+_shared_streams: Dict[str, Tuple[AgentPlan, SharedStream]] = {}
+# 加入已在生成中的共享流式回覆的請求數
+_coalesce_stats = {'stream_joined': 0}
+
+
+def _coalesce_key(raw_query: str, history: List[Dict[str, str]]) -> Optional[str]:
+    """可合併的請求鍵：只有當前查詢、沒有之前的對話時才合併（忽略大小寫和多餘空白）"""
+    if len(history) > 1:
+        return None
+    return ' '.join(raw_query.lower().split())
+
+
+async def _plan_with_deadline(raw_query: str, history: List[Dict[str, str]], session) -> AgentPlan:
+    """開始計時並處理查詢；之後的回覆生成沿用同一個截止時間"""
+    deadline = RequestDeadline(AGENT_DEADLINE)
+    plan = await _plan_query(raw_query, history, session, deadline)
+    plan.session = session
+    plan.deadline = deadline
+    agent_latency.record('plan', deadline.elapsed())
+    return plan
+
+
+async def _answer_agent_query(raw_query: str, history: List[Dict[str, str]], session) -> Tuple[AgentPlan, str, str]:
+    """
+    處理查詢並生成完整回覆
+
+    Returns:
+        (處理結果, 回覆, 回覆來源)
+    """
+    plan = await _plan_with_deadline(raw_query, history, session)
+    if not plan.needs_llm:
+        agent_latency.record('total', plan.deadline.elapsed())
+        return plan, plan.message, plan.reply_source
+    reply = await deepseek_client.chat(**plan.chat_kwargs())
+    agent_latency.record('total', plan.deadline.elapsed())
+    return plan, reply or plan.fallback_message(), 'llm' if reply else 'fallback'
+
+
+@app.post("/api/agent")
+async def agent_endpoint(request: AgentRequest):
+    """
+    智能助手主端點
     
-    # 如果本地未匹配，嘗試在線搜索補充
-    online_results = ''
-    if not matched:
-        logger.info(f"{log_prefix} 本地未匹配，嘗試在線搜索補充...")
-        online_results = ''
+    處理用戶查詢，返回商品價格信息或對話回覆
+    """
+    logger.info("[Agent] ========== 收到新的 Agent 請求 ==========")
+    raw_query, history, session = _resolve_agent_input(request)
+    key = _coalesce_key(raw_query, history)
+    if key is None:
+        plan, message, source = await _answer_agent_query(raw_query, history, session)
+    else:
+        plan, message, source = await agent_flight.do(
+            ('reply', key), lambda: _answer_agent_query(raw_query, history, None)
+        )
+        plan = plan.for_session(session)
     
-    # 生成回覆
+    _count_reply(source)
+    plan.remember(message)
+    return plan.response(message)
+
+
+def _sse(event: str, data: Any) -> bytes:
+    """編碼一條 Server-Sent Event"""
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n".encode('utf-8')
+
+
+async def _start_shared_stream(key: str, raw_query: str, history: List[Dict[str, str]]):
+    plan = await _plan_with_deadline(raw_query, history, None)
+    if not plan.needs_llm:
+        return plan, None
+    stream = SharedStream(deepseek_client.chat_stream(**plan.chat_kwargs()))
+    entry = (plan, stream)
+    _shared_streams[key] = entry
+    stream.add_done_callback(lambda: _shared_streams.get(key) is entry and _shared_streams.pop(key))
+    return entry
+
+
+async def _shared_agent_stream(key: str, raw_query: str, history: List[Dict[str, str]]):
+    """
+    合併相同查詢的流式請求：處理階段共享同一次意圖分類和本地匹配，
+    生成階段共享同一個 DeepSeek 流（晚到的請求先重放已生成的部分）
+    """
+    entry = _shared_streams.get(key)
+    if entry is not None:
+        _coalesce_stats['stream_joined'] += 1
+        return entry
+    return await agent_flight.do(('stream', key), lambda: _start_shared_stream(key, raw_query, history))
+
+
+async def _stream_agent_reply(plan: AgentPlan, chunks: Optional[AsyncIterator[str]] = None):
+    """
+    SSE 事件流：
+    - meta：本地匹配完成後立即發送結構化字段（intent / product / price / reference ...）
+    - delta：DeepSeek 逐段生成的回覆文本 {"text": ...}
+    - done：完整響應（與 /api/agent 相同）
+    - error：已輸出部分內容後生成失敗 {"detail": ...}
+    """
+    yield _sse('meta', plan.fields())
+    if not plan.needs_llm:
+        _count_reply(plan.reply_source)
+        plan.remember(plan.message)
+        yield _sse('delta', {'text': plan.message})
+        yield _sse('done', plan.response(plan.message).model_dump())
+        return
+    
+    parts: List[str] = []
     try:
-        reply = deepseek_client.chat(
-            user_query=raw_query,
-            history=normalized_messages,
-            intent=intent,
-            candidates=candidates,
-            online_results=online_results,
-        )
-        
-        message = reply or (
-            f"您好！為您查詢到 **{product_name}**\n💰 價格：{price}€\n📦 參考號：{reference}"
-            + (f"\n🔗 {product_link}" if product_link else '')
-            if matched else
-            '抱歉，暫未找到相關商品。您可以說"在線查詢{品牌}{商品}"我幫您搜索官網。'
-        )
-        
-        return AgentResponse(
-            message=message,
-            intent=intent,
-            product=product_name,
-            price=price,
-            reference=reference,
-            matched=bool(matched),
-            online=bool(online_results),
-        )
-        
+        async for text in chunks:
+            parts.append(text)
+            yield _sse('delta', {'text': text})
     except Exception as e:
-        logger.error(f"{log_prefix} ❌ DeepSeek 回覆失敗: {e}")
-        message = (
-            f"您好！為您查詢到 **{product_name}**\n💰 價格：{price}€\n📦 參考號：{reference}"
-            + (f"\n🔗 {product_link}" if product_link else '')
-            if matched else
-            '抱歉，查詢暫時失敗。請稍後重試。'
-        )
-        return AgentResponse(
-            message=message,
-            intent=intent,
-            product=product_name,
-            price=price,
-            reference=reference,
-            matched=bool(matched),
-        )
+        logger.error(f"[Agent] ❌ DeepSeek 流式回覆失敗: {e}")
+        if parts:
+            _count_reply('llm')
+            yield _sse('error', {'detail': 'llm_stream_failed'})
+            return
+    finally:
+        # 客戶端斷開時立即關閉上游流並歸還調用名額，不等垃圾回收
+        await chunks.aclose()
+    
+    message = ''.join(parts).strip()
+    _count_reply('llm' if message else 'fallback')
+    if not message:
+        message = plan.fallback_message()
+        yield _sse('delta', {'text': message})
+    plan.remember(message)
+    yield _sse('done', plan.response(message).model_dump())
+
+
+@app.post("/api/agent/stream")
+async def agent_stream_endpoint(request: AgentRequest):
+    """
+    智能助手流式端點（Server-Sent Events）
+
+    與 /api/agent 處理流程相同；本地匹配完成即返回結構化字段，
+    之後逐段推送 DeepSeek 生成的回覆
+    """
+    logger.info("[Agent] ========== 收到新的流式 Agent 請求 ==========")
+    raw_query, history, session = _resolve_agent_input(request)
+    key = _coalesce_key(raw_query, history)
+    if key is None:
+        plan = await _plan_with_deadline(raw_query, history, session)
+        chunks = deepseek_client.chat_stream(**plan.chat_kwargs()) if plan.needs_llm else None
+    else:
+        plan, stream = await _shared_agent_stream(key, raw_query, history)
+        plan = plan.for_session(session)
+        chunks = stream.subscribe() if stream is not None else None
+    
+    return StreamingResponse(
+        _stream_agent_reply(plan, chunks),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
 
 
 # ============ 啟動入口 ============
@@ -0,0 +1,51 @@
+# -*- coding: utf-8 -*-
+"""
+Gunicorn 多 worker 配置（主進程預載入商品目錄）
+
+啟動方式：
+    cd server/python
+    gunicorn -c gunicorn.conf.py app:app                      # 默認單 worker
+    WEB_CONCURRENCY=4 gunicorn -c gunicorn.conf.py app:app    # 多 worker
+
+注意：render.yaml 和 start.sh 目前直接以單進程 uvicorn 啟動，不讀取本文件；
+要在部署中使用多 worker，需把 startCommand 改為 `gunicorn -c gunicorn.conf.py app:app`。
+
+主進程在 fork 之前載入商品目錄並凍結 GC 堆（gc.freeze），worker 啟動時通過寫時複製共享目錄內存。
+但商品仍是普通 Python 對象，搜索遍歷商品時的引用計數增減會寫入對象頭，
+被觸及的內存頁隨流量逐步複製到各 worker，共享只在剛啟動時完整。
+實測（15 萬條商品，2 個 worker，tools/load_test.py 壓測後用 tools/worker_memory.py 測量）：
+
+                      每 worker USS   共享頁      PSS 合計
+    啟動後              11-15 MB       ~390 MB     430 MB
+    壓測後（已穩定）    166-182 MB     ~309 MB     755 MB
+
+單進程 uvicorn 同一目錄啟動後 RSS 375 MB，壓測後 464 MB，即不預載入時 2 個 worker 約 930 MB。
+預載入的收益是 worker 啟動無需重新解析目錄，穩態內存只比獨立載入少約 20%，
+每增加一個 worker 仍按接近整份目錄的內存規劃。worker 熱重載後持有各自的新世代，不再共享。
+
+默認只啟動一個 worker。以下狀態按進程保存，多 worker 時需要注意：
+- 對話會話（SessionStore）：需按 session_id 粘性路由，否則會話經常未命中
+- 意圖緩存、DeepSeek 並發隔離與熔斷、延遲統計：各 worker 獨立，總併發上限為 worker 數倍
+- 圖片磁盤緩存（DiskCache）：各 worker 只統計自己見過的文件，目錄總大小可能超出上限
+- 商品修改：通過變更日誌的文件鎖在 worker 間同步，其他 worker 在下一次文件檢查
+  （PRODUCTS_WATCH_INTERVAL）後才可見；增量版本號只在簽發它的 worker 上有效
+"""
+
+import os
+import sys
+
+bind = f"0.0.0.0:{os.getenv('PORT', '5000')}"
+workers = int(os.getenv('WEB_CONCURRENCY') or 1)
+worker_class = 'uvicorn.workers.UvicornWorker'
+preload_app = True
+timeout = 120
+graceful_timeout = 30
+
+
+def when_ready(server):
+    """所有 worker fork 之前：同步載入商品目錄並凍結堆"""
+    app_module = sys.modules.get('app')
+    if app_module is None:
+        return
+    app_module.preload_catalog(workers=server.num_workers)
+    server.log.info("商品目錄已在主進程預載入，worker 啟動時以寫時複製共享")
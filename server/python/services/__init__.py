@@ -33,10 +33,99 @@ from .deepseek_client import (
     get_default_client as get_default_deepseek_client,
 )
 
+from .llm_bulkhead import (
+    LLMBulkhead,
+    BulkheadRejected,
+)
+
+from .latency_budget import (
+    LatencyTracker,
+    RequestDeadline,
+    Hedger,
+)
+
+from .prompt_builder import (
+    PromptBuilder,
+    estimate_tokens,
+)
+
 from .google_search import (
     reverse_image_search,
 )
 
+from .catalog import (
+    CatalogGeneration,
+    CatalogStore,
+    CatalogConflictError,
+    build_generation,
+    file_signature,
+    encode_cursor,
+    decode_cursor,
+)
+
+from .catalog_ingest import (
+    IngestError,
+    IngestRegistry,
+    CatalogBuilder,
+    iter_json_array,
+)
+
+from .catalog_journal import (
+    CatalogJournal,
+    build_upsert,
+)
+
+from .single_flight import (
+    SingleFlight,
+    SharedStream,
+)
+
+from .ttl_cache import (
+    TTLCache,
+)
+
+from .intent_rules import (
+    IntentRules,
+    is_follow_up,
+)
+
+from .session_store import (
+    SessionStore,
+    ConversationSession,
+)
+
+from .reply_templates import (
+    detect_language,
+    confident_match,
+    render_product_reply,
+)
+
+from .image_proxy import (
+    ThumbnailService,
+    ImageProxyError,
+    split_image_urls,
+    snap_width,
+    choose_format,
+    is_available as image_resizing_available,
+    CONTENT_TYPES as IMAGE_CONTENT_TYPES,
+)
+
+from .catalog_payloads import (
+    EncodedPayload,
+    etag_matches,
+)
+
+from .runtime_stats import (
+    read_process_memory,
+    list_child_pids,
+)
+
+from .catalog_download import (
+    CatalogDownloadError,
+    download_catalog,
+    read_download_meta,
+)
+
 __all__ = [
     # query_processor
     'preprocess_query',
@@ -62,6 +151,65 @@ __all__ = [
     'pick_recent_messages',
     'extract_price_evidence',
     'get_default_deepseek_client',
+    # llm_bulkhead
+    'LLMBulkhead',
+    'BulkheadRejected',
+    # latency_budget
+    'LatencyTracker',
+    'RequestDeadline',
+    'Hedger',
+    # prompt_builder
+    'PromptBuilder',
+    'estimate_tokens',
     # google_search
     'reverse_image_search',
+    # catalog
+    'CatalogGeneration',
+    'CatalogStore',
+    'CatalogConflictError',
+    'build_generation',
+    'file_signature',
+    'encode_cursor',
+    'decode_cursor',
+    # catalog_ingest
+    'IngestError',
+    'IngestRegistry',
+    'CatalogBuilder',
+    'iter_json_array',
+    # catalog_journal
+    'CatalogJournal',
+    'build_upsert',
+    # single_flight
+    'SingleFlight',
+    'SharedStream',
+    # ttl_cache
+    'TTLCache',
+    # intent_rules
+    'IntentRules',
+    'is_follow_up',
+    # session_store
+    'SessionStore',
+    'ConversationSession',
+    # reply_templates
+    'detect_language',
+    'confident_match',
+    'render_product_reply',
+    # image_proxy
+    'ThumbnailService',
+    'ImageProxyError',
+    'split_image_urls',
+    'snap_width',
+    'choose_format',
+    'image_resizing_available',
+    'IMAGE_CONTENT_TYPES',
+    # catalog_payloads
+    'EncodedPayload',
+    'etag_matches',
+    # runtime_stats
+    'read_process_memory',
+    'list_child_pids',
+    # catalog_download
+    'CatalogDownloadError',
+    'download_catalog',
+    'read_download_meta',
 ]
@@ -0,0 +1,848 @@
+# -*- coding: utf-8 -*-
+"""
+商品目錄模塊
+不可變的商品目錄世代（商品 + 索引）及其原子切換
+"""
+
+import os
+import sys
+import json
+import time
+import uuid
+import base64
+import bisect
+import logging
+import threading
+from collections import deque, OrderedDict
+from contextlib import contextmanager, nullcontext
+from typing import List, Dict, Any, Optional, Tuple, Callable, Iterator, Set, Sequence, Iterable
+from pathlib import Path
+
+# 確保可以導入本地模塊
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from config.brand_mappings import normalize_famille
+
+logger = logging.getLogger(__name__)
+
+# 每個世代緩存的字段投影數量（LRU）
+PROJECTION_CACHE_SIZE = 16
+# 同一字段組合被請求多少次後為整個世代預計算投影
+PROJECTION_MIN_REQUESTS = 3
+# 增量派生的世代繼承字段投影時最多累積的差異條數（超過時放棄繼承，按需重新全量投影）
+MAX_INHERITED_CHANGES = 10000
+
+
+class CatalogConflictError(RuntimeError):
+    """構建期間目錄已被其他任務切換"""
+
+
+def file_signature(path: str) -> Optional[Tuple[int, int]]:
+    """
+    獲取文件簽名 (mtime_ns, size)，用於判斷文件是否變更
+
+    Returns:
+        文件不存在時返回 None
+    """
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return (st.st_mtime_ns, st.st_size)
+
+
+def read_products_file(path: str) -> List[Dict[str, Any]]:
+    """讀取商品 JSON 文件，文件不存在或格式錯誤時返回空列表"""
+    if not os.path.exists(path):
+        return []
+    with open(path, 'r', encoding='utf-8') as f:
+        data = json.load(f)
+    return data if isinstance(data, list) else []
+
+
+def normalize_product(product: Dict[str, Any]) -> Dict[str, Any]:
+    """規範化單條商品記錄（Famille 標準化）"""
+    return {**product, 'Famille': normalize_famille(product.get('Famille', ''))}
+
+
+def _ref(item: Dict[str, Any]) -> str:
+    return str(item.get('produit') or '').lower().strip()
+
+
+def _brand_key(item: Dict[str, Any]) -> str:
+    return str(item.get('Marque') or '').lower().strip()
+
+
+def apply_ops(
+    products: Sequence[Dict[str, Any]],
+    ops: Iterable[Dict[str, Any]],
+) -> Tuple[List[Dict[str, Any]], Set[str], Dict[str, str]]:
+    """
+    把變更操作應用到商品列表（返回新列表，不修改原列表）
+
+    支持的操作：
+        {"op": "upsert", "item": {...}}           整條記錄替換或追加（按 produit）
+        {"op": "delete_brand", "brand": "dior"}   刪除品牌（小寫鍵）下的全部商品
+
+    Returns:
+        (新商品列表, 新增或修改的 produit 鍵, 被刪除的 {produit 鍵: produit})
+    """
+    items: List[Optional[Dict[str, Any]]] = list(products)
+    index: Dict[str, int] = {}
+    for i, item in enumerate(items):
+        ref = _ref(item)
+        if ref and ref not in index:
+            index[ref] = i
+
+    upserted: Set[str] = set()
+    deleted: Dict[str, str] = {}
+    for op in ops:
+        kind = op.get('op')
+        if kind == 'upsert':
+            item = op['item']
+            ref = _ref(item)
+            if not ref:
+                continue
+            i = index.get(ref)
+            if i is None:
+                index[ref] = len(items)
+                items.append(item)
+            else:
+                items[i] = item
+            upserted.add(ref)
+            deleted.pop(ref, None)
+        elif kind == 'delete_brand':
+            brand = str(op.get('brand') or '').lower().strip()
+            for i, item in enumerate(items):
+                if item is None or _brand_key(item) != brand:
+                    continue
+                items[i] = None
+                ref = _ref(item)
+                if ref and index.get(ref) == i:
+                    del index[ref]
+                    upserted.discard(ref)
+                    deleted[ref] = str(item.get('produit'))
+        else:
+            raise ValueError(f'unknown_journal_op: {kind}')
+
+    return [item for item in items if item is not None], upserted, deleted
+
+
+class CatalogGeneration:
+    """
+    商品目錄世代
+
+    創建後不再修改：商品列表和索引在構建時一次生成（或由上一世代增量派生，見 derive），
+    請求在整個處理過程中持有同一個世代，切換不會影響進行中的請求
+    """
+
+    def __init__(
+        self,
+        generation: int,
+        products: Tuple[Dict[str, Any], ...],
+        source_signature: Optional[Tuple[int, int]] = None,
+        indexes: Optional[Tuple[Dict[str, Any], Dict[str, Any], Dict[str, int]]] = None,
+    ):
+        """
+        Args:
+            indexes: 已構建好的 (by_ref, by_brand, 位置索引)，由 derive 增量生成時傳入，跳過全量建索引
+        """
+        self.generation = generation
+        self.products = products
+        self.source_signature = source_signature
+        self.created_at = time.time()
+        # 由單條修改增量派生（而非完整載入）的世代
+        self.derived = indexes is not None
+
+        if indexes is not None:
+            self.by_ref, self.by_brand, self._positions = indexes
+        else:
+            # produit（小寫）→ 商品
+            by_ref: Dict[str, Dict[str, Any]] = {}
+            # 品牌（小寫）→ 商品列表
+            by_brand: Dict[str, List[Dict[str, Any]]] = {}
+            # produit（小寫）→ 在 products 中的位置（增量派生時定位被修改的商品）
+            positions: Dict[str, int] = {}
+            for i, item in enumerate(products):
+                ref = str(item.get('produit') or '').lower().strip()
+                if ref and ref not in by_ref:
+                    by_ref[ref] = item
+                    positions[ref] = i
+                brand = str(item.get('Marque') or '').lower().strip()
+                by_brand.setdefault(brand, []).append(item)
+
+            self.by_ref = by_ref
+            self.by_brand = {k: tuple(v) for k, v in by_brand.items()}
+            self._positions = positions
+
+        self._leases = 0
+        self._lease_lock = threading.Lock()
+
+        # 世代內的派生數據緩存（預序列化響應等），隨世代一起釋放
+        self._memo: Dict[Any, Any] = {}
+        self._memo_building: Dict[Any, threading.Lock] = {}
+        self._memo_lock = threading.Lock()
+
+        # 字段投影緩存：字段組合 → {id(商品): 投影後的字典}
+        self._projections: 'OrderedDict[Tuple[str, ...], Dict[int, Dict[str, Any]]]' = OrderedDict()
+        self._projection_requests: Dict[Tuple[str, ...], int] = {}
+        # 增量派生時從上一世代繼承、尚未修補的投影：字段組合 → (上一世代的投影, 被替換的商品, 修改或新增的商品)
+        self._inherited_projections: Dict[Tuple[str, ...], Tuple[Dict[int, Dict[str, Any]], List[Dict[str, Any]], List[Dict[str, Any]]]] = {}
+
+    def __len__(self) -> int:
+        return len(self.products)
+
+    def derive(
+        self,
+        generation: int,
+        ops: Sequence[Dict[str, Any]],
+    ) -> Optional[Tuple['CatalogGeneration', Set[str], Dict[str, str]]]:
+        """
+        在本世代上應用 upsert 操作得到新世代（結果與 apply_ops 後重新構建相同）
+
+        新世代與本世代結構共享：商品元組只做指針複製，by_ref 只改動受影響的鍵，
+        by_brand 只重建受影響的品牌，位置索引在沒有新增商品時直接共用，
+        已預計算的字段投影複製後只替換修改過的商品。單條修改的耗時與目錄大小基本無關
+
+        Returns:
+            (新世代, 新增或修改的 produit 鍵, 被刪除的 {produit 鍵: produit})；
+            含 delete_brand 等非 upsert 操作時返回 None，由調用方全量構建
+        """
+        if any(op.get('op') != 'upsert' for op in ops):
+            return None
+        products = list(self.products)
+        positions = self._positions
+        by_ref = dict(self.by_ref)
+        by_brand = dict(self.by_brand)
+        changed: Set[int] = set()  # 被替換或新增的位置
+        upserted: Set[str] = set()
+        rescan_brands: Set[str] = set()
+
+        for op in ops:
+            item = op['item']
+            ref = _ref(item)
+            if not ref:
+                continue
+            upserted.add(ref)
+            brand = _brand_key(item)
+            i = positions.get(ref)
+            if i is None:
+                if positions is self._positions:
+                    positions = dict(positions)
+                i = positions[ref] = len(products)
+                products.append(item)
+                by_brand[brand] = by_brand.get(brand, ()) + (item,)
+            else:
+                old = products[i]
+                products[i] = item
+                old_brand = _brand_key(old)
+                if old_brand == brand:
+                    by_brand[brand] = tuple(item if p is old else p for p in by_brand[brand])
+                else:
+                    # 換品牌：新品牌中的順序需與商品列表一致，最後按列表重新篩選
+                    by_brand[old_brand] = tuple(p for p in by_brand[old_brand] if p is not old)
+                    rescan_brands.add(brand)
+            changed.add(i)
+            by_ref[ref] = item
+
+        for brand in rescan_brands:
+            by_brand[brand] = tuple(p for p in products if _brand_key(p) == brand)
+        for brand in [k for k, v in by_brand.items() if not v]:
+            del by_brand[brand]
+
+        gen = CatalogGeneration(
+            generation,
+            tuple(products),
+            self.source_signature,
+            indexes=(by_ref, by_brand, positions),
+        )
+        base_size = len(self.products)
+        gen._inherit_projections(
+            self,
+            [self.products[i] for i in changed if i < base_size],
+            [products[i] for i in changed],
+        )
+        return gen, upserted, {}
+
+    def _inherit_projections(
+        self,
+        base: 'CatalogGeneration',
+        removed: List[Dict[str, Any]],
+        updated: List[Dict[str, Any]],
+    ) -> None:
+        """
+        繼承 base 已預計算的字段投影
+
+        只記錄差異（被替換的商品、修改或新增的商品），首次使用時才複製並修補（見 projection），
+        不佔用修改時的獨佔鎖
+        """
+        with base._memo_lock:
+            inherited = {fields: (proj, [], []) for fields, proj in base._projections.items()}
+            for fields, pending in base._inherited_projections.items():
+                inherited.setdefault(fields, pending)
+        removed_ids = {id(item) for item in removed}
+        for fields, (base_proj, prev_removed, prev_updated) in inherited.items():
+            # base 的投影也還未修補時合併兩次差異；差異過多時放棄繼承，需要時重新全量投影
+            if len(prev_removed) + len(removed) > MAX_INHERITED_CHANGES:
+                continue
+            self._inherited_projections[fields] = (
+                base_proj,
+                [*prev_removed, *removed],
+                [item for item in prev_updated if id(item) not in removed_ids] + updated,
+            )
+
+    def _materialize_projection(self, fields: Tuple[str, ...]) -> Optional[Dict[int, Dict[str, Any]]]:
+        """把繼承的投影複製並修補為本世代的投影（調用方持有 _memo_lock）"""
+        pending = self._inherited_projections.pop(fields, None)
+        if pending is None:
+            return None
+        base_proj, removed, updated = pending
+        wanted = frozenset(fields)
+        proj = dict(base_proj)
+        for item in removed:
+            proj.pop(id(item), None)
+        for item in updated:
+            proj[id(item)] = {k: v for k, v in item.items() if k in wanted}
+        self._projections[fields] = proj
+        return proj
+
+    @property
+    def in_flight(self) -> int:
+        """正在使用此世代的請求數"""
+        return self._leases
+
+    def memo(self, key: Any, factory: Callable[[], Any]) -> Any:
+        """
+        獲取世代內緩存的派生數據，不存在時調用 factory 生成
+
+        世代不可變，派生數據在世代生命週期內始終有效
+        """
+        try:
+            return self._memo[key]
+        except KeyError:
+            pass
+        # 按鍵加鎖構建：相同鍵只構建一次，不同鍵互不阻塞
+        with self._memo_lock:
+            key_lock = self._memo_building.setdefault(key, threading.Lock())
+        with key_lock:
+            if key not in self._memo:
+                value = factory()
+                with self._memo_lock:
+                    self._memo[key] = value
+                    self._memo_building.pop(key, None)
+            return self._memo[key]
+
+    def projection(self, fields: Tuple[str, ...], force: bool = False) -> Optional[Dict[int, Dict[str, Any]]]:
+        """
+        獲取整個世代的字段投影
+
+        常用字段組合（請求次數達到 PROJECTION_MIN_REQUESTS 或 force=True）
+        為所有商品預計算一次，之後直接複用；偶發組合返回 None 由調用方按需投影
+
+        Args:
+            fields: 排序後的字段名元組
+            force: 立即構建（用於預熱）
+        """
+        with self._memo_lock:
+            cached = self._projections.get(fields)
+            if cached is not None:
+                self._projections.move_to_end(fields)
+                return cached
+            if fields in self._inherited_projections:
+                return self._materialize_projection(fields)
+            if not force:
+                if len(self._projection_requests) > 256:
+                    self._projection_requests.clear()
+                count = self._projection_requests.get(fields, 0) + 1
+                self._projection_requests[fields] = count
+                if count < PROJECTION_MIN_REQUESTS:
+                    return None
+
+        wanted = frozenset(fields)
+        built = {
+            id(item): {k: v for k, v in item.items() if k in wanted}
+            for item in self.products
+        }
+        with self._memo_lock:
+            self._projections[fields] = built
+            self._projections.move_to_end(fields)
+            while len(self._projections) > PROJECTION_CACHE_SIZE:
+                self._projections.popitem(last=False)
+        return built
+
+    def project(self, items: Sequence[Dict[str, Any]], fields: Optional[Tuple[str, ...]]) -> List[Dict[str, Any]]:
+        """
+        只保留指定字段（fields 為 None 時原樣返回）
+
+        items 必須來自本世代；命中預計算投影時不再逐條重建字典
+        """
+        if fields is None:
+            return list(items)
+        proj = self.projection(fields)
+        if proj is not None:
+            return [proj[id(item)] for item in items]
+        wanted = frozenset(fields)
+        return [{k: v for k, v in item.items() if k in wanted} for item in items]
+
+    def top_brands(self, limit: int) -> List[str]:
+        """商品數最多的品牌（小寫）"""
+        ranked = sorted(self.by_brand.items(), key=lambda kv: len(kv[1]), reverse=True)
+        return [brand for brand, _ in ranked if brand][:limit]
+
+    def sorted_view(self, brand: Optional[str] = None) -> Tuple[List[Tuple[str, int]], Tuple[Dict[str, Any], ...]]:
+        """
+        按 produit 排序的穩定視圖（游標分頁用，每個世代每個品牌只排序一次）
+
+        Returns:
+            (排序鍵列表, 對應的商品)，排序鍵為 (produit 小寫, 原始位置)
+        """
+        brand_key = str(brand or '').lower().strip()
+
+        def build():
+            source = self.get_by_brand(brand_key) if brand_key else self.products
+            keyed = sorted(
+                ((str(item.get('produit') or '').lower().strip(), i), item)
+                for i, item in enumerate(source)
+            )
+            return [k for k, _ in keyed], tuple(item for _, item in keyed)
+
+        return self.memo(('sorted', brand_key), build)
+
+    def page_after(
+        self,
+        after: Optional[Tuple[str, int]],
+        limit: int,
+        brand: Optional[str] = None,
+    ) -> Tuple[Tuple[Dict[str, Any], ...], Optional[Tuple[str, int]], int]:
+        """
+        鍵集分頁：返回排序鍵大於 after 的前 limit 條商品，耗時 O(log n + limit)
+
+        Returns:
+            (本頁商品, 下一頁起點鍵（無更多時為 None）, 總數)
+        """
+        keys, items = self.sorted_view(brand)
+        start = bisect.bisect_right(keys, tuple(after)) if after else 0
+        end = start + limit
+        next_key = keys[end - 1] if end < len(keys) else None
+        return items[start:end], next_key, len(keys)
+
+    def get_by_produit(self, produit: str) -> Optional[Dict[str, Any]]:
+        """根據 produit 獲取商品（索引查找）"""
+        return self.by_ref.get(str(produit or '').lower().strip())
+
+    def get_by_brand(self, brand: str) -> Tuple[Dict[str, Any], ...]:
+        """根據品牌獲取商品（索引查找）"""
+        return self.by_brand.get(str(brand or '').lower().strip(), ())
+
+
+def build_generation(
+    raw: List[Dict[str, Any]],
+    generation: int,
+    source_signature: Optional[Tuple[int, int]] = None,
+    progress: Optional[Callable[[int, int], None]] = None,
+) -> CatalogGeneration:
+    """
+    由原始商品數據構建新世代（規範化 + 建索引）
+
+    Args:
+        raw: 原始商品列表
+        generation: 世代編號
+        source_signature: 來源文件簽名
+        progress: 進度回調 progress(已處理, 總數)
+    """
+    total = len(raw)
+    products = []
+    for i, p in enumerate(raw, 1):
+        if not isinstance(p, dict):
+            continue
+        products.append(normalize_product(p))
+        if progress and i % 5000 == 0:
+            progress(i, total)
+    if progress:
+        progress(total, total)
+    return CatalogGeneration(generation, tuple(products), source_signature)
+
+
+def encode_cursor(generation: int, key: Tuple[str, int], brand: Optional[str] = None) -> str:
+    """生成不透明的分頁游標（攜帶世代、排序鍵和品牌篩選）"""
+    payload = json.dumps(
+        {'g': generation, 'k': list(key), 'b': str(brand or '').lower().strip()},
+        ensure_ascii=False,
+        separators=(',', ':'),
+    )
+    return base64.urlsafe_b64encode(payload.encode('utf-8')).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor: str) -> Dict[str, Any]:
+    """
+    解析分頁游標
+
+    Raises:
+        ValueError: 游標格式無效
+    """
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        data = json.loads(base64.urlsafe_b64decode(padded.encode('ascii')))
+        ref, pos = data['k']
+        return {'generation': int(data['g']), 'key': (str(ref), int(pos)), 'brand': str(data.get('b') or '')}
+    except (ValueError, TypeError, KeyError, UnicodeError) as e:
+        raise ValueError('invalid_cursor') from e
+
+
+def diff_generations(
+    old: Optional[CatalogGeneration],
+    new: CatalogGeneration,
+) -> Tuple[Set[str], Dict[str, str]]:
+    """
+    比較兩個世代
+
+    Returns:
+        (新增或修改的 produit 鍵（小寫）, 被刪除的 {produit 鍵: 原始 produit})
+    """
+    if old is None:
+        return set(new.by_ref), {}
+    upserted = {ref for ref, item in new.by_ref.items() if old.by_ref.get(ref) != item}
+    deleted = {
+        ref: str(item.get('produit'))
+        for ref, item in old.by_ref.items()
+        if ref not in new.by_ref
+    }
+    return upserted, deleted
+
+
+class CatalogChangeLog:
+    """
+    商品目錄變更日誌
+
+    記錄每個世代相對上一世代新增/修改/刪除的 produit，客戶端憑版本號只拉取增量。
+    版本號形如 "<epoch>.<世代>"，epoch 按進程生成（fork 出的 worker 各自重新生成，
+    各 worker 的世代編號互不相關）；日誌超過容量時丟棄最舊記錄，
+    過舊或來自其他進程的版本號只能全量重新同步
+    """
+
+    def __init__(self, max_entries: int = 64, max_changes: int = 20000):
+        self._epoch = uuid.uuid4().hex[:8]
+        self._epoch_pid = os.getpid()
+        self._entries: deque = deque()  # (世代, 新增/修改鍵集合, 刪除 {鍵: produit})
+        self._total_changes = 0
+        self._max_entries = max_entries
+        self._max_changes = max_changes
+        self._base_generation: Optional[int] = None  # 可計算增量的最早版本
+        self._lock = threading.Lock()
+
+    @property
+    def epoch(self) -> str:
+        if self._epoch_pid != os.getpid():
+            self._epoch = uuid.uuid4().hex[:8]
+            self._epoch_pid = os.getpid()
+        return self._epoch
+
+    def version_token(self, generation: int) -> str:
+        return f"{self.epoch}.{generation}"
+
+    def parse_token(self, token: str) -> Optional[int]:
+        """解析版本號，不屬於本進程時返回 None"""
+        epoch, _, generation = (token or '').partition('.')
+        if epoch != self.epoch or not generation.isdigit():
+            return None
+        return int(generation)
+
+    def record(self, generation: int, upserted: Set[str], deleted: Dict[str, str], initial: bool = False) -> None:
+        """記錄一個世代的變更（initial=True 表示首個世代，只作為增量基準）"""
+        with self._lock:
+            if initial or self._base_generation is None:
+                self._entries.clear()
+                self._total_changes = 0
+                self._base_generation = generation
+                return
+            self._entries.append((generation, upserted, deleted))
+            self._total_changes += len(upserted) + len(deleted)
+            # 壓縮：丟棄最舊的記錄，基準版本前移
+            while self._entries and (
+                len(self._entries) > self._max_entries or self._total_changes > self._max_changes
+            ):
+                gen, up, de = self._entries.popleft()
+                self._total_changes -= len(up) + len(de)
+                self._base_generation = gen
+
+    def changes_since(self, generation: int) -> Optional[Tuple[Set[str], Dict[str, str]]]:
+        """
+        合併指定版本之後的所有變更
+
+        Returns:
+            (新增或修改的鍵, 刪除的 {鍵: produit})；版本已被壓縮時返回 None
+        """
+        with self._lock:
+            if self._base_generation is None or generation < self._base_generation:
+                return None
+            upserted: Set[str] = set()
+            deleted: Dict[str, str] = {}
+            for gen, up, de in self._entries:
+                if gen <= generation:
+                    continue
+                for ref in up:
+                    upserted.add(ref)
+                    deleted.pop(ref, None)
+                for ref, produit in de.items():
+                    deleted[ref] = produit
+                    upserted.discard(ref)
+            return upserted, deleted
+
+
+class CatalogStore:
+    """
+    商品目錄存儲
+
+    持有當前世代；新世代在請求路徑之外構建完成後原子替換。
+    舊世代在所有進行中的請求釋放後即不再被引用，由 GC 回收
+
+    多 worker 共享變更日誌時，寫入前先在日誌的跨進程鎖內追上其他 worker 的修改
+    （見 sync_journal），保證修改基於全部已提交的變更
+    """
+
+    def __init__(self, journal=None):
+        self._current: Optional[CatalogGeneration] = None
+        self._retired: List[CatalogGeneration] = []
+        # 可選的變更日誌（CatalogJournal）：載入時重放，單條修改追加寫入
+        self.journal = journal
+        # 本進程自己寫出的數據文件簽名（壓縮快照），不應觸發熱重載
+        self._own_signature: Optional[Tuple[int, int]] = None
+        self._lock = threading.Lock()
+        self._build_lock = threading.RLock()
+        self._next_generation = 1
+        self.changes = CatalogChangeLog()
+
+    @property
+    def current(self) -> Optional[CatalogGeneration]:
+        """當前世代（未載入時為 None）"""
+        return self._current
+
+    @property
+    def is_ready(self) -> bool:
+        return self._current is not None
+
+    def next_generation_id(self) -> int:
+        with self._lock:
+            gen_id = self._next_generation
+            self._next_generation += 1
+            return gen_id
+
+    @contextmanager
+    def lease(self) -> Iterator[CatalogGeneration]:
+        """
+        在請求處理期間持有當前世代
+
+        用法：
+            with store.lease() as gen:
+                gen.products ...
+        """
+        with self._lock:
+            gen = self._current
+            if gen is None:
+                raise LookupError('catalog_not_loaded')
+            with gen._lease_lock:
+                gen._leases += 1
+        try:
+            yield gen
+        finally:
+            with gen._lease_lock:
+                gen._leases -= 1
+                drained = gen._leases == 0
+            if drained:
+                self._release_retired()
+
+    def publish(
+        self,
+        gen: CatalogGeneration,
+        changes: Optional[Tuple[Set[str], Dict[str, str]]] = None,
+    ) -> Optional[CatalogGeneration]:
+        """
+        原子切換到新世代
+
+        Args:
+            gen: 新世代
+            changes: 已知的變更 (新增或修改的鍵, 刪除的 {鍵: produit})，為空時與當前世代比較得出
+
+        Returns:
+            被替換的舊世代
+        """
+        with self._build_lock:
+            old = self._current
+            if changes is None and old is not None:
+                changes = diff_generations(old, gen)
+            with self._lock:
+                self._current = gen
+                if old is not None:
+                    self._retired.append(old)
+                upserted, deleted = changes or (set(), {})
+                self.changes.record(gen.generation, upserted, deleted, initial=old is None)
+        logger.info(
+            f"[Catalog] 切換到世代 {gen.generation}: {len(gen)} 條商品"
+            + (f"（舊世代 {old.generation} 進行中請求 {old.in_flight}）" if old else '')
+        )
+        self._release_retired()
+        return old
+
+    def publish_if_current(
+        self,
+        expected: CatalogGeneration,
+        build: Callable[[int], CatalogGeneration],
+        changes: Optional[Tuple[Set[str], Dict[str, str]]] = None,
+    ) -> CatalogGeneration:
+        """
+        基於 expected 增量構建的新世代：僅當 expected 仍是當前世代時才構建並切換
+
+        build 在獨佔鎖內執行（可在其中完成落盤），避免與重載交錯
+
+        Raises:
+            CatalogConflictError: 當前世代已不是 expected
+        """
+        with self._build_lock, self._journal_lock():
+            # 其他 worker 已提交的修改不在 expected 中，追上後按衝突處理
+            self._sync_locked()
+            if self._current is not expected:
+                raise CatalogConflictError('catalog_changed')
+            gen = build(self.next_generation_id())
+            self.publish(gen, changes)
+            return gen
+
+    def _journal_lock(self):
+        return self.journal.exclusive() if self.journal is not None else nullcontext()
+
+    def _sync_locked(self) -> Optional[CatalogGeneration]:
+        """
+        追上其他進程寫入變更日誌或數據文件的修改（調用方持有 _build_lock 和日誌鎖）
+
+        Returns:
+            新切換的世代；沒有新變更時返回 None
+        """
+        journal = self.journal
+        base = self._current
+        if journal is None or base is None:
+            return None
+        records = journal.read_new()
+        if records is None or self.is_stale(journal.snapshot_path):
+            logger.info("[Catalog] 數據文件已被其他進程更新，重新載入")
+            return self.load_file(journal.snapshot_path)
+        if not records:
+            return None
+        gen, upserted, deleted = self._derive(base, records)
+        self.publish(gen, (upserted, deleted))
+        return gen
+
+    def _derive(
+        self,
+        base: CatalogGeneration,
+        ops: List[Dict[str, Any]],
+    ) -> Tuple[CatalogGeneration, Set[str], Dict[str, str]]:
+        """基於 base 應用變更操作：upsert 增量派生，含刪除品牌時全量構建"""
+        generation = self.next_generation_id()
+        derived = base.derive(generation, ops)
+        if derived is not None:
+            return derived
+        products, upserted, deleted = apply_ops(base.products, ops)
+        return CatalogGeneration(generation, tuple(products), base.source_signature), upserted, deleted
+
+    def sync_journal(self) -> Optional[CatalogGeneration]:
+        """應用其他 worker 寫入變更日誌的修改（由文件監視任務定期調用）"""
+        with self._build_lock, self._journal_lock():
+            return self._sync_locked()
+
+    def _release_retired(self) -> None:
+        """丟棄已無進行中請求的舊世代"""
+        with self._lock:
+            if not self._retired:
+                return
+            remaining = []
+            for gen in self._retired:
+                if gen.in_flight > 0:
+                    remaining.append(gen)
+                else:
+                    logger.info(f"[Catalog] 舊世代 {gen.generation} 已排空並釋放")
+            self._retired = remaining
+
+    def retired_status(self) -> List[Dict[str, int]]:
+        """仍在排空中的舊世代"""
+        with self._lock:
+            return [{'generation': g.generation, 'in_flight': g.in_flight} for g in self._retired]
+
+    def load_file(
+        self,
+        path: str,
+        progress: Optional[Callable[[int, int], None]] = None,
+    ) -> CatalogGeneration:
+        """
+        從文件構建新世代並切換（同一時間只有一個構建/切換任務）
+
+        Raises:
+            OSError / ValueError: 文件讀取或解析失敗（當前世代保持不變）
+        """
+        # 持有日誌鎖：其他進程不會在讀取期間替換快照或截斷日誌
+        with self._build_lock, self._journal_lock():
+            signature = file_signature(path)
+            raw = read_products_file(path)
+            if self.journal is not None:
+                raw = self.journal.replay(raw, signature)
+            gen = build_generation(raw, self.next_generation_id(), signature, progress)
+            self.publish(gen)
+            return gen
+
+    def apply_changes(
+        self,
+        make_ops: Callable[[CatalogGeneration], List[Dict[str, Any]]],
+    ) -> Tuple[CatalogGeneration, Set[str], Dict[str, str]]:
+        """
+        把單條修改/刪除應用到當前世代並切換，同時追加寫入變更日誌
+
+        make_ops 在獨佔鎖（含日誌的跨進程鎖）內基於當前世代生成變更操作（見 apply_ops），
+        併發修改同一商品不會互相覆蓋；磁盤 IO 只與變更大小有關，返回前等待日誌落盤
+
+        Returns:
+            (新世代, 新增或修改的 produit 鍵, 被刪除的 {produit 鍵: produit})
+
+        Raises:
+            LookupError: 目錄尚未載入，或 make_ops 找不到要修改的商品
+        """
+        with self._build_lock, self._journal_lock():
+            if self._current is None:
+                raise LookupError('catalog_not_loaded')
+            self._sync_locked()
+            base = self._current
+            ops = make_ops(base)
+            gen, upserted, deleted = self._derive(base, ops)
+            seq = self.journal.append(ops) if self.journal is not None else 0
+            self.publish(gen, (upserted, deleted))
+        if self.journal is not None:
+            self.journal.wait_durable(seq)
+        return gen, upserted, deleted
+
+    def compact(self) -> Optional[CatalogGeneration]:
+        """
+        把變更日誌壓縮為新的數據文件快照（後台執行，不阻塞修改）
+
+        多 worker 部署時只應由 journal.claim_compactor() 成功的進程調用
+
+        Returns:
+            寫入快照的世代；沒有待壓縮的變更時返回 None
+        """
+        journal = self.journal
+        if journal is None:
+            return None
+        with self._build_lock, journal.exclusive():
+            self._sync_locked()
+            gen = self._current
+            through = journal.last_seq
+            if gen is None or journal.pending == 0:
+                return None
+        start = time.time()
+        self._own_signature = journal.write_snapshot(gen.products, through)
+        logger.info(f"[Catalog] 變更日誌已壓縮到快照（序號 {through}，世代 {gen.generation}），耗時 {time.time() - start:.2f}s")
+        return gen
+
+    def is_stale(self, path: str) -> bool:
+        """數據文件是否已在當前世代載入之後被外部變更"""
+        gen = self._current
+        signature = file_signature(path)
+        if gen is None or signature is None:
+            return False
+        return signature not in (gen.source_signature, self._own_signature)
@@ -0,0 +1,239 @@
+# -*- coding: utf-8 -*-
+"""
+商品數據下載模塊
+流式下載遠端 products.json，支持斷點續傳、校驗和驗證、原子替換和 ETag 條件請求
+"""
+
+import os
+import re
+import json
+import time
+import hashlib
+import logging
+from datetime import datetime
+from typing import Dict, Any, Optional, Callable
+
+import requests
+
+logger = logging.getLogger(__name__)
+
+# 每次寫入磁盤的塊大小
+CHUNK_SIZE = 64 * 1024
+
+# SHA-256 十六進制格式（Hugging Face 的 X-Linked-Etag 即 LFS 文件的 SHA-256）
+_SHA256_RE = re.compile(r'^[0-9a-f]{64}$')
+
+
+class CatalogDownloadError(Exception):
+    """下載失敗（重試耗盡或校驗和不一致）"""
+
+
+def _meta_path(dest: str) -> str:
+    return f"{dest}.meta.json"
+
+
+def _part_path(dest: str) -> str:
+    return f"{dest}.part"
+
+
+def _part_meta_path(dest: str) -> str:
+    return f"{dest}.part.json"
+
+
+def _read_json(path: str) -> Dict[str, Any]:
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+            return data if isinstance(data, dict) else {}
+    except (OSError, ValueError):
+        return {}
+
+
+def _write_json_atomic(path: str, data: Dict[str, Any]) -> None:
+    tmp = f"{path}.tmp"
+    with open(tmp, 'w', encoding='utf-8') as f:
+        json.dump(data, f, ensure_ascii=False)
+    os.replace(tmp, path)
+
+
+def _remove_quietly(path: str) -> None:
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+def _hash_file(path: str) -> 'hashlib._Hash':
+    """計算已下載部分的 SHA-256（續傳時繼續累加）"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b''):
+            digest.update(chunk)
+    return digest
+
+
+def _expected_checksum(response: requests.Response, expected_sha256: Optional[str]) -> Optional[str]:
+    """
+    優先使用顯式配置的校驗和，其次使用響應頭中的 SHA-256
+
+    Hugging Face 的 resolve URL 以 302 重定向到 CDN，X-Linked-Etag 只在重定向響應上，
+    因此先查最終響應，再從最近一跳往前查 response.history
+    """
+    if expected_sha256:
+        return expected_sha256.strip().lower()
+    for hop in [response, *reversed(response.history)]:
+        for header in ('X-Linked-Etag', 'X-Checksum-Sha256', 'ETag'):
+            value = (hop.headers.get(header) or '').strip().strip('"').lower()
+            if value.startswith('w/'):
+                continue
+            if _SHA256_RE.match(value):
+                return value
+    return None
+
+
+def read_download_meta(dest: str) -> Dict[str, Any]:
+    """讀取上次成功下載的元數據（etag / sha256 / size）"""
+    return _read_json(_meta_path(dest))
+
+
+def download_catalog(
+    url: str,
+    dest: str,
+    bearer: str = '',
+    expected_sha256: Optional[str] = None,
+    timeout: float = 60,
+    max_retries: int = 3,
+    session: Optional[requests.Session] = None,
+    progress: Optional[Callable[[int, Optional[int]], None]] = None,
+    require_checksum: bool = False,
+) -> Dict[str, Any]:
+    """
+    下載商品數據文件
+
+    - 流式寫入 dest.part，不把整個文件放進內存
+    - 連接中斷後用 Range 請求從已下載位置續傳（If-Range 保證仍是同一版本）
+    - 下載完成後驗證 SHA-256，再用 os.replace 原子替換 dest；
+      沒有可用的校驗和時記錄警告並在結果中標記 verified=False（require_checksum 時直接失敗）
+    - dest 已存在時帶上 If-None-Match，未變更只需一次 304
+
+    Args:
+        url: 遠端文件 URL
+        dest: 本地目標路徑
+        bearer: 可選的 Bearer Token
+        expected_sha256: 期望的 SHA-256（為空時使用響應頭中的校驗和）
+        timeout: 連接/讀取超時（秒）
+        max_retries: 失敗後的重試次數
+        session: 可注入的 requests.Session（便於對本地 HTTP 服務測試）
+        progress: 進度回調 progress(已下載字節, 總字節或 None)
+        require_checksum: 既未配置也未從響應頭得到校驗和時拒絕下載
+
+    Returns:
+        {'status': 'downloaded' | 'not_modified', 'bytes': int, 'etag': str, 'sha256': str, 'verified': bool}
+
+    Raises:
+        CatalogDownloadError: 重試耗盡、校驗和不一致或缺少要求的校驗和
+    """
+    http = session or requests.Session()
+    part = _part_path(dest)
+    meta = read_download_meta(dest) if os.path.exists(dest) else {}
+    dest_dir = os.path.dirname(dest)
+    if dest_dir:
+        os.makedirs(dest_dir, exist_ok=True)
+
+    last_error: Optional[Exception] = None
+    for attempt in range(max_retries + 1):
+        if attempt:
+            time.sleep(min(2 ** attempt, 30))
+        try:
+            headers = {}
+            if bearer:
+                headers['Authorization'] = f'Bearer {bearer}'
+            if meta.get('etag'):
+                headers['If-None-Match'] = meta['etag']
+
+            part_meta = _read_json(_part_meta_path(dest))
+            offset = os.path.getsize(part) if os.path.exists(part) else 0
+            if offset and part_meta.get('etag'):
+                headers['Range'] = f'bytes={offset}-'
+                headers['If-Range'] = part_meta['etag']
+            else:
+                offset = 0
+
+            with http.get(url, headers=headers, stream=True, timeout=timeout) as response:
+                if response.status_code == 304:
+                    logger.info(f"[Download] 遠端數據未變更 (ETag {meta.get('etag')})")
+                    return {
+                        'status': 'not_modified',
+                        'bytes': 0,
+                        'etag': meta.get('etag', ''),
+                        'sha256': meta.get('sha256', ''),
+                        'verified': bool(meta.get('verified', True)),
+                    }
+                if response.status_code == 416:
+                    # 已下載部分已失效，丟棄後從頭下載
+                    _remove_quietly(part)
+                    _remove_quietly(_part_meta_path(dest))
+                    raise CatalogDownloadError('range_not_satisfiable')
+                response.raise_for_status()
+
+                expected = _expected_checksum(response, expected_sha256)
+                if expected is None and require_checksum:
+                    raise CatalogDownloadError('checksum_unavailable')
+
+                etag = response.headers.get('ETag', '')
+                if response.status_code == 206 and offset:
+                    mode = 'ab'
+                    digest = _hash_file(part)
+                    logger.info(f"[Download] 從 {offset} 字節處續傳")
+                else:
+                    mode = 'wb'
+                    offset = 0
+                    digest = hashlib.sha256()
+
+                length = response.headers.get('Content-Length')
+                total = offset + int(length) if length and length.isdigit() else None
+                if etag:
+                    _write_json_atomic(_part_meta_path(dest), {'etag': etag, 'url': url})
+
+                done = offset
+                with open(part, mode) as f:
+                    for chunk in response.iter_content(chunk_size=CHUNK_SIZE):
+                        if not chunk:
+                            continue
+                        f.write(chunk)
+                        digest.update(chunk)
+                        done += len(chunk)
+                        if progress:
+                            progress(done, total)
+                    f.flush()
+                    os.fsync(f.fileno())
+
+                if total is not None and done != total:
+                    raise CatalogDownloadError(f"incomplete: {done}/{total} bytes")
+
+                sha256 = digest.hexdigest()
+                if expected is None:
+                    logger.warning(f"[Download] 未配置校驗和且響應頭中沒有 SHA-256，無法驗證下載內容 (sha256={sha256[:12]})")
+                elif sha256 != expected:
+                    _remove_quietly(part)
+                    _remove_quietly(_part_meta_path(dest))
+                    raise CatalogDownloadError(f"checksum mismatch: {sha256} != {expected}")
+
+            os.replace(part, dest)
+            _remove_quietly(_part_meta_path(dest))
+            _write_json_atomic(_meta_path(dest), {
+                'etag': etag,
+                'sha256': sha256,
+                'size': done,
+                'verified': expected is not None,
+                'url': url,
+                'downloaded_at': datetime.now().isoformat(),
+            })
+            logger.info(f"[Download] 數據文件下載成功: {dest} ({done} 字節, sha256={sha256[:12]})")
+            return {'status': 'downloaded', 'bytes': done, 'etag': etag, 'sha256': sha256, 'verified': expected is not None}
+
+        except (requests.RequestException, OSError, CatalogDownloadError) as e:
+            last_error = e
+            logger.warning(f"[Download] 第 {attempt + 1} 次下載失敗: {e}")
+
+    raise CatalogDownloadError(f"下載失敗: {last_error}")
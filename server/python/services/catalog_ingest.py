@@ -0,0 +1,276 @@
+# -*- coding: utf-8 -*-
+"""
+商品批量導入模塊
+流式解析上傳的 JSON 數組，逐條校驗規範化，增量構建下一世代並原子寫入磁盤
+"""
+
+import os
+import sys
+import json
+import time
+import uuid
+import codecs
+import logging
+import threading
+from collections import OrderedDict
+from typing import List, Dict, Any, Optional, AsyncIterator, Set
+from pathlib import Path
+
+# 確保可以導入本地模塊
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from config.brand_mappings import normalize_brand
+from .catalog import CatalogGeneration, normalize_product, file_signature
+
+logger = logging.getLogger(__name__)
+
+# 單條記錄的最大字符數（防止畸形輸入導致緩衝區無限增長）
+MAX_RECORD_CHARS = 1_000_000
+
+# 寫入臨時文件時每批的記錄數
+WRITE_BATCH_SIZE = 500
+
+
+class IngestError(ValueError):
+    """上傳內容格式無效"""
+
+
+async def iter_json_array(chunks: AsyncIterator[bytes]) -> AsyncIterator[Any]:
+    """
+    流式解析 JSON 數組，逐個產出數組元素
+
+    只在內存中保留當前未解析完的部分，不需要把整個請求體讀入內存
+
+    Raises:
+        IngestError: 不是 JSON 數組或格式錯誤
+    """
+    decoder = codecs.getincrementaldecoder('utf-8')()
+    json_decoder = json.JSONDecoder()
+    buf = ''
+    pos = 0
+    started = False
+    finished = False
+    eof = False
+    it = chunks.__aiter__()
+
+    while True:
+        # 跳過空白和分隔符
+        while pos < len(buf) and (buf[pos].isspace() or (started and buf[pos] == ',')):
+            pos += 1
+
+        if pos < len(buf):
+            if finished:
+                raise IngestError('unexpected_data_after_array')
+            if not started:
+                if buf[pos] != '[':
+                    raise IngestError('expected_json_array')
+                started = True
+                pos += 1
+                continue
+            if buf[pos] == ']':
+                finished = True
+                pos += 1
+                continue
+            try:
+                value, end = json_decoder.raw_decode(buf, pos)
+            except json.JSONDecodeError:
+                if eof:
+                    raise IngestError('invalid_json')
+                if len(buf) - pos > MAX_RECORD_CHARS:
+                    raise IngestError('record_too_large')
+            else:
+                # 數字等標量可能在緩衝區末尾被截斷，等待更多數據再確認
+                if end < len(buf) or eof or isinstance(value, (dict, list, str)):
+                    pos = end
+                    yield value
+                    continue
+
+        if eof:
+            if not finished:
+                raise IngestError('unterminated_json_array')
+            return
+
+        # 讀取更多數據，丟棄已解析部分
+        try:
+            chunk = await it.__anext__()
+            text = decoder.decode(chunk)
+        except StopAsyncIteration:
+            text = decoder.decode(b'', final=True)
+            eof = True
+        except UnicodeDecodeError:
+            raise IngestError('invalid_utf8')
+        buf = buf[pos:] + text
+        pos = 0
+
+
+class IngestJob:
+    """一次批量導入的進度"""
+
+    def __init__(self, job_id: Optional[str] = None):
+        self.id = job_id or uuid.uuid4().hex[:12]
+        self.status = 'receiving'  # receiving / persisting / publishing / done / failed
+        self.received = 0
+        self.inserted = 0
+        self.duplicates = 0
+        self.invalid = 0
+        self.total = 0
+        self.generation: Optional[int] = None
+        self.error: Optional[str] = None
+        self.started_at = time.time()
+        self.finished_at: Optional[float] = None
+
+    def to_dict(self) -> Dict[str, Any]:
+        end = self.finished_at or time.time()
+        return {
+            'job_id': self.id,
+            'status': self.status,
+            'received': self.received,
+            'inserted': self.inserted,
+            'duplicatesSkipped': self.duplicates,
+            'invalid': self.invalid,
+            'total': self.total,
+            'generation': self.generation,
+            'error': self.error,
+            'elapsed': round(end - self.started_at, 3),
+        }
+
+
+class IngestRegistry:
+    """保留最近的導入任務，供進度查詢"""
+
+    def __init__(self, max_jobs: int = 20):
+        self._jobs: 'OrderedDict[str, IngestJob]' = OrderedDict()
+        self._max_jobs = max_jobs
+        self._lock = threading.Lock()
+
+    def create(self, job_id: Optional[str] = None) -> IngestJob:
+        job = IngestJob(job_id)
+        with self._lock:
+            self._jobs[job.id] = job
+            while len(self._jobs) > self._max_jobs:
+                self._jobs.popitem(last=False)
+        return job
+
+    def get(self, job_id: str) -> Optional[IngestJob]:
+        with self._lock:
+            return self._jobs.get(job_id)
+
+
+class CatalogBuilder:
+    """
+    增量構建下一世代
+
+    以當前世代為基礎，逐條加入上傳記錄（跳過重複 produit），
+    同時把記錄流式寫入臨時文件，完成後原子替換數據文件
+    """
+
+    def __init__(self, base: CatalogGeneration, path: str, job: IngestJob):
+        self._path = path
+        self._tmp_path = f"{path}.ingest.tmp"
+        self._job = job
+        self._products: List[Dict[str, Any]] = list(base.products)
+        self._seen: Set[str] = set(base.by_ref)
+        self.inserted_refs: Set[str] = set()
+        # 品牌鍵 → 目錄中已使用的寫法（保持品牌名大小寫一致）
+        self._brand_display: Dict[str, str] = {
+            key: str(items[0].get('Marque') or '').strip()
+            for key, items in base.by_brand.items() if key and items
+        }
+        self._pending: List[str] = []
+        self._count = 0
+
+        path_dir = os.path.dirname(path)
+        if path_dir:
+            os.makedirs(path_dir, exist_ok=True)
+        self._file = open(self._tmp_path, 'w', encoding='utf-8')
+        try:
+            self._file.write('[')
+            for item in self._products:
+                self._write(item)
+        except BaseException:
+            # 寫入現有商品時失敗（如磁盤已滿）：調用方拿不到實例，在此清理臨時文件
+            self.abort()
+            raise
+        job.total = len(self._products)
+
+    def _write(self, item: Dict[str, Any]) -> None:
+        self._pending.append(json.dumps(item, ensure_ascii=False, separators=(',', ':')))
+        if len(self._pending) >= WRITE_BATCH_SIZE:
+            self._flush_pending()
+
+    def _flush_pending(self) -> None:
+        if not self._pending:
+            return
+        prefix = ',' if self._count else ''
+        self._file.write(prefix + ','.join(self._pending))
+        self._count += len(self._pending)
+        self._pending = []
+
+    def _normalize_marque(self, value: Any) -> str:
+        marque = str(value or '').strip()
+        if not marque:
+            return ''
+        key = str(normalize_brand(marque)).lower().strip()
+        if key in self._brand_display:
+            return self._brand_display[key]
+        display = marque if key == marque.lower() else key.title()
+        self._brand_display[key] = display
+        return display
+
+    def add(self, record: Any) -> str:
+        """
+        加入一條上傳記錄
+
+        Returns:
+            'inserted' / 'duplicate' / 'invalid'
+        """
+        job = self._job
+        job.received += 1
+        if not isinstance(record, dict):
+            job.invalid += 1
+            return 'invalid'
+        produit = str(record.get('produit') if record.get('produit') is not None else '').strip()
+        if not produit:
+            job.invalid += 1
+            return 'invalid'
+        ref = produit.lower()
+        if ref in self._seen:
+            job.duplicates += 1
+            return 'duplicate'
+
+        item = normalize_product({**record, 'produit': produit})
+        if 'Marque' in item:
+            item['Marque'] = self._normalize_marque(item.get('Marque'))
+        self._seen.add(ref)
+        self.inserted_refs.add(ref)
+        self._products.append(item)
+        self._write(item)
+        job.inserted += 1
+        job.total = len(self._products)
+        return 'inserted'
+
+    def add_many(self, records: List[Any]) -> None:
+        for record in records:
+            self.add(record)
+
+    def commit(self, generation: int) -> CatalogGeneration:
+        """寫完並 fsync 臨時文件，原子替換數據文件，返回新世代"""
+        self._job.status = 'persisting'
+        self._flush_pending()
+        self._file.write(']')
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._file.close()
+        os.replace(self._tmp_path, self._path)
+        self._job.status = 'publishing'
+        return CatalogGeneration(generation, tuple(self._products), file_signature(self._path))
+
+    def abort(self) -> None:
+        """放棄導入，刪除臨時文件"""
+        try:
+            self._file.close()
+        finally:
+            try:
+                os.remove(self._tmp_path)
+            except FileNotFoundError:
+                pass
@@ -0,0 +1,425 @@
+# -*- coding: utf-8 -*-
+"""
+商品變更日誌模塊
+單條商品修改、品牌刪除追加寫入日誌（批量 fsync），後台壓縮為新的數據文件快照
+"""
+
+import os
+import sys
+import json
+import logging
+import threading
+from contextlib import contextmanager
+from typing import List, Dict, Any, Optional, Tuple, Sequence, Iterator
+from pathlib import Path
+
+try:
+    import fcntl
+except ImportError:  # 非 POSIX 平台：只能單進程運行
+    fcntl = None
+
+# 確保可以導入本地模塊
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from .catalog import normalize_product, file_signature, apply_ops
+
+logger = logging.getLogger(__name__)
+
+# 狀態文件中保留的快照記錄數（壓縮寫快照前先記錄，崩潰時仍能找到舊快照的位置）
+MAX_SNAPSHOT_STATES = 4
+
+
+class CatalogJournal:
+    """
+    追加寫入的商品變更日誌
+
+    - 每行一條 JSON 記錄，帶遞增序號 seq
+    - 寫入在內存中完成後由第一個等待者統一 fsync（組提交），
+      併發的多次修改共用一次 fsync
+    - 狀態文件記錄每個數據文件快照（按文件簽名識別）已包含到哪個序號，
+      載入時只重放該序號之後的記錄；快照被外部替換時日誌作廢
+
+    多進程（多 worker）共享同一日誌：
+    - 分配序號、追加、登記快照、截斷日誌都在 exclusive() 的文件鎖內進行，
+      寫入前先用 read_new() 追上其他進程的記錄，序號全局遞增
+    - 只有 claim_compactor() 成功的進程執行後台壓縮
+    """
+
+    def __init__(self, snapshot_path: str):
+        self.snapshot_path = snapshot_path
+        self.path = f"{snapshot_path}.journal"
+        self.state_path = f"{snapshot_path}.journal-state"
+        self.lock_path = f"{snapshot_path}.journal-lock"
+        self.compactor_path = f"{snapshot_path}.journal-compactor"
+        self._cond = threading.Condition()
+        self._file = None
+        self._file_ino: Optional[int] = None
+        # 跨進程文件鎖（flock 鎖屬於打開的文件描述，fork 後須在子進程中重新打開）
+        self._mutex = threading.RLock()
+        self._lock_fd: Optional[int] = None
+        self._lock_pid: Optional[int] = None
+        self._lock_depth = 0
+        self._compactor_fd: Optional[int] = None
+        self._compactor_pid: Optional[int] = None
+        self._seen: Optional[Tuple[int, int]] = None  # 最近一次讀寫後日誌文件的 (inode, 大小)
+        self._last_seq = 0
+        self._durable_seq = 0
+        self._syncing = False
+        self._through = 0  # 當前快照已包含的序號
+        self.fsyncs = 0
+        self.compactions = 0
+
+    # ------------------------------------------------------------------
+    # 狀態
+    # ------------------------------------------------------------------
+
+    @property
+    def last_seq(self) -> int:
+        return self._last_seq
+
+    @property
+    def pending(self) -> int:
+        """尚未壓縮進快照的記錄數"""
+        return self._last_seq - self._through
+
+    def size_bytes(self) -> int:
+        try:
+            return os.path.getsize(self.path)
+        except OSError:
+            return 0
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'last_seq': self._last_seq,
+            'pending': self.pending,
+            'bytes': self.size_bytes(),
+            'fsyncs': self.fsyncs,
+            'compactions': self.compactions,
+        }
+
+    def changed_on_disk(self) -> bool:
+        """日誌文件是否被其他進程追加或重寫過（只比較 inode 和大小，開銷很小）"""
+        return _stat_key(self.path) != self._seen
+
+    # ------------------------------------------------------------------
+    # 跨進程鎖
+    # ------------------------------------------------------------------
+
+    @contextmanager
+    def exclusive(self) -> Iterator[None]:
+        """
+        跨進程獨佔鎖（可重入）
+
+        持鎖順序：CatalogStore._build_lock → exclusive() → _cond
+        """
+        with self._mutex:
+            if self._lock_depth == 0 and fcntl is not None:
+                if self._lock_pid != os.getpid():
+                    self._lock_fd = os.open(self.lock_path, os.O_RDWR | os.O_CREAT, 0o644)
+                    self._lock_pid = os.getpid()
+                fcntl.flock(self._lock_fd, fcntl.LOCK_EX)
+            self._lock_depth += 1
+            try:
+                yield
+            finally:
+                self._lock_depth -= 1
+                if self._lock_depth == 0 and fcntl is not None:
+                    fcntl.flock(self._lock_fd, fcntl.LOCK_UN)
+
+    def claim_compactor(self) -> bool:
+        """
+        嘗試成為負責壓縮的進程（非阻塞，成功後在進程生命週期內一直持有）
+
+        持有者退出後鎖自動釋放，由下一個調用者接替
+        """
+        if fcntl is None:
+            return True
+        if self._compactor_pid == os.getpid():
+            return True
+        fd = os.open(self.compactor_path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            os.close(fd)
+            return False
+        self._compactor_fd, self._compactor_pid = fd, os.getpid()
+        return True
+
+    def _read_states(self) -> List[Dict[str, Any]]:
+        try:
+            with open(self.state_path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return []
+        return data.get('snapshots', []) if isinstance(data, dict) else []
+
+    def _write_states(self, states: List[Dict[str, Any]]) -> None:
+        tmp_path = f"{self.state_path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({'snapshots': states[-MAX_SNAPSHOT_STATES:]}, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.state_path)
+
+    def _record_snapshot(self, signature: Optional[Tuple[int, int]], through: int) -> None:
+        states = [s for s in self._read_states() if tuple(s.get('signature') or ()) != tuple(signature or ())]
+        states.append({'signature': list(signature) if signature else None, 'through': through})
+        self._write_states(states)
+
+    def _read_records(self) -> List[Dict[str, Any]]:
+        """讀取日誌記錄（忽略崩潰時寫了一半的末行）"""
+        records = []
+        try:
+            f = open(self.path, 'r', encoding='utf-8')
+        except FileNotFoundError:
+            return records
+        with f:
+            for line_no, line in enumerate(f, 1):
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    records.append(json.loads(line))
+                except ValueError:
+                    logger.warning(f"[Journal] 忽略無法解析的日誌行 {line_no}")
+        return records
+
+    def _has_torn_tail(self) -> bool:
+        """日誌末尾是否有未寫完的行（繼續追加前需要清理）"""
+        try:
+            with open(self.path, 'rb') as f:
+                f.seek(0, os.SEEK_END)
+                if f.tell() == 0:
+                    return False
+                f.seek(-1, os.SEEK_END)
+                return f.read(1) != b'\n'
+        except FileNotFoundError:
+            return False
+
+    def _open(self):
+        # 其他進程壓縮時會原子替換日誌文件，舊句柄指向已刪除的 inode，須重新打開
+        if self._file is not None and _stat_key(self.path, ino_only=True) != self._file_ino:
+            self._close()
+        if self._file is None:
+            self._file = open(self.path, 'a', encoding='utf-8')
+            self._file_ino = os.fstat(self._file.fileno()).st_ino
+        return self._file
+
+    def _close(self) -> None:
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+            self._file_ino = None
+
+    def _rewrite(self, records: List[Dict[str, Any]]) -> None:
+        """用給定記錄原子替換日誌文件（調用方持有 _cond）"""
+        self._close()
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            for record in records:
+                f.write(json.dumps(record, ensure_ascii=False, separators=(',', ':')) + '\n')
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.path)
+        self._seen = _stat_key(self.path)
+
+    # ------------------------------------------------------------------
+    # 載入
+    # ------------------------------------------------------------------
+
+    def replay(self, raw: List[Dict[str, Any]], signature: Optional[Tuple[int, int]]) -> List[Dict[str, Any]]:
+        """
+        在數據文件快照上重放日誌（CatalogStore 載入文件時調用）
+
+        Args:
+            raw: 快照中的原始商品
+            signature: 快照文件簽名
+        """
+        with self.exclusive(), self._cond:
+            self._close()
+            records = self._read_records()
+            if self._has_torn_tail():
+                self._rewrite(records)
+            states = self._read_states()
+            # 壓縮或導入後日誌可能為空，序號須從快照狀態中延續，否則新記錄的序號會落在 through 之內被跳過
+            last_seq = max(
+                [self._last_seq]
+                + [int(r.get('seq', 0)) for r in records]
+                + [int(s.get('through', 0)) for s in states]
+            )
+            self._last_seq = self._durable_seq = last_seq
+            self._seen = _stat_key(self.path)
+
+            state = next(
+                (s for s in reversed(states)
+                 if tuple(s.get('signature') or ()) == tuple(signature or ())),
+                None,
+            )
+            if state is None:
+                if records:
+                    logger.warning(f"[Journal] 數據文件已被外部替換，丟棄 {len(records)} 條未壓縮的變更")
+                    self._rewrite([])
+                self._through = last_seq
+                self._record_snapshot(signature, last_seq)
+                return raw
+
+            self._through = int(state.get('through', 0))
+            ops = [r for r in records if int(r.get('seq', 0)) > self._through]
+            if not ops:
+                return raw
+            products, _, _ = apply_ops(raw, ops)
+            logger.info(f"[Journal] 重放 {len(ops)} 條變更（序號 {self._through + 1}-{last_seq}）")
+            return products
+
+    def read_new(self) -> Optional[List[Dict[str, Any]]]:
+        """
+        讀取其他進程追加的、本進程尚未應用的記錄（調用方持有 exclusive()）
+
+        Returns:
+            序號大於 last_seq 的記錄（按序號排列）；其中有缺口時返回 None，
+            說明其他進程已把本進程未見過的記錄壓縮進快照，須重新載入數據文件
+        """
+        with self._cond:
+            if self._file is not None:
+                self._file.flush()
+            records = [r for r in self._read_records() if int(r.get('seq', 0)) > self._last_seq]
+            states = self._read_states()
+            self._seen = _stat_key(self.path)
+            newest = max([self._last_seq] + [int(s.get('through', 0)) for s in states])
+            if records:
+                newest = max(newest, int(records[-1].get('seq', 0)))
+            seqs = [int(r.get('seq', 0)) for r in records]
+            if seqs != list(range(self._last_seq + 1, newest + 1)):
+                return None
+            if records:
+                self._last_seq = self._durable_seq = newest
+            # 其他進程導入或壓縮時登記的快照位置（決定是否還需要壓縮）
+            signature = file_signature(self.snapshot_path)
+            for s in states:
+                if tuple(s.get('signature') or ()) == tuple(signature or ()):
+                    self._through = max(self._through, int(s.get('through', 0)))
+            return records
+
+    # ------------------------------------------------------------------
+    # 寫入
+    # ------------------------------------------------------------------
+
+    def append(self, ops: List[Dict[str, Any]]) -> int:
+        """
+        追加變更（寫入操作系統緩衝，不等待落盤）
+
+        多進程部署時調用方須持有 exclusive() 並已通過 read_new() 追上其他進程的記錄
+
+        Returns:
+            最後一條記錄的序號，傳給 wait_durable 等待落盤
+        """
+        with self._cond:
+            f = self._open()
+            lines = []
+            for op in ops:
+                self._last_seq += 1
+                lines.append(json.dumps({'seq': self._last_seq, **op}, ensure_ascii=False, separators=(',', ':')))
+            f.write('\n'.join(lines) + '\n')
+            # 釋放文件鎖前寫到文件，其他進程追加的記錄才不會與之交錯
+            f.flush()
+            self._seen = _stat_key(self.path)
+            return self._last_seq
+
+    def wait_durable(self, seq: int) -> None:
+        """
+        等待序號 seq 之前的記錄全部 fsync
+
+        組提交：沒有進行中的 fsync 時由當前線程執行，否則等待並在下一輪一起落盤
+        """
+        while True:
+            with self._cond:
+                if self._durable_seq >= seq:
+                    return
+                if self._syncing:
+                    self._cond.wait()
+                    continue
+                self._syncing = True
+                f = self._open()
+                f.flush()
+                fd = os.dup(f.fileno())
+                target = self._last_seq
+            try:
+                os.fsync(fd)
+                self.fsyncs += 1
+            finally:
+                os.close(fd)
+                with self._cond:
+                    self._durable_seq = max(self._durable_seq, target)
+                    self._syncing = False
+                    self._cond.notify_all()
+
+    # ------------------------------------------------------------------
+    # 快照
+    # ------------------------------------------------------------------
+
+    def mark_snapshot(self, signature: Optional[Tuple[int, int]], through: int) -> None:
+        """
+        數據文件已寫入包含序號 through 之前所有變更的新快照：記錄狀態並截斷日誌
+
+        調用時新快照應已原子替換到位
+        """
+        with self.exclusive(), self._cond:
+            self._record_snapshot(signature, through)
+            self._through = max(self._through, through)
+            if self._file is not None:
+                self._file.flush()
+            remaining = [r for r in self._read_records() if int(r.get('seq', 0)) > through]
+            self._rewrite(remaining)
+            self._durable_seq = max(self._durable_seq, self._last_seq)
+
+    def write_snapshot(self, products: Sequence[Dict[str, Any]], through: int) -> Tuple[int, int]:
+        """
+        把商品寫成新的數據文件快照並截斷日誌（壓縮）
+
+        先寫臨時文件並 fsync，在狀態文件中登記其簽名後再原子替換：
+        任何時刻崩潰，載入時都能在狀態中找到磁盤上快照對應的序號。
+        寫臨時文件時不持有文件鎖，其他進程的修改照常追加（序號大於 through，截斷時保留）
+
+        Returns:
+            新快照的文件簽名
+        """
+        tmp_path = f"{self.snapshot_path}.compact.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            f.write('[')
+            for i, item in enumerate(products):
+                if i:
+                    f.write(',')
+                f.write(json.dumps(item, ensure_ascii=False, separators=(',', ':')))
+            f.write(']')
+            f.flush()
+            os.fsync(f.fileno())
+        signature = file_signature(tmp_path)
+        with self.exclusive():
+            with self._cond:
+                self._record_snapshot(signature, through)
+            os.replace(tmp_path, self.snapshot_path)
+            self.mark_snapshot(signature, through)
+        self.compactions += 1
+        return signature
+
+    def close(self) -> None:
+        with self._cond:
+            if self._file is not None:
+                self._file.flush()
+                os.fsync(self._file.fileno())
+            self._close()
+
+
+def _stat_key(path: str, ino_only: bool = False):
+    """文件的 (inode, 大小)；文件不存在時返回 None"""
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return st.st_ino if ino_only else (st.st_ino, st.st_size)
+
+
+def build_upsert(existing: Dict[str, Any], changes: Dict[str, Any]) -> Dict[str, Any]:
+    """合併單條商品修改（produit 不可修改），返回規範化後的整條記錄"""
+    merged = {**existing, **{k: v for k, v in changes.items() if k != 'produit'}}
+    return normalize_product(merged)
@@ -0,0 +1,124 @@
+# -*- coding: utf-8 -*-
+"""
+預序列化響應模塊
+每個商品目錄世代只序列化、壓縮一次，之後按 Accept-Encoding 直接返回字節
+"""
+
+import gzip
+import json
+import hashlib
+from typing import Any, Optional, Tuple
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# 壓縮級別：每個世代只壓縮一次，取較高級別；brotli 11 對數十 MB 的目錄需數分鐘，故用 9
+GZIP_LEVEL = 9
+BROTLI_QUALITY = 9
+# 單條修改派生的世代可能很快又被下一次修改替換，改用快速級別（約快 6 倍，體積大 10-60%）
+FAST_GZIP_LEVEL = 4
+FAST_BROTLI_QUALITY = 4
+
+
+class EncodedPayload:
+    """
+    一份預編碼的 JSON 響應
+
+    只保存壓縮後的字節；極少數不接受壓縮的客戶端按需解壓 gzip 版本
+    """
+
+    __slots__ = ('gzip', 'br', 'etag', 'size')
+
+    def __init__(self, data: Any, fast: bool = False):
+        """
+        Args:
+            data: 可 JSON 序列化的響應數據
+            fast: 使用快速壓縮級別（生命週期可能很短的世代）
+        """
+        body = json.dumps(data, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+        # 強 ETag：由內容決定，內容不變的新世代沿用同一 ETag；各編碼的響應體另加後綴（見 etag_for）
+        self.etag = f'"{hashlib.sha256(body).hexdigest()[:32]}"'
+        self.size = len(body)
+        self.gzip = gzip.compress(body, compresslevel=FAST_GZIP_LEVEL if fast else GZIP_LEVEL, mtime=0)
+        self.br = brotli.compress(body, quality=FAST_BROTLI_QUALITY if fast else BROTLI_QUALITY) if brotli else None
+
+    def etag_for(self, encoding: Optional[str]) -> str:
+        """
+        某個編碼的響應體的強 ETag
+
+        字節不同的表示不能共用強 ETag（緩存會按 ETag 合併或做範圍請求），
+        壓縮版本在引號內追加 -gzip / -br 後綴，未壓縮版本即 self.etag
+        """
+        if not encoding:
+            return self.etag
+        return f'{self.etag[:-1]}-{encoding}"'
+
+    def identity(self) -> bytes:
+        """未壓縮的響應體"""
+        return gzip.decompress(self.gzip)
+
+    def select(self, accept_encoding: Optional[str]) -> Tuple[bytes, Optional[str]]:
+        """
+        按 Accept-Encoding 選擇響應體
+
+        Returns:
+            (響應體, Content-Encoding 或 None)
+        """
+        encodings = parse_accept_encoding(accept_encoding)
+        if self.br is not None and encodings.get('br', 0) > 0:
+            return self.br, 'br'
+        if encodings.get('gzip', 0) > 0:
+            return self.gzip, 'gzip'
+        return self.identity(), None
+
+
+def parse_accept_encoding(header: Optional[str]) -> dict:
+    """解析 Accept-Encoding，返回 {編碼: q 值}"""
+    result = {}
+    for part in (header or '').split(','):
+        name, _, params = part.strip().partition(';')
+        name = name.strip().lower()
+        if not name:
+            continue
+        q = 1.0
+        params = params.strip()
+        if params.startswith('q='):
+            try:
+                q = float(params[2:])
+            except ValueError:
+                q = 0.0
+        result[name] = q
+    if '*' in result:
+        for enc in ('br', 'gzip'):
+            result.setdefault(enc, result['*'])
+    return result
+
+
+# etag_for 追加的編碼後綴
+ETAG_CODING_SUFFIXES = ('-gzip"', '-br"')
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """
+    If-None-Match 是否命中當前內容的 ETag（忽略 W/ 前綴）
+
+    etag 為未壓縮版本的 ETag；任一編碼的變體（"<hash>-br" 等）都視為命中，
+    客戶端換用另一種 Accept-Encoding 時仍可返回 304
+    """
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == '*':
+        return True
+    for tag in if_none_match.split(','):
+        tag = tag.strip()
+        if tag.startswith('W/'):
+            tag = tag[2:]
+        for suffix in ETAG_CODING_SUFFIXES:
+            if tag.endswith(suffix):
+                tag = tag[:-len(suffix)] + '"'
+                break
+        if tag == etag:
+            return True
+    return False
@@ -7,17 +7,96 @@ DeepSeek API 客戶端模塊
 import os
 import re
 import json
+import time
+import asyncio
 import logging
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, Optional, AsyncIterator, Awaitable, Callable, Tuple
 
 try:
-    from openai import OpenAI
+    from openai import OpenAI, AsyncOpenAI
 except ImportError:
     OpenAI = None
+    AsyncOpenAI = None
+
+try:
+    import httpx
+except ImportError:
+    httpx = None
+
+from .ttl_cache import TTLCache
+from .prompt_builder import PromptBuilder
+from .llm_bulkhead import LLMBulkhead, BulkheadRejected
+from .latency_budget import LatencyTracker, RequestDeadline, Hedger
 
 # 配置日誌
 logger = logging.getLogger(__name__)
 
+# 異步連接池配置（單個 worker 可同時保持的 DeepSeek 請求數等）
+DEEPSEEK_MAX_CONNECTIONS = int(os.getenv('DEEPSEEK_MAX_CONNECTIONS') or 100)
+DEEPSEEK_MAX_KEEPALIVE = int(os.getenv('DEEPSEEK_MAX_KEEPALIVE') or 20)
+DEEPSEEK_KEEPALIVE_EXPIRY = float(os.getenv('DEEPSEEK_KEEPALIVE_EXPIRY') or 30)
+# 超時（秒）：連接 / 整體讀取
+DEEPSEEK_CONNECT_TIMEOUT = float(os.getenv('DEEPSEEK_CONNECT_TIMEOUT') or 5)
+DEEPSEEK_TIMEOUT = float(os.getenv('DEEPSEEK_TIMEOUT') or 60)
+DEEPSEEK_MAX_RETRIES = int(os.getenv('DEEPSEEK_MAX_RETRIES') or 2)
+
+# 調用隔離：同時進行的調用數、排隊上限、排隊超時（秒），超出時立即走本地兜底回覆
+DEEPSEEK_MAX_CONCURRENCY = int(os.getenv('DEEPSEEK_MAX_CONCURRENCY') or 32)
+DEEPSEEK_MAX_QUEUE = int(os.getenv('DEEPSEEK_MAX_QUEUE') or 64)
+DEEPSEEK_QUEUE_TIMEOUT = float(os.getenv('DEEPSEEK_QUEUE_TIMEOUT') or 2)
+# 各階段預算（秒，含 SDK 重試，且不超過請求的剩餘時間）：意圖分類 / 回覆生成（流式為整個流）
+DEEPSEEK_INTENT_DEADLINE = float(os.getenv('DEEPSEEK_INTENT_DEADLINE') or 8)
+DEEPSEEK_CHAT_DEADLINE = float(os.getenv('DEEPSEEK_CHAT_DEADLINE') or 25)
+# 熔斷：連續失敗次數閾值、熔斷後放行試探調用前的冷卻時間（秒）
+DEEPSEEK_BREAKER_FAILURES = int(os.getenv('DEEPSEEK_BREAKER_FAILURES') or 5)
+DEEPSEEK_BREAKER_RESET = float(os.getenv('DEEPSEEK_BREAKER_RESET') or 30)
+# 對沖：參與對沖的階段（逗號分隔，intent / answer / chat，為空則關閉）、觸發分位數、
+# 對沖次數上限（佔調用數的比例）；各階段至少有 DEEPSEEK_LATENCY_MIN_SAMPLES 個樣本後才對沖
+DEEPSEEK_HEDGE_STAGES = [s.strip() for s in os.getenv('DEEPSEEK_HEDGE_STAGES', 'intent').split(',') if s.strip()]
+DEEPSEEK_HEDGE_PERCENTILE = float(os.getenv('DEEPSEEK_HEDGE_PERCENTILE') or 95)
+DEEPSEEK_HEDGE_MAX_RATIO = float(os.getenv('DEEPSEEK_HEDGE_MAX_RATIO') or 0.1)
+DEEPSEEK_LATENCY_MIN_SAMPLES = int(os.getenv('DEEPSEEK_LATENCY_MIN_SAMPLES') or 20)
+
+# 對話提示詞預算（估算 token 數）：整體上限、保留的歷史消息數、單條歷史消息上限
+DEEPSEEK_PROMPT_BUDGET = int(os.getenv('DEEPSEEK_PROMPT_BUDGET') or 3000)
+DEEPSEEK_HISTORY_MESSAGES = int(os.getenv('DEEPSEEK_HISTORY_MESSAGES') or 12)
+DEEPSEEK_HISTORY_MESSAGE_TOKENS = int(os.getenv('DEEPSEEK_HISTORY_MESSAGE_TOKENS') or 500)
+
+# 意圖分類緩存：容量、有效期（秒）、持久化文件（為空則只在內存中）
+INTENT_CACHE_SIZE = int(os.getenv('INTENT_CACHE_SIZE') or 5000)
+INTENT_CACHE_TTL = float(os.getenv('INTENT_CACHE_TTL') or 24 * 3600)
+INTENT_CACHE_PATH = os.getenv('INTENT_CACHE_PATH') or ''
+
+# 意圖分類提示詞
+INTENT_SYSTEM_PROMPT = '\n'.join([
+    '你是意圖分類器，請輸出 JSON，不要輸出其他內容。',
+    '字段: intent (query_price_online/query_price/chat/other), hint (提取的商品名稱或參考號，若無則空字符串), message (非查價時給用戶的簡短中文回覆)。',
+    '判斷規則：',
+    '- query_price_online: 用戶明確要求"在線查詢"、"上網查"、"搜索"等關鍵詞，且包含商品信息',
+    '- query_price: 用戶想查價格，但沒有明確要求在線查詢',
+    '- chat: 用戶只是問候/閒聊/無商品信息',
+    '- other: 其他情況',
+    '如果 intent=chat，message 應為："您好，我是Feel智能助手，您可以給我商品具體名稱或者識別碼我來幫您查詢它們對應的價格，如果您想要我在線查詢某個商品的信息請說在線查詢XX品牌的商品"',
+    '不可編造商品或價格。',
+])
+
+
+# 價格硬性規則（緊跟在助手系統提示詞之後）
+PRICE_EVIDENCE_RULE = '額外硬性規則：如果 priceEvidence 為空，嚴禁輸出任何具體價格數字（也不要輸出價格區間/估價）。需要價格時請引導用戶去官網或讓我繼續在線搜索。'
+
+
+# 單次調用模式：在對話回覆的基礎上同時輸出意圖分類（候選商品按預處理後的查詢預先搜索）
+ANSWER_FORMAT_PROMPT = '\n'.join([
+    '本輪請同時完成意圖分類和回覆，輸出 JSON，不要輸出其他內容。',
+    '字段: intent (query_price_online/query_price/chat/other), hint (提取的商品名稱或參考號，若無則空字符串), message (給用戶的最終回覆，遵守上述所有規則)。',
+    '判斷規則：',
+    '- query_price_online: 用戶明確要求"在線查詢"、"上網查"、"搜索"等關鍵詞，且包含商品信息',
+    '- query_price: 用戶想查價格，但沒有明確要求在線查詢',
+    '- chat: 用戶只是問候/閒聊/無商品信息',
+    '- other: 其他情況',
+    'candidates 是按用戶原話預先搜索的本地候選；若你提取的 hint 與原話指向的商品不同，message 中不要引用與 hint 無關的候選。',
+])
+
 
 def build_luxury_assistant_system_prompt() -> str:
     """
@@ -157,6 +236,10 @@ class DeepSeekClient:
         self,
         api_key: str = None,
         base_url: str = None,
+        intent_cache: Optional[TTLCache] = None,
+        prompt_builder: Optional[PromptBuilder] = None,
+        bulkhead: Optional[LLMBulkhead] = None,
+        hedger: Optional[Hedger] = None,
     ):
         """
         初始化客戶端
@@ -164,10 +247,46 @@ class DeepSeekClient:
         Args:
             api_key: DeepSeek API 密鑰（可從環境變量 DEEPSEEK_API_KEY 獲取）
             base_url: API 基礎 URL（默認 https://api.deepseek.com）
+            intent_cache: 意圖分類緩存（默認按 INTENT_CACHE_* 環境變量創建）
+            prompt_builder: 對話提示詞構建器（默認按 DEEPSEEK_PROMPT_BUDGET 等環境變量創建）
+            bulkhead: 異步調用的併發隔離與熔斷（默認按 DEEPSEEK_MAX_CONCURRENCY 等環境變量創建）
+            hedger: 長尾調用的對沖策略，其 tracker 同時記錄各階段延遲（默認按 DEEPSEEK_HEDGE_* 環境變量創建）
         """
         self.api_key = api_key or os.getenv('DEEPSEEK_API_KEY') or os.getenv('Deepseek_API_KEY')
         self.base_url = base_url or os.getenv('DEEPSEEK_BASE_URL') or 'https://api.deepseek.com'
         self._client = None
+        self._async_client = None
+        
+        # 意圖分類是確定性的（temperature=0），相同查詢直接複用結果
+        self.intent_cache = intent_cache or TTLCache(INTENT_CACHE_SIZE, INTENT_CACHE_TTL, INTENT_CACHE_PATH or None)
+        loaded = self.intent_cache.load()
+        if loaded:
+            logger.info(f"[Intent] 從 {self.intent_cache.persist_path} 載入 {loaded} 條意圖緩存")
+        
+        # 靜態系統提示詞只構建一次
+        self.prompt_builder = prompt_builder or PromptBuilder(
+            [build_luxury_assistant_system_prompt(), PRICE_EVIDENCE_RULE],
+            budget_tokens=DEEPSEEK_PROMPT_BUDGET,
+            history_message_tokens=DEEPSEEK_HISTORY_MESSAGE_TOKENS,
+        )
+        
+        # 上游變慢或故障時限制排隊並快速失敗，避免請求堆積
+        self.bulkhead = bulkhead or LLMBulkhead(
+            DEEPSEEK_MAX_CONCURRENCY,
+            DEEPSEEK_MAX_QUEUE,
+            DEEPSEEK_QUEUE_TIMEOUT,
+            failure_threshold=DEEPSEEK_BREAKER_FAILURES,
+            reset_timeout=DEEPSEEK_BREAKER_RESET,
+        )
+        
+        # 各階段延遲（intent / answer / chat / stream_first_token / stream），同時決定對沖延遲
+        self.hedger = hedger or Hedger(
+            LatencyTracker(min_samples=DEEPSEEK_LATENCY_MIN_SAMPLES),
+            DEEPSEEK_HEDGE_STAGES,
+            percentile=DEEPSEEK_HEDGE_PERCENTILE,
+            max_ratio=DEEPSEEK_HEDGE_MAX_RATIO,
+        )
+        self.latency = self.hedger.tracker
         
         if self.api_key and OpenAI:
             try:
@@ -189,12 +308,101 @@ class DeepSeekClient:
         """檢查客戶端是否可用"""
         return self._client is not None
     
-    async def classify_intent(self, query: str) -> Dict[str, str]:
+    def _get_async_client(self):
+        """
+        獲取異步客戶端（首次調用時創建）
+        
+        所有請求共用同一個 httpx 連接池：keep-alive 複用連接，
+        連接數與超時可通過環境變量配置
+        """
+        if self._async_client is None and self.api_key and AsyncOpenAI:
+            http_client = None
+            if httpx is not None:
+                http_client = httpx.AsyncClient(
+                    limits=httpx.Limits(
+                        max_connections=DEEPSEEK_MAX_CONNECTIONS,
+                        max_keepalive_connections=DEEPSEEK_MAX_KEEPALIVE,
+                        keepalive_expiry=DEEPSEEK_KEEPALIVE_EXPIRY,
+                    ),
+                    timeout=httpx.Timeout(DEEPSEEK_TIMEOUT, connect=DEEPSEEK_CONNECT_TIMEOUT),
+                )
+            self._async_client = AsyncOpenAI(
+                api_key=self.api_key,
+                base_url=self.base_url,
+                http_client=http_client,
+                max_retries=DEEPSEEK_MAX_RETRIES,
+                timeout=DEEPSEEK_TIMEOUT,
+            )
+        return self._async_client
+    
+    async def aclose(self) -> None:
+        """關閉異步連接池並保存意圖緩存（應用關閉時調用）"""
+        try:
+            self.intent_cache.save()
+        except OSError as e:
+            logger.warning(f"[Intent] 保存意圖緩存失敗: {e}")
+        if self._async_client is not None:
+            await self._async_client.close()
+            self._async_client = None
+    
+    async def _call(
+        self,
+        stage: str,
+        factory: Callable[[], Awaitable[Any]],
+        stage_budget: float,
+        deadline: Optional[RequestDeadline] = None,
+    ) -> Any:
+        """
+        在調用隔離內執行一次非流式調用，成功時記錄該階段延遲
+
+        超時取階段預算與請求剩餘時間中的較小者；超過該階段的對沖延遲仍未返回時
+        （且有空閒名額）再發起一次相同的調用
+        
+        Raises:
+            BulkheadRejected: 調用被隔離拒絕
+            asyncio.TimeoutError: 超時或請求已無剩餘時間
+        """
+        timeout = deadline.timeout(stage_budget) if deadline is not None else stage_budget
+        if timeout <= 0:
+            raise asyncio.TimeoutError()
+        started = time.perf_counter()
+        result = await self.hedger.run(
+            stage,
+            lambda attempt_timeout: self.bulkhead.run(factory, attempt_timeout),
+            timeout,
+            can_hedge=self.bulkhead.has_capacity,
+        )
+        self.latency.record(stage, time.perf_counter() - started)
+        return result
+    
+    @staticmethod
+    def _intent_messages(query: str) -> List[Dict[str, str]]:
+        return [
+            {'role': 'system', 'content': INTENT_SYSTEM_PROMPT},
+            {'role': 'user', 'content': query or ''},
+        ]
+    
+    @staticmethod
+    def intent_cache_key(query: str) -> str:
+        """意圖緩存鍵：已完成品牌標準化和類型增強的查詢，再忽略大小寫和多餘空白"""
+        return ' '.join((query or '').lower().split())
+    
+    @staticmethod
+    def _parse_intent(text: str, query: str) -> Dict[str, str]:
+        parsed = json.loads(text)
+        return {
+            'intent': parsed.get('intent') or 'query_price',
+            'hint': parsed.get('hint') or query or '',
+            'message': parsed.get('message') or '',
+        }
+    
+    async def classify_intent(self, query: str, deadline: Optional[RequestDeadline] = None) -> Dict[str, str]:
         """
         對用戶查詢進行意圖分類
         
         Args:
             query: 用戶查詢
+            deadline: 請求的整體截止時間（本階段超時不超過剩餘時間）
             
         Returns:
             包含 intent, hint, message 的字典
@@ -204,49 +412,44 @@ class DeepSeekClient:
         
         default_result = {'intent': 'query_price', 'hint': query or '', 'message': ''}
         
-        if not self._client:
+        cache_key = self.intent_cache_key(query)
+        cached = self.intent_cache.get(cache_key)
+        if cached is not None:
+            logger.info(f"{log_prefix} ✅ 命中意圖緩存: {cached}")
+            return dict(cached)
+        
+        client = self._get_async_client()
+        if not client:
             logger.warning(f"{log_prefix} DeepSeek 客戶端未初始化，使用默認意圖 query_price")
             return default_result
         
         try:
-            prompt = [
-                {
-                    'role': 'system',
-                    'content': '\n'.join([
-                        '你是意圖分類器，請輸出 JSON，不要輸出其他內容。',
-                        '字段: intent (query_price_online/query_price/chat/other), hint (提取的商品名稱或參考號，若無則空字符串), message (非查價時給用戶的簡短中文回覆)。',
-                        '判斷規則：',
-                        '- query_price_online: 用戶明確要求"在線查詢"、"上網查"、"搜索"等關鍵詞，且包含商品信息',
-                        '- query_price: 用戶想查價格，但沒有明確要求在線查詢',
-                        '- chat: 用戶只是問候/閒聊/無商品信息',
-                        '- other: 其他情況',
-                        '如果 intent=chat，message 應為："您好，我是Feel智能助手，您可以給我商品具體名稱或者識別碼我來幫您查詢它們對應的價格，如果您想要我在線查詢某個商品的信息請說在線查詢XX品牌的商品"',
-                        '不可編造商品或價格。',
-                    ])
-                },
-                {'role': 'user', 'content': query or ''}
-            ]
-            
-            response = self._client.chat.completions.create(
-                model='deepseek-chat',
-                temperature=0,
-                messages=prompt,
-                response_format={'type': 'json_object'},
+            response = await self._call(
+                'intent',
+                lambda: client.chat.completions.create(
+                    model='deepseek-chat',
+                    temperature=0,
+                    messages=self._intent_messages(query),
+                    response_format={'type': 'json_object'},
+                ),
+                DEEPSEEK_INTENT_DEADLINE,
+                deadline,
             )
             
             text = response.choices[0].message.content or ''
             logger.debug(f"{log_prefix} DeepSeek 原始響應: {text}")
             
-            parsed = json.loads(text)
-            result = {
-                'intent': parsed.get('intent') or 'query_price',
-                'hint': parsed.get('hint') or query or '',
-                'message': parsed.get('message') or '',
-            }
-            
+            result = self._parse_intent(text, query)
+            self.intent_cache.set(cache_key, result)
             logger.info(f"{log_prefix} ✅ 意圖分類完成: {result}")
-            return result
+            return dict(result)
             
+        except BulkheadRejected as e:
+            logger.warning(f"{log_prefix} ⚠️ 跳過意圖分類（{e.reason}），使用默認意圖 query_price")
+            return default_result
+        except asyncio.TimeoutError:
+            logger.error(f"{log_prefix} ❌ 意圖分類超時")
+            return default_result
         except Exception as e:
             logger.error(f"{log_prefix} ❌ 意圖分類失敗: {e}")
             return default_result
@@ -266,126 +469,282 @@ class DeepSeekClient:
         
         default_result = {'intent': 'query_price', 'hint': query or '', 'message': ''}
         
+        cache_key = self.intent_cache_key(query)
+        cached = self.intent_cache.get(cache_key)
+        if cached is not None:
+            logger.info(f"{log_prefix} ✅ 命中意圖緩存: {cached}")
+            return dict(cached)
+        
         if not self._client:
             logger.warning(f"{log_prefix} DeepSeek 客戶端未初始化，使用默認意圖 query_price")
             return default_result
         
         try:
-            prompt = [
-                {
-                    'role': 'system',
-                    'content': '\n'.join([
-                        '你是意圖分類器，請輸出 JSON，不要輸出其他內容。',
-                        '字段: intent (query_price_online/query_price/chat/other), hint (提取的商品名稱或參考號，若無則空字符串), message (非查價時給用戶的簡短中文回覆)。',
-                        '判斷規則：',
-                        '- query_price_online: 用戶明確要求"在線查詢"、"上網查"、"搜索"等關鍵詞，且包含商品信息',
-                        '- query_price: 用戶想查價格，但沒有明確要求在線查詢',
-                        '- chat: 用戶只是問候/閒聊/無商品信息',
-                        '- other: 其他情況',
-                        '如果 intent=chat，message 應為："您好，我是Feel智能助手，您可以給我商品具體名稱或者識別碼我來幫您查詢它們對應的價格，如果您想要我在線查詢某個商品的信息請說在線查詢XX品牌的商品"',
-                        '不可編造商品或價格。',
-                    ])
-                },
-                {'role': 'user', 'content': query or ''}
-            ]
-            
             response = self._client.chat.completions.create(
                 model='deepseek-chat',
                 temperature=0,
-                messages=prompt,
+                messages=self._intent_messages(query),
                 response_format={'type': 'json_object'},
             )
             
             text = response.choices[0].message.content or ''
             logger.debug(f"{log_prefix} DeepSeek 原始響應: {text}")
             
-            parsed = json.loads(text)
-            result = {
-                'intent': parsed.get('intent') or 'query_price',
-                'hint': parsed.get('hint') or query or '',
-                'message': parsed.get('message') or '',
-            }
-            
+            result = self._parse_intent(text, query)
+            self.intent_cache.set(cache_key, result)
             logger.info(f"{log_prefix} ✅ 意圖分類完成: {result}")
-            return result
+            return dict(result)
             
         except Exception as e:
             logger.error(f"{log_prefix} ❌ 意圖分類失敗: {e}")
             return default_result
     
-    def chat(
+    def _chat_messages(
         self,
         user_query: str,
         history: List[Dict[str, str]] = None,
         intent: str = None,
         candidates: List[Dict[str, Any]] = None,
         online_results: str = None,
+        instructions: Tuple[str, ...] = (),
+        usage: Optional[Dict[str, Any]] = None,
+    ) -> List[Dict[str, str]]:
+        """
+        構建對話請求的消息列表（歷史、候選和在線結果按 token 預算裁剪）
+
+        history 由調用方用 normalize_agent_messages 標準化過（或來自會話存儲），此處不再重複處理；
+        usage 不為空時寫入本次請求的提示詞 token 數（見 PromptBuilder.build）
+        """
+        safe_history = pick_recent_messages(history or [], DEEPSEEK_HISTORY_MESSAGES)
+        messages, prompt_tokens = self.prompt_builder.build(
+            user_query,
+            history=safe_history,
+            intent=intent,
+            candidates=candidates,
+            online_results=online_results,
+            price_evidence=extract_price_evidence(online_results),
+            instructions=instructions,
+            usage=usage,
+        )
+        logger.debug(f"[Chat] 提示詞約 {prompt_tokens} tokens（{len(messages)} 條消息）")
+        return messages
+    
+    def _record_usage(self, api_usage: Any, usage: Optional[Dict[str, Any]] = None) -> None:
+        """記錄 API 返回的實際提示詞 token 數（usage 為本次請求的記錄）"""
+        self.prompt_builder.record_usage(getattr(api_usage, 'prompt_tokens', None), usage)
+    
+    async def classify_and_reply(
+        self,
+        user_query: str,
+        history: List[Dict[str, str]] = None,
+        candidates: List[Dict[str, Any]] = None,
+        online_results: str = None,
         temperature: float = 0.4,
+        deadline: Optional[RequestDeadline] = None,
+        usage: Optional[Dict[str, Any]] = None,
+    ) -> Optional[Dict[str, str]]:
+        """
+        單次調用完成意圖分類和回覆（結構化輸出）
+        
+        Args:
+            user_query: 用戶當前查詢
+            history: 標準化後的對話歷史（見 normalize_agent_messages）
+            candidates: 按預處理後的查詢預先搜索的本地候選
+            online_results: 在線搜索結果
+            temperature: 生成溫度
+            deadline: 請求的整體截止時間
+            usage: 本次請求的提示詞 token 記錄（estimated / reported），由調用方傳入後讀取
+            
+        Returns:
+            包含 intent, hint, message 的字典，失敗返回 None
+        """
+        client = self._get_async_client()
+        if not client:
+            return None
+        
+        messages = self._chat_messages(
+            user_query, history, None, candidates, online_results,
+            instructions=(ANSWER_FORMAT_PROMPT,), usage=usage,
+        )
+        try:
+            response = await self._call(
+                'answer',
+                lambda: client.chat.completions.create(
+                    model='deepseek-chat',
+                    temperature=temperature,
+                    messages=messages,
+                    response_format={'type': 'json_object'},
+                ),
+                DEEPSEEK_CHAT_DEADLINE,
+                deadline,
+            )
+            
+            self._record_usage(response.usage, usage)
+            text = response.choices[0].message.content or ''
+            result = self._parse_intent(text, user_query)
+            result['message'] = result['message'].strip()
+            logger.info(f"[Intent] ✅ 單次調用完成: intent={result['intent']}, hint={result['hint']}")
+            return result
+            
+        except BulkheadRejected as e:
+            logger.warning(f"[Intent] ⚠️ 跳過單次調用（{e.reason}）")
+            return None
+        except asyncio.TimeoutError:
+            logger.error("[Intent] ❌ 單次調用超時")
+            return None
+        except Exception as e:
+            logger.error(f"[Intent] ❌ 單次調用失敗: {e}")
+            return None
+    
+    async def chat(
+        self,
+        user_query: str,
+        history: List[Dict[str, str]] = None,
+        intent: str = None,
+        candidates: List[Dict[str, Any]] = None,
+        online_results: str = None,
+        temperature: float = 0.4,
+        deadline: Optional[RequestDeadline] = None,
+        usage: Optional[Dict[str, Any]] = None,
     ) -> Optional[str]:
         """
         生成對話回覆
         
         Args:
             user_query: 用戶當前查詢
-            history: 對話歷史
+            history: 標準化後的對話歷史（見 normalize_agent_messages）
             intent: 意圖分類結果
             candidates: 本地商品候選
             online_results: 在線搜索結果
             temperature: 生成溫度
+            deadline: 請求的整體截止時間
+            usage: 本次請求的提示詞 token 記錄（estimated / reported），由調用方傳入後讀取
             
         Returns:
             助手回覆，失敗返回 None
         """
-        if not self._client:
+        client = self._get_async_client()
+        if not client:
             return None
         
+        messages = self._chat_messages(user_query, history, intent, candidates, online_results, usage=usage)
         try:
-            # 處理歷史消息
-            safe_history = pick_recent_messages(
-                normalize_agent_messages(history or []),
-                12
+            response = await self._call(
+                'chat',
+                lambda: client.chat.completions.create(
+                    model='deepseek-chat',
+                    temperature=temperature,
+                    messages=messages,
+                ),
+                DEEPSEEK_CHAT_DEADLINE,
+                deadline,
             )
             
-            # 構建系統提示詞
-            system_prompt = build_luxury_assistant_system_prompt()
-            
-            # 提取價格證據
-            price_evidence = extract_price_evidence(online_results)
-            
-            # 構建上下文
-            context_payload = {
-                'intent': intent or 'unknown',
-                'query': user_query or '',
-                'candidates': candidates if isinstance(candidates, list) else [],
-                'onlineResults': str(online_results)[:6000] if online_results else '',
-                'priceEvidence': price_evidence,
-            }
-            
-            # 構建消息列表
-            messages = [
-                {'role': 'system', 'content': system_prompt},
-                {
-                    'role': 'system',
-                    'content': '額外硬性規則：如果 priceEvidence 為空，嚴禁輸出任何具體價格數字（也不要輸出價格區間/估價）。需要價格時請引導用戶去官網或讓我繼續在線搜索。'
-                },
-                {
-                    'role': 'system',
-                    'content': f'你可以使用以下信息作為參考（不是用戶原話）：\n{json.dumps(context_payload, ensure_ascii=False, indent=2)}'
-                },
-                *safe_history,
-            ]
-            
-            # 確保最後一條是用戶消息
-            if not messages or messages[-1].get('role') != 'user' or messages[-1].get('content') != user_query:
-                messages.append({'role': 'user', 'content': user_query or ''})
+            self._record_usage(response.usage, usage)
+            content = response.choices[0].message.content
+            return (content or '').strip()
             
-            # 調用 API
+        except BulkheadRejected as e:
+            logger.warning(f"[Chat] ⚠️ 跳過 DeepSeek 調用（{e.reason}）")
+            return None
+        except asyncio.TimeoutError:
+            logger.error("[Chat] ❌ 調用 DeepSeek 超時")
+            return None
+        except Exception as e:
+            logger.error(f"調用 DeepSeek 失敗: {e}")
+            return None
+    
+    async def chat_stream(
+        self,
+        user_query: str,
+        history: List[Dict[str, str]] = None,
+        intent: str = None,
+        candidates: List[Dict[str, Any]] = None,
+        online_results: str = None,
+        temperature: float = 0.4,
+        deadline: Optional[RequestDeadline] = None,
+        usage: Optional[Dict[str, Any]] = None,
+    ) -> AsyncIterator[str]:
+        """
+        流式生成對話回覆，逐段產出模型輸出的文本
+        
+        與 chat() 不同，調用失敗時拋出異常，由調用方決定如何回退
+        （已輸出部分內容時無法再替換為兜底回覆）；客戶端不可用時不產出任何內容
+        
+        整個流期間佔用一個調用名額；被隔離拒絕時拋出 BulkheadRejected，
+        超過 DEEPSEEK_CHAT_DEADLINE（或請求剩餘時間）時拋出 asyncio.TimeoutError；
+        流式調用不對沖（已輸出的內容無法撤回）
+        """
+        client = self._get_async_client()
+        if not client:
+            return
+        
+        messages = self._chat_messages(user_query, history, intent, candidates, online_results, usage=usage)
+        timeout = deadline.timeout(DEEPSEEK_CHAT_DEADLINE) if deadline is not None else DEEPSEEK_CHAT_DEADLINE
+        if timeout <= 0:
+            raise asyncio.TimeoutError()
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+        expires_at = started + timeout
+        first_token = True
+        async with self.bulkhead.slot():
+            stream = await asyncio.wait_for(
+                client.chat.completions.create(
+                    model='deepseek-chat',
+                    temperature=temperature,
+                    messages=messages,
+                    stream=True,
+                    stream_options={'include_usage': True},
+                ),
+                timeout,
+            )
+            try:
+                chunks = stream.__aiter__()
+                while True:
+                    try:
+                        chunk = await asyncio.wait_for(chunks.__anext__(), expires_at - loop.time())
+                    except StopAsyncIteration:
+                        break
+                    if chunk.usage:
+                        self._record_usage(chunk.usage, usage)
+                    if not chunk.choices:
+                        continue
+                    delta = chunk.choices[0].delta.content
+                    if delta:
+                        if first_token:
+                            first_token = False
+                            self.latency.record('stream_first_token', loop.time() - started)
+                        yield delta
+            finally:
+                await stream.close()
+        self.latency.record('stream', loop.time() - started)
+    
+    def chat_sync(
+        self,
+        user_query: str,
+        history: List[Dict[str, str]] = None,
+        intent: str = None,
+        candidates: List[Dict[str, Any]] = None,
+        online_results: str = None,
+        temperature: float = 0.4,
+    ) -> Optional[str]:
+        """
+        同步版本的對話回覆
+        
+        Returns:
+            助手回覆，失敗返回 None
+        """
+        if not self._client:
+            return None
+        
+        try:
             response = self._client.chat.completions.create(
                 model='deepseek-chat',
                 temperature=temperature,
-                messages=messages,
+                messages=self._chat_messages(user_query, history, intent, candidates, online_results),
             )
             
+            self._record_usage(response.usage)
             content = response.choices[0].message.content
             return (content or '').strip()
             
@@ -0,0 +1,423 @@
+# -*- coding: utf-8 -*-
+"""
+圖片縮略圖代理模塊
+原圖只下載一次，按固定寬度檔位縮放並重新編碼，結果保存在有容量上限的磁盤緩存中
+"""
+
+import io
+import os
+import re
+import time
+import socket
+import hashlib
+import asyncio
+import ipaddress
+import logging
+import threading
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import urlsplit
+
+import httpx
+import httpcore
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:
+    Image = None
+    ImageOps = None
+
+from .single_flight import SingleFlight
+
+logger = logging.getLogger(__name__)
+
+# 縮略圖寬度檔位：請求寬度向上取整到檔位，避免任意寬度撐爆緩存
+THUMBNAIL_WIDTHS = (64, 128, 256, 384, 512, 768, 1024, 1600)
+
+# 編碼參數
+WEBP_QUALITY = 80
+JPEG_QUALITY = 82
+
+# 原圖限制（重定向逐跳校驗目標地址）
+MAX_REDIRECTS = 3
+MAX_ORIGIN_BYTES = 20 * 1024 * 1024
+MAX_ORIGIN_PIXELS = 40_000_000
+
+# 啟動時清理超過該時間（秒）未修改的臨時文件（崩潰殘留）
+STALE_TMP_SECONDS = 3600
+
+# 字段中多個 URL 以「逗號後緊接 http」分隔（URL 內部的逗號參數不受影響）
+_URL_SPLIT_RE = re.compile(r',(?=https?://)')
+
+CONTENT_TYPES = {'webp': 'image/webp', 'jpeg': 'image/jpeg'}
+
+
+class ImageProxyError(Exception):
+    """原圖無法獲取或解碼"""
+
+    def __init__(self, status_code: int, detail: str):
+        super().__init__(detail)
+        self.status_code = status_code
+        self.detail = detail
+
+
+def is_available() -> bool:
+    """是否安裝了 Pillow（未安裝時無法縮放）"""
+    return Image is not None
+
+
+def split_image_urls(raw: str) -> List[str]:
+    """拆分商品圖片字段中的多個 URL"""
+    return [u.strip() for u in _URL_SPLIT_RE.split(raw or '') if u.strip()]
+
+
+def snap_width(width: int) -> int:
+    """把請求寬度向上取整到最近的檔位"""
+    for w in THUMBNAIL_WIDTHS:
+        if width <= w:
+            return w
+    return THUMBNAIL_WIDTHS[-1]
+
+
+def choose_format(requested: str, accept: Optional[str]) -> str:
+    """auto 時按 Accept 選擇 WebP，否則 JPEG"""
+    if requested in CONTENT_TYPES:
+        return requested
+    return 'webp' if 'image/webp' in (accept or '') else 'jpeg'
+
+
+class DiskCache:
+    """
+    有容量上限的磁盤緩存（LRU）
+
+    首次讀寫時才創建並掃描目錄（導入模塊不產生磁盤副作用），按修改時間重建順序；
+    命中時更新修改時間，寫入後超出容量時從最久未用的文件開始刪除
+
+    多 worker 共享同一目錄時每個進程只統計自己寫入或讀到過的文件，
+    目錄總大小最多可能達到 max_bytes 的 worker 數倍
+    """
+
+    def __init__(self, directory: str, max_bytes: int):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._entries: 'OrderedDict[str, int]' = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._opened = False
+        self._open_lock = threading.Lock()
+
+    def _ensure_open(self) -> None:
+        if self._opened:
+            return
+        with self._open_lock:
+            if self._opened:
+                return
+            os.makedirs(self.directory, exist_ok=True)
+            self._scan()
+            self._opened = True
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, key[:2], key)
+
+    def _scan(self) -> None:
+        found = []
+        for root, _, files in os.walk(self.directory):
+            for name in files:
+                path = os.path.join(root, name)
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue
+                if name.endswith('.tmp'):
+                    # 只清理崩潰殘留的臨時文件，其他 worker 可能正在寫入較新的臨時文件
+                    if time.time() - st.st_mtime > STALE_TMP_SECONDS:
+                        try:
+                            os.remove(path)
+                        except OSError:
+                            pass
+                    continue
+                found.append((st.st_mtime, name, st.st_size))
+        for _, name, size in sorted(found):
+            self._entries[name] = size
+            self._bytes += size
+        self._evict()
+
+    def get(self, key: str) -> Optional[bytes]:
+        self._ensure_open()
+        path = self._path(key)
+        try:
+            with open(path, 'rb') as f:
+                data = f.read()
+        except OSError:
+            with self._lock:
+                self.misses += 1
+                if key in self._entries:
+                    self._bytes -= self._entries.pop(key)
+            return None
+        with self._lock:
+            self.hits += 1
+            if key in self._entries:
+                self._entries.move_to_end(key)
+            else:
+                # 其他 worker 寫入的文件，納入本進程的容量統計
+                self._entries[key] = len(data)
+                self._bytes += len(data)
+                self._evict()
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        return data
+
+    def put(self, key: str, data: bytes) -> None:
+        self._ensure_open()
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+        with self._lock:
+            self._bytes += len(data) - self._entries.pop(key, 0)
+            self._entries[key] = len(data)
+            self._evict()
+
+    def _evict(self) -> None:
+        while self._bytes > self.max_bytes and self._entries:
+            key, size = self._entries.popitem(last=False)
+            self._bytes -= size
+            self.evictions += 1
+            try:
+                os.remove(self._path(key))
+            except OSError:
+                pass
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                'entries': len(self._entries),
+                'bytes': self._bytes,
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+            }
+
+
+def _resize(data: bytes, width: int, fmt: str) -> bytes:
+    """解碼原圖，等比縮放到不超過 width 的寬度並重新編碼（在線程中執行）"""
+    try:
+        img = Image.open(io.BytesIO(data))
+        if img.width * img.height > MAX_ORIGIN_PIXELS:
+            raise ImageProxyError(422, 'image_too_large')
+        img.draft('RGB', (width, width))  # JPEG 解碼時直接降採樣
+        img = ImageOps.exif_transpose(img)
+    except ImageProxyError:
+        raise
+    except Exception as e:
+        raise ImageProxyError(502, f'image_decode_failed: {e}')
+
+    if img.width > width:
+        height = max(1, round(img.height * width / img.width))
+        img = img.resize((width, height), Image.LANCZOS)
+
+    out = io.BytesIO()
+    if fmt == 'webp':
+        if img.mode not in ('RGB', 'RGBA'):
+            img = img.convert('RGBA' if 'A' in img.getbands() or 'transparency' in img.info else 'RGB')
+        img.save(out, 'WEBP', quality=WEBP_QUALITY, method=4)
+    else:
+        if img.mode in ('RGBA', 'LA') or 'transparency' in img.info:
+            rgba = img.convert('RGBA')
+            background = Image.new('RGB', rgba.size, (255, 255, 255))
+            background.paste(rgba, mask=rgba.getchannel('A'))
+            img = background
+        elif img.mode != 'RGB':
+            img = img.convert('RGB')
+        img.save(out, 'JPEG', quality=JPEG_QUALITY, optimize=True, progressive=True)
+    return out.getvalue()
+
+
+class _PublicAddressBackend(httpcore.AsyncNetworkBackend):
+    """
+    建立 TCP 連接時自行解析主機名並校驗地址，只連接通過校驗的 IP
+
+    校驗與連接使用同一次解析結果，DNS 重綁定無法在兩者之間把主機名換成內網地址；
+    TLS 的 SNI 和證書校驗仍使用原主機名
+    """
+
+    def __init__(self):
+        self._inner = httpcore.AnyIOBackend()
+
+    async def connect_tcp(self, host, port, timeout=None, local_address=None, socket_options=None):
+        try:
+            infos = await asyncio.get_running_loop().getaddrinfo(host, port, type=socket.SOCK_STREAM)
+        except OSError:
+            raise ImageProxyError(502, 'image_host_unresolvable')
+        addresses = list(dict.fromkeys(info[4][0] for info in infos))
+        if not addresses or any(not ipaddress.ip_address(a).is_global for a in addresses):
+            raise ImageProxyError(403, 'image_host_not_allowed')
+        error: Optional[Exception] = None
+        for address in addresses:
+            try:
+                return await self._inner.connect_tcp(
+                    address, port, timeout=timeout, local_address=local_address, socket_options=socket_options,
+                )
+            except httpcore.ConnectError as e:
+                error = e
+        raise error
+
+    async def connect_unix_socket(self, path, timeout=None, socket_options=None):
+        raise ImageProxyError(403, 'image_host_not_allowed')
+
+    async def sleep(self, seconds: float) -> None:
+        await self._inner.sleep(seconds)
+
+
+class _PublicOnlyTransport(httpx.AsyncHTTPTransport):
+    """只連接公網地址的傳輸層（httpx 沒有公開設置 network_backend 的參數）"""
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self._pool._network_backend = _PublicAddressBackend()
+
+
+class ThumbnailService:
+    """
+    縮略圖服務
+
+    - 縮略圖和原圖都進入磁盤緩存：同一 URL 的不同寬度只下載一次原圖
+    - 同一 URL 的併發請求合併為一次下載，同一縮略圖的併發請求合併為一次縮放
+    """
+
+    def __init__(
+        self,
+        cache_dir: str,
+        max_cache_bytes: int,
+        timeout: float = 10.0,
+        allow_private: bool = False,
+        allowed_hosts: Optional[List[str]] = None,
+    ):
+        self.cache = DiskCache(cache_dir, max_cache_bytes)
+        self.timeout = timeout
+        self.allow_private = allow_private
+        self.allowed_hosts = [h.lower() for h in (allowed_hosts or []) if h]
+        self._client: Optional[httpx.AsyncClient] = None
+        self._origin_flight = SingleFlight()
+        self._thumb_flight = SingleFlight()
+        self.origin_fetches = 0
+
+    @staticmethod
+    def _key(*parts: object) -> str:
+        return hashlib.sha256('\0'.join(str(p) for p in parts).encode('utf-8')).hexdigest()
+
+    def thumbnail_key(self, url: str, width: int, fmt: str) -> str:
+        return self._key('thumb', url, width, fmt)
+
+    def _client_instance(self) -> httpx.AsyncClient:
+        if self._client is None:
+            # 默認在建立連接時校驗目標地址；不讀取代理環境變量，避免繞過校驗
+            self._client = httpx.AsyncClient(
+                timeout=self.timeout,
+                headers={'User-Agent': 'FeelEurope-ImageProxy/1.0'},
+                transport=None if self.allow_private else _PublicOnlyTransport(),
+                trust_env=self.allow_private,
+            )
+        return self._client
+
+    async def aclose(self) -> None:
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    def _check_url(self, url: str) -> None:
+        """
+        只允許 http(s) 和白名單主機（每一跳重定向都校驗）
+
+        內網地址在建立連接時由 _PublicAddressBackend 拒絕（防止 SSRF），
+        解析結果不會在校驗之後被替換
+        """
+        parts = urlsplit(url)
+        host = (parts.hostname or '').lower()
+        if parts.scheme not in ('http', 'https') or not host:
+            raise ImageProxyError(400, 'invalid_image_url')
+        if self.allowed_hosts and not any(host == h or host.endswith('.' + h) for h in self.allowed_hosts):
+            raise ImageProxyError(403, 'image_host_not_allowed')
+
+    async def _fetch_origin(self, url: str) -> bytes:
+        key = self._key('origin', url)
+        data = await asyncio.to_thread(self.cache.get, key)
+        if data is not None:
+            return data
+
+        start = time.time()
+        self.origin_fetches += 1
+        target = url
+        try:
+            for _ in range(MAX_REDIRECTS + 1):
+                self._check_url(target)
+                data = await self._download(target)
+                if isinstance(data, bytes):
+                    break
+                target = data
+            else:
+                raise ImageProxyError(502, 'image_too_many_redirects')
+        except httpx.HTTPError as e:
+            raise ImageProxyError(502, f'image_fetch_failed: {e}')
+        logger.info(f"[ImageProxy] 下載原圖 {len(data)} 字節，耗時 {time.time() - start:.2f}s: {url[:120]}")
+        await asyncio.to_thread(self.cache.put, key, data)
+        return data
+
+    async def _download(self, url: str):
+        """下載一跳：返回原圖字節，或重定向目標 URL（str）"""
+        async with self._client_instance().stream('GET', url) as resp:
+            if resp.is_redirect:
+                return str(resp.url.join(resp.headers.get('location', '')))
+            if resp.status_code != 200:
+                raise ImageProxyError(502, f'image_origin_status_{resp.status_code}')
+            content_type = resp.headers.get('content-type', '')
+            if content_type and not content_type.startswith(('image/', 'application/octet-stream')):
+                raise ImageProxyError(502, 'image_origin_not_image')
+            chunks = []
+            size = 0
+            async for chunk in resp.aiter_bytes():
+                size += len(chunk)
+                if size > MAX_ORIGIN_BYTES:
+                    raise ImageProxyError(413, 'image_too_large')
+                chunks.append(chunk)
+            return b''.join(chunks)
+
+    async def _build(self, url: str, width: int, fmt: str) -> bytes:
+        key = self.thumbnail_key(url, width, fmt)
+        data = await asyncio.to_thread(self.cache.get, key)
+        if data is not None:
+            return data
+        origin = await self._origin_flight.do(url, lambda: self._fetch_origin(url))
+        data = await asyncio.to_thread(_resize, origin, width, fmt)
+        await asyncio.to_thread(self.cache.put, key, data)
+        return data
+
+    async def thumbnail(self, url: str, width: int, fmt: str) -> Tuple[bytes, str]:
+        """
+        獲取縮略圖
+
+        Returns:
+            (圖片字節, 緩存鍵（用作 ETag）)
+
+        Raises:
+            ImageProxyError: 原圖無法獲取或解碼
+        """
+        key = self.thumbnail_key(url, width, fmt)
+        data = await self._thumb_flight.do(key, lambda: self._build(url, width, fmt))
+        return data, key
+
+    def stats(self) -> Dict[str, object]:
+        return {
+            'cache': self.cache.stats(),
+            'origin_fetches': self.origin_fetches,
+            'origin_coalesced': self._origin_flight.shared,
+            'thumbnail_coalesced': self._thumb_flight.shared,
+        }
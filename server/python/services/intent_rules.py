@@ -0,0 +1,176 @@
+# -*- coding: utf-8 -*-
+"""
+規則意圖預分類模塊
+對有把握的查詢（參考號、問候、明確要求在線查詢）直接給出意圖，無需調用 DeepSeek
+"""
+
+import re
+import threading
+from typing import Callable, Dict, Optional
+
+# 與 DeepSeek 意圖分類提示詞中 chat 意圖的固定回覆一致
+CHAT_MESSAGE = '您好，我是Feel智能助手，您可以給我商品具體名稱或者識別碼我來幫您查詢它們對應的價格，如果您想要我在線查詢某個商品的信息請說在線查詢XX品牌的商品'
+
+# 純問候語（去除標點和空白後完全匹配）
+GREETINGS = {
+    '你好', '您好', '你好呀', '你好啊', '您好呀', '嗨', '哈囉', '哈喽', '哈咯', '喂',
+    '在吗', '在嗎', '在不在', '早', '早上好', '早安', '中午好', '下午好', '晚上好', '晚安',
+    '谢谢', '謝謝', '多谢', '多謝', '感谢', '感謝',
+    'hi', 'hello', 'hey', 'hallo', 'bonjour', 'bonsoir', 'salut', 'coucou', 'ciao',
+    'thanks', 'thank you', 'merci',
+}
+
+# 明確要求在線查詢的關鍵詞
+ONLINE_TRIGGERS = (
+    '在线查询', '在線查詢', '在线查', '在線查', '上网查询', '上網查詢', '上网查', '上網查',
+    '网上查', '網上查', '在线搜索', '在線搜索', '上网搜', '上網搜', '联网查', '聯網查',
+    'online search', 'search online',
+)
+
+# 參考號後常見的查價附加詞（去除後剩下單個參考號仍視為查價）
+PRICE_FILLERS = (
+    '多少钱', '多少錢', '什么价', '什麼價', '价格', '價格', '价钱', '價錢', '报价', '報價',
+    '查询', '查詢', '查一下', '请问', '請問', '帮我查', '幫我查', '帮我', '幫我',
+    'price', 'prix', 'how much',
+)
+
+# 在線查詢提示詞中需要去掉的語氣詞
+HINT_FILLERS = ('帮我', '幫我', '请', '請', '一下', '麻烦', '麻煩', '给我', '給我')
+
+# 指代上一輪商品的詞（追問時不含新的商品信息）
+FOLLOW_UP_WORDS = ('那个', '那個', '这个', '這個', '那款', '这款', '這款', '上面那', '刚才那', '剛才那', '它')
+FOLLOW_UP_WORDS_LATIN = ('that one', 'this one', 'that', 'this', 'it', 'celui-ci', 'celui-là', 'celui', 'celle', 'ça')
+# 追問中常見的語氣詞
+FOLLOW_UP_FILLERS = ('的', '呢', '吗', '嗎', '呀', '啊', '是', '要', '多少', '几多', '幾多')
+FOLLOW_UP_FILLERS_LATIN = {
+    'is', 'what', "what's", 'the', 'of', 'a', 'does', 'cost', 'costs',
+    'est', 'le', 'la', 'quel', 'de', 'du', 'combien', 'coûte', 'coute',
+}
+
+# 參考號：單個由字母數字和 -_./ 組成的詞
+_REFERENCE_RE = re.compile(r'^[a-z0-9][a-z0-9\-_./]{3,39}$', re.IGNORECASE)
+_PUNCT_RE = re.compile(r'[\s!?,.;:~。，！？；：、…"\'()（）\-]+')
+# 分詞時保留參考號內部的 -_./
+_SEPARATOR_RE = re.compile(r'[\s!?,;:~。，！？；：、…"\'()（）]+')
+_FOLLOW_UP_LATIN_RE = re.compile(
+    r"(?<![\w-])(?:" + '|'.join(re.escape(w) for w in FOLLOW_UP_WORDS_LATIN) + r")(?![\w-])"
+)
+
+
+def _strip_punct(text: str) -> str:
+    return _PUNCT_RE.sub(' ', text).strip()
+
+
+def _looks_like_reference(token: str) -> bool:
+    if not _REFERENCE_RE.match(token) or not any(ch.isdigit() for ch in token):
+        return False
+    # 純數字需足夠長，避免把數量/價格當作參考號
+    return any(ch.isalpha() for ch in token) or len(token) >= 6
+
+
+def is_follow_up(query: str) -> bool:
+    """
+    是否為針對上一輪商品的追問（如"那个多少钱"）
+
+    必須包含指代詞，且去掉指代詞、查價詞和語氣詞後不剩商品信息
+    """
+    text = (query or '').lower()
+    latin = _FOLLOW_UP_LATIN_RE.search(text) is not None
+    if not latin and not any(word in text for word in FOLLOW_UP_WORDS):
+        return False
+    text = _FOLLOW_UP_LATIN_RE.sub(' ', text)
+    for word in sorted(FOLLOW_UP_WORDS + PRICE_FILLERS + HINT_FILLERS + FOLLOW_UP_FILLERS, key=len, reverse=True):
+        text = text.replace(word, ' ')
+    rest = ''.join(t for t in _strip_punct(text).split() if t not in FOLLOW_UP_FILLERS_LATIN)
+    return len(rest) < 2
+
+
+class IntentRules:
+    """
+    規則預分類器
+
+    classify() 對有把握的查詢返回 {'intent', 'hint', 'message'}，否則返回 None；
+    is_known_ref 可選，用於確認單個詞是否為目錄中的 produit；
+    is_cached 可選，用於判斷查詢是否已在意圖緩存中（命中緩存的查詢本就不會調用 DeepSeek，
+    規則命中時不計入節省的調用數）
+    """
+
+    def __init__(
+        self,
+        is_known_ref: Optional[Callable[[str], bool]] = None,
+        is_cached: Optional[Callable[[str], bool]] = None,
+    ):
+        self.is_known_ref = is_known_ref
+        self.is_cached = is_cached
+        self._lock = threading.Lock()
+        self.rule_hits: Dict[str, int] = {'reference': 0, 'greeting': 0, 'online': 0}
+        self.cached_hits = 0
+        self.undecided = 0
+
+    def _count(self, rule: Optional[str], cached: bool = False) -> None:
+        with self._lock:
+            if rule is None:
+                self.undecided += 1
+            else:
+                self.rule_hits[rule] += 1
+                if cached:
+                    self.cached_hits += 1
+
+    def classify(self, query: str) -> Optional[Dict[str, str]]:
+        """
+        Args:
+            query: 經過品牌標準化和類型增強的查詢（與 DeepSeek 意圖分類的輸入相同）
+        """
+        rule, result = self._classify(query or '')
+        cached = rule is not None and self.is_cached is not None and self.is_cached(query or '')
+        self._count(rule, cached)
+        return result
+
+    def _classify(self, query: str):
+        text = query.strip()
+        lower = text.lower()
+        if not lower:
+            return None, None
+
+        # 明確要求在線查詢，且去掉關鍵詞後仍有商品信息
+        for trigger in ONLINE_TRIGGERS:
+            if trigger in lower:
+                hint = lower.replace(trigger, ' ')
+                for filler in HINT_FILLERS:
+                    hint = hint.replace(filler, ' ')
+                hint = _strip_punct(hint)
+                if len(hint.replace(' ', '')) < 2:
+                    return None, None
+                return 'online', {'intent': 'query_price_online', 'hint': hint, 'message': ''}
+
+        # 純問候/致謝
+        bare = _strip_punct(lower)
+        if bare in GREETINGS:
+            return 'greeting', {'intent': 'chat', 'hint': '', 'message': CHAT_MESSAGE}
+
+        # 單個參考號（可帶查價附加詞）
+        candidate = lower
+        for filler in PRICE_FILLERS:
+            candidate = candidate.replace(filler, ' ')
+        tokens = [t.strip('.-/_') for t in _SEPARATOR_RE.split(candidate) if t.strip('.-/_')]
+        if len(tokens) == 1:
+            token = tokens[0]
+            known = self.is_known_ref is not None and self.is_known_ref(token)
+            if known or _looks_like_reference(token):
+                return 'reference', {'intent': 'query_price', 'hint': token, 'message': ''}
+
+        return None, None
+
+    @property
+    def llm_calls_avoided(self) -> int:
+        """規則命中且意圖緩存未命中的次數（真正省下的 DeepSeek 調用）"""
+        return sum(self.rule_hits.values()) - self.cached_hits
+
+    def stats(self) -> Dict[str, object]:
+        with self._lock:
+            return {
+                'llm_calls_avoided': sum(self.rule_hits.values()) - self.cached_hits,
+                'cached_hits': self.cached_hits,
+                'undecided': self.undecided,
+                'by_rule': dict(self.rule_hits),
+            }
@@ -0,0 +1,182 @@
+# -*- coding: utf-8 -*-
+"""
+延遲預算模塊
+按階段統計調用延遲、把請求的整體截止時間分配到各階段，並對長尾調用發起對沖請求
+"""
+
+import time
+import asyncio
+import threading
+from collections import deque
+from typing import Any, Awaitable, Callable, Deque, Dict, Iterable, Optional
+
+
+def _percentile(ordered: list, pct: float) -> float:
+    index = min(len(ordered) - 1, max(0, round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+class LatencyTracker:
+    """
+    各階段最近 window 次調用的延遲（秒），用於查看分位數和計算對沖延遲
+
+    樣本數少於 min_samples 時 percentile() 返回 None（數據不足以估計長尾）
+    """
+
+    def __init__(self, window: int = 512, min_samples: int = 20):
+        self.window = window
+        self.min_samples = min_samples
+        self._samples: Dict[str, Deque[float]] = {}
+        self._counts: Dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    def record(self, stage: str, seconds: float) -> None:
+        with self._lock:
+            samples = self._samples.get(stage)
+            if samples is None:
+                samples = self._samples[stage] = deque(maxlen=self.window)
+            samples.append(seconds)
+            self._counts[stage] = self._counts.get(stage, 0) + 1
+
+    def percentile(self, stage: str, pct: float) -> Optional[float]:
+        with self._lock:
+            samples = self._samples.get(stage)
+            if not samples or len(samples) < self.min_samples:
+                return None
+            ordered = sorted(samples)
+        return _percentile(ordered, pct)
+
+    def stats(self) -> Dict[str, Dict[str, Any]]:
+        with self._lock:
+            snapshot = {stage: (sorted(samples), self._counts[stage]) for stage, samples in self._samples.items()}
+        return {
+            stage: {
+                'count': count,
+                'p50_ms': round(_percentile(ordered, 50) * 1000, 1),
+                'p95_ms': round(_percentile(ordered, 95) * 1000, 1),
+                'p99_ms': round(_percentile(ordered, 99) * 1000, 1),
+                'max_ms': round(ordered[-1] * 1000, 1),
+            }
+            for stage, (ordered, count) in snapshot.items()
+        }
+
+
+class RequestDeadline:
+    """
+    一個請求的整體截止時間
+
+    各階段的超時取該階段預算和剩餘時間中的較小者，前面的階段超時不會擠佔整體上限
+    """
+
+    def __init__(self, total: float):
+        self.total = total
+        self.started_at = time.monotonic()
+        self.expires_at = self.started_at + total
+
+    def elapsed(self) -> float:
+        return time.monotonic() - self.started_at
+
+    def remaining(self) -> float:
+        return max(0.0, self.expires_at - time.monotonic())
+
+    def timeout(self, stage_budget: float) -> float:
+        """某階段可用的超時（秒），為 0 表示已無剩餘時間"""
+        return min(stage_budget, self.remaining())
+
+
+class Hedger:
+    """
+    對沖請求
+
+    調用超過該階段歷史 P{percentile} 延遲仍未返回時再發起一次相同的調用，取先成功返回的結果，
+    另一個取消。對沖只用於冪等、無副作用的調用（如 temperature=0 的意圖分類）；
+    對沖次數不超過調用數的 max_ratio，避免上游變慢時成倍放大負載
+    """
+
+    def __init__(
+        self,
+        tracker: LatencyTracker,
+        stages: Iterable[str],
+        percentile: float = 95,
+        max_ratio: float = 0.1,
+    ):
+        self.tracker = tracker
+        self.stages = frozenset(stages)
+        self.percentile = percentile
+        self.max_ratio = max_ratio
+        self.calls = 0
+        self.hedged = 0
+        self.hedge_won = 0
+        self.skipped = 0
+
+    def delay(self, stage: str) -> Optional[float]:
+        """發起對沖前的等待時間；該階段不對沖或樣本不足時返回 None"""
+        if stage not in self.stages:
+            return None
+        return self.tracker.percentile(stage, self.percentile)
+
+    async def run(
+        self,
+        stage: str,
+        attempt: Callable[[float], Awaitable[Any]],
+        timeout: float,
+        can_hedge: Callable[[], bool] = lambda: True,
+    ) -> Any:
+        """
+        執行 attempt(超時秒數)，必要時對沖；對沖調用的超時為剩餘時間，兩次調用在同一時刻截止
+
+        attempt 須自行在給定超時後拋出 asyncio.TimeoutError（超時由調用方統計，不在此處取消）；
+        兩次調用都失敗時拋出首次調用的異常（首次調用被取消時拋出對沖調用的異常）
+        """
+        delay = self.delay(stage)
+        if delay is None:
+            return await attempt(timeout)
+
+        self.calls += 1
+        loop = asyncio.get_running_loop()
+        expires_at = loop.time() + timeout
+        primary = asyncio.ensure_future(attempt(timeout))
+        pending = {primary}
+        errors: Dict[asyncio.Future, BaseException] = {}
+        try:
+            if delay < timeout:
+                done, _ = await asyncio.wait(pending, timeout=delay)
+                if not done:
+                    if self.hedged < self.max_ratio * self.calls and can_hedge():
+                        self.hedged += 1
+                        pending.add(asyncio.ensure_future(attempt(expires_at - loop.time())))
+                    else:
+                        self.skipped += 1
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    # 被外部取消的調用沒有異常可取（exception() 會拋出 CancelledError）
+                    error = asyncio.CancelledError() if task.cancelled() else task.exception()
+                    if error is None:
+                        if task is not primary:
+                            self.hedge_won += 1
+                        return task.result()
+                    errors[task] = error
+            # 優先拋出首次調用的異常，被取消的調用排在真正的錯誤之後
+            failures = sorted(errors.items(), key=lambda item: (
+                isinstance(item[1], asyncio.CancelledError), item[0] is not primary,
+            ))
+            raise failures[0][1]
+        finally:
+            for task in pending:
+                task.cancel()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'stages': sorted(self.stages),
+            'percentile': self.percentile,
+            'calls': self.calls,
+            'hedged': self.hedged,
+            'hedge_won': self.hedge_won,
+            'skipped': self.skipped,
+            'delay_ms': {
+                stage: round(delay * 1000, 1)
+                for stage in sorted(self.stages)
+                for delay in [self.delay(stage)] if delay is not None
+            },
+        }
@@ -0,0 +1,181 @@
+# -*- coding: utf-8 -*-
+"""
+LLM 調用隔離模塊
+限制同時進行的 DeepSeek 調用數，排隊有上限和超時，單次調用有截止時間，連續失敗時熔斷
+"""
+
+import time
+import asyncio
+import logging
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class BulkheadRejected(Exception):
+    """調用未執行即被拒絕（熔斷中 / 隊列已滿 / 排隊超時），調用方應立即走兜底邏輯"""
+
+    def __init__(self, reason: str):
+        super().__init__(reason)
+        self.reason = reason
+
+
+class LLMBulkhead:
+    """
+    併發隔離 + 熔斷
+
+    - 最多 max_concurrency 個調用同時進行；其餘最多 max_queue 個排隊，
+      隊列已滿時立即拒絕，排隊超過 queue_timeout 秒也拒絕
+    - 連續 failure_threshold 次失敗（含超過截止時間）後熔斷：reset_timeout 秒內直接拒絕，
+      之後放行一次試探調用，成功則恢復，失敗則繼續熔斷
+    - 調用方取消（如客戶端斷開）不計入成功或失敗
+
+    只在事件循環中使用（信號量在首次使用時創建）
+    """
+
+    def __init__(
+        self,
+        max_concurrency: int,
+        max_queue: int,
+        queue_timeout: float,
+        failure_threshold: int = 5,
+        reset_timeout: float = 30.0,
+    ):
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self.state = 'closed'
+        self._opened_at = 0.0
+        self._trial_in_flight = False
+        self._consecutive_failures = 0
+        self.in_flight = 0
+        self.waiting = 0
+        self.calls = 0
+        self.errors = 0
+        self.deadline_exceeded = 0
+        self.rejected: Dict[str, int] = {'circuit_open': 0, 'queue_full': 0, 'queue_timeout': 0}
+        self.breaker_opens = 0
+
+    def _reject(self, reason: str) -> BulkheadRejected:
+        self.rejected[reason] += 1
+        return BulkheadRejected(reason)
+
+    def _enter_breaker(self) -> bool:
+        """檢查熔斷狀態；返回本次調用是否為半開狀態下的試探調用"""
+        if self.state == 'open':
+            if time.monotonic() - self._opened_at < self.reset_timeout:
+                raise self._reject('circuit_open')
+            self.state = 'half_open'
+        if self.state == 'half_open':
+            if self._trial_in_flight:
+                raise self._reject('circuit_open')
+            self._trial_in_flight = True
+            return True
+        return False
+
+    def _record(self, ok: bool) -> None:
+        if ok:
+            self._consecutive_failures = 0
+            if self.state != 'closed':
+                logger.info("[LLM] ✅ 試探調用成功，熔斷恢復")
+            self.state = 'closed'
+            return
+        self._consecutive_failures += 1
+        if self.state == 'half_open' or self._consecutive_failures >= self.failure_threshold:
+            if self.state != 'open':
+                self.breaker_opens += 1
+                logger.warning(f"[LLM] ⚠️ 連續失敗 {self._consecutive_failures} 次，熔斷 {self.reset_timeout:.0f}s")
+            self.state = 'open'
+            self._opened_at = time.monotonic()
+
+    async def _acquire(self) -> None:
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        if self._semaphore.locked() and self.waiting >= self.max_queue:
+            raise self._reject('queue_full')
+        self.waiting += 1
+        # 不用 wait_for：名額恰好在調用方被取消時分配，wait_for 會吞掉取消並佔住名額
+        acquire = asyncio.ensure_future(self._semaphore.acquire())
+        try:
+            done, _ = await asyncio.wait({acquire}, timeout=self.queue_timeout)
+        except asyncio.CancelledError:
+            if acquire.done() and not acquire.cancelled():
+                self._semaphore.release()
+            else:
+                acquire.cancel()
+            raise
+        finally:
+            self.waiting -= 1
+        if not done:
+            acquire.cancel()
+            raise self._reject('queue_timeout')
+
+    def has_capacity(self) -> bool:
+        """當前是否有空閒名額（無需排隊）"""
+        return self.state == 'closed' and self.in_flight < self.max_concurrency
+
+    @asynccontextmanager
+    async def slot(self) -> AsyncIterator[None]:
+        """
+        佔用一個調用名額（流式調用在整個流期間佔用）
+
+        Raises:
+            BulkheadRejected: 熔斷中 / 隊列已滿 / 排隊超時
+        """
+        trial = self._enter_breaker()
+        try:
+            await self._acquire()
+        except BaseException:
+            if trial:
+                self._trial_in_flight = False
+            raise
+
+        self.in_flight += 1
+        self.calls += 1
+        outcome: Optional[bool] = None
+        try:
+            yield
+            outcome = True
+        except asyncio.TimeoutError:
+            self.deadline_exceeded += 1
+            outcome = False
+            raise
+        except Exception:
+            self.errors += 1
+            outcome = False
+            raise
+        finally:
+            self.in_flight -= 1
+            self._semaphore.release()
+            if trial:
+                self._trial_in_flight = False
+            if outcome is not None:
+                self._record(outcome)
+
+    async def run(self, factory: Callable[[], Awaitable[Any]], deadline: float) -> Any:
+        """
+        在名額內執行一次調用，超過 deadline 秒取消並拋出 asyncio.TimeoutError
+
+        Raises:
+            BulkheadRejected: 調用未執行即被拒絕
+        """
+        async with self.slot():
+            return await asyncio.wait_for(factory(), deadline)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'state': self.state,
+            'in_flight': self.in_flight,
+            'waiting': self.waiting,
+            'max_concurrency': self.max_concurrency,
+            'max_queue': self.max_queue,
+            'calls': self.calls,
+            'errors': self.errors,
+            'deadline_exceeded': self.deadline_exceeded,
+            'rejected': dict(self.rejected),
+            'breaker_opens': self.breaker_opens,
+        }
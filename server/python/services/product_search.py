@@ -6,7 +6,7 @@
 
 import re
 import json
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, Optional, Sequence
 from pathlib import Path
 
 
@@ -103,7 +103,7 @@ def score_product_for_query(item: Dict[str, Any], query: str) -> int:
 
 
 def find_top_product_candidates(
-    products: List[Dict[str, Any]],
+    products: Sequence[Dict[str, Any]],
     query: str,
     limit: int = 5
 ) -> List[Dict[str, Any]]:
@@ -120,7 +120,7 @@ def find_top_product_candidates(
     Returns:
         評分後的候選商品列表，每項包含 'score' 和 'item'
     """
-    if not isinstance(products, list):
+    if not isinstance(products, (list, tuple)):
         products = []
     
     scored = []
@@ -220,28 +220,46 @@ class ProductSearcher:
     封裝商品數據加載和搜索功能
     """
     
-    def __init__(self, products: List[Dict[str, Any]] = None, data_file: str = None):
+    def __init__(
+        self,
+        products: List[Dict[str, Any]] = None,
+        data_file: str = None,
+        store: 'CatalogStore' = None,
+    ):
         """
         初始化搜索器
         
         Args:
             products: 商品列表（可選）
             data_file: 商品數據文件路徑（可選）
+            store: 商品目錄存儲（可選，提供時始終讀取其當前世代）
         """
         self._products = products or []
         self._data_file = data_file
+        self._store = store
         
-        if data_file and not products:
+        if data_file and not products and store is None:
             self._products = load_products_from_file(data_file)
     
     @property
-    def products(self) -> List[Dict[str, Any]]:
-        """獲取商品列表"""
+    def _products_view(self) -> Sequence[Dict[str, Any]]:
+        if self._store is not None:
+            gen = self._store.current
+            return gen.products if gen is not None else ()
         return self._products
     
+    @property
+    def products(self) -> Sequence[Dict[str, Any]]:
+        """獲取商品列表"""
+        return self._products_view
+    
     def reload(self) -> None:
-        """重新加載商品數據"""
-        if self._data_file:
+        """重新加載商品數據（新數據完整構建後再整體替換）"""
+        if not self._data_file:
+            return
+        if self._store is not None:
+            self._store.load_file(self._data_file)
+        else:
             self._products = load_products_from_file(self._data_file)
     
     def search(
@@ -261,7 +279,7 @@ class ProductSearcher:
         Returns:
             匹配的商品列表
         """
-        return search_products(self._products, query, limit, brief)
+        return search_products(self._products_view, query, limit, brief)
     
     def get_by_produit(self, produit: str) -> Optional[Dict[str, Any]]:
         """
@@ -273,6 +291,8 @@ class ProductSearcher:
         Returns:
             商品數據，未找到則返回 None
         """
+        if self._store is not None and self._store.current is not None:
+            return self._store.current.get_by_produit(produit)
         prod_lower = produit.lower().strip()
         for item in self._products:
             item_prod = str(item.get('produit') or '').lower().strip()
@@ -291,6 +311,8 @@ class ProductSearcher:
         Returns:
             該品牌的商品列表
         """
+        if self._store is not None and self._store.current is not None:
+            return list(self._store.current.get_by_brand(brand)[:limit])
         brand_lower = brand.lower().strip()
         result = []
         for item in self._products:
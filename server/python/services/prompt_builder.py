@@ -0,0 +1,217 @@
+# -*- coding: utf-8 -*-
+"""
+對話提示詞構建模塊
+按 token 預算組裝系統提示詞、上下文和對話歷史，並統計每次請求的提示詞 token 數
+"""
+
+import re
+import json
+import threading
+from collections import deque
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+# 本地 token 估算（DeepSeek 官方換算：1 個中文字符 ≈ 0.6 token，1 個英文字符 ≈ 0.3 token）
+CJK_TOKEN_RATIO = 0.6
+OTHER_TOKEN_RATIO = 0.3
+# 每條消息的格式開銷（角色標記等）
+MESSAGE_OVERHEAD_TOKENS = 4
+
+# 傳給模型的候選商品字段（圖片鏈接對文字回覆無用，不發送）
+CANDIDATE_FIELDS = ('score', 'designation', 'Marque', 'produit', 'Prix_Vente', 'Lien_Externe')
+# 在線搜索結果最多佔用剩餘預算的比例（其餘留給對話歷史）
+ONLINE_RESULTS_SHARE = 0.5
+ONLINE_RESULTS_MAX_CHARS = 6000
+# /api/metrics 中保留的最近請求數（每條含估算和 API 返回的提示詞 token 數）
+RECENT_REQUESTS = 20
+
+_CJK_RE = re.compile(r'[\u3000-\u303f\u3400-\u9fff\uff00-\uffef]')
+
+
+def estimate_tokens(text: str) -> int:
+    """估算文本的 token 數（不依賴分詞器，偏保守）"""
+    if not text:
+        return 0
+    cjk = len(_CJK_RE.findall(text))
+    return int(cjk * CJK_TOKEN_RATIO + (len(text) - cjk) * OTHER_TOKEN_RATIO) + 1
+
+
+def truncate_to_tokens(text: str, max_tokens: int) -> str:
+    """把文本截斷到約 max_tokens 個 token（截斷時末尾加 …）"""
+    if estimate_tokens(text) <= max_tokens:
+        return text
+    used = 0.0
+    for i, ch in enumerate(text):
+        used += CJK_TOKEN_RATIO if _CJK_RE.match(ch) else OTHER_TOKEN_RATIO
+        if used > max_tokens - 1:
+            return text[:i] + '…'
+    return text
+
+
+def _message_tokens(message: Dict[str, str]) -> int:
+    return estimate_tokens(message.get('content', '')) + MESSAGE_OVERHEAD_TOKENS
+
+
+def _compact_json(value: Any) -> str:
+    return json.dumps(value, ensure_ascii=False, separators=(',', ':'))
+
+
+class PromptBuilder:
+    """
+    按 token 預算構建對話請求的消息列表
+
+    - 靜態系統提示詞在構造時生成一次並緩存
+    - 上下文用緊湊 JSON 序列化；候選商品按分數順序保留到預算用完（至少保留第一個）
+    - 對話歷史從最近的消息開始保留，單條消息超過 history_message_tokens 時截斷
+    - 當前查詢、系統提示詞和額外指令始終完整保留（預算只約束可裁剪的部分）
+    """
+
+    def __init__(
+        self,
+        system_messages: Sequence[str],
+        budget_tokens: int = 3000,
+        history_message_tokens: int = 500,
+    ):
+        self.system_messages = [{'role': 'system', 'content': text} for text in system_messages]
+        self._system_tokens = sum(_message_tokens(m) for m in self.system_messages)
+        self.budget_tokens = budget_tokens
+        self.history_message_tokens = history_message_tokens
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.estimated_total = 0
+        self.estimated_max = 0
+        self.reported_requests = 0
+        self.reported_total = 0
+        self.trimmed_history = 0
+        self.trimmed_candidates = 0
+        self.truncated_online = 0
+        self.recent: deque = deque(maxlen=RECENT_REQUESTS)
+
+    def _fit_candidates(self, candidates: List[Dict[str, Any]], available: int) -> List[Dict[str, Any]]:
+        kept = []
+        used = 0
+        for candidate in candidates:
+            brief = {k: candidate[k] for k in CANDIDATE_FIELDS if candidate.get(k) not in (None, '')}
+            tokens = estimate_tokens(_compact_json(brief))
+            if kept and used + tokens > available:
+                break
+            kept.append(brief)
+            used += tokens
+        return kept
+
+    def build(
+        self,
+        user_query: str,
+        history: Optional[List[Dict[str, str]]] = None,
+        intent: Optional[str] = None,
+        candidates: Optional[List[Dict[str, Any]]] = None,
+        online_results: Optional[str] = None,
+        price_evidence: Optional[List[str]] = None,
+        instructions: Sequence[str] = (),
+        usage: Optional[Dict[str, Any]] = None,
+    ) -> Tuple[List[Dict[str, str]], int]:
+        """
+        Args:
+            history: 已標準化的對話歷史（可包含當前查詢作為最後一條）
+            price_evidence: 從完整在線搜索結果中提取的價格證據
+            instructions: 附加在靜態系統提示詞之後的指令（計入固定部分）
+            usage: 本次請求的 token 記錄，寫入 estimated（API 返回後由 record_usage 寫入 reported）
+
+        Returns:
+            (消息列表, 估算的提示詞 token 數)
+        """
+        history = list(history or [])
+        if history and history[-1].get('role') == 'user' and history[-1].get('content') == user_query:
+            history.pop()
+        query_message = {'role': 'user', 'content': user_query or ''}
+        extra = [{'role': 'system', 'content': text} for text in instructions]
+
+        context_payload = {
+            'intent': intent or 'unknown',
+            'query': user_query or '',
+            'candidates': [],
+            'onlineResults': '',
+            'priceEvidence': price_evidence or [],
+        }
+        context_prefix = '你可以使用以下信息作為參考（不是用戶原話）：\n'
+        fixed = (
+            self._system_tokens
+            + sum(_message_tokens(m) for m in extra)
+            + _message_tokens(query_message)
+            + estimate_tokens(context_prefix + _compact_json(context_payload))
+            + MESSAGE_OVERHEAD_TOKENS
+        )
+        available = max(0, self.budget_tokens - fixed)
+
+        # 候選商品優先
+        all_candidates = candidates if isinstance(candidates, list) else []
+        context_payload['candidates'] = self._fit_candidates(all_candidates, available)
+        available = max(0, available - estimate_tokens(_compact_json(context_payload['candidates'])))
+        trimmed_candidates = len(all_candidates) - len(context_payload['candidates'])
+
+        # 在線搜索結果最多佔剩餘預算的一部分
+        truncated_online = False
+        if online_results:
+            online_text = str(online_results)[:ONLINE_RESULTS_MAX_CHARS]
+            fitted = truncate_to_tokens(online_text, int(available * ONLINE_RESULTS_SHARE))
+            truncated_online = fitted != str(online_results)
+            context_payload['onlineResults'] = fitted
+            available = max(0, available - estimate_tokens(fitted))
+
+        # 對話歷史：從最近的消息開始保留
+        kept_history: List[Dict[str, str]] = []
+        for message in reversed(history):
+            content = truncate_to_tokens(message.get('content', ''), self.history_message_tokens)
+            tokens = estimate_tokens(content) + MESSAGE_OVERHEAD_TOKENS
+            if tokens > available:
+                break
+            kept_history.append({'role': message.get('role'), 'content': content})
+            available -= tokens
+        kept_history.reverse()
+
+        context_message = {'role': 'system', 'content': context_prefix + _compact_json(context_payload)}
+        messages = [*self.system_messages, *extra, context_message, *kept_history, query_message]
+        prompt_tokens = sum(_message_tokens(m) for m in messages)
+        record = usage if usage is not None else {}
+        record['estimated'] = prompt_tokens
+        record['reported'] = None
+
+        with self._lock:
+            self.requests += 1
+            self.estimated_total += prompt_tokens
+            self.estimated_max = max(self.estimated_max, prompt_tokens)
+            self.trimmed_history += len(history) - len(kept_history)
+            self.trimmed_candidates += trimmed_candidates
+            self.truncated_online += int(truncated_online)
+            self.recent.append(record)
+        return messages, prompt_tokens
+
+    def record_usage(self, prompt_tokens: Optional[int], usage: Optional[Dict[str, Any]] = None) -> None:
+        """
+        記錄 API 返回的實際提示詞 token 數（用於校準估算）
+
+        Args:
+            usage: 構建提示詞時傳入 build 的同一請求記錄
+        """
+        if not prompt_tokens:
+            return
+        with self._lock:
+            if usage is not None:
+                usage['reported'] = prompt_tokens
+            self.reported_requests += 1
+            self.reported_total += prompt_tokens
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                'budget': self.budget_tokens,
+                'requests': self.requests,
+                'estimated_avg': round(self.estimated_total / self.requests, 1) if self.requests else 0.0,
+                'estimated_max': self.estimated_max,
+                'reported_avg': (
+                    round(self.reported_total / self.reported_requests, 1) if self.reported_requests else 0.0
+                ),
+                'trimmed_history_messages': self.trimmed_history,
+                'trimmed_candidates': self.trimmed_candidates,
+                'truncated_online_results': self.truncated_online,
+                'recent': [dict(record) for record in self.recent],
+            }
@@ -0,0 +1,94 @@
+# -*- coding: utf-8 -*-
+"""
+模板回覆模塊
+本地高置信度命中（如參考號完全匹配）時直接用模板生成回覆，無需調用 DeepSeek
+"""
+
+import re
+from typing import Any, Dict, List, Optional, Sequence
+
+# 參考號完全匹配的分數（見 score_product_for_query）
+EXACT_REFERENCE_SCORE = 120
+
+# 各語言模板：{name} {brand} {price} {ref} {link}（brand / link 已包含前綴，可為空）
+REPLY_TEMPLATES = {
+    'zh': '為您查詢到 **{name}**{brand}\n💰 價格：**{price}€**\n📦 參考號：**{ref}**{link}\n需要我幫您對比其他尺寸/材質嗎？',
+    'en': 'Here is **{name}**{brand}\n💰 Price: **{price}€**\n📦 Reference: **{ref}**{link}\nWould you like me to compare other sizes or materials?',
+    'fr': 'Voici **{name}**{brand}\n💰 Prix : **{price} €**\n📦 Référence : **{ref}**{link}\nSouhaitez-vous que je compare d\'autres tailles ou matières ?',
+}
+BRAND_FORMATS = {'zh': '（{}）', 'en': ' ({})', 'fr': ' ({})'}
+LINK_FORMAT = '\n🔗 {}'
+
+_CJK_RE = re.compile(r'[\u3400-\u9fff]')
+_WORD_RE = re.compile(r"[a-zàâçéèêëîïôûùüÿœæ']+")
+_FRENCH_CHARS_RE = re.compile(r'[àâçéèêëîïôûùüÿœæ]')
+FRENCH_WORDS = {
+    'prix', 'combien', 'coûte', 'coute', 'quel', 'quelle', 'est', 'le', 'la', 'les', 'du', 'des',
+    'sac', 'bonjour', 'merci', 'svp', 'pour', 'je', 'cherche', 'référence',
+}
+ENGLISH_WORDS = {
+    'price', 'how', 'much', 'what', 'is', 'the', 'cost', 'costs', 'of', 'for', 'please',
+    'bag', 'hello', 'thanks', 'looking', 'reference', 'find',
+}
+
+
+def _language_of(text: str) -> Optional[str]:
+    """單條文本的語言（無法判斷時返回 None）"""
+    text = (text or '').lower()
+    if _CJK_RE.search(text):
+        return 'zh'
+    if _FRENCH_CHARS_RE.search(text):
+        return 'fr'
+    words = set(_WORD_RE.findall(text))
+    french = len(words & FRENCH_WORDS)
+    english = len(words & ENGLISH_WORDS)
+    if french > english:
+        return 'fr'
+    if english > french:
+        return 'en'
+    return None
+
+
+def detect_language(query: str, history: Optional[Sequence[Dict[str, str]]] = None) -> str:
+    """
+    回覆語言：優先按當前查詢判斷，只有參考號等無語言特徵時參考最近的用戶消息，默認中文
+    """
+    language = _language_of(query)
+    if language:
+        return language
+    for message in reversed(list(history or [])):
+        if message.get('role') == 'user':
+            language = _language_of(message.get('content', ''))
+            if language:
+                return language
+    return 'zh'
+
+
+def confident_match(top_matches: List[Dict[str, Any]], min_score: int = EXACT_REFERENCE_SCORE) -> Optional[Dict[str, Any]]:
+    """
+    唯一的高置信度命中商品
+
+    首個候選分數達到 min_score、有價格，且沒有其他候選同樣達到閾值時返回該商品，否則返回 None
+    """
+    if not top_matches or top_matches[0].get('score', 0) < min_score:
+        return None
+    if len(top_matches) > 1 and top_matches[1].get('score', 0) >= min_score:
+        return None
+    item = top_matches[0].get('item') or {}
+    if not (item.get('Prix_Vente') or item.get('prix_achat')):
+        return None
+    return item
+
+
+def render_product_reply(item: Dict[str, Any], language: str = 'zh') -> str:
+    """按語言模板生成單個商品的回覆"""
+    language = language if language in REPLY_TEMPLATES else 'zh'
+    brand = item.get('Marque') or ''
+    link = item.get('Lien_Externe') or ''
+    return REPLY_TEMPLATES[language].format(
+        name=item.get('designation') or item.get('descriptif') or item.get('produit') or '',
+        brand=BRAND_FORMATS[language].format(brand) if brand else '',
+        price=item.get('Prix_Vente') or item.get('prix_achat'),
+        ref=item.get('produit') or '',
+        link=LINK_FORMAT.format(link) if link else '',
+    )
@@ -0,0 +1,61 @@
+# -*- coding: utf-8 -*-
+"""
+運行時統計模塊
+讀取進程內存佔用（Linux /proc），用於衡量多 worker 下的目錄內存共享效果
+"""
+
+import os
+from typing import Dict, List, Optional, Union
+
+# smaps_rollup 中關心的字段（單位 kB）
+_SMAPS_FIELDS = (
+    'Rss', 'Pss', 'Shared_Clean', 'Shared_Dirty', 'Private_Clean', 'Private_Dirty',
+)
+
+
+def read_process_memory(pid: Union[int, str] = 'self') -> Optional[Dict[str, int]]:
+    """
+    讀取進程內存（kB）
+
+    - rss: 常駐內存（共享頁在每個進程中都會計入）
+    - pss: 按共享進程數均攤後的內存，多個 worker 的 pss 之和即實際佔用
+    - uss: 進程獨佔內存（Private_Clean + Private_Dirty）
+    - shared: 與其他進程共享的內存
+
+    Returns:
+        非 Linux 或無法讀取時返回 None
+    """
+    path = f"/proc/{pid}/smaps_rollup"
+    values: Dict[str, int] = {}
+    try:
+        with open(path, 'r') as f:
+            for line in f:
+                key, _, rest = line.partition(':')
+                if key in _SMAPS_FIELDS:
+                    values[key] = int(rest.split()[0])
+    except (OSError, ValueError, IndexError):
+        return None
+
+    return {
+        'rss_kb': values.get('Rss', 0),
+        'pss_kb': values.get('Pss', 0),
+        'uss_kb': values.get('Private_Clean', 0) + values.get('Private_Dirty', 0),
+        'shared_kb': values.get('Shared_Clean', 0) + values.get('Shared_Dirty', 0),
+    }
+
+
+def list_child_pids(pid: int) -> List[int]:
+    """列出進程的直接子進程（gunicorn master → workers）"""
+    children: List[int] = []
+    task_dir = f"/proc/{pid}/task"
+    try:
+        tasks = os.listdir(task_dir)
+    except OSError:
+        return children
+    for tid in tasks:
+        try:
+            with open(f"{task_dir}/{tid}/children", 'r') as f:
+                children.extend(int(c) for c in f.read().split())
+        except (OSError, ValueError):
+            continue
+    return children
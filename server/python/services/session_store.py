@@ -0,0 +1,152 @@
+# -*- coding: utf-8 -*-
+"""
+對話會話模塊
+在服務端保存標準化後的對話歷史和上一輪的候選商品，客戶端每輪只需發送新消息
+"""
+
+import time
+import secrets
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+
+# 會話內存估算：每條消息 / 每個候選商品的固定開銷（字節），字符按 UTF-8 上限估算
+MESSAGE_OVERHEAD_BYTES = 200
+CANDIDATE_OVERHEAD_BYTES = 120
+SESSION_OVERHEAD_BYTES = 600
+
+
+class ConversationSession:
+    """
+    單個會話
+
+    history: 標準化後的 user/assistant 消息（不含當前輪）
+    candidates: 上一輪本地匹配的候選商品 [(produit, score)]，只保存參考號，使用時從當前世代取商品
+    """
+
+    __slots__ = ('session_id', 'history', 'candidates', 'updated_at', 'size')
+
+    def __init__(self, session_id: str, history: Optional[List[Dict[str, str]]] = None):
+        self.session_id = session_id
+        self.history: List[Dict[str, str]] = list(history or [])
+        self.candidates: List[Tuple[str, int]] = []
+        self.updated_at = time.time()
+        self.size = 0
+
+
+def _estimate_size(session: ConversationSession) -> int:
+    size = SESSION_OVERHEAD_BYTES
+    for message in session.history:
+        size += MESSAGE_OVERHEAD_BYTES + 4 * len(message.get('content', ''))
+    for produit, _ in session.candidates:
+        size += CANDIDATE_OVERHEAD_BYTES + len(produit)
+    return size
+
+
+class SessionStore:
+    """
+    線程安全的會話存儲（LRU + 空閒超時 + 內存上限）
+
+    - 會話 ttl 秒內無訪問即失效（讀取時惰性刪除）
+    - 超過 max_sessions 個或估算內存超過 max_bytes 時淘汰最久未用的會話
+    - 每個會話最多保留 max_history 條消息
+    """
+
+    def __init__(self, max_sessions: int, ttl: float, max_bytes: int, max_history: int = 20):
+        self.max_sessions = max_sessions
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.max_history = max_history
+        self._sessions: 'OrderedDict[str, ConversationSession]' = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.created = 0
+        self.hits = 0
+        self.misses = 0
+        self.expired = 0
+        self.evictions = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_sessions > 0
+
+    def __len__(self) -> int:
+        return len(self._sessions)
+
+    def _remove(self, session_id: str) -> None:
+        session = self._sessions.pop(session_id, None)
+        if session is not None:
+            self._bytes -= session.size
+
+    def _evict(self) -> None:
+        while self._sessions and (len(self._sessions) > self.max_sessions or self._bytes > self.max_bytes):
+            _, session = self._sessions.popitem(last=False)
+            self._bytes -= session.size
+            self.evictions += 1
+
+    def get(self, session_id: str) -> Optional[ConversationSession]:
+        now = time.time()
+        with self._lock:
+            session = self._sessions.get(session_id or '')
+            if session is None or session.updated_at + self.ttl <= now:
+                if session is not None:
+                    self._remove(session_id)
+                    self.expired += 1
+                self.misses += 1
+                return None
+            session.updated_at = now
+            self._sessions.move_to_end(session_id)
+            self.hits += 1
+            return session
+
+    def create(self, history: Optional[List[Dict[str, str]]] = None) -> ConversationSession:
+        """新建會話（history 為客戶端發送的已標準化歷史，用於恢復失效的會話）"""
+        session = ConversationSession(secrets.token_urlsafe(16), history[-self.max_history:] if history else None)
+        with self._lock:
+            session.size = _estimate_size(session)
+            self._sessions[session.session_id] = session
+            self._bytes += session.size
+            self.created += 1
+            self._evict()
+        return session
+
+    def record_turn(
+        self,
+        session: ConversationSession,
+        user_message: str,
+        reply: str,
+        candidates: Optional[List[Tuple[str, int]]] = None,
+    ) -> None:
+        """
+        追加一輪對話
+
+        Args:
+            candidates: 本輪的候選商品；None 表示本輪未做本地匹配，保留上一輪的候選
+        """
+        with self._lock:
+            session.history.append({'role': 'user', 'content': user_message})
+            session.history.append({'role': 'assistant', 'content': reply})
+            del session.history[:-self.max_history]
+            if candidates is not None:
+                session.candidates = list(candidates)
+            session.updated_at = time.time()
+            old_size = session.size
+            session.size = _estimate_size(session)
+            if self._sessions.get(session.session_id) is session:
+                self._bytes += session.size - old_size
+                self._sessions.move_to_end(session.session_id)
+                self._evict()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                'sessions': len(self._sessions),
+                'max_sessions': self.max_sessions,
+                'bytes': self._bytes,
+                'max_bytes': self.max_bytes,
+                'created': self.created,
+                'hits': self.hits,
+                'misses': self.misses,
+                'expired': self.expired,
+                'evictions': self.evictions,
+            }
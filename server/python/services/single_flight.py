@@ -0,0 +1,106 @@
+# -*- coding: utf-8 -*-
+"""
+請求合併模塊
+相同鍵的併發調用只執行一次，其餘調用者等待並共享同一結果（或同一個流式輸出）
+"""
+
+import asyncio
+import logging
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, Hashable, List, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class SingleFlight:
+    """
+    異步請求合併（single-flight）
+
+    用法：
+        flight = SingleFlight()
+        result = await flight.do(key, lambda: fetch(key))
+
+    第一個調用者執行 factory，執行期間相同鍵的調用者共享結果（包括異常）；
+    完成後鍵即釋放，之後的調用重新執行。等待者被取消不影響執行中的任務
+    """
+
+    def __init__(self):
+        self._inflight: Dict[Hashable, asyncio.Future] = {}
+        self.executed = 0
+        self.shared = 0
+
+    def __len__(self) -> int:
+        return len(self._inflight)
+
+    async def do(self, key: Hashable, factory: Callable[[], Awaitable[Any]]) -> Any:
+        future = self._inflight.get(key)
+        if future is not None:
+            self.shared += 1
+            return await asyncio.shield(future)
+
+        self.executed += 1
+        future = asyncio.ensure_future(factory())
+        self._inflight[key] = future
+        future.add_done_callback(lambda f: self._done(key, f))
+        return await asyncio.shield(future)
+
+    def _done(self, key: Hashable, future: asyncio.Future) -> None:
+        if self._inflight.get(key) is future:
+            del self._inflight[key]
+        # 所有等待者都已取消時避免 "exception was never retrieved" 警告
+        if not future.cancelled():
+            future.exception()
+
+    def stats(self) -> Dict[str, int]:
+        return {'executed': self.executed, 'shared': self.shared, 'in_flight': len(self._inflight)}
+
+
+class SharedStream:
+    """
+    把一個異步迭代器的輸出廣播給多個讀取者
+
+    源迭代器在後台任務中消費，與讀取者是否斷開無關；晚加入的讀取者先重放已產出的部分。
+    源拋出異常時，讀取者在讀完已產出的部分後收到同一異常
+    """
+
+    def __init__(self, source: AsyncIterator[Any]):
+        self.items: List[Any] = []
+        self.done = False
+        self.error: Optional[BaseException] = None
+        self.readers = 0
+        self._changed = asyncio.Event()
+        self._task = asyncio.ensure_future(self._pump(source))
+
+    async def _pump(self, source: AsyncIterator[Any]) -> None:
+        try:
+            async for item in source:
+                self.items.append(item)
+                self._notify()
+        except Exception as e:
+            self.error = e
+        finally:
+            self.done = True
+            self._notify()
+
+    def _notify(self) -> None:
+        self._changed.set()
+        self._changed = asyncio.Event()
+
+    def add_done_callback(self, callback: Callable[[], None]) -> None:
+        self._task.add_done_callback(lambda _: callback())
+
+    async def subscribe(self) -> AsyncIterator[Any]:
+        """從頭讀取源的輸出，直到源結束"""
+        self.readers += 1
+        index = 0
+        while True:
+            changed = self._changed
+            if index < len(self.items):
+                item = self.items[index]
+                index += 1
+                yield item
+                continue
+            if self.done:
+                if self.error is not None:
+                    raise self.error
+                return
+            await changed.wait()
@@ -0,0 +1,163 @@
+# -*- coding: utf-8 -*-
+"""
+TTL 緩存模塊
+有容量上限（LRU 淘汰）且按過期時間失效的內存緩存，可選持久化到磁盤
+"""
+
+import os
+import json
+import time
+import logging
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+try:
+    import fcntl
+except ImportError:  # 非 POSIX 平台：不加文件鎖
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+
+class TTLCache:
+    """
+    線程安全的 LRU + TTL 緩存
+
+    - 超過 max_entries 時淘汰最久未使用的條目
+    - 條目寫入 ttl 秒後失效（讀取時惰性刪除）
+    - 指定 persist_path 時可 load()/save() 到 JSON 文件（值需可 JSON 序列化）；
+      多個進程共用同一文件時 save() 與文件中已有的條目合併，不會互相覆蓋
+    """
+
+    def __init__(self, max_entries: int, ttl: float, persist_path: Optional[str] = None):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.persist_path = persist_path
+        self._data: 'OrderedDict[str, Tuple[float, Any]]' = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def __contains__(self, key: str) -> bool:
+        """是否有未過期的條目（不計入命中統計，不更新 LRU 順序）"""
+        with self._lock:
+            entry = self._data.get(key)
+            return entry is not None and entry[0] > time.time()
+
+    def get(self, key: str) -> Optional[Any]:
+        now = time.time()
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None or entry[0] <= now:
+                if entry is not None:
+                    del self._data[key]
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def set(self, key: str, value: Any) -> None:
+        with self._lock:
+            self._data[key] = (time.time() + self.ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'size': len(self._data),
+                'max_entries': self.max_entries,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': round(self.hits / lookups, 4) if lookups else 0.0,
+                'evictions': self.evictions,
+            }
+
+    def _read_entries(self) -> List[Any]:
+        try:
+            with open(self.persist_path, 'r', encoding='utf-8') as f:
+                entries = json.load(f)
+        except FileNotFoundError:
+            return []
+        except (OSError, ValueError) as e:
+            logger.warning(f"[Cache] 載入緩存文件失敗 {self.persist_path}: {e}")
+            return []
+        if not isinstance(entries, list):
+            logger.warning(f"[Cache] 緩存文件格式錯誤，已忽略: {self.persist_path}")
+            return []
+        # 逐條校驗 [鍵, 過期時間, 值]，跳過格式錯誤的條目（文件損壞或被手工修改）
+        valid = []
+        skipped = 0
+        for entry in entries:
+            try:
+                key, expires, value = entry
+                valid.append((str(key), float(expires), value))
+            except (TypeError, ValueError):
+                skipped += 1
+        if skipped:
+            logger.warning(f"[Cache] 跳過 {skipped} 條格式錯誤的緩存條目: {self.persist_path}")
+        return valid
+
+    @contextmanager
+    def _file_lock(self) -> Iterator[None]:
+        """跨進程串行化讀-合併-寫，避免多個 worker 同時退出時丟失條目"""
+        if fcntl is None:
+            yield
+            return
+        fd = os.open(f"{self.persist_path}.lock", os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            yield
+        finally:
+            os.close(fd)
+
+    def load(self) -> int:
+        """從 persist_path 載入未過期的條目，返回載入數量"""
+        if not self.persist_path:
+            return 0
+        entries = self._read_entries()
+
+        now = time.time()
+        loaded = 0
+        with self._lock:
+            for key, expires, value in entries[-self.max_entries:]:
+                if expires > now:
+                    self._data[key] = (expires, value)
+                    loaded += 1
+        return loaded
+
+    def save(self) -> int:
+        """把未過期的條目與文件中已有的條目合併後原子寫入 persist_path，返回寫入數量"""
+        if not self.persist_path:
+            return 0
+        now = time.time()
+        with self._lock:
+            own = [[key, expires, value] for key, (expires, value) in self._data.items() if expires > now]
+        path_dir = os.path.dirname(self.persist_path)
+        if path_dir:
+            os.makedirs(path_dir, exist_ok=True)
+        with self._file_lock():
+            # 其他進程保存的條目在前，本進程的條目（較新）在後並覆蓋同名鍵
+            merged: 'OrderedDict[str, List[Any]]' = OrderedDict()
+            for key, expires, value in self._read_entries():
+                if expires > now:
+                    merged[key] = [key, expires, value]
+            for entry in own:
+                merged.pop(entry[0], None)
+                merged[entry[0]] = entry
+            entries = list(merged.values())[-self.max_entries:]
+            tmp_path = f"{self.persist_path}.{os.getpid()}.tmp"
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(entries, f, ensure_ascii=False)
+            os.replace(tmp_path, self.persist_path)
+        return len(entries)
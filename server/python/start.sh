@@ -7,5 +7,5 @@ cd server/python
 # 安裝依賴（如果沒有使用 Docker）
 pip install -r requirements.txt
 
-# 啟動 uvicorn
+# 啟動 uvicorn（單進程；gunicorn.conf.py 的多 worker 配置需改用 gunicorn -c gunicorn.conf.py app:app）
 uvicorn app:app --host 0.0.0.0 --port ${PORT:-5000}
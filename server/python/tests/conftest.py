@@ -0,0 +1,156 @@
+# -*- coding: utf-8 -*-
+import sys
+import json
+import asyncio
+from pathlib import Path
+
+import httpx
+import pytest
+from openai import AsyncOpenAI
+
+# 測試直接導入 services / app 等本地模塊
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+APP_PRODUCTS = [
+    {'produit': 'M00001X', 'Marque': 'Dior', 'Famille': 'Sac', 'Prix_Vente': 101, 'Prix_Achat': 80},
+    {'produit': 'M00002X', 'Marque': 'Dior', 'Famille': 'Sac', 'Prix_Vente': 102, 'Prix_Achat': 81},
+    {'produit': 'M00003X', 'Marque': 'Chanel', 'Famille': 'Sac', 'Prix_Vente': 103, 'Prix_Achat': 82},
+]
+
+ADMIN_KEY = 'test-admin'
+
+
+@pytest.fixture(scope='session')
+def app_module(tmp_path_factory):
+    """
+    導入 app 模塊（整個測試會話只導入一次）
+
+    配置在導入時讀取：數據與緩存目錄指向臨時目錄，關閉後台監視與壓縮，
+    DeepSeek 指向不可達地址，需要上游的測試自行替換 HTTP 傳輸
+    """
+    root = tmp_path_factory.mktemp('app')
+    patch = pytest.MonkeyPatch()
+    patch.setenv('PRODUCTS_JSON_PATH', str(root / 'products.json'))
+    patch.setenv('PRODUCTS_DATA_URL', 'http://127.0.0.1:9/products.json')
+    patch.setenv('IMAGE_CACHE_DIR', str(root / 'image_cache'))
+    patch.setenv('ADMIN_KEY', ADMIN_KEY)
+    patch.setenv('PRODUCTS_WATCH_INTERVAL', '0')
+    patch.setenv('JOURNAL_COMPACT_INTERVAL', '0')
+    patch.setenv('CATALOG_RETRY_INTERVAL', '0')
+    patch.setenv('DEEPSEEK_API_KEY', 'test-key')
+    patch.setenv('DEEPSEEK_BASE_URL', 'http://127.0.0.1:9/v1')
+    patch.setenv('INTENT_CACHE_PATH', '')
+    import app
+    yield app
+    patch.undo()
+
+
+@pytest.fixture
+def app_catalog(app_module, tmp_path, monkeypatch):
+    """
+    每個測試使用獨立的數據文件、變更日誌與目錄存儲（未載入）
+
+    返回數據文件路徑；需要已就緒目錄的測試調用 app_module.load_catalog()
+    """
+    from services.catalog import CatalogStore
+    from services.catalog_journal import CatalogJournal
+
+    path = tmp_path / 'products.json'
+    path.write_text(json.dumps(APP_PRODUCTS), encoding='utf-8')
+    journal = CatalogJournal(str(path))
+    store = CatalogStore(journal=journal)
+    monkeypatch.setattr(app_module, 'PRODUCTS_FILE', str(path))
+    monkeypatch.setattr(app_module, 'catalog_journal', journal)
+    monkeypatch.setattr(app_module, 'catalog_store', store)
+    monkeypatch.setattr(app_module.product_searcher, '_store', store)
+    monkeypatch.setattr(app_module, '_catalog_state', dict(app_module._catalog_state, status='pending', error=None))
+    yield path
+    journal.close()
+
+
+@pytest.fixture
+def client(app_module, app_catalog):
+    """不運行 lifespan 的測試客戶端，目錄已載入"""
+    from fastapi.testclient import TestClient
+
+    app_module.load_catalog()
+    assert app_module.is_catalog_ready()
+    return TestClient(app_module.app)
+
+
+def completion(content, prompt_tokens=10):
+    """DeepSeek 格式的非流式響應"""
+    return {
+        'id': 'cmpl-test', 'object': 'chat.completion', 'created': 0, 'model': 'deepseek-chat',
+        'choices': [{'index': 0, 'message': {'role': 'assistant', 'content': content}, 'finish_reason': 'stop'}],
+        'usage': {'prompt_tokens': prompt_tokens, 'completion_tokens': 5, 'total_tokens': prompt_tokens + 5},
+    }
+
+
+def sse_chunk(text=None, prompt_tokens=None):
+    """DeepSeek 格式的流式響應片段（只給 prompt_tokens 時為 include_usage 的最後一段）"""
+    data = {'id': 'cmpl-test', 'object': 'chat.completion.chunk', 'created': 0, 'model': 'deepseek-chat', 'choices': []}
+    if text is not None:
+        data['choices'] = [{'index': 0, 'delta': {'content': text}, 'finish_reason': None}]
+    if prompt_tokens is not None:
+        data['usage'] = {'prompt_tokens': prompt_tokens, 'completion_tokens': 5, 'total_tokens': prompt_tokens + 5}
+    return f'data: {json.dumps(data)}\n\n'.encode('utf-8')
+
+
+class Upstream:
+    """
+    按請求返回 DeepSeek 格式響應的 httpx MockTransport 處理函數
+
+    JSON 模式（response_format=json_object）的請求返回 intent，
+    其他非流式請求返回 reply，流式請求逐段返回 pieces
+    """
+
+    def __init__(self):
+        self.intent = {'intent': 'chat', 'hint': '', 'message': ''}
+        self.reply = '這款商品的價格請參考上面的列表。'
+        self.pieces = ['您好', '，請問', '想找哪款？']
+        self.delay = 0.0  # 每個請求的響應延遲（秒）
+        self.status = 200  # 非流式請求的狀態碼
+        self.fail_after = None  # 輸出幾段後連接中斷
+        self.hang_after = None  # 輸出幾段後不再返回數據
+        self.requests = []
+
+    async def _stream(self):
+        for index, piece in enumerate(self.pieces):
+            if index == self.fail_after:
+                raise httpx.ReadError('connection reset')
+            if index == self.hang_after:
+                await asyncio.sleep(3600)
+            yield sse_chunk(piece)
+        yield sse_chunk(prompt_tokens=10)
+        yield b'data: [DONE]\n\n'
+
+    async def handle(self, request):
+        body = json.loads(request.content)
+        self.requests.append(body)
+        if self.delay:
+            await asyncio.sleep(self.delay)
+        if body.get('stream'):
+            return httpx.Response(200, headers={'Content-Type': 'text/event-stream'}, content=self._stream())
+        if self.status != 200:
+            return httpx.Response(self.status, json={'error': {'message': 'upstream error'}})
+        if body.get('response_format', {}).get('type') == 'json_object':
+            return httpx.Response(200, json=completion(json.dumps(self.intent)))
+        return httpx.Response(200, json=completion(self.reply))
+
+    def client(self):
+        """連接到本處理函數的 AsyncOpenAI 客戶端（不重試）"""
+        return AsyncOpenAI(
+            api_key='test-key',
+            base_url='http://deepseek.test/v1',
+            http_client=httpx.AsyncClient(transport=httpx.MockTransport(self.handle)),
+            max_retries=0,
+        )
+
+
+@pytest.fixture
+def upstream(app_module, monkeypatch):
+    """把 app 的 DeepSeek 客戶端指向模擬上游"""
+    upstream = Upstream()
+    monkeypatch.setattr(app_module.deepseek_client, '_async_client', upstream.client())
+    return upstream
@@ -0,0 +1,70 @@
+# -*- coding: utf-8 -*-
+"""單次調用模式：一次結構化調用得到意圖和回覆，hint 改變候選時才再調用一次"""
+
+import pytest
+
+from services.llm_bulkhead import LLMBulkhead
+
+
+@pytest.fixture
+def single_call(app_module, client, upstream, monkeypatch):
+    monkeypatch.setattr(app_module, 'AGENT_SINGLE_CALL', True)
+    monkeypatch.setattr(app_module.intent_rules, 'classify', lambda query: None)
+    monkeypatch.setattr(app_module, '_single_call_stats', {'single': 0, 'second_call': 0, 'fallback': 0})
+    return upstream
+
+
+def _json_requests(upstream):
+    return [r for r in upstream.requests if r.get('response_format', {}).get('type') == 'json_object']
+
+
+def test_price_query_uses_one_call(app_module, client, single_call):
+    single_call.intent = {'intent': 'query_price', 'hint': 'dior sac', 'message': 'Dior 手袋售價 101 歐元。'}
+
+    response = client.post('/api/agent', json={'query': 'dior sac'})
+
+    assert response.status_code == 200
+    assert response.json()['message'] == 'Dior 手袋售價 101 歐元。'
+    assert response.json()['intent'] == 'query_price'
+    assert len(single_call.requests) == 1
+    # 候選商品在調用前已搜索好並放入提示詞
+    prompt = '\n'.join(m['content'] for m in single_call.requests[0]['messages'])
+    assert 'M00001X' in prompt
+    assert app_module._single_call_stats == {'single': 1, 'second_call': 0, 'fallback': 0}
+
+
+def test_hint_changing_candidates_triggers_second_call(app_module, client, single_call):
+    single_call.intent = {'intent': 'query_price', 'hint': 'chanel sac', 'message': 'Dior 手袋售價 101 歐元。'}
+
+    response = client.post('/api/agent', json={'query': 'dior sac'})
+
+    assert response.json()['message'] == single_call.reply
+    assert len(_json_requests(single_call)) == 1
+    assert len(single_call.requests) == 2
+    second_prompt = '\n'.join(m['content'] for m in single_call.requests[1]['messages'])
+    assert 'M00003X' in second_prompt
+    assert app_module._single_call_stats == {'single': 0, 'second_call': 1, 'fallback': 0}
+
+
+def test_chat_intent_replies_in_one_call(app_module, client, single_call):
+    single_call.intent = {'intent': 'chat', 'hint': '', 'message': '您好，有什麼可以幫您？'}
+
+    response = client.post('/api/agent', json={'query': '今天過得怎麼樣'})
+
+    assert response.json()['message'] == '您好，有什麼可以幫您？'
+    assert len(single_call.requests) == 1
+
+
+def test_failed_single_call_falls_back_to_two_calls(app_module, client, single_call, monkeypatch):
+    # 獨立的熔斷計數，失敗不影響其他測試
+    monkeypatch.setattr(app_module.deepseek_client, 'bulkhead', LLMBulkhead(4, 4, 1))
+    single_call.status = 500
+
+    response = client.post('/api/agent', json={'query': 'dior sac noir'})
+
+    assert response.status_code == 200
+    assert response.json()['message']
+    assert app_module._single_call_stats['fallback'] == 1
+    # 單次調用失敗後依次嘗試意圖分類和對話生成
+    assert len(_json_requests(single_call)) == 2
+    assert len(single_call.requests) == 3
@@ -0,0 +1,69 @@
+# -*- coding: utf-8 -*-
+"""推測本地搜索：意圖分類失敗或請求取消時不留下無人等待的任務"""
+
+import asyncio
+
+import pytest
+
+
+@pytest.fixture
+def speculation(app_module, app_catalog, monkeypatch):
+    app_module.load_catalog()
+    started = []
+    start = app_module._start_speculative_search
+
+    def record(lookup_query):
+        speculative = start(lookup_query)
+        started.append(speculative[1])
+        return speculative
+
+    monkeypatch.setattr(app_module, '_start_speculative_search', record)
+    monkeypatch.setattr(app_module.intent_rules, 'classify', lambda query: None)
+    return started
+
+
+async def _plan_and_settle(app_module, query):
+    try:
+        return await app_module._plan_query(query, [{'role': 'user', 'content': query}], None)
+    finally:
+        for _ in range(5):
+            await asyncio.sleep(0)
+
+
+@pytest.mark.parametrize('single_call', [False, True])
+def test_classifier_failure_cancels_speculative_search(app_module, speculation, monkeypatch, single_call):
+    async def fail(*args, **kwargs):
+        raise RuntimeError('upstream down')
+
+    monkeypatch.setattr(app_module, 'AGENT_SINGLE_CALL', single_call)
+    monkeypatch.setattr(app_module.deepseek_client, 'classify_intent', fail)
+    monkeypatch.setattr(app_module.deepseek_client, 'classify_and_reply', fail)
+    discarded = app_module._speculation_stats['discarded']
+
+    async def run():
+        with pytest.raises(RuntimeError):
+            await _plan_and_settle(app_module, 'dior sac m00001x bleu')
+        assert len(speculation) == 1
+        assert speculation[0].done()
+
+    asyncio.run(run())
+    assert app_module._speculation_stats['discarded'] == discarded + 1
+
+
+def test_cancelled_request_cancels_speculative_search(app_module, speculation, monkeypatch):
+    async def hang(*args, **kwargs):
+        await asyncio.sleep(3600)
+
+    monkeypatch.setattr(app_module, 'AGENT_SINGLE_CALL', False)
+    monkeypatch.setattr(app_module.deepseek_client, 'classify_intent', hang)
+
+    async def run():
+        plan = asyncio.create_task(_plan_and_settle(app_module, 'dior sac bleu'))
+        while not speculation:
+            await asyncio.sleep(0)
+        plan.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await plan
+        assert speculation[0].done()
+
+    asyncio.run(run())
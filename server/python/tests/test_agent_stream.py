@@ -0,0 +1,102 @@
+# -*- coding: utf-8 -*-
+"""流式智能助手端點 /api/agent/stream：事件順序、上游中途失敗與客戶端斷開"""
+
+import asyncio
+import json
+
+
+def _events(body):
+    events = []
+    for block in body.decode('utf-8').split('\n\n'):
+        if not block.strip():
+            continue
+        lines = dict(line.split(': ', 1) for line in block.split('\n'))
+        events.append((lines['event'], json.loads(lines['data'])))
+    return events
+
+
+def test_events_arrive_in_order(client, app_module, upstream):
+    response = client.post('/api/agent/stream', json={'query': '你好呀朋友'})
+    assert response.status_code == 200
+    assert response.headers['content-type'].startswith('text/event-stream')
+    events = _events(response.content)
+    assert [name for name, _ in events] == ['meta', 'delta', 'delta', 'delta', 'done']
+    assert events[0][1]['intent'] == 'chat'
+    assert [data['text'] for name, data in events if name == 'delta'] == upstream.pieces
+    assert events[-1][1]['message'] == ''.join(upstream.pieces)
+    assert upstream.requests[-1]['stream'] is True
+    assert app_module.deepseek_client.bulkhead.in_flight == 0
+
+
+def test_upstream_failure_mid_stream_sends_error(client, app_module, upstream):
+    upstream.fail_after = 1
+    response = client.post('/api/agent/stream', json={'query': '早安朋友'})
+    events = _events(response.content)
+    assert [name for name, _ in events] == ['meta', 'delta', 'error']
+    assert events[1][1] == {'text': upstream.pieces[0]}
+    assert events[2][1] == {'detail': 'llm_stream_failed'}
+    assert app_module.deepseek_client.bulkhead.in_flight == 0
+
+
+def test_upstream_failure_before_output_falls_back(client, app_module, upstream):
+    upstream.fail_after = 0
+    response = client.post('/api/agent/stream', json={'query': '晚安朋友'})
+    events = _events(response.content)
+    assert [name for name, _ in events] == ['meta', 'delta', 'done']
+    assert events[-1][1]['message'] == app_module.CHAT_FALLBACK
+
+
+async def _disconnect_after_first_delta(app, payload, on_delta):
+    """直接驅動 ASGI 應用：收到第一段回覆後模擬客戶端斷開"""
+    body = json.dumps(payload).encode('utf-8')
+    disconnected = asyncio.Event()
+    received = []
+    request_sent = False
+
+    async def receive():
+        nonlocal request_sent
+        if not request_sent:
+            request_sent = True
+            return {'type': 'http.request', 'body': body, 'more_body': False}
+        await disconnected.wait()
+        return {'type': 'http.disconnect'}
+
+    async def send(message):
+        if message['type'] == 'http.response.body':
+            received.append(message.get('body', b''))
+            if b'event: delta' in message.get('body', b''):
+                on_delta()
+                disconnected.set()
+
+    scope = {
+        'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1', 'method': 'POST',
+        'scheme': 'http', 'path': '/api/agent/stream', 'raw_path': b'/api/agent/stream', 'root_path': '',
+        'query_string': b'', 'headers': [(b'content-type', b'application/json'), (b'host', b'test')],
+        'client': ('127.0.0.1', 1234), 'server': ('test', 80),
+    }
+    await asyncio.wait_for(app(scope, receive, send), 5)
+    return b''.join(received)
+
+
+def test_client_disconnect_releases_bulkhead_slot(client, app_module, upstream):
+    upstream.hang_after = 1
+    bulkhead = app_module.deepseek_client.bulkhead
+    # 帶歷史的請求不參與合併，生成器直接持有上游流
+    payload = {'messages': [
+        {'role': 'user', 'content': '你好'},
+        {'role': 'assistant', 'content': '您好'},
+        {'role': 'user', 'content': '午安朋友'},
+    ]}
+
+    held = []
+
+    async def run():
+        body = await _disconnect_after_first_delta(app_module.app, payload, lambda: held.append(bulkhead.in_flight))
+        for _ in range(10):
+            await asyncio.sleep(0)
+        return body, bulkhead.in_flight
+
+    body, in_flight = asyncio.run(run())
+    assert [name for name, _ in _events(body)] == ['meta', 'delta']
+    assert held == [1]
+    assert in_flight == 0
@@ -0,0 +1,79 @@
+# -*- coding: utf-8 -*-
+"""增量同步：按版本號返回新增/修改和刪除的商品，過舊的版本號要求全量同步"""
+
+import json
+
+from services.catalog import CatalogChangeLog
+
+from conftest import ADMIN_KEY, APP_PRODUCTS
+
+ADMIN = {'x-admin-key': ADMIN_KEY}
+
+
+def test_change_log_merges_entries_after_version():
+    log = CatalogChangeLog()
+    log.record(1, set(), {}, initial=True)
+    log.record(2, {'a', 'b'}, {})
+    log.record(3, set(), {'a': 'A'})
+    log.record(4, {'c'}, {})
+
+    assert log.changes_since(1) == ({'b', 'c'}, {'a': 'A'})
+    assert log.changes_since(3) == ({'c'}, {})
+    assert log.changes_since(4) == (set(), {})
+
+
+def test_change_log_compaction_moves_base_forward():
+    log = CatalogChangeLog(max_entries=2)
+    log.record(1, set(), {}, initial=True)
+    for gen in range(2, 6):
+        log.record(gen, {f'ref{gen}'}, {})
+
+    assert log.changes_since(2) is None
+    assert log.changes_since(3) == ({'ref4', 'ref5'}, {})
+
+
+def test_version_token_from_other_epoch_is_rejected():
+    log = CatalogChangeLog()
+    assert log.parse_token(log.version_token(7)) == 7
+    assert log.parse_token('deadbeef.7') is None
+    assert log.parse_token('garbage') is None
+
+
+def _version(client):
+    response = client.get('/api/products')
+    return response.headers['X-Catalog-Version']
+
+
+def test_changes_endpoint_returns_delta(client):
+    version = _version(client)
+    assert client.patch('/api/products/M00001X', json={'Prix_Vente': 7}, headers=ADMIN).status_code == 200
+    assert client.delete('/api/brands/chanel', headers=ADMIN).status_code == 200
+
+    delta = client.get('/api/products/changes', params={'since': version, 'fields': 'produit,Prix_Vente'}).json()
+
+    assert delta['full_resync'] is False
+    assert delta['upserted'] == [{'produit': 'M00001X', 'Prix_Vente': 7}]
+    assert delta['deleted'] == ['M00003X']
+    assert delta['version'] != version
+
+    # 已是最新版本：空增量
+    latest = client.get('/api/products/changes', params={'since': delta['version']}).json()
+    assert latest == {'version': delta['version'], 'full_resync': False, 'upserted': [], 'deleted': []}
+
+
+def test_changes_endpoint_requests_full_resync_for_unknown_version(client):
+    delta = client.get('/api/products/changes', params={'since': 'deadbeef.1'}).json()
+    assert delta['full_resync'] is True
+    assert delta['upserted'] == [] and delta['deleted'] == []
+
+
+def test_reload_records_file_diff(app_module, client, app_catalog):
+    version = _version(client)
+    products = [dict(APP_PRODUCTS[0], Prix_Vente=1), APP_PRODUCTS[1]]
+    app_catalog.write_text(json.dumps(products), encoding='utf-8')
+    assert client.post('/api/admin/reload', headers=ADMIN).status_code == 200
+
+    delta = client.get('/api/products/changes', params={'since': version}).json()
+
+    assert [p['produit'] for p in delta['upserted']] == ['M00001X']
+    assert delta['deleted'] == ['M00003X']
@@ -0,0 +1,171 @@
+# -*- coding: utf-8 -*-
+"""商品數據下載：斷點續傳、條件請求與校驗和（本地 HTTP 服務）"""
+
+import hashlib
+import json
+import os
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from services import catalog_download
+from services.catalog_download import CatalogDownloadError, download_catalog, read_download_meta
+
+BODY = json.dumps([{'produit': f'M{i:05d}X', 'Marque': 'Dior'} for i in range(5000)]).encode('utf-8')
+
+
+class _Origin(BaseHTTPRequestHandler):
+    body = BODY
+    etag = '"v1"'
+    checksum = hashlib.sha256(BODY).hexdigest()
+    truncate_first = False  # 首次請求只發送一半內容後斷開
+    checksum_on_redirect = False  # 像 Hugging Face 一樣只在 /resolve 的 302 上帶 X-Linked-Etag
+    log = []
+
+    def do_GET(self):
+        cls = type(self)
+        if self.path == '/resolve':
+            self.send_response(302)
+            self.send_header('Location', '/products.json')
+            if cls.checksum:
+                self.send_header('X-Linked-Etag', f'"{cls.checksum}"')
+            self.end_headers()
+            return
+        cls.log.append({k: self.headers.get(k) for k in ('Range', 'If-Range', 'If-None-Match')})
+        if self.headers.get('If-None-Match') == cls.etag:
+            self.send_response(304)
+            self.end_headers()
+            return
+        body, start = cls.body, 0
+        range_header = self.headers.get('Range')
+        if range_header and self.headers.get('If-Range') == cls.etag:
+            start = int(range_header.split('=')[1].rstrip('-'))
+            self.send_response(206)
+            self.send_header('Content-Range', f'bytes {start}-{len(body) - 1}/{len(body)}')
+        else:
+            self.send_response(200)
+        self.send_header('ETag', cls.etag)
+        if cls.checksum and not cls.checksum_on_redirect:
+            self.send_header('X-Linked-Etag', cls.checksum)
+        self.send_header('Content-Length', str(len(body) - start))
+        self.end_headers()
+        if cls.truncate_first:
+            cls.truncate_first = False
+            self.wfile.write(body[start:len(body) // 2])
+            self.wfile.flush()
+            self.close_connection = True
+            return
+        self.wfile.write(body[start:])
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def origin(monkeypatch):
+    monkeypatch.setattr(catalog_download.time, 'sleep', lambda seconds: None)
+    handler = type('Origin', (_Origin,), {'log': []})
+    server = ThreadingHTTPServer(('127.0.0.1', 0), handler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    handler.url = f'http://127.0.0.1:{server.server_address[1]}/products.json'
+    handler.resolve_url = f'http://127.0.0.1:{server.server_address[1]}/resolve'
+    yield handler
+    server.shutdown()
+    server.server_close()
+
+
+def test_download_then_not_modified(origin, tmp_path):
+    dest = str(tmp_path / 'products.json')
+    result = download_catalog(origin.url, dest)
+    assert result['status'] == 'downloaded'
+    assert result['sha256'] == origin.checksum
+    with open(dest, 'rb') as f:
+        assert f.read() == BODY
+    assert read_download_meta(dest)['etag'] == '"v1"'
+
+    result = download_catalog(origin.url, dest)
+    assert result['status'] == 'not_modified'
+    assert origin.log[-1]['If-None-Match'] == '"v1"'
+
+
+def test_resume_after_interrupted_transfer(origin, tmp_path):
+    origin.truncate_first = True
+    dest = str(tmp_path / 'products.json')
+    result = download_catalog(origin.url, dest, max_retries=1)
+
+    assert result['status'] == 'downloaded'
+    assert len(origin.log) == 2
+    # 中斷前已寫入的整塊從該位置續傳
+    offset = int(origin.log[1]['Range'][len('bytes='):-1])
+    assert 0 < offset <= len(BODY) // 2
+    assert origin.log[1]['If-Range'] == '"v1"'
+    with open(dest, 'rb') as f:
+        assert f.read() == BODY
+    assert not os.path.exists(f'{dest}.part')
+
+
+def test_resume_restarts_when_remote_version_changed(origin, tmp_path):
+    origin.truncate_first = True
+    dest = str(tmp_path / 'products.json')
+    with pytest.raises(CatalogDownloadError):
+        download_catalog(origin.url, dest, max_retries=0)
+    assert 0 < os.path.getsize(f'{dest}.part') <= len(BODY) // 2
+
+    # 遠端換了版本：If-Range 不匹配，服務端返回完整的 200，從頭下載
+    origin.body = BODY[::-1]
+    origin.etag = '"v2"'
+    origin.checksum = hashlib.sha256(origin.body).hexdigest()
+    result = download_catalog(origin.url, dest)
+    assert result['etag'] == '"v2"'
+    with open(dest, 'rb') as f:
+        assert f.read() == origin.body
+
+
+def test_checksum_mismatch_keeps_existing_file(origin, tmp_path):
+    dest = tmp_path / 'products.json'
+    dest.write_bytes(b'[]')
+    origin.checksum = '0' * 64
+    with pytest.raises(CatalogDownloadError):
+        download_catalog(origin.url, str(dest), max_retries=1)
+    assert dest.read_bytes() == b'[]'
+    assert not os.path.exists(f'{dest}.part')
+
+
+def test_explicit_checksum_overrides_header(origin, tmp_path):
+    dest = str(tmp_path / 'products.json')
+    with pytest.raises(CatalogDownloadError):
+        download_catalog(origin.url, dest, expected_sha256='f' * 64, max_retries=0)
+    assert not os.path.exists(dest)
+    result = download_catalog(origin.url, dest, expected_sha256=origin.checksum.upper())
+    assert result['status'] == 'downloaded'
+
+
+def test_checksum_from_redirect_is_verified(origin, tmp_path):
+    origin.checksum_on_redirect = True
+    dest = str(tmp_path / 'products.json')
+    result = download_catalog(origin.resolve_url, dest)
+    assert result['verified'] is True
+    assert read_download_meta(dest)['verified'] is True
+
+    origin.body = BODY[::-1]
+    origin.etag = '"v2"'
+    with pytest.raises(CatalogDownloadError, match='checksum mismatch'):
+        download_catalog(origin.resolve_url, dest, max_retries=0)
+    with open(dest, 'rb') as f:
+        assert f.read() == BODY
+
+
+def test_missing_checksum_is_reported_or_rejected(origin, tmp_path):
+    origin.checksum = None
+    dest = str(tmp_path / 'products.json')
+    with pytest.raises(CatalogDownloadError, match='checksum_unavailable'):
+        download_catalog(origin.url, dest, max_retries=0, require_checksum=True)
+    assert not os.path.exists(dest)
+    assert not os.path.exists(f'{dest}.part')
+
+    result = download_catalog(origin.url, dest)
+    assert result['status'] == 'downloaded'
+    assert result['verified'] is False
+    assert read_download_meta(dest)['verified'] is False
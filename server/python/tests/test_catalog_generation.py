@@ -0,0 +1,100 @@
+# -*- coding: utf-8 -*-
+"""增量派生世代：與全量構建結果一致，投影只修補變更的商品"""
+
+import random
+
+import pytest
+
+from services.catalog import CatalogGeneration, apply_ops, build_generation
+
+FIELDS = ('Marque', 'Prix_Vente', 'produit')
+BRANDS = ['Dior', 'Chanel', 'Gucci']
+
+
+def _base():
+    raw = [
+        {'produit': f'M{i:05d}X', 'Marque': BRANDS[i % 3], 'Famille': 'Sac', 'Prix_Vente': 100 + i}
+        for i in range(60)
+    ]
+    raw.append({'produit': 'M00001X', 'Marque': 'Dior', 'Famille': 'Sac', 'Prix_Vente': 1})  # 重複的 produit
+    gen = build_generation(raw, 1)
+    gen.projection(FIELDS, force=True)
+    return gen
+
+
+def _random_ops(rng, gen, count):
+    ops = []
+    for _ in range(count):
+        if rng.random() < 0.3:
+            ref = f'N{rng.randrange(20):05d}X'
+            item = {'produit': ref, 'Marque': rng.choice(BRANDS), 'Prix_Vente': rng.randrange(1000)}
+        else:
+            existing = gen.products[rng.randrange(len(gen.products))]
+            item = dict(existing, Prix_Vente=rng.randrange(1000))
+            if rng.random() < 0.2:
+                item['Marque'] = rng.choice(BRANDS + ['Celine'])
+        ops.append({'op': 'upsert', 'item': item})
+    return ops
+
+
+def _assert_same(derived, expected):
+    assert derived.products == expected.products
+    assert derived.by_ref == expected.by_ref
+    assert derived.by_brand == expected.by_brand
+    for items in derived.by_brand.values():
+        for item in items:
+            assert any(item is p for p in derived.products)
+
+
+@pytest.mark.parametrize('seed', range(5))
+def test_derived_generation_matches_full_rebuild(seed):
+    rng = random.Random(seed)
+    gen = _base()
+    for step in range(6):
+        ops = _random_ops(rng, gen, rng.randrange(1, 6))
+        derived, upserted, deleted = gen.derive(gen.generation + 1, ops)
+        products, expected_upserted, expected_deleted = apply_ops(gen.products, ops)
+        expected = CatalogGeneration(gen.generation + 1, tuple(products))
+
+        assert derived.derived and not expected.derived
+        assert (upserted, deleted) == (expected_upserted, expected_deleted)
+        _assert_same(derived, expected)
+        # 隔一步才使用投影：未修補的繼承投影跨兩個世代累積後再修補
+        if step % 2:
+            assert FIELDS in derived._inherited_projections
+            assert derived.project(derived.products, FIELDS) == expected.project(expected.products, FIELDS)
+            assert derived._inherited_projections == {}
+        gen = derived
+
+
+def test_derive_shares_unchanged_structure():
+    gen = _base()
+    item = dict(gen.get_by_produit('M00004X'), Prix_Vente=5)
+    derived, _, _ = gen.derive(2, [{'op': 'upsert', 'item': item}])
+    assert derived._positions is gen._positions
+    assert derived.by_brand['dior'] is gen.by_brand['dior']
+    assert derived.get_by_produit('m00004x') is item
+    assert gen.get_by_produit('m00004x')['Prix_Vente'] == 104
+    # 原世代的投影不受影響
+    assert gen.projection(FIELDS)[id(gen.get_by_produit('m00004x'))]['Prix_Vente'] == 104
+    assert derived.projection(FIELDS)[id(item)]['Prix_Vente'] == 5
+
+
+def test_delete_brand_is_not_derived():
+    gen = _base()
+    assert gen.derive(2, [{'op': 'delete_brand', 'brand': 'dior'}]) is None
+
+
+def test_edit_warms_only_full_payload(app_module, app_catalog):
+    app_module.load_catalog()
+    store = app_module.catalog_store
+    full = store.current
+    assert ('payload', '', app_module.FIELD_PRESETS['list']) in full._memo
+
+    def make_ops(base):
+        return [{'op': 'upsert', 'item': dict(base.get_by_produit('M00001X'), Prix_Vente=1)}]
+
+    gen, _, _ = store.apply_changes(make_ops)
+    assert gen.derived
+    app_module.warm_catalog_payloads(gen)
+    assert set(gen._memo) == {('payload', '', None)}
@@ -0,0 +1,80 @@
+# -*- coding: utf-8 -*-
+"""批量導入：計數、錯誤請求體與失敗時的任務狀態"""
+
+import json
+
+from conftest import ADMIN_KEY
+
+
+def _ingest(client, body, job_id):
+    if not isinstance(body, (bytes, str)):
+        body = json.dumps(body)
+    return client.post(
+        '/api/products',
+        content=body,
+        headers={'x-admin-key': ADMIN_KEY, 'x-ingest-id': job_id, 'Content-Type': 'application/json'},
+    )
+
+
+def _job(client, job_id):
+    return client.get(f'/api/products/ingest/{job_id}', headers={'x-admin-key': ADMIN_KEY}).json()
+
+
+def test_ingest_counts_inserted_duplicate_and_invalid(client, app_module, app_catalog):
+    body = [
+        {'produit': 'N00001X', 'Marque': 'DIOR', 'Famille': 'Sac', 'Prix_Vente': 200},
+        {'produit': 'm00001x', 'Marque': 'Dior'},
+        {'produit': 'N00001X', 'Marque': 'Dior'},
+        {'Marque': 'Dior'},
+        {'produit': '  '},
+        'not an object',
+    ]
+    response = _ingest(client, body, 'counts')
+    assert response.status_code == 200
+    job = response.json()
+    assert job['status'] == 'done'
+    assert (job['received'], job['inserted'], job['duplicatesSkipped'], job['invalid']) == (6, 1, 2, 3)
+    assert job['total'] == 4
+
+    gen = app_module.catalog_store.current
+    assert job['generation'] == gen.generation
+    # 品牌沿用目錄中已有的寫法
+    assert gen.get_by_produit('N00001X')['Marque'] == 'Dior'
+    assert [p['produit'] for p in json.loads(app_catalog.read_text(encoding='utf-8'))][-1] == 'N00001X'
+
+
+def test_truncated_body_fails_job_and_keeps_catalog(client, app_module, app_catalog):
+    before = app_module.catalog_store.current
+    response = _ingest(client, '[{"produit": "N00001X"}, {"produit": "N0', 'truncated')
+    assert response.status_code == 400
+    job = _job(client, 'truncated')
+    assert job['status'] == 'failed'
+    assert job['error'] == response.json()['detail']
+    assert app_module.catalog_store.current is before
+    assert not (app_catalog.parent / 'products.json.ingest.tmp').exists()
+
+
+def test_non_array_body_is_rejected(client, app_module):
+    before = app_module.catalog_store.current
+    response = _ingest(client, {'produit': 'N00001X'}, 'object')
+    assert response.status_code == 400
+    assert response.json()['detail'] == 'expected_json_array'
+    assert _job(client, 'object')['status'] == 'failed'
+    assert app_module.catalog_store.current is before
+
+
+def test_builder_error_marks_job_failed(client, app_module, monkeypatch):
+    builder = app_module.CatalogBuilder
+
+    def fail(*args, **kwargs):
+        raise OSError('No space left on device')
+
+    monkeypatch.setattr(app_module, 'CatalogBuilder', fail)
+    response = _ingest(client, [{'produit': 'N00001X'}], 'disk-full')
+    assert response.status_code == 500
+    job = _job(client, 'disk-full')
+    assert job['status'] == 'failed'
+    assert 'No space left' in job['error']
+    # 導入鎖已釋放，之後的導入不受影響
+    monkeypatch.setattr(app_module, 'CatalogBuilder', builder)
+    assert _ingest(client, [{'produit': 'N00002X'}], 'after').status_code == 200
@@ -0,0 +1,201 @@
+# -*- coding: utf-8 -*-
+"""商品變更日誌：重放、截斷與重啟"""
+
+import json
+
+import pytest
+
+from services.catalog import CatalogStore
+from services.catalog_journal import CatalogJournal, build_upsert
+
+
+PRODUCTS = [
+    {'produit': 'M00001X', 'Marque': 'Dior', 'Famille': 'Sac', 'Prix_Vente': 101},
+    {'produit': 'M00002X', 'Marque': 'Dior', 'Famille': 'Sac', 'Prix_Vente': 102},
+    {'produit': 'M00003X', 'Marque': 'Chanel', 'Famille': 'Sac', 'Prix_Vente': 103},
+]
+
+
+@pytest.fixture
+def products_file(tmp_path):
+    path = tmp_path / 'products.json'
+    path.write_text(json.dumps(PRODUCTS), encoding='utf-8')
+    return str(path)
+
+
+def _open_store(path):
+    """模擬進程啟動：新的日誌和存儲實例，從磁盤載入"""
+    journal = CatalogJournal(path)
+    store = CatalogStore(journal=journal)
+    store.load_file(path)
+    return store, journal
+
+
+def _patch(store, produit, **changes):
+    def make_ops(base):
+        return [{'op': 'upsert', 'item': build_upsert(base.get_by_produit(produit), changes)}]
+    return store.apply_changes(make_ops)
+
+
+def _price(store, produit):
+    return store.current.get_by_produit(produit)['Prix_Vente']
+
+
+def test_changes_survive_restart(products_file):
+    store, journal = _open_store(products_file)
+    _patch(store, 'M00003X', Prix_Vente=7)
+    journal.close()
+
+    store, journal = _open_store(products_file)
+    assert _price(store, 'M00003X') == 7
+    assert journal.pending == 1
+
+
+def test_sequence_continues_after_compaction_and_restart(products_file):
+    store, journal = _open_store(products_file)
+    _patch(store, 'M00001X', Prix_Vente=1)
+    _patch(store, 'M00002X', Prix_Vente=2)
+    assert store.compact() is not None
+    assert journal.pending == 0
+    journal.close()
+
+    # 壓縮後日誌為空：重啟後新記錄的序號必須接在快照之後
+    store, journal = _open_store(products_file)
+    assert journal.last_seq == 2
+    _patch(store, 'M00003X', Prix_Vente=7)
+    assert journal.last_seq == 3
+    assert journal.pending == 1
+    journal.close()
+
+    store, journal = _open_store(products_file)
+    assert _price(store, 'M00001X') == 1
+    assert _price(store, 'M00003X') == 7
+    assert journal.pending == 1
+
+
+def test_sequence_continues_after_mark_snapshot(products_file):
+    store, journal = _open_store(products_file)
+    _patch(store, 'M00001X', Prix_Vente=1)
+    # 導入流程：寫出包含全部變更的新快照後登記並截斷日誌
+    journal.write_snapshot(store.current.products, journal.last_seq)
+    journal.close()
+
+    store, journal = _open_store(products_file)
+    _patch(store, 'M00003X', Prix_Vente=7)
+    journal.close()
+
+    store, journal = _open_store(products_file)
+    assert _price(store, 'M00001X') == 1
+    assert _price(store, 'M00003X') == 7
+    assert journal.pending >= 0
+
+
+def test_replay_ignores_torn_tail(products_file):
+    store, journal = _open_store(products_file)
+    _patch(store, 'M00001X', Prix_Vente=1)
+    _patch(store, 'M00002X', Prix_Vente=2)
+    journal.close()
+
+    # 模擬崩潰：最後一條記錄只寫了一半
+    with open(journal.path, 'rb+') as f:
+        data = f.read()
+        f.seek(0)
+        f.truncate()
+        f.write(data[:-10])
+
+    store, journal = _open_store(products_file)
+    assert _price(store, 'M00001X') == 1
+    assert _price(store, 'M00002X') == 102
+    # 殘行已清理，後續追加不會與之粘連
+    _patch(store, 'M00002X', Prix_Vente=3)
+    journal.close()
+
+    store, journal = _open_store(products_file)
+    assert _price(store, 'M00002X') == 3
+
+
+def test_external_replacement_discards_journal(products_file):
+    store, journal = _open_store(products_file)
+    _patch(store, 'M00001X', Prix_Vente=1)
+    journal.close()
+
+    replaced = [dict(p, Prix_Vente=500) for p in PRODUCTS]
+    with open(products_file, 'w', encoding='utf-8') as f:
+        json.dump(replaced + [{'produit': 'M00004X', 'Marque': 'Celine'}], f)
+
+    store, journal = _open_store(products_file)
+    assert _price(store, 'M00001X') == 500
+    assert journal.pending == 0
+    _patch(store, 'M00002X', Prix_Vente=2)
+    journal.close()
+
+    store, journal = _open_store(products_file)
+    assert _price(store, 'M00001X') == 500
+    assert _price(store, 'M00002X') == 2
+
+
+def test_workers_share_journal(products_file):
+    # 兩個實例模擬兩個 worker：各自持有世代，共享同一日誌文件
+    store_a, journal_a = _open_store(products_file)
+    store_b, journal_b = _open_store(products_file)
+
+    _patch(store_a, 'M00001X', Prix_Vente=1)
+    # B 寫入前先追上 A 的修改，序號不重複
+    _patch(store_b, 'M00002X', Prix_Vente=2)
+    assert journal_b.last_seq == 2
+    assert _price(store_b, 'M00001X') == 1
+
+    assert journal_a.changed_on_disk()
+    store_a.sync_journal()
+    assert _price(store_a, 'M00002X') == 2
+    assert not journal_a.changed_on_disk()
+
+    # A 壓縮後 B 的下一次修改基於新快照重新載入
+    _patch(store_a, 'M00003X', Prix_Vente=3)
+    assert store_a.compact() is not None
+    _patch(store_b, 'M00001X', Prix_Vente=11)
+    assert _price(store_b, 'M00003X') == 3
+    assert journal_b.last_seq == 4
+    journal_a.close()
+    journal_b.close()
+
+    store, journal = _open_store(products_file)
+    assert [_price(store, ref) for ref in ('M00001X', 'M00002X', 'M00003X')] == [11, 2, 3]
+
+
+def _worker_patches(path, produit, count):
+    store, journal = _open_store(path)
+    for i in range(count):
+        _patch(store, produit, Prix_Vente=i, Stock=i)
+    journal.close()
+
+
+def test_concurrent_processes_do_not_lose_edits(products_file):
+    multiprocessing = pytest.importorskip('multiprocessing')
+    ctx = multiprocessing.get_context('fork')
+    count = 30
+    procs = [
+        ctx.Process(target=_worker_patches, args=(products_file, p['produit'], count))
+        for p in PRODUCTS
+    ]
+    for proc in procs:
+        proc.start()
+    for proc in procs:
+        proc.join(30)
+        assert proc.exitcode == 0
+
+    with open(f'{products_file}.journal', encoding='utf-8') as f:
+        seqs = [json.loads(line)['seq'] for line in f]
+    assert seqs == list(range(1, count * len(PRODUCTS) + 1))
+
+    store, journal = _open_store(products_file)
+    for p in PRODUCTS:
+        assert _price(store, p['produit']) == count - 1
+
+
+def test_compactor_is_claimed_once(products_file):
+    journal_a = CatalogJournal(products_file)
+    journal_b = CatalogJournal(products_file)
+    assert journal_a.claim_compactor()
+    assert journal_a.claim_compactor()
+    assert not journal_b.claim_compactor()
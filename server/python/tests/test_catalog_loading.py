@@ -0,0 +1,44 @@
+# -*- coding: utf-8 -*-
+"""商品目錄首次載入：失敗時保持未就緒並重試"""
+
+import asyncio
+import json
+
+from fastapi.testclient import TestClient
+
+from conftest import APP_PRODUCTS
+
+
+def test_invalid_file_keeps_catalog_unavailable(app_module, app_catalog):
+    app_catalog.write_text('[{"produit": "M0000', encoding='utf-8')
+    app_module.load_catalog()
+
+    assert not app_module.is_catalog_ready()
+    assert app_module.catalog_store.current is None
+    client = TestClient(app_module.app)
+    ready = client.get('/api/ready')
+    assert ready.status_code == 503
+    assert ready.json()['status'] == 'failed'
+    assert ready.headers['Retry-After']
+    products = client.get('/api/products')
+    assert products.status_code == 503
+    assert products.headers['Retry-After']
+
+
+def test_load_is_retried_until_file_is_valid(app_module, app_catalog, monkeypatch):
+    app_catalog.write_text('not json', encoding='utf-8')
+    load_catalog = app_module.load_catalog
+    attempts = []
+
+    def load_and_repair():
+        load_catalog()
+        attempts.append(app_module._catalog_state['status'])
+        app_catalog.write_text(json.dumps(APP_PRODUCTS), encoding='utf-8')
+
+    monkeypatch.setattr(app_module, 'load_catalog', load_and_repair)
+    asyncio.run(app_module._load_catalog_until_ready(1))
+
+    assert attempts == ['failed', 'ready']
+    assert app_module.is_catalog_ready()
+    assert len(app_module.catalog_store.current) == len(APP_PRODUCTS)
+    assert TestClient(app_module.app).get('/api/ready').status_code == 200
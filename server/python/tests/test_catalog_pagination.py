@@ -0,0 +1,84 @@
+# -*- coding: utf-8 -*-
+"""游標分頁：跨世代切換繼續翻頁"""
+
+import pytest
+
+from services.catalog import CatalogStore, apply_ops, build_generation, decode_cursor, encode_cursor
+
+
+def _product(ref, brand='Dior', price=100):
+    return {'produit': ref, 'Marque': brand, 'Famille': 'Sac', 'Prix_Vente': price}
+
+
+def _pages(gen, limit, brand=None, after=None):
+    """從 after 開始翻到最後一頁，返回 produit 列表"""
+    refs = []
+    while True:
+        items, after, _ = gen.page_after(after, limit, brand)
+        refs.extend(item['produit'] for item in items)
+        if after is None:
+            return refs
+
+
+@pytest.fixture
+def store():
+    store = CatalogStore()
+    raw = [_product(f'M{i:03d}') for i in range(0, 40, 2)] + [_product('C001', brand='Chanel')]
+    store.publish(build_generation(raw, store.next_generation_id()))
+    return store
+
+
+def test_pages_cover_generation_in_order(store):
+    gen = store.current
+    refs = _pages(gen, 7)
+    assert refs == sorted(p['produit'] for p in gen.products)
+    assert _pages(gen, 3, brand='chanel') == ['C001']
+
+
+def test_cursor_continues_across_generation_swap(store):
+    old = store.current
+    first, next_key, _ = old.page_after(None, 5, 'dior')
+    cursor = encode_cursor(old.generation, next_key, 'dior')
+    seen = [item['produit'] for item in first]
+
+    # 翻頁期間目錄切換：游標前後各插入一條、刪除一條尚未返回的商品、修改一條
+    ops = [
+        {'op': 'upsert', 'item': _product('M001')},
+        {'op': 'upsert', 'item': _product('M031')},
+        {'op': 'upsert', 'item': _product('M020', price=1)},
+    ]
+    products, upserted, deleted = apply_ops(old.products, ops)
+    products = [p for p in products if p['produit'] != 'M024']
+    new = build_generation(products, store.next_generation_id())
+    store.publish(new)
+
+    decoded = decode_cursor(cursor)
+    assert decoded['generation'] == old.generation != store.current.generation
+    rest = _pages(store.current, 5, 'dior', after=decoded['key'])
+
+    # 已返回的商品不重複，游標之後的新增可見，已刪除的不返回，修改後的取新值
+    assert not set(seen) & set(rest)
+    assert 'M001' not in rest
+    assert 'M031' in rest
+    assert 'M024' not in rest
+    assert rest == sorted(rest)
+    assert store.current.get_by_produit('M020')['Prix_Vente'] == 1
+    assert seen + rest == sorted(set(p['produit'] for p in new.products if p['Marque'] == 'Dior') - {'M001'})
+
+
+def test_cursor_on_deleted_key_resumes_after_it(store):
+    old = store.current
+    _, next_key, _ = old.page_after(None, 3)
+    # 游標所指的商品被刪除：從排序位置繼續，不跳過也不重複
+    products = [p for p in old.products if p['produit'].lower() != next_key[0]]
+    new = build_generation(products, store.next_generation_id())
+    store.publish(new)
+    rest = _pages(new, 4, after=next_key)
+    assert rest == [p for p in sorted(q['produit'] for q in products) if p.lower() > next_key[0]]
+
+
+def test_invalid_cursor_is_rejected():
+    with pytest.raises(ValueError):
+        decode_cursor('not-a-cursor')
+    with pytest.raises(ValueError):
+        decode_cursor(encode_cursor(1, ('m000', 0))[:-4])
@@ -0,0 +1,81 @@
+# -*- coding: utf-8 -*-
+"""預編碼響應：Accept-Encoding 協商、各編碼的 ETag 與 304"""
+
+import gzip
+import json
+
+import pytest
+
+from services import catalog_payloads
+from services.catalog_payloads import EncodedPayload, etag_matches
+
+requires_brotli = pytest.mark.skipif(catalog_payloads.brotli is None, reason='brotli 未安裝')
+
+DATA = [{'produit': f'M{i:05d}X', 'Marque': 'Dior'} for i in range(200)]
+
+
+def test_each_encoding_has_its_own_etag():
+    payload = EncodedPayload(DATA)
+    tags = {payload.etag_for(None), payload.etag_for('gzip'), payload.etag_for('br')}
+    assert len(tags) == 3
+    assert payload.etag_for('br') == payload.etag[:-1] + '-br"'
+    for tag in tags:
+        assert etag_matches(tag, payload.etag)
+        assert etag_matches(f'W/{tag}', payload.etag)
+    assert etag_matches(f'"other", {payload.etag_for("gzip")}', payload.etag)
+    assert etag_matches('*', payload.etag)
+    assert not etag_matches('"other-br"', payload.etag)
+    assert not etag_matches(None, payload.etag)
+
+
+@pytest.mark.parametrize('accept, expected', [
+    pytest.param('gzip, deflate, br', 'br', marks=requires_brotli),
+    ('br;q=0, gzip', 'gzip'),
+    pytest.param('*', 'br', marks=requires_brotli),
+    ('identity', None),
+    (None, None),
+])
+def test_select_negotiates_encoding(accept, expected):
+    payload = EncodedPayload(DATA)
+    body, encoding = payload.select(accept)
+    assert encoding == expected
+    if encoding == 'gzip':
+        body = gzip.decompress(body)
+    elif encoding == 'br':
+        body = catalog_payloads.brotli.decompress(body)
+    assert json.loads(body) == DATA
+
+
+@pytest.mark.parametrize('accept, encoding', [
+    pytest.param('br', 'br', marks=requires_brotli),
+    ('gzip', 'gzip'),
+    ('identity', None),
+])
+def test_catalog_endpoint_negotiation(client, accept, encoding):
+    response = client.get('/api/products', headers={'Accept-Encoding': accept})
+    assert response.status_code == 200
+    assert response.headers.get('Content-Encoding') == encoding
+    assert 'Accept-Encoding' in response.headers['Vary']
+    # 中間件不會對已壓縮的響應再壓縮一次：客戶端解碼一次即得到 JSON
+    assert [p['produit'] for p in response.json()] == ['M00001X', 'M00002X', 'M00003X']
+    etag = response.headers['ETag']
+    assert etag.endswith(f'-{encoding}"') if encoding else '-' not in etag
+
+
+@requires_brotli
+def test_catalog_endpoint_not_modified_for_any_variant(client):
+    br = client.get('/api/products', headers={'Accept-Encoding': 'br'})
+    etag = br.headers['ETag']
+
+    same = client.get('/api/products', headers={'Accept-Encoding': 'br', 'If-None-Match': etag})
+    assert same.status_code == 304
+    assert same.content == b''
+    assert same.headers['ETag'] == etag
+
+    # 換用 gzip 時 br 變體仍命中，304 帶 gzip 版本的 ETag
+    switched = client.get('/api/products', headers={'Accept-Encoding': 'gzip', 'If-None-Match': etag})
+    assert switched.status_code == 304
+    assert switched.headers['ETag'] == etag.replace('-br"', '-gzip"')
+
+    stale = client.get('/api/products', headers={'Accept-Encoding': 'gzip', 'If-None-Match': '"stale-gzip"'})
+    assert stale.status_code == 200
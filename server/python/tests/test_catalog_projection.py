@@ -0,0 +1,84 @@
+# -*- coding: utf-8 -*-
+"""字段投影：常用字段組合按世代預計算並複用，fields= 參數只返回指定字段"""
+
+import pytest
+
+from services import catalog
+from services.catalog import build_generation
+
+from conftest import APP_PRODUCTS
+
+FIELDS = ('Prix_Vente', 'produit')
+
+
+def test_projection_is_built_after_repeated_requests():
+    gen = build_generation(APP_PRODUCTS, 1)
+    for _ in range(catalog.PROJECTION_MIN_REQUESTS - 1):
+        assert gen.projection(FIELDS) is None
+
+    built = gen.projection(FIELDS)
+
+    assert built is not None
+    assert gen.projection(FIELDS) is built
+    first = gen.project(gen.products, FIELDS)
+    assert first == [{'produit': p['produit'], 'Prix_Vente': p['Prix_Vente']} for p in APP_PRODUCTS]
+    # 命中投影時返回同一批字典，不再逐條重建
+    assert all(a is b for a, b in zip(first, gen.project(gen.products, FIELDS)))
+
+
+def test_occasional_fields_are_projected_per_request():
+    gen = build_generation(APP_PRODUCTS, 1)
+    items = gen.get_by_brand('dior')
+
+    assert gen.project(items, ('Marque',)) == [{'Marque': 'Dior'}, {'Marque': 'Dior'}]
+    assert gen.project(items, None) == list(items)
+
+
+def test_projection_cache_is_bounded(monkeypatch):
+    monkeypatch.setattr(catalog, 'PROJECTION_CACHE_SIZE', 2)
+    gen = build_generation(APP_PRODUCTS, 1)
+    oldest = gen.projection(('produit',), force=True)
+    gen.projection(('Marque',), force=True)
+    gen.projection(('Famille',), force=True)
+
+    assert gen.projection(('produit',), force=True) is not oldest
+
+
+def test_new_generation_does_not_share_projections():
+    old = build_generation(APP_PRODUCTS, 1)
+    new = build_generation(APP_PRODUCTS, 2)
+    assert old.projection(FIELDS, force=True) is not new.projection(FIELDS, force=True)
+
+
+def test_fields_parameter_limits_response(client):
+    full = client.get('/api/products', params={'fields': 'produit,Prix_Vente'}).json()
+    assert full == [{'produit': p['produit'], 'Prix_Vente': p['Prix_Vente']} for p in APP_PRODUCTS]
+
+    page = client.get('/api/products', params={'fields': 'produit', 'brand': 'dior', 'page': 1, 'limit': 1}).json()
+    assert page['items'] == [{'produit': 'M00001X'}]
+    assert page['total'] == 2
+
+
+def test_preset_fields_use_precomputed_payload(app_module, client):
+    fields = ','.join(app_module.FIELD_PRESETS['admin'])
+    response = client.get('/api/products', params={'fields': fields})
+
+    assert response.status_code == 200
+    assert response.headers['ETag']
+    assert set(response.json()[0]) == {'Marque', 'Prix_Vente', 'produit'}
+    gen = app_module.catalog_store.current
+    assert ('payload', '', app_module.FIELD_PRESETS['admin']) in gen._memo
+
+
+def test_slim_matches_list_preset(app_module, client):
+    slim = client.get('/api/products', params={'slim': 'true'}).json()
+    listed = client.get('/api/products', params={'fields': ','.join(app_module.FIELD_PRESETS['list'])}).json()
+    assert slim == listed
+    assert 'Prix_Achat' not in slim[0]
+
+
+@pytest.mark.parametrize('fields', [',', 'produit;drop', 'a' * 65, ','.join(f'f{i}' for i in range(41))])
+def test_invalid_fields_are_rejected(client, fields):
+    response = client.get('/api/products', params={'fields': fields})
+    assert response.status_code == 400
+    assert response.json()['detail'] == 'invalid_fields'
@@ -0,0 +1,78 @@
+# -*- coding: utf-8 -*-
+"""熱重載：新世代原子切換，進行中的請求保留舊世代，失敗時保留當前世代"""
+
+import asyncio
+import json
+
+from services.catalog import CatalogStore, build_generation
+
+from conftest import ADMIN_KEY, APP_PRODUCTS
+
+RELOADED = APP_PRODUCTS + [{'produit': 'M00004X', 'Marque': 'Gucci', 'Famille': 'Sac', 'Prix_Vente': 104}]
+
+
+def test_lease_keeps_old_generation_until_drained():
+    store = CatalogStore()
+    store.publish(build_generation(APP_PRODUCTS, store.next_generation_id()))
+
+    with store.lease() as old:
+        store.publish(build_generation(RELOADED, store.next_generation_id()))
+        assert store.current is not old
+        assert len(old) == len(APP_PRODUCTS)
+        assert store.retired_status() == [{'generation': old.generation, 'in_flight': 1}]
+
+    assert store.retired_status() == []
+    assert len(store.current) == len(RELOADED)
+
+
+def test_admin_reload_requires_key(client):
+    assert client.post('/api/admin/reload').status_code == 401
+    assert client.post('/api/admin/reload', headers={'x-admin-key': 'wrong'}).status_code == 401
+
+
+def test_admin_reload_swaps_generation(app_module, client, app_catalog):
+    before = app_module.catalog_store.current
+    assert client.get('/api/products/M00004X').status_code == 404
+
+    app_catalog.write_text(json.dumps(RELOADED), encoding='utf-8')
+    response = client.post('/api/admin/reload', headers={'x-admin-key': ADMIN_KEY})
+
+    assert response.status_code == 200
+    assert response.json()['total'] == len(RELOADED)
+    assert response.json()['generation'] > before.generation
+    assert client.get('/api/products/M00004X').json()['Marque'] == 'Gucci'
+    # 商品搜索與緩存視圖讀取同一個新世代
+    assert app_module.product_searcher.get_by_produit('M00004X') is not None
+    assert len(app_module.get_cached_products()) == len(RELOADED)
+
+
+def test_failed_reload_keeps_current_generation(app_module, client, app_catalog):
+    before = app_module.catalog_store.current
+    app_catalog.write_text('[{"produit": ', encoding='utf-8')
+
+    response = client.post('/api/admin/reload', headers={'x-admin-key': ADMIN_KEY})
+
+    assert response.status_code == 500
+    assert app_module.catalog_store.current is before
+    assert client.get('/api/products/M00001X').status_code == 200
+    assert client.get('/api/ready').json()['ready'] is True
+
+
+def test_watcher_reloads_changed_file(app_module, client, app_catalog):
+    store = app_module.catalog_store
+    assert not store.is_stale(str(app_catalog))
+    app_catalog.write_text(json.dumps(RELOADED), encoding='utf-8')
+    assert store.is_stale(str(app_catalog))
+
+    async def watch_once():
+        task = asyncio.ensure_future(app_module._watch_products_file(0.01))
+        for _ in range(200):
+            await asyncio.sleep(0.01)
+            if len(store.current) == len(RELOADED):
+                break
+        task.cancel()
+
+    asyncio.run(watch_once())
+
+    assert len(store.current) == len(RELOADED)
+    assert not store.is_stale(str(app_catalog))
@@ -0,0 +1,121 @@
+# -*- coding: utf-8 -*-
+"""異步 DeepSeek 客戶端：共享連接池、併發調用不阻塞事件循環、失敗時回退默認意圖"""
+
+import time
+import asyncio
+
+import httpx
+
+from services import deepseek_client as deepseek_module
+from services.deepseek_client import DeepSeekClient
+from services.ttl_cache import TTLCache
+
+from conftest import Upstream
+
+
+def _client(upstream):
+    client = DeepSeekClient(api_key='test-key', base_url='http://deepseek.test/v1', intent_cache=TTLCache(64, 60))
+    client._async_client = upstream.client()
+    return client
+
+
+def test_async_client_is_pooled_and_configured(monkeypatch):
+    created = []
+
+    class RecordingClient(httpx.AsyncClient):
+        def __init__(self, **kwargs):
+            created.append(kwargs)
+            super().__init__(**kwargs)
+
+    monkeypatch.setattr(deepseek_module.httpx, 'AsyncClient', RecordingClient)
+    client = DeepSeekClient(api_key='test-key', base_url='http://deepseek.test/v1', intent_cache=TTLCache(8, 60))
+
+    first = client._get_async_client()
+    assert client._get_async_client() is first
+    assert len(created) == 1
+    limits = created[0]['limits']
+    assert limits.max_connections == deepseek_module.DEEPSEEK_MAX_CONNECTIONS
+    assert limits.max_keepalive_connections == deepseek_module.DEEPSEEK_MAX_KEEPALIVE
+    assert created[0]['timeout'].connect == deepseek_module.DEEPSEEK_CONNECT_TIMEOUT
+
+    asyncio.run(client.aclose())
+    assert client._async_client is None
+
+
+def test_concurrent_calls_overlap():
+    upstream = Upstream()
+    upstream.delay = 0.2
+    upstream.intent = {'intent': 'query_price', 'hint': 'dior', 'message': ''}
+    client = _client(upstream)
+    ticks = []
+
+    async def ticker():
+        while True:
+            ticks.append(time.perf_counter())
+            await asyncio.sleep(0.01)
+
+    async def run():
+        tick = asyncio.ensure_future(ticker())
+        started = time.perf_counter()
+        results = await asyncio.gather(*(client.classify_intent(f'dior bag {i}') for i in range(10)))
+        elapsed = time.perf_counter() - started
+        tick.cancel()
+        return results, elapsed
+
+    results, elapsed = asyncio.run(run())
+
+    assert [r['intent'] for r in results] == ['query_price'] * 10
+    assert len(upstream.requests) == 10
+    # 十個調用同時在途：總耗時接近單次延遲，事件循環期間仍在運行其他任務
+    assert elapsed < 1.0
+    assert len(ticks) >= 10
+
+
+def test_classify_intent_uses_cache():
+    upstream = Upstream()
+    upstream.intent = {'intent': 'query_price', 'hint': 'chanel', 'message': ''}
+    client = _client(upstream)
+
+    async def run():
+        first = await client.classify_intent('Chanel  Bag')
+        second = await client.classify_intent('chanel bag')
+        return first, second
+
+    first, second = asyncio.run(run())
+    assert first == second == upstream.intent
+    assert len(upstream.requests) == 1
+
+
+def test_upstream_error_falls_back_to_default_intent():
+    upstream = Upstream()
+    upstream.status = 500
+    client = _client(upstream)
+
+    result = asyncio.run(client.classify_intent('celine bag'))
+
+    assert result == {'intent': 'query_price', 'hint': 'celine bag', 'message': ''}
+    assert asyncio.run(client.chat('celine bag')) is None
+
+
+def test_slow_llm_call_does_not_block_other_requests(app_module, client, upstream):
+    upstream.delay = 0.5
+    upstream.intent = {'intent': 'chat', 'hint': '', 'message': ''}
+
+    async def run():
+        transport = httpx.ASGITransport(app=app_module.app)
+        async with httpx.AsyncClient(transport=transport, base_url='http://test') as http:
+            agent = asyncio.ensure_future(http.post('/api/agent', json={'query': '介紹一下你們的門店吧'}))
+            while not upstream.requests:
+                await asyncio.sleep(0.01)
+            started = time.perf_counter()
+            health = await http.get('/api/health')
+            health_elapsed = time.perf_counter() - started
+            done_before = agent.done()
+            return health, health_elapsed, done_before, await agent
+
+    health, health_elapsed, done_before, agent = asyncio.run(run())
+
+    assert health.status_code == 200
+    assert health_elapsed < 0.3
+    assert not done_before
+    assert agent.status_code == 200
@@ -0,0 +1,143 @@
+# -*- coding: utf-8 -*-
+"""圖片代理的原圖下載與 SSRF 防護"""
+
+import asyncio
+import socket
+import ipaddress
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from services import image_proxy
+from services.image_proxy import ImageProxyError, ThumbnailService
+
+IMAGE = b'\x89PNG\r\n\x1a\n' + b'\0' * 64
+
+
+class _Handler(BaseHTTPRequestHandler):
+    requests = []
+    hosts = []
+
+    def do_GET(self):
+        _Handler.requests.append(self.path)
+        _Handler.hosts.append(self.headers.get('Host'))
+        if self.path.startswith('/redirect'):
+            self.send_response(302)
+            self.send_header('Location', self.path.split('to=', 1)[1])
+            self.end_headers()
+            return
+        self.send_response(200)
+        self.send_header('Content-Type', 'image/png')
+        self.send_header('Content-Length', str(len(IMAGE)))
+        self.end_headers()
+        self.wfile.write(IMAGE)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def origin():
+    _Handler.requests = []
+    _Handler.hosts = []
+    server = ThreadingHTTPServer(('127.0.0.1', 0), _Handler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f'http://127.0.0.1:{server.server_address[1]}'
+    server.shutdown()
+    server.server_close()
+
+
+def _fetch(service, url):
+    async def run():
+        try:
+            return await service._fetch_origin(url)
+        finally:
+            await service.aclose()
+    return asyncio.run(run())
+
+
+def test_private_address_is_rejected_before_request(origin, tmp_path):
+    service = ThumbnailService(str(tmp_path), 1 << 20)
+    with pytest.raises(ImageProxyError) as exc:
+        _fetch(service, f'{origin}/a.png')
+    assert exc.value.status_code == 403
+    assert _Handler.requests == []
+
+
+def test_hostname_is_checked_at_connect_time(origin, tmp_path, monkeypatch):
+    # 主機名在連接時才解析：解析到內網地址（如 DNS 重綁定後）直接拒絕，不會發出請求
+    port = int(origin.rsplit(':', 1)[1])
+    real_getaddrinfo = socket.getaddrinfo
+
+    def fake_getaddrinfo(host, *args, **kwargs):
+        if host == 'images.example.com':
+            return [
+                (socket.AF_INET, socket.SOCK_STREAM, 6, '', ('93.184.216.34', port)),
+                (socket.AF_INET, socket.SOCK_STREAM, 6, '', ('127.0.0.1', port)),
+            ]
+        return real_getaddrinfo(host, *args, **kwargs)
+
+    monkeypatch.setattr(socket, 'getaddrinfo', fake_getaddrinfo)
+    service = ThumbnailService(str(tmp_path), 1 << 20)
+    with pytest.raises(ImageProxyError) as exc:
+        _fetch(service, f'http://images.example.com:{port}/a.png')
+    assert exc.value.status_code == 403
+    assert _Handler.requests == []
+
+
+def test_every_redirect_hop_is_checked(origin, tmp_path):
+    service = ThumbnailService(str(tmp_path), 1 << 20, allow_private=True, allowed_hosts=['127.0.0.1'])
+    port = origin.rsplit(':', 1)[1]
+    with pytest.raises(ImageProxyError) as exc:
+        _fetch(service, f'{origin}/redirect?to=http://localhost:{port}/a.png')
+    assert exc.value.status_code == 403
+    assert len(_Handler.requests) == 1
+
+
+def test_fetch_follows_allowed_redirect(origin, tmp_path):
+    service = ThumbnailService(str(tmp_path), 1 << 20, allow_private=True)
+    data = _fetch(service, f'{origin}/redirect?to={origin}/a.png')
+    assert data == IMAGE
+    assert len(_Handler.requests) == 2
+
+
+def test_connects_to_checked_address_with_original_host(origin, tmp_path, monkeypatch):
+    port = int(origin.rsplit(':', 1)[1])
+    resolved = []
+    real_getaddrinfo = socket.getaddrinfo
+
+    def fake_getaddrinfo(host, *args, **kwargs):
+        if host == 'images.example.com':
+            resolved.append(host)
+            return [(socket.AF_INET, socket.SOCK_STREAM, 6, '', ('127.0.0.1', port))]
+        return real_getaddrinfo(host, *args, **kwargs)
+
+    class _PublicLoopback:
+        """把回環地址視為公網地址，驗證連接使用的是校驗過的解析結果"""
+
+        @staticmethod
+        def ip_address(address):
+            ip = ipaddress.ip_address(address)
+            return type('Address', (), {'is_global': ip.is_loopback or ip.is_global})()
+
+    monkeypatch.setattr(socket, 'getaddrinfo', fake_getaddrinfo)
+    monkeypatch.setattr(image_proxy, 'ipaddress', _PublicLoopback)
+    service = ThumbnailService(str(tmp_path), 1 << 20)
+    assert _fetch(service, f'http://images.example.com:{port}/a.png') == IMAGE
+    assert resolved == ['images.example.com']
+    assert _Handler.hosts == [f'images.example.com:{port}']
+
+
+def test_cache_directory_is_created_on_first_use(tmp_path):
+    cache_dir = tmp_path / 'image_cache'
+    service = ThumbnailService(str(cache_dir), 1 << 20)
+    assert not cache_dir.exists()
+    assert service.cache.stats()['entries'] == 0
+    assert not cache_dir.exists()
+
+    assert service.cache.get('ab' + '0' * 62) is None
+    assert cache_dir.is_dir()
+    service.cache.put('ab' + '1' * 62, b'data')
+    assert service.cache.get('ab' + '1' * 62) == b'data'
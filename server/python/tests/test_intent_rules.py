@@ -0,0 +1,31 @@
+# -*- coding: utf-8 -*-
+"""規則意圖預分類"""
+
+from services.intent_rules import IntentRules
+from services.ttl_cache import TTLCache
+
+
+def test_rule_hits_on_cached_queries_are_not_counted_as_avoided():
+    cache = TTLCache(10, 100)
+    cache.set('hello', {'intent': 'chat'})
+    rules = IntentRules(is_cached=lambda query: query.lower() in cache)
+
+    assert rules.classify('hello')['intent'] == 'chat'
+    assert rules.classify('bonjour')['intent'] == 'chat'
+    assert rules.classify('M0446CBAA')['intent'] == 'query_price'
+    assert rules.classify('dior 馬鞍包') is None
+
+    stats = rules.stats()
+    assert stats['by_rule'] == {'reference': 1, 'greeting': 2, 'online': 0}
+    assert stats['cached_hits'] == 1
+    assert stats['llm_calls_avoided'] == rules.llm_calls_avoided == 2
+    assert stats['undecided'] == 1
+    # 判斷緩存不影響緩存自身的命中統計
+    assert cache.stats()['hits'] == 0
+
+
+def test_without_cache_every_rule_hit_counts():
+    rules = IntentRules()
+    rules.classify('你好')
+    rules.classify('在線查詢 dior 馬鞍包')
+    assert rules.llm_calls_avoided == 2
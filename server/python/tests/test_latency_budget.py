@@ -0,0 +1,114 @@
+# -*- coding: utf-8 -*-
+"""延遲統計與對沖請求"""
+
+import asyncio
+
+import pytest
+
+from services.latency_budget import Hedger, LatencyTracker
+
+
+def _hedger(delay=0.05, max_ratio=1.0):
+    tracker = LatencyTracker(min_samples=1)
+    tracker.record('intent', delay)
+    return Hedger(tracker, ['intent'], percentile=95, max_ratio=max_ratio)
+
+
+def test_hedge_wins_over_slow_primary():
+    hedger = _hedger()
+    started = []
+
+    async def attempt(timeout):
+        started.append(timeout)
+        # 首次調用卡在長尾，對沖調用很快返回
+        await asyncio.sleep(5 if len(started) == 1 else 0.01)
+        return len(started)
+
+    async def run():
+        return await asyncio.wait_for(hedger.run('intent', attempt, 2.0), 1.0)
+
+    assert asyncio.run(run()) == 2
+    assert len(started) == 2
+    assert started[1] < started[0]
+    assert (hedger.calls, hedger.hedged, hedger.hedge_won) == (1, 1, 1)
+
+
+def test_fast_primary_is_not_hedged():
+    hedger = _hedger(delay=0.5)
+
+    async def attempt(timeout):
+        return 'ok'
+
+    assert asyncio.run(hedger.run('intent', attempt, 2.0)) == 'ok'
+    assert hedger.hedged == 0
+
+
+def test_hedge_budget_is_limited():
+    hedger = _hedger(max_ratio=0.0)
+    calls = []
+
+    async def attempt(timeout):
+        calls.append(timeout)
+        await asyncio.sleep(0.1)
+        return 'slow'
+
+    assert asyncio.run(hedger.run('intent', attempt, 2.0)) == 'slow'
+    assert len(calls) == 1
+    assert hedger.skipped == 1
+
+
+def test_primary_error_is_raised_when_both_fail():
+    hedger = _hedger()
+    calls = []
+
+    async def attempt(timeout):
+        calls.append(timeout)
+        if len(calls) == 1:
+            await asyncio.sleep(0.1)
+            raise ValueError('primary')
+        raise KeyError('hedge')
+
+    with pytest.raises(ValueError):
+        asyncio.run(hedger.run('intent', attempt, 2.0))
+
+
+def test_cancelled_attempt_is_treated_as_failure():
+    hedger = _hedger()
+    tasks = []
+
+    async def attempt(timeout):
+        tasks.append(asyncio.current_task())
+        if len(tasks) == 1:
+            await asyncio.sleep(0.1)
+            return 'primary'
+        # 對沖調用被外部取消（如連接池關閉）不應讓 run() 因 exception() 報錯
+        tasks[1].cancel()
+        await asyncio.sleep(1)
+
+    assert asyncio.run(hedger.run('intent', attempt, 2.0)) == 'primary'
+
+
+def test_unhedged_stage_runs_once():
+    hedger = _hedger()
+
+    async def attempt(timeout):
+        return timeout
+
+    assert asyncio.run(hedger.run('chat', attempt, 3.0)) == 3.0
+    assert hedger.calls == 0
+
+
+def test_cancelled_primary_reports_hedge_error():
+    hedger = _hedger()
+    tasks = []
+
+    async def attempt(timeout):
+        tasks.append(asyncio.current_task())
+        if len(tasks) == 1:
+            await asyncio.sleep(1)
+        tasks[0].cancel()
+        await asyncio.sleep(0)
+        raise KeyError('hedge')
+
+    with pytest.raises(KeyError):
+        asyncio.run(hedger.run('intent', attempt, 2.0))
@@ -0,0 +1,172 @@
+# -*- coding: utf-8 -*-
+"""LLM 調用隔離：排隊上限、排隊超時與熔斷狀態轉換"""
+
+import asyncio
+
+import pytest
+
+from services.llm_bulkhead import BulkheadRejected, LLMBulkhead
+
+
+async def _ok():
+    return 'ok'
+
+
+async def _fail():
+    raise RuntimeError('upstream')
+
+
+async def _hold(bulkhead, release):
+    async with bulkhead.slot():
+        await release.wait()
+
+
+def test_queue_full_is_rejected_immediately():
+    bulkhead = LLMBulkhead(max_concurrency=1, max_queue=1, queue_timeout=1)
+
+    async def run():
+        release = asyncio.Event()
+        holder = asyncio.ensure_future(_hold(bulkhead, release))
+        queued = asyncio.ensure_future(bulkhead.run(_ok, 1))
+        await asyncio.sleep(0.01)
+        assert (bulkhead.in_flight, bulkhead.waiting) == (1, 1)
+        assert not bulkhead.has_capacity()
+        with pytest.raises(BulkheadRejected) as exc:
+            await bulkhead.run(_ok, 1)
+        release.set()
+        await holder
+        return exc.value.reason, await queued
+
+    assert asyncio.run(run()) == ('queue_full', 'ok')
+    assert bulkhead.rejected['queue_full'] == 1
+    assert bulkhead.state == 'closed'
+
+
+def test_queue_timeout():
+    bulkhead = LLMBulkhead(max_concurrency=1, max_queue=4, queue_timeout=0.02)
+
+    async def run():
+        release = asyncio.Event()
+        holder = asyncio.ensure_future(_hold(bulkhead, release))
+        await asyncio.sleep(0)
+        try:
+            with pytest.raises(BulkheadRejected) as exc:
+                await bulkhead.run(_ok, 1)
+            return exc.value.reason
+        finally:
+            release.set()
+            await holder
+
+    assert asyncio.run(run()) == 'queue_timeout'
+    assert bulkhead.waiting == 0
+    # 排隊被拒絕不計入失敗，不會觸發熔斷
+    assert bulkhead.state == 'closed'
+
+
+def test_deadline_counts_as_failure():
+    bulkhead = LLMBulkhead(max_concurrency=2, max_queue=2, queue_timeout=1, failure_threshold=1)
+
+    async def slow():
+        await asyncio.sleep(1)
+
+    async def run():
+        with pytest.raises(asyncio.TimeoutError):
+            await bulkhead.run(slow, 0.01)
+
+    asyncio.run(run())
+    assert bulkhead.deadline_exceeded == 1
+    assert bulkhead.state == 'open'
+    assert bulkhead.in_flight == 0
+
+
+def test_breaker_opens_then_half_open_trial_closes_it():
+    bulkhead = LLMBulkhead(max_concurrency=4, max_queue=4, queue_timeout=1, failure_threshold=3, reset_timeout=0.05)
+
+    async def run():
+        for _ in range(3):
+            with pytest.raises(RuntimeError):
+                await bulkhead.run(_fail, 1)
+        assert bulkhead.state == 'open'
+        with pytest.raises(BulkheadRejected) as exc:
+            await bulkhead.run(_ok, 1)
+        assert exc.value.reason == 'circuit_open'
+
+        await asyncio.sleep(0.06)
+        # 半開：只放行一次試探調用，試探期間其他調用仍被拒絕
+        release = asyncio.Event()
+        trial = asyncio.ensure_future(_hold(bulkhead, release))
+        await asyncio.sleep(0)
+        assert bulkhead.state == 'half_open'
+        with pytest.raises(BulkheadRejected):
+            await bulkhead.run(_ok, 1)
+        release.set()
+        await trial
+        assert bulkhead.state == 'closed'
+        return await bulkhead.run(_ok, 1)
+
+    assert asyncio.run(run()) == 'ok'
+    assert bulkhead.breaker_opens == 1
+    assert bulkhead.rejected['circuit_open'] == 2
+
+
+def test_failed_trial_reopens_breaker():
+    bulkhead = LLMBulkhead(max_concurrency=4, max_queue=4, queue_timeout=1, failure_threshold=1, reset_timeout=0.05)
+
+    async def run():
+        with pytest.raises(RuntimeError):
+            await bulkhead.run(_fail, 1)
+        await asyncio.sleep(0.06)
+        with pytest.raises(RuntimeError):
+            await bulkhead.run(_fail, 1)
+        assert bulkhead.state == 'open'
+        with pytest.raises(BulkheadRejected):
+            await bulkhead.run(_ok, 1)
+
+    asyncio.run(run())
+    assert bulkhead.errors == 2
+
+
+def test_cancelled_trial_is_neutral():
+    bulkhead = LLMBulkhead(max_concurrency=4, max_queue=4, queue_timeout=1, failure_threshold=1, reset_timeout=0.05)
+
+    async def run():
+        with pytest.raises(RuntimeError):
+            await bulkhead.run(_fail, 1)
+        await asyncio.sleep(0.06)
+        trial = asyncio.ensure_future(_hold(bulkhead, asyncio.Event()))
+        await asyncio.sleep(0)
+        trial.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await trial
+        # 試探調用被取消：仍為半開，下一次調用成為新的試探
+        assert bulkhead.state == 'half_open'
+        return await bulkhead.run(_ok, 1)
+
+    assert asyncio.run(run()) == 'ok'
+    assert bulkhead.state == 'closed'
+
+
+def test_cancelled_waiter_does_not_leak_slot():
+    bulkhead = LLMBulkhead(max_concurrency=1, max_queue=4, queue_timeout=1)
+
+    async def run():
+        # 取消恰好發生在名額分配時，名額必須歸還，取消也不能被吞掉
+        waiter = asyncio.ensure_future(bulkhead.run(_ok, 1))
+        await asyncio.sleep(0)
+        waiter.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await asyncio.wait_for(waiter, 1)
+
+        release = asyncio.Event()
+        holder = asyncio.ensure_future(_hold(bulkhead, release))
+        queued = asyncio.ensure_future(bulkhead.run(_ok, 1))
+        await asyncio.sleep(0.01)
+        queued.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await queued
+        release.set()
+        await holder
+        return await asyncio.wait_for(bulkhead.run(_ok, 1), 0.5)
+
+    assert asyncio.run(run()) == 'ok'
+    assert (bulkhead.in_flight, bulkhead.waiting, bulkhead.calls) == (0, 0, 2)
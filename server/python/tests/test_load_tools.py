@@ -0,0 +1,178 @@
+# -*- coding: utf-8 -*-
+"""壓測工具：模擬 DeepSeek 服務的響應格式與延遲，壓測腳本的查詢組合、統計和離線運行"""
+
+import json
+import random
+import asyncio
+import argparse
+
+import httpx
+import pytest
+from fastapi.testclient import TestClient
+from openai import AsyncOpenAI
+
+from services.deepseek_client import DeepSeekClient
+from services.llm_bulkhead import LLMBulkhead
+from services.ttl_cache import TTLCache
+from tools import load_test, openai_stub
+
+from conftest import APP_PRODUCTS
+
+
+@pytest.fixture
+def stub(monkeypatch):
+    settings = argparse.Namespace(**vars(openai_stub.settings))
+    settings.latency = 0.0
+    settings.chunk_delay = 0.0
+    settings.chunks = 4
+    monkeypatch.setattr(openai_stub, 'settings', settings)
+    client = TestClient(openai_stub.app)
+    client.post('/stats/reset')
+    return client
+
+
+def _content(response):
+    return response.json()['choices'][0]['message']['content']
+
+
+def _intent_request(query, systems=1):
+    messages = [{'role': 'system', 'content': 'system'}] * systems + [{'role': 'user', 'content': query}]
+    return {'model': 'deepseek-chat', 'messages': messages, 'response_format': {'type': 'json_object'}}
+
+
+@pytest.mark.parametrize('query, intent, hint', [
+    ('Dior 包 多少錢', 'query_price', 'Dior 包'),
+    ('在線查詢 Gucci 鞋', 'query_price_online', '查詢 Gucci 鞋'),
+    ('你好', 'chat', ''),
+])
+def test_stub_classifies_intent(stub, query, intent, hint):
+    result = json.loads(_content(stub.post('/v1/chat/completions', json=_intent_request(query))))
+    assert (result['intent'], result['hint']) == (intent, hint)
+    assert stub.get('/stats').json()['intent'] == 1
+
+
+def test_stub_single_call_answer_and_chat(stub):
+    answer = json.loads(_content(stub.post('/v1/chat/completions', json=_intent_request('Dior 包 價格', systems=2))))
+    assert answer['message'] == openai_stub.REPLY_TEXT
+
+    chat = stub.post('/chat/completions', json={'messages': [{'role': 'user', 'content': 'hi'}]})
+    assert _content(chat) == openai_stub.REPLY_TEXT
+    counters = stub.get('/stats').json()
+    assert (counters['answer'], counters['chat']) == (1, 1)
+
+
+def test_stub_streams_reply_in_chunks(stub):
+    response = stub.post('/v1/chat/completions', json={'messages': [], 'stream': True})
+
+    events = [line[6:] for line in response.text.split('\n\n') if line.startswith('data: ')]
+    assert events[-1] == '[DONE]'
+    chunks = [json.loads(e)['choices'][0] for e in events[:-1]]
+    text = ''.join(c['delta'].get('content') or '' for c in chunks)
+    assert text == openai_stub.REPLY_TEXT
+    assert chunks[-1]['finish_reason'] == 'stop'
+    assert len(chunks) == openai_stub.settings.chunks + 2
+
+
+def test_stub_injects_errors(stub):
+    openai_stub.settings.error_rate = 1.0
+    response = stub.post('/v1/chat/completions', json=_intent_request('Dior'))
+    assert response.status_code == 503
+    assert stub.get('/stats').json()['errors'] == 1
+
+
+def test_stub_latency_distributions(stub):
+    settings = openai_stub.settings
+    settings.latency = 0.5
+    assert openai_stub._latency() == 0.5
+    settings.latency_dist, settings.latency_spread = 'uniform', 0.1
+    assert all(0.4 <= openai_stub._latency() <= 0.6 for _ in range(50))
+    settings.latency_dist = 'normal'
+    assert all(openai_stub._latency() >= 0 for _ in range(50))
+    settings.latency_dist, settings.tail_ratio, settings.tail_latency = 'fixed', 1.0, 5.0
+    assert openai_stub._latency(0.2) == pytest.approx(5.2)
+
+
+def test_deepseek_client_talks_to_stub(stub):
+    client = DeepSeekClient(api_key='stub', base_url='http://stub/v1', intent_cache=TTLCache(8, 60))
+    client._async_client = AsyncOpenAI(
+        api_key='stub',
+        base_url='http://stub/v1',
+        http_client=httpx.AsyncClient(transport=httpx.ASGITransport(app=openai_stub.app)),
+        max_retries=0,
+    )
+
+    async def run():
+        intent = await client.classify_intent('Chanel 包 多少錢')
+        chunks = [chunk async for chunk in client.chat_stream('Chanel 包 多少錢', intent='query_price')]
+        return intent, ''.join(chunks)
+
+    intent, reply = asyncio.run(run())
+    assert intent == {'intent': 'query_price', 'hint': 'Chanel 包', 'message': ''}
+    assert reply == openai_stub.REPLY_TEXT
+
+
+def test_percentile_and_mix_parsing():
+    values = [float(v) for v in range(1, 101)]
+    assert load_test._percentile(values, 50) == 51.0
+    assert load_test._percentile(values, 99) == 99.0
+    assert load_test._percentile([3.0], 95) == 3.0
+    assert load_test._parse_mix('price=2,chat') == {'price': 2.0, 'chat': 1.0}
+    with pytest.raises(argparse.ArgumentTypeError):
+        load_test._parse_mix('price=1,unknown=2')
+
+
+def test_query_mix_uses_catalog_and_weights():
+    mix = load_test.QueryMix(APP_PRODUCTS, {'reference': 1, 'chat': 0}, random.Random(1))
+    refs = {p['produit'] for p in APP_PRODUCTS}
+    picks = [mix.pick() for _ in range(20)]
+    assert {kind for kind, _ in picks} == {'reference'}
+    assert {query for _, query in picks} <= refs
+
+    empty = load_test.QueryMix([], {'reference': 1, 'price': 1}, random.Random(1))
+    assert empty.kinds == ['price']
+    kind, query = empty.pick()
+    assert kind == 'price' and any(brand in query for brand in load_test.FALLBACK_BRANDS)
+
+
+def test_results_summary():
+    results = load_test.Results()
+    for latency in (0.1, 0.2, 0.3):
+        results.record('price', latency)
+    results.record('price', 1.0, 'timeout')
+    results.record('chat', 0.05)
+    results.dropped = 2
+
+    summary = results.summary(2.0)
+
+    assert (summary['sent'], summary['completed'], summary['failed'], summary['dropped']) == (5, 4, 1, 2)
+    assert summary['throughput_rps'] == 2.0
+    assert summary['error_rate'] == 0.2
+    assert summary['errors'] == {'timeout': 1}
+    assert summary['by_kind']['price'] == {
+        'count': 3, 'errors': 1, 'p50_ms': 200.0, 'p90_ms': 300.0, 'p95_ms': 300.0, 'p99_ms': 300.0, 'max_ms': 300.0,
+    }
+    assert list(summary['by_kind']) == ['price', 'chat']
+
+
+def test_run_load_against_app_offline(app_module, client, upstream, monkeypatch):
+    """把壓測客戶端接到進程內的應用（模擬 DeepSeek 由 upstream 提供），跑一小段完整流程"""
+    class InProcessClient(httpx.AsyncClient):
+        def __init__(self, **kwargs):
+            super().__init__(transport=httpx.ASGITransport(app=app_module.app), **kwargs)
+
+    # load_test.httpx 即全局 httpx 模塊，用子類替換以保留 openai 的 isinstance 檢查
+    monkeypatch.setattr(load_test.httpx, 'AsyncClient', InProcessClient)
+    # asyncio.run 另開事件循環，信號量會綁定到該循環；用獨立的隔艙，不影響其他測試
+    monkeypatch.setattr(app_module.deepseek_client, 'bulkhead', LLMBulkhead(4, 16, 5))
+    args = argparse.Namespace(
+        rate=40, duration=0.25, poisson=False, stream_ratio=0.5, max_in_flight=50, timeout=10,
+    )
+    mix = load_test.QueryMix(APP_PRODUCTS, {'reference': 1, 'follow_up': 1}, random.Random(3))
+
+    summary = asyncio.run(load_test.run_load('http://app', mix, args))
+
+    assert summary['failed'] == 0
+    assert summary['completed'] >= 10
+    assert set(summary['by_kind']) <= {'reference', 'price', 'follow_up'}
+    assert summary['overall']['count'] == summary['completed']
+    assert app_module.deepseek_client.bulkhead.stats()['breaker_opens'] == 0
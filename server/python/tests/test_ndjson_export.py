@@ -0,0 +1,61 @@
+# -*- coding: utf-8 -*-
+"""NDJSON 導出：響應頭世代與導出內容一致，結束或斷開時釋放租約"""
+
+import asyncio
+import gc
+import json
+
+from conftest import APP_PRODUCTS
+
+
+def _read(response, limit=None):
+    async def run():
+        chunks = []
+        async for chunk in response.body_iterator:
+            chunks.append(chunk)
+            if len(chunks) == limit:
+                break
+        await response.body_iterator.aclose()
+        return chunks
+    return asyncio.run(run())
+
+
+def _lines(chunks):
+    return [json.loads(line) for line in b''.join(chunks).decode('utf-8').splitlines()]
+
+
+def test_export_streams_generation_named_in_header(app_module, app_catalog):
+    app_module.load_catalog()
+    response = app_module._ndjson_response(None, ('produit', 'Prix_Vente'))
+    exported = app_module.catalog_store.current
+    assert response.headers['X-Catalog-Generation'] == str(exported.generation)
+
+    # 響應創建後、開始輸出前熱重載：導出仍使用響應頭中的世代
+    app_catalog.write_text(json.dumps([dict(p, Prix_Vente=1) for p in APP_PRODUCTS]), encoding='utf-8')
+    app_module.reload_catalog('test')
+    assert app_module.catalog_store.current.generation != exported.generation
+
+    rows = _lines(_read(response))
+    assert [row['Prix_Vente'] for row in rows] == [p['Prix_Vente'] for p in APP_PRODUCTS]
+    assert exported._leases == 0
+
+
+def test_disconnect_releases_lease(app_module, app_catalog):
+    app_module.load_catalog()
+    gen = app_module.catalog_store.current
+    response = app_module._ndjson_response('dior', None)
+    assert gen._leases == 1
+    _read(response, limit=1)
+    # 客戶端斷開後響應被丟棄，生成器關閉時釋放租約
+    del response
+    gc.collect()
+    assert gen._leases == 0
+
+
+def test_ndjson_endpoint(client, app_module):
+    response = client.get('/api/products', params={'format': 'ndjson', 'brand': 'chanel'})
+    assert response.status_code == 200
+    assert response.headers['content-type'].startswith('application/x-ndjson')
+    assert response.headers['X-Catalog-Generation'] == str(app_module.catalog_store.current.generation)
+    assert [row['produit'] for row in _lines([response.content])] == ['M00003X']
+    assert app_module.catalog_store.current._leases == 0
@@ -0,0 +1,156 @@
+# -*- coding: utf-8 -*-
+"""提示詞預算：靜態系統提示詞緩存、緊湊上下文、按預算裁剪歷史與候選，並按請求統計 token 數"""
+
+import json
+
+import pytest
+
+from services.prompt_builder import PromptBuilder, estimate_tokens, truncate_to_tokens
+
+SYSTEM = '你是奢侈品價格助手。'
+
+
+def _history(turns, size=40):
+    messages = []
+    for i in range(turns):
+        messages.append({'role': 'user', 'content': f'第{i}輪問題' + '問' * size})
+        messages.append({'role': 'assistant', 'content': f'第{i}輪回答' + '答' * size})
+    return messages
+
+
+def _candidate(i):
+    return {
+        'score': 100 - i, 'produit': f'M{i:05d}X', 'Marque': 'Dior', 'designation': 'Lady Dior ' * 5,
+        'Prix_Vente': 100 + i, 'image_url': 'https://example.com/image.jpg',
+    }
+
+
+def _context(messages):
+    _, _, payload = messages[1]['content'].partition('\n')
+    return json.loads(payload)
+
+
+def test_estimate_and_truncate():
+    assert estimate_tokens('') == 0
+    assert estimate_tokens('你好' * 10) > estimate_tokens('ab' * 10)
+    text = '價格' * 200
+    cut = truncate_to_tokens(text, 20)
+    assert cut.endswith('…')
+    assert estimate_tokens(cut) <= 21
+    assert truncate_to_tokens('short', 20) == 'short'
+
+
+def test_static_system_messages_are_reused():
+    builder = PromptBuilder([SYSTEM])
+    first, _ = builder.build('Dior 包多少錢')
+    second, _ = builder.build('Chanel 包多少錢')
+    assert first[0] is second[0] is builder.system_messages[0]
+
+
+def test_context_is_compact_and_drops_unused_fields():
+    builder = PromptBuilder([SYSTEM])
+    messages, _ = builder.build('Dior 包', intent='query_price', candidates=[_candidate(0)])
+
+    content = messages[1]['content']
+    assert '\n  ' not in content and '": ' not in content
+    candidate = _context(messages)['candidates'][0]
+    assert 'image_url' not in candidate
+    assert candidate['produit'] == 'M00000X'
+
+
+def test_history_is_trimmed_from_oldest_within_budget():
+    builder = PromptBuilder([SYSTEM], budget_tokens=400, history_message_tokens=500)
+    history = _history(20) + [{'role': 'user', 'content': '那個多少錢'}]
+
+    messages, tokens = builder.build('那個多少錢', history=history)
+
+    assert tokens <= 400
+    assert messages[-1] == {'role': 'user', 'content': '那個多少錢'}
+    kept = messages[2:-1]
+    assert kept and kept == history[len(history) - 1 - len(kept):-1]
+    assert builder.stats()['trimmed_history_messages'] == 40 - len(kept)
+
+
+def test_long_history_message_is_truncated():
+    builder = PromptBuilder([SYSTEM], budget_tokens=3000, history_message_tokens=50)
+    history = [{'role': 'assistant', 'content': '很長的回答' * 200}]
+
+    messages, _ = builder.build('好的', history=history)
+
+    assert messages[2]['content'].endswith('…')
+    assert estimate_tokens(messages[2]['content']) <= 51
+
+
+def test_candidates_are_trimmed_but_first_is_kept():
+    candidates = [_candidate(i) for i in range(30)]
+
+    tight = PromptBuilder([SYSTEM], budget_tokens=10)
+    messages, _ = tight.build('Dior', candidates=candidates)
+    assert [c['produit'] for c in _context(messages)['candidates']] == ['M00000X']
+
+    roomy = PromptBuilder([SYSTEM], budget_tokens=300)
+    messages, _ = roomy.build('Dior', candidates=candidates)
+    kept = _context(messages)['candidates']
+    assert 1 < len(kept) < 30
+    assert [c['produit'] for c in kept] == [c['produit'] for c in candidates[:len(kept)]]
+    assert roomy.stats()['trimmed_candidates'] == 30 - len(kept)
+
+
+def test_online_results_take_at_most_half_the_remaining_budget():
+    builder = PromptBuilder([SYSTEM], budget_tokens=600)
+    messages, _ = builder.build('Dior 官網價格', online_results='官網價格 3500 歐元。' * 500)
+
+    online = _context(messages)['onlineResults']
+    assert online.endswith('…')
+    assert estimate_tokens(online) <= 300
+    assert builder.stats()['truncated_online_results'] == 1
+
+
+def test_usage_records_estimate_and_reported_tokens():
+    builder = PromptBuilder([SYSTEM])
+    usage = {}
+    _, tokens = builder.build('Dior', usage=usage)
+    builder.record_usage(123, usage)
+    builder.build('Chanel')
+
+    stats = builder.stats()
+    assert usage == {'estimated': tokens, 'reported': 123}
+    assert stats['recent'][0] == usage
+    assert stats['recent'][1]['reported'] is None
+    assert stats['requests'] == 2
+    assert stats['reported_avg'] == 123.0
+
+
+@pytest.fixture
+def prompt_builder(app_module, monkeypatch):
+    builder = PromptBuilder([SYSTEM])
+    monkeypatch.setattr(app_module.deepseek_client, 'prompt_builder', builder)
+    return builder
+
+
+def test_agent_response_reports_prompt_tokens(app_module, client, upstream, prompt_builder):
+    upstream.intent = {'intent': 'chat', 'hint': '', 'message': ''}
+
+    body = client.post('/api/agent', json={'query': '可以介紹一下保養方法嗎'}).json()
+
+    assert body['message'] == upstream.reply
+    estimated = prompt_builder.recent[-1]['estimated']
+    assert body['prompt_tokens'] == {'estimated': estimated, 'reported': 10}
+    metrics = client.get('/api/metrics').json()['prompt_tokens']
+    assert metrics['recent'] == [{'estimated': estimated, 'reported': 10}]
+
+
+def test_template_reply_has_no_prompt_tokens(client, upstream, prompt_builder):
+    body = client.post('/api/agent', json={'query': 'M00001X'}).json()
+    assert body['prompt_tokens'] is None
+    assert prompt_builder.stats()['requests'] == 0
+
+
+def test_stream_done_event_reports_prompt_tokens(client, upstream, prompt_builder):
+    upstream.intent = {'intent': 'chat', 'hint': '', 'message': ''}
+
+    response = client.post('/api/agent/stream', json={'query': '可以介紹一下退換貨嗎'})
+
+    done = [block for block in response.text.split('\n\n') if block.startswith('event: done')][0]
+    data = json.loads(done.split('data: ', 1)[1])
+    assert data['prompt_tokens'] == {'estimated': prompt_builder.recent[-1]['estimated'], 'reported': 10}
@@ -0,0 +1,87 @@
+# -*- coding: utf-8 -*-
+"""模板回覆：高置信度命中時本地生成多語言回覆，不調用 DeepSeek"""
+
+import pytest
+
+from services.reply_templates import EXACT_REFERENCE_SCORE, confident_match, detect_language, render_product_reply
+
+ITEM = {
+    'produit': 'M00001X', 'Marque': 'Dior', 'designation': 'Lady Dior', 'Prix_Vente': 101,
+    'Lien_Externe': 'https://example.com/m00001x',
+}
+
+
+@pytest.mark.parametrize('query, history, expected', [
+    ('M00001X 多少錢', None, 'zh'),
+    ('how much is M00001X', None, 'en'),
+    ('prix du sac M00001X', None, 'fr'),
+    ('Référence M00001X', None, 'fr'),
+    ('M00001X', [{'role': 'user', 'content': 'how much is the bag'}], 'en'),
+    ('M00001X', [{'role': 'assistant', 'content': 'Voici le prix'}], 'zh'),
+    ('M00001X', None, 'zh'),
+])
+def test_detect_language(query, history, expected):
+    assert detect_language(query, history) == expected
+
+
+def test_confident_match_requires_unique_priced_hit():
+    exact = {'score': EXACT_REFERENCE_SCORE, 'item': ITEM}
+    assert confident_match([exact, {'score': 40, 'item': {}}]) is ITEM
+    assert confident_match([{'score': EXACT_REFERENCE_SCORE - 1, 'item': ITEM}]) is None
+    assert confident_match([exact, {'score': EXACT_REFERENCE_SCORE, 'item': ITEM}]) is None
+    assert confident_match([{'score': 200, 'item': {'produit': 'M00009X'}}]) is None
+    assert confident_match([{'score': 50, 'item': ITEM}], min_score=50) is ITEM
+    assert confident_match([]) is None
+
+
+def test_render_product_reply_per_language():
+    zh = render_product_reply(ITEM, 'zh')
+    assert '**Lady Dior**（Dior）' in zh and '**101€**' in zh and '**M00001X**' in zh
+    assert '🔗 https://example.com/m00001x' in zh
+    assert 'Price: **101€**' in render_product_reply(ITEM, 'en')
+    assert 'Prix : **101 €**' in render_product_reply(ITEM, 'fr')
+    # 未知語言回退中文；缺少名稱和鏈接時用參考號、省略鏈接
+    bare = render_product_reply({'produit': 'M00002X', 'Prix_Vente': 5}, 'de')
+    assert bare.startswith('為您查詢到 **M00002X**\n')
+    assert '🔗' not in bare
+
+
+@pytest.fixture
+def reply_stats(app_module, monkeypatch):
+    stats = {'template': 0, 'fixed': 0, 'llm': 0, 'fallback': 0}
+    monkeypatch.setattr(app_module, '_reply_stats', stats)
+    return stats
+
+
+def test_reference_query_is_answered_from_template(app_module, client, upstream, reply_stats):
+    response = client.post('/api/agent', json={'query': 'M00002X'})
+
+    assert response.status_code == 200
+    body = response.json()
+    assert body['message'].startswith('為您查詢到 **M00002X**（Dior）')
+    assert body['reference'] == 'M00002X'
+    assert upstream.requests == []
+    assert reply_stats['template'] == 1
+    assert client.get('/api/metrics').json()['replies']['answered_without_llm'] == 1.0
+
+
+def test_classified_exact_match_skips_chat_call(app_module, client, upstream, reply_stats):
+    upstream.intent = {'intent': 'query_price', 'hint': 'M00001X', 'message': ''}
+
+    response = client.post('/api/agent', json={'query': 'how much is the M00001X'})
+
+    assert response.json()['message'].startswith('Here is **M00001X** (Dior)')
+    # 只有意圖分類一次調用，回覆由模板生成
+    assert [r.get('response_format') for r in upstream.requests] == [{'type': 'json_object'}]
+    assert reply_stats['template'] == 1
+
+
+def test_threshold_above_match_score_uses_llm(app_module, client, upstream, reply_stats, monkeypatch):
+    monkeypatch.setattr(app_module, 'AGENT_TEMPLATE_MIN_SCORE', 10_000)
+
+    response = client.post('/api/agent', json={'query': 'M00003X'})
+
+    assert response.json()['message'] == upstream.reply
+    assert [r for r in upstream.requests if not r.get('response_format')]
+    assert reply_stats == {'template': 0, 'fixed': 0, 'llm': 1, 'fallback': 0}
+    assert client.get('/api/metrics').json()['replies']['answered_without_llm'] == 0.0
@@ -0,0 +1,103 @@
+# -*- coding: utf-8 -*-
+"""對話會話：LRU / 超時 / 內存上限，以及 /api/agent 的會話恢復"""
+
+import pytest
+
+from services import session_store
+from services.session_store import SessionStore
+
+HISTORY = [{'role': 'user', 'content': 'dior 包'}, {'role': 'assistant', 'content': '請問哪一款？'}]
+
+
+def test_get_expires_idle_sessions(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(session_store.time, 'time', lambda: now[0])
+    store = SessionStore(max_sessions=10, ttl=60, max_bytes=1 << 20)
+    session = store.create(HISTORY)
+    assert store.get(session.session_id) is session
+    now[0] += 59
+    assert store.get(session.session_id) is session
+    # 每次訪問都會續期：從最後一次訪問起計算空閒時間
+    now[0] += 60
+    assert store.get(session.session_id) is None
+    assert len(store) == 0
+    stats = store.stats()
+    assert (stats['hits'], stats['misses'], stats['expired']) == (2, 1, 1)
+
+
+def test_evicts_least_recently_used():
+    store = SessionStore(max_sessions=2, ttl=60, max_bytes=1 << 20)
+    first, second = store.create(), store.create()
+    store.get(first.session_id)
+    third = store.create()
+    assert store.get(second.session_id) is None
+    assert store.get(first.session_id) is first
+    assert store.get(third.session_id) is third
+    assert store.stats()['evictions'] == 1
+
+
+def test_memory_limit_counts_history_growth():
+    store = SessionStore(max_sessions=10, ttl=60, max_bytes=4 * session_store.SESSION_OVERHEAD_BYTES)
+    old, new = store.create(), store.create()
+    store.record_turn(new, 'x' * 110, 'y' * 110)
+    assert store.get(old.session_id) is None
+    assert store.get(new.session_id) is new
+    assert store.stats()['bytes'] <= store.max_bytes
+
+
+def test_record_turn_trims_history_and_keeps_candidates():
+    store = SessionStore(max_sessions=10, ttl=60, max_bytes=1 << 20, max_history=4)
+    session = store.create(HISTORY * 3)
+    assert session.history == HISTORY * 2
+    store.record_turn(session, 'M00001X', '101€', [('M00001X', 100)])
+    store.record_turn(session, '那个多少钱', '101€')
+    assert [m['content'] for m in session.history] == ['M00001X', '101€', '那个多少钱', '101€']
+    # 未做本地匹配的一輪保留上一輪的候選
+    assert session.candidates == [('M00001X', 100)]
+
+
+def test_agent_session_round_trip(client, app_module):
+    first = client.post('/api/agent', json={'query': 'M00001X', 'session_id': ''})
+    assert first.status_code == 200
+    session_id = first.json()['session_id']
+    session = app_module.agent_sessions.get(session_id)
+    assert [m['role'] for m in session.history] == ['user', 'assistant']
+    assert session.candidates[0][0] == 'M00001X'
+
+    # 追問只發送新消息，複用上一輪的候選
+    reused = app_module._session_stats['follow_ups_reused']
+    follow_up = client.post('/api/agent', json={'query': '那个多少钱', 'session_id': session_id})
+    assert follow_up.status_code == 200
+    assert follow_up.json()['session_id'] == session_id
+    assert follow_up.json()['reference'] == 'M00001X'
+    assert app_module._session_stats['follow_ups_reused'] == reused + 1
+    assert len(session.history) == 4
+
+
+def test_unknown_session_without_history_is_409(client):
+    response = client.post('/api/agent', json={'query': 'M00001X', 'session_id': 'gone'})
+    assert response.status_code == 409
+    assert response.json()['detail'] == 'session_not_found'
+
+
+def test_unknown_session_is_rebuilt_from_client_history(client, app_module):
+    messages = [
+        {'role': 'user', 'content': ' dior 包 '},
+        {'role': 'system', 'content': 'ignored'},
+        {'role': 'assistant', 'content': '請問哪一款？'},
+        {'role': 'user', 'content': 'M00001X'},
+    ]
+    response = client.post('/api/agent', json={'messages': messages, 'session_id': 'gone'})
+    assert response.status_code == 200
+    session_id = response.json()['session_id']
+    assert session_id != 'gone'
+    history = app_module.agent_sessions.get(session_id).history
+    assert history[:2] == HISTORY
+    assert history[2:] == [{'role': 'user', 'content': 'M00001X'}, {'role': 'assistant', 'content': response.json()['message']}]
+
+
+def test_chat_messages_use_history_as_given(app_module):
+    messages = app_module.deepseek_client._chat_messages('M00001X', HISTORY, 'query_price')
+    contents = [m['content'] for m in messages]
+    assert contents.index(HISTORY[0]['content']) < contents.index(HISTORY[1]['content'])
+    assert messages[-1] == {'role': 'user', 'content': 'M00001X'}
@@ -0,0 +1,152 @@
+# -*- coding: utf-8 -*-
+"""請求合併：結果與異常共享、等待者取消"""
+
+import asyncio
+
+import pytest
+
+from services.single_flight import SharedStream, SingleFlight
+
+
+def test_concurrent_calls_execute_once():
+    flight = SingleFlight()
+    calls = []
+
+    async def fetch():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        return 'result'
+
+    async def run():
+        results = await asyncio.gather(*(flight.do('k', fetch) for _ in range(5)))
+        assert len(flight) == 0
+        # 完成後鍵已釋放，再次調用重新執行
+        await flight.do('k', fetch)
+        return results
+
+    assert asyncio.run(run()) == ['result'] * 5
+    assert len(calls) == 2
+    assert flight.stats() == {'executed': 2, 'shared': 4, 'in_flight': 0}
+
+
+def test_error_is_shared_with_all_waiters():
+    flight = SingleFlight()
+
+    async def fail():
+        await asyncio.sleep(0.01)
+        raise ValueError('upstream')
+
+    async def run():
+        return await asyncio.gather(*(flight.do('k', fail) for _ in range(3)), return_exceptions=True)
+
+    errors = asyncio.run(run())
+    assert all(isinstance(e, ValueError) for e in errors)
+    assert flight.executed == 1
+
+
+def test_cancelled_waiter_does_not_cancel_execution():
+    flight = SingleFlight()
+    finished = []
+
+    async def fetch():
+        await asyncio.sleep(0.05)
+        finished.append(1)
+        return 'result'
+
+    async def run():
+        first = asyncio.ensure_future(flight.do('k', fetch))
+        second = asyncio.ensure_future(flight.do('k', fetch))
+        await asyncio.sleep(0.01)
+        first.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await first
+        return await second
+
+    assert asyncio.run(run()) == 'result'
+    assert finished == [1]
+
+
+def test_all_waiters_cancelled_still_releases_key():
+    flight = SingleFlight()
+
+    async def fail():
+        await asyncio.sleep(0.02)
+        raise ValueError('nobody listening')
+
+    async def run():
+        waiter = asyncio.ensure_future(flight.do('k', fail))
+        await asyncio.sleep(0.005)
+        waiter.cancel()
+        await asyncio.sleep(0.05)
+        return len(flight)
+
+    assert asyncio.run(run()) == 0
+
+
+async def _source(items, error=None, delay=0.01):
+    for item in items:
+        await asyncio.sleep(delay)
+        yield item
+    if error is not None:
+        raise error
+
+
+async def _read(stream):
+    return [item async for item in stream.subscribe()]
+
+
+def test_late_reader_replays_stream():
+    async def run():
+        stream = SharedStream(_source(['a', 'b', 'c']))
+        first = asyncio.ensure_future(_read(stream))
+        await asyncio.sleep(0.025)
+        second = asyncio.ensure_future(_read(stream))
+        return await first, await second, stream.readers
+
+    first, second, readers = asyncio.run(run())
+    assert first == second == ['a', 'b', 'c']
+    assert readers == 2
+
+
+def test_stream_error_reaches_every_reader_after_items():
+    async def read_until_error(stream):
+        items = []
+        with pytest.raises(RuntimeError):
+            async for item in stream.subscribe():
+                items.append(item)
+        return items
+
+    async def run():
+        stream = SharedStream(_source(['a', 'b'], error=RuntimeError('upstream')))
+        return await asyncio.gather(read_until_error(stream), read_until_error(stream))
+
+    assert asyncio.run(run()) == [['a', 'b'], ['a', 'b']]
+
+
+def test_reader_disconnect_does_not_stop_source():
+    async def run():
+        done = asyncio.Event()
+        stream = SharedStream(_source(['a', 'b', 'c']))
+        stream.add_done_callback(done.set)
+
+        reader = stream.subscribe()
+        assert await reader.__anext__() == 'a'
+        await reader.aclose()
+
+        await asyncio.wait_for(done.wait(), 1)
+        return stream.items, await _read(stream)
+
+    items, replay = asyncio.run(run())
+    assert items == replay == ['a', 'b', 'c']
+
+
+def test_cancelled_reader_does_not_affect_others():
+    async def run():
+        stream = SharedStream(_source(['a', 'b', 'c'], delay=0.02))
+        cancelled = asyncio.ensure_future(_read(stream))
+        other = asyncio.ensure_future(_read(stream))
+        await asyncio.sleep(0.03)
+        cancelled.cancel()
+        return await other, cancelled.cancelled()
+
+    assert asyncio.run(run()) == (['a', 'b', 'c'], True)
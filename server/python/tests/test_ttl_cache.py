@@ -0,0 +1,65 @@
+# -*- coding: utf-8 -*-
+"""TTL 緩存的持久化"""
+
+import json
+import time
+
+from services.ttl_cache import TTLCache
+
+
+def test_save_merges_entries_from_other_processes(tmp_path):
+    path = str(tmp_path / 'intent_cache.json')
+    worker_a = TTLCache(10, 100, path)
+    worker_b = TTLCache(10, 100, path)
+    worker_a.set('dior', 'a')
+    worker_a.set('chanel', 'a')
+    worker_b.set('chanel', 'b')
+    worker_b.set('celine', 'b')
+
+    worker_a.save()
+    assert worker_b.save() == 3
+
+    cache = TTLCache(10, 100, path)
+    assert cache.load() == 3
+    assert [cache.get(k) for k in ('dior', 'chanel', 'celine')] == ['a', 'b', 'b']
+
+
+def test_save_keeps_newest_entries_within_capacity(tmp_path):
+    path = str(tmp_path / 'intent_cache.json')
+    old = TTLCache(3, 100, path)
+    for key in ('k1', 'k2', 'k3'):
+        old.set(key, 1)
+    old.save()
+
+    new = TTLCache(3, 100, path)
+    new.set('k4', 2)
+    assert new.save() == 3
+
+    cache = TTLCache(3, 100, path)
+    cache.load()
+    assert cache.get('k1') is None
+    assert cache.get('k4') == 2
+
+
+def test_load_skips_malformed_entries(tmp_path):
+    path = tmp_path / 'intent_cache.json'
+    path.write_text(json.dumps([
+        ['dior', time.time() + 100, {'intent': 'query_price'}],
+        'not-a-row',
+        ['too', 'short'],
+        ['chanel', 'never', 'x'],
+        None,
+        ['celine', time.time() + 100, 'ok', 'extra'],
+        ['hermes', time.time() + 100, 'ok'],
+    ]), encoding='utf-8')
+
+    cache = TTLCache(10, 100, str(path))
+    assert cache.load() == 2
+    assert cache.get('dior') == {'intent': 'query_price'}
+    assert cache.get('hermes') == 'ok'
+
+
+def test_load_ignores_wrong_top_level_shape(tmp_path):
+    path = tmp_path / 'intent_cache.json'
+    path.write_text(json.dumps({'dior': 1}), encoding='utf-8')
+    assert TTLCache(10, 100, str(path)).load() == 0
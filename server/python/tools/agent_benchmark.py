@@ -0,0 +1,154 @@
+# -*- coding: utf-8 -*-
+"""
+比較智能助手兩次調用（意圖分類 + 對話）與單次調用模式（AGENT_SINGLE_CALL）的端到端延遲
+
+用法：
+    python tools/agent_benchmark.py --products data/products.json [--requests 20] [--concurrency 1]
+                                    [--latency 0.8] [--chunks 20] [--chunk-delay 0.05]
+
+啟動 tools/openai_stub.py 模擬 DeepSeek，再分別以兩種模式啟動服務並發送相同的查詢；
+意圖緩存關閉（INTENT_CACHE_SIZE=0），避免重複查詢命中緩存。輸出每種模式的延遲分位數
+和每個請求的平均模型調用次數（來自模擬服務的 /stats）
+"""
+
+import os
+import sys
+import time
+import socket
+import asyncio
+import argparse
+import subprocess
+from pathlib import Path
+from typing import Dict, List
+
+import httpx
+
+ROOT = Path(__file__).parent.parent
+
+# 不會命中規則預分類的查價語句（規則命中時兩種模式都不調用意圖分類）
+QUERIES = [
+    'dior 黑色 包 多少錢',
+    'gucci 裙子 價格',
+    'chanel 2.55 手袋',
+    'hermes birkin 30',
+    'lv neverfull 價格多少',
+    'prada 尼龍 背包',
+    'celine 太陽眼鏡',
+    'fendi baguette 價格',
+]
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def _wait_until(url: str, timeout: float) -> None:
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            if httpx.get(url, timeout=1).status_code == 200:
+                return
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.2)
+    raise RuntimeError(f'服務未就緒: {url}')
+
+
+def _percentile(values: List[float], pct: float) -> float:
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+async def _run_requests(base_url: str, total: int, concurrency: int) -> List[float]:
+    latencies: List[float] = []
+    queue = asyncio.Queue()
+    for i in range(total):
+        queue.put_nowait(QUERIES[i % len(QUERIES)])
+
+    async def worker(client: httpx.AsyncClient) -> None:
+        while not queue.empty():
+            query = queue.get_nowait()
+            start = time.perf_counter()
+            resp = await client.post(f'{base_url}/api/agent', json={'query': query})
+            resp.raise_for_status()
+            latencies.append(time.perf_counter() - start)
+
+    async with httpx.AsyncClient(timeout=120) as client:
+        await asyncio.gather(*(worker(client) for _ in range(concurrency)))
+    return latencies
+
+
+def _bench_mode(name: str, single_call: bool, stub_url: str, args) -> Dict[str, float]:
+    port = _free_port()
+    env = dict(
+        os.environ,
+        DEEPSEEK_BASE_URL=stub_url,
+        DEEPSEEK_API_KEY='stub',
+        INTENT_CACHE_SIZE='0',
+        INTENT_CACHE_PATH='',
+        AGENT_SINGLE_CALL='1' if single_call else '0',
+        PRODUCTS_WATCH_INTERVAL='0',
+    )
+    if args.products:
+        env['PRODUCTS_JSON_PATH'] = str(Path(args.products).resolve())
+    server = subprocess.Popen(
+        [sys.executable, '-m', 'uvicorn', 'app:app', '--port', str(port), '--log-level', 'warning'],
+        cwd=ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    base_url = f'http://127.0.0.1:{port}'
+    try:
+        _wait_until(f'{base_url}/api/ready', 120)
+        asyncio.run(_run_requests(base_url, len(QUERIES), 1))  # 預熱
+        httpx.post(f'{stub_url}/stats/reset')
+        latencies = asyncio.run(_run_requests(base_url, args.requests, args.concurrency))
+        calls = httpx.get(f'{stub_url}/stats').json()
+    finally:
+        server.terminate()
+        server.wait()
+
+    return {
+        'mode': name,
+        'mean': sum(latencies) / len(latencies),
+        'p50': _percentile(latencies, 50),
+        'p95': _percentile(latencies, 95),
+        'calls': sum(v for k, v in calls.items() if k != 'errors') / len(latencies),
+    }
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description='智能助手單次調用模式延遲對比')
+    parser.add_argument('--products', help='商品數據文件（默認使用 PRODUCTS_JSON_PATH 或 data/products.json）')
+    parser.add_argument('--requests', type=int, default=20)
+    parser.add_argument('--concurrency', type=int, default=1)
+    parser.add_argument('--latency', type=float, default=0.8, help='模擬模型首個 token 延遲（秒）')
+    parser.add_argument('--chunks', type=int, default=20, help='模擬回覆分段數')
+    parser.add_argument('--chunk-delay', type=float, default=0.05, help='模擬回覆分段間隔（秒）')
+    args = parser.parse_args()
+
+    stub_port = _free_port()
+    stub_url = f'http://127.0.0.1:{stub_port}'
+    stub = subprocess.Popen([
+        sys.executable, str(ROOT / 'tools' / 'openai_stub.py'), '--port', str(stub_port),
+        '--latency', str(args.latency), '--chunks', str(args.chunks), '--chunk-delay', str(args.chunk_delay),
+    ])
+    try:
+        _wait_until(f'{stub_url}/stats', 30)
+        results = [
+            _bench_mode('two-call', False, stub_url, args),
+            _bench_mode('single-call', True, stub_url, args),
+        ]
+    finally:
+        stub.terminate()
+        stub.wait()
+
+    print(f"{'模式':<12} {'平均':>8} {'P50':>8} {'P95':>8} {'調用/請求':>10}")
+    for r in results:
+        print(f"{r['mode']:<12} {r['mean']:7.2f}s {r['p50']:7.2f}s {r['p95']:7.2f}s {r['calls']:10.2f}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
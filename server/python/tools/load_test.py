@@ -0,0 +1,416 @@
+# -*- coding: utf-8 -*-
+"""
+智能助手壓測：按目標速率向 /api/agent 和 /api/agent/stream 發送按比例混合的查詢，
+報告吞吐、延遲分位數和錯誤率
+
+用法：
+    # 自動啟動模擬 DeepSeek（tools/openai_stub.py）和服務，完全離線
+    python tools/load_test.py --spawn --products data/products.json --rate 20 --duration 60
+                              [--workers 1] [--stub-args "--latency 0.8 --latency-dist lognormal --latency-spread 0.4"]
+
+    # 壓測已在運行的服務
+    python tools/load_test.py --url http://127.0.0.1:5000 --products data/products.json --rate 20
+
+- 開環壓測：請求按固定間隔（--poisson 為泊松到達）發出，不等待之前的請求完成；
+  延遲從計劃發送時刻算起，服務變慢時排隊時間也計入（避免協調遺漏）
+- 同時在途的請求超過 --max-in-flight 時不再發送，計為 dropped
+- 查詢類型及比例由 --mix 指定：price 品牌 + 品類查價，reference 參考號（模板回覆），
+  online 在線查詢，chat 閒聊問候，follow_up 兩輪會話（查價後追問"那個多少錢"，首輪計入 price）
+- --stream-ratio 比例的請求走流式端點，另外統計首段回覆（首個 delta 事件）的延遲
+- 多 worker 時會話保存在各自 worker 中，追問落到其他 worker 會返回 409（記為錯誤）
+- 服務端統計（回覆來源、調用隔離、對沖）來自 /api/metrics，多 worker 時只是其中一個 worker 的數據
+"""
+
+import os
+import sys
+import json
+import time
+import shlex
+import random
+import socket
+import asyncio
+import argparse
+import subprocess
+from collections import Counter
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+import httpx
+
+ROOT = Path(__file__).parent.parent
+
+# 確保可以導入本地模塊
+sys.path.insert(0, str(ROOT))
+
+from services.product_search import load_products_from_file
+
+DEFAULT_MIX = 'price=45,reference=20,online=10,chat=10,follow_up=15'
+CATEGORIES = ['包', '手袋', '錢包', '圍巾', '太陽眼鏡', '鞋', '裙子', '腰帶']
+PRICE_TEMPLATES = [
+    '{brand} {category} 多少錢',
+    '{brand} {category} 價格',
+    '{brand} {name} 價格',
+    'how much is the {brand} {name}',
+    'prix {brand} {name}',
+]
+ONLINE_TEMPLATES = ['在線查詢 {brand} {category}', '幫我上網查一下 {brand} {category} 的價格']
+CHAT_QUERIES = ['你好', '謝謝', '你是誰', 'hello', '今天天氣怎麼樣', 'bonjour']
+FOLLOW_UP_QUERIES = ['那個多少錢', '這個多少錢', '那款的價格是多少']
+FALLBACK_BRANDS = ['Dior', 'Gucci', 'Chanel', 'Hermes', 'Louis Vuitton', 'Prada', 'Celine', 'Fendi']
+STAGES = ('price', 'reference', 'online', 'chat', 'follow_up')
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def _wait_until(url: str, timeout: float) -> None:
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            if httpx.get(url, timeout=1).status_code == 200:
+                return
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.2)
+    raise RuntimeError(f'服務未就緒: {url}')
+
+
+def _percentile(values: List[float], pct: float) -> float:
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def _parse_mix(text: str) -> Dict[str, float]:
+    mix = {}
+    for part in text.split(','):
+        name, _, weight = part.partition('=')
+        name = name.strip()
+        if name not in STAGES:
+            raise argparse.ArgumentTypeError(f'未知的查詢類型: {name}（可選 {", ".join(STAGES)}）')
+        mix[name] = float(weight or 1)
+    return mix
+
+
+class QueryMix:
+    """按比例生成查詢（品牌、商品名和參考號取自商品數據）"""
+
+    def __init__(self, products: List[Dict[str, Any]], mix: Dict[str, float], rng: random.Random):
+        self.rng = rng
+        self.items = [p for p in products if p.get('produit')]
+        self.brands = sorted({p['Marque'] for p in products if p.get('Marque')}) or FALLBACK_BRANDS
+        if not self.items:
+            mix = {k: v for k, v in mix.items() if k != 'reference'}
+        self.kinds = list(mix)
+        self.weights = [mix[k] for k in self.kinds]
+
+    def _product(self) -> Dict[str, Any]:
+        return self.rng.choice(self.items) if self.items else {'Marque': self.rng.choice(self.brands)}
+
+    def price_query(self) -> str:
+        item = self._product()
+        template = self.rng.choice(PRICE_TEMPLATES if item.get('designation') else PRICE_TEMPLATES[:2])
+        return template.format(
+            brand=item.get('Marque') or self.rng.choice(self.brands),
+            category=self.rng.choice(CATEGORIES),
+            name=item.get('designation') or '',
+        )
+
+    def pick(self) -> Tuple[str, str]:
+        kind = self.rng.choices(self.kinds, self.weights)[0]
+        if kind == 'reference':
+            return kind, self._product()['produit']
+        if kind == 'online':
+            template = self.rng.choice(ONLINE_TEMPLATES)
+            return kind, template.format(brand=self.rng.choice(self.brands), category=self.rng.choice(CATEGORIES))
+        if kind == 'chat':
+            return kind, self.rng.choice(CHAT_QUERIES)
+        return kind, self.price_query()
+
+
+class Results:
+    """各查詢類型的延遲和錯誤"""
+
+    def __init__(self):
+        self.latencies: Dict[str, List[float]] = {}
+        self.first_delta: List[float] = []
+        self.errors: Dict[str, Counter] = {}
+        self.dropped = 0
+
+    def record(self, kind: str, latency: float, error: Optional[str] = None) -> None:
+        if error:
+            self.errors.setdefault(kind, Counter())[error] += 1
+        else:
+            self.latencies.setdefault(kind, []).append(latency)
+
+    def summary(self, elapsed: float) -> Dict[str, Any]:
+        rows = {}
+        all_latencies: List[float] = []
+        all_errors: Counter = Counter()
+        for kind in STAGES:
+            latencies = self.latencies.get(kind, [])
+            errors = self.errors.get(kind, Counter())
+            if not latencies and not errors:
+                continue
+            rows[kind] = _latency_row(latencies, sum(errors.values()))
+            all_latencies.extend(latencies)
+            all_errors.update(errors)
+        completed = len(all_latencies)
+        failed = sum(all_errors.values())
+        return {
+            'elapsed_s': round(elapsed, 2),
+            'sent': completed + failed,
+            'completed': completed,
+            'failed': failed,
+            'dropped': self.dropped,
+            'throughput_rps': round(completed / elapsed, 2) if elapsed else 0.0,
+            'error_rate': round(failed / (completed + failed), 4) if completed + failed else 0.0,
+            'errors': dict(all_errors),
+            'overall': _latency_row(all_latencies, failed),
+            'by_kind': rows,
+            'stream_first_delta': _latency_row(self.first_delta, 0),
+        }
+
+
+def _latency_row(latencies: List[float], errors: int) -> Dict[str, Any]:
+    row: Dict[str, Any] = {'count': len(latencies), 'errors': errors}
+    if latencies:
+        for pct in (50, 90, 95, 99):
+            row[f'p{pct}_ms'] = round(_percentile(latencies, pct) * 1000, 1)
+        row['max_ms'] = round(max(latencies) * 1000, 1)
+    return row
+
+
+async def _read_stream(response: httpx.Response, started: float, results: Results) -> Dict[str, Any]:
+    """讀取 SSE 響應，返回 done 事件的數據；收到 error 事件時拋出 RuntimeError"""
+    event = None
+    seen_delta = False
+    async for line in response.aiter_lines():
+        if line.startswith('event: '):
+            event = line[7:]
+        elif line.startswith('data: '):
+            if event == 'delta' and not seen_delta:
+                seen_delta = True
+                results.first_delta.append(time.perf_counter() - started)
+            elif event == 'done':
+                return json.loads(line[6:])
+            elif event == 'error':
+                raise RuntimeError('stream_error')
+    raise RuntimeError('stream_incomplete')
+
+
+async def _ask(
+    client: httpx.AsyncClient,
+    base_url: str,
+    query: str,
+    session_id: Optional[str],
+    stream: bool,
+    started: float,
+    results: Results,
+) -> Tuple[Optional[str], Optional[str]]:
+    """
+    發送一次查詢
+
+    Returns:
+        (錯誤類型, 響應中的 session_id)；成功時錯誤類型為 None
+    """
+    payload: Dict[str, Any] = {'query': query}
+    if session_id is not None:
+        payload['session_id'] = session_id
+    try:
+        if stream:
+            async with client.stream('POST', f'{base_url}/api/agent/stream', json=payload) as response:
+                if response.status_code != 200:
+                    return f'http_{response.status_code}', None
+                data = await _read_stream(response, started, results)
+        else:
+            response = await client.post(f'{base_url}/api/agent', json=payload)
+            if response.status_code != 200:
+                return f'http_{response.status_code}', None
+            data = response.json()
+    except httpx.TimeoutException:
+        return 'timeout', None
+    except httpx.HTTPError:
+        return 'connection', None
+    except RuntimeError as e:
+        return str(e), None
+    return None, data.get('session_id')
+
+
+async def _conversation(
+    client: httpx.AsyncClient,
+    base_url: str,
+    kind: str,
+    query: str,
+    mix: QueryMix,
+    stream: bool,
+    scheduled: float,
+    results: Results,
+) -> None:
+    if kind != 'follow_up':
+        error, _ = await _ask(client, base_url, query, None, stream, scheduled, results)
+        results.record(kind, time.perf_counter() - scheduled, error)
+        return
+
+    # 兩輪會話：首輪查價（計入 price），追問複用服務端會話
+    error, session_id = await _ask(client, base_url, query, '', stream, scheduled, results)
+    results.record('price', time.perf_counter() - scheduled, error)
+    if error or not session_id:
+        return
+    started = time.perf_counter()
+    follow_up = mix.rng.choice(FOLLOW_UP_QUERIES)
+    error, _ = await _ask(client, base_url, follow_up, session_id, stream, started, results)
+    results.record('follow_up', time.perf_counter() - started, error)
+
+
+async def run_load(base_url: str, mix: QueryMix, args) -> Dict[str, Any]:
+    results = Results()
+    rng = mix.rng
+    loop = asyncio.get_running_loop()
+    limits = httpx.Limits(max_connections=args.max_in_flight, max_keepalive_connections=args.max_in_flight)
+    pending = set()
+
+    async with httpx.AsyncClient(timeout=args.timeout, limits=limits) as client:
+        start = loop.time()
+        perf_start = time.perf_counter()
+        next_at = 0.0
+        while next_at < args.duration:
+            await asyncio.sleep(max(0.0, start + next_at - loop.time()))
+            scheduled = perf_start + next_at
+            next_at += rng.expovariate(args.rate) if args.poisson else 1 / args.rate
+            if len(pending) >= args.max_in_flight:
+                results.dropped += 1
+                continue
+            kind, query = mix.pick()
+            stream = rng.random() < args.stream_ratio
+            task = asyncio.ensure_future(
+                _conversation(client, base_url, kind, query, mix, stream, scheduled, results)
+            )
+            pending.add(task)
+            task.add_done_callback(pending.discard)
+        if pending:
+            await asyncio.gather(*pending)
+        elapsed = time.perf_counter() - perf_start
+
+    return results.summary(elapsed)
+
+
+def _server_metrics(base_url: str) -> Dict[str, Any]:
+    try:
+        metrics = httpx.get(f'{base_url}/api/metrics', timeout=5).json()
+    except (httpx.HTTPError, ValueError):
+        return {}
+    keys = ('replies', 'llm_bulkhead', 'hedging', 'coalescing', 'intent_rules')
+    return {key: metrics[key] for key in keys if key in metrics}
+
+
+def _print_report(summary: Dict[str, Any], args) -> None:
+    print(f"\n目標速率 {args.rate:g} req/s × {args.duration:g}s（{'泊松' if args.poisson else '均勻'}到達，"
+          f"流式 {args.stream_ratio:.0%}）")
+    print(f"發送 {summary['sent']}  完成 {summary['completed']}  失敗 {summary['failed']}  "
+          f"丟棄 {summary['dropped']}  耗時 {summary['elapsed_s']}s")
+    print(f"吞吐 {summary['throughput_rps']} req/s  錯誤率 {summary['error_rate']:.2%}"
+          + (f"  {summary['errors']}" if summary['errors'] else ''))
+
+    header = f"\n{'類型':<18} {'請求':>6} {'錯誤':>6} {'P50':>9} {'P90':>9} {'P95':>9} {'P99':>9} {'最大':>9}"
+    print(header)
+    rows = [('overall', summary['overall']), *summary['by_kind'].items()]
+    if summary['stream_first_delta']['count']:
+        rows.append(('stream_first_delta', summary['stream_first_delta']))
+    for name, row in rows:
+        cells = ''.join(
+            f" {row[key]:7.0f}ms" if key in row else f" {'-':>9}"
+            for key in ('p50_ms', 'p90_ms', 'p95_ms', 'p99_ms', 'max_ms')
+        )
+        print(f"{name:<18} {row['count']:>6} {row['errors']:>6}{cells}")
+
+    server = summary.get('server') or {}
+    if server:
+        print('\n服務端統計（/api/metrics）：')
+        for key, value in server.items():
+            print(f"  {key}: {json.dumps(value, ensure_ascii=False)}")
+
+
+def _spawn(args) -> Tuple[str, List[subprocess.Popen]]:
+    """啟動模擬 DeepSeek 和服務，返回服務地址和進程列表"""
+    stub_port = _free_port()
+    stub_url = f'http://127.0.0.1:{stub_port}'
+    processes = [subprocess.Popen(
+        [sys.executable, str(ROOT / 'tools' / 'openai_stub.py'), '--port', str(stub_port), *shlex.split(args.stub_args)],
+    )]
+    _wait_until(f'{stub_url}/stats', 30)
+
+    port = _free_port()
+    env = dict(
+        os.environ,
+        DEEPSEEK_BASE_URL=stub_url,
+        DEEPSEEK_API_KEY='stub',
+        INTENT_CACHE_PATH='',
+        PRODUCTS_WATCH_INTERVAL='0',
+    )
+    if args.products:
+        env['PRODUCTS_JSON_PATH'] = str(Path(args.products).resolve())
+    processes.append(subprocess.Popen(
+        [sys.executable, '-m', 'uvicorn', 'app:app', '--port', str(port),
+         '--workers', str(args.workers), '--log-level', 'warning'],
+        cwd=ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    ))
+    base_url = f'http://127.0.0.1:{port}'
+    _wait_until(f'{base_url}/api/ready', 180)
+    return base_url, processes
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description='智能助手開環壓測')
+    parser.add_argument('--url', help='已運行服務的地址（與 --spawn 二選一）')
+    parser.add_argument('--spawn', action='store_true', help='自動啟動模擬 DeepSeek 和服務')
+    parser.add_argument('--products', help='商品數據文件（生成查詢用；--spawn 時同時作為服務的數據）')
+    parser.add_argument('--rate', type=float, default=10, help='目標請求速率（req/s）')
+    parser.add_argument('--duration', type=float, default=30, help='發送時長（秒）')
+    parser.add_argument('--poisson', action='store_true', help='泊松到達（默認均勻間隔）')
+    parser.add_argument('--mix', type=_parse_mix, default=_parse_mix(DEFAULT_MIX), help=f'查詢比例（默認 {DEFAULT_MIX}）')
+    parser.add_argument('--stream-ratio', type=float, default=0.5, help='走流式端點的請求比例')
+    parser.add_argument('--max-in-flight', type=int, default=500, help='同時在途的請求上限')
+    parser.add_argument('--timeout', type=float, default=60, help='單個請求的超時（秒）')
+    parser.add_argument('--seed', type=int, default=None, help='隨機種子（用於復現查詢序列）')
+    parser.add_argument('--workers', type=int, default=1, help='--spawn 時的 uvicorn worker 數')
+    parser.add_argument('--stub-args', default='--latency 0.8 --latency-dist lognormal --latency-spread 0.4',
+                        help='--spawn 時傳給 tools/openai_stub.py 的參數')
+    parser.add_argument('--json', help='把結果寫入 JSON 文件')
+    args = parser.parse_args()
+
+    if bool(args.url) == args.spawn:
+        parser.error('請指定 --url 或 --spawn 之一')
+    if args.rate <= 0 or args.duration <= 0:
+        parser.error('--rate 和 --duration 必須大於 0')
+
+    products_path = args.products or os.getenv('PRODUCTS_JSON_PATH') or str(ROOT / 'data' / 'products.json')
+    products = load_products_from_file(products_path)
+    if not products:
+        print(f'⚠️ 未能從 {products_path} 讀取商品，使用內置品牌列表且不生成參考號查詢')
+    mix = QueryMix(products, args.mix, random.Random(args.seed))
+
+    processes: List[subprocess.Popen] = []
+    try:
+        if args.spawn:
+            base_url, processes = _spawn(args)
+        else:
+            base_url = args.url.rstrip('/')
+        summary = asyncio.run(run_load(base_url, mix, args))
+        summary['server'] = _server_metrics(base_url)
+    finally:
+        for process in reversed(processes):
+            process.terminate()
+            process.wait()
+
+    _print_report(summary, args)
+    if args.json:
+        Path(args.json).write_text(json.dumps(summary, ensure_ascii=False, indent=2), encoding='utf-8')
+    return 1 if summary['completed'] == 0 else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
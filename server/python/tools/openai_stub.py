@@ -0,0 +1,193 @@
+# -*- coding: utf-8 -*-
+"""
+OpenAI 兼容的模擬 DeepSeek 服務（本地壓測 / 流式調試用，不消耗真實 token）
+
+用法：
+    python tools/openai_stub.py [--port 8900] [--latency 0.8] [--chunks 20] [--chunk-delay 0.05]
+                                [--latency-dist lognormal --latency-spread 0.5] [--intent-latency 0.3]
+                                [--tail-ratio 0.05 --tail-latency 5] [--error-rate 0.01] [--seed 1]
+
+    DEEPSEEK_BASE_URL=http://127.0.0.1:8900 DEEPSEEK_API_KEY=stub python app.py
+
+- 請求帶 response_format 時返回 JSON：只有一條 system 消息視為意圖分類（等待 intent-latency 秒），
+  否則視為單次調用模式（意圖 + 回覆，等待時間與完整回覆相同）；意圖按關鍵詞判斷
+  （問候 → chat，在線查詢 → query_price_online，其餘 → query_price），hint 為去掉查價用語的用戶輸入
+- stream=true 時先等待 latency 秒（模擬首個 token 延遲），再按 chunk-delay 間隔分段推送
+- 否則等待 latency + chunks * chunk-delay 秒後返回完整回覆
+- 延遲分佈（latency-dist）：fixed 固定；uniform 在 latency ± spread 內均勻分佈；
+  normal 均值 latency、標準差 spread；lognormal 中位數 latency、對數標準差 spread；
+  exponential 均值 latency
+- 每個請求以 tail-ratio 的概率額外等待 tail-latency 秒（模擬長尾延遲，用於驗證對沖請求）
+- 每個請求以 error-rate 的概率返回 503（SDK 會按 DEEPSEEK_MAX_RETRIES 重試）
+- GET /stats 返回各類請求數，POST /stats/reset 清零
+"""
+
+import re
+import json
+import time
+import random
+import asyncio
+import argparse
+from typing import Any, Dict, List, Optional
+
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+REPLY_TEXT = '您好！為您查詢到該商品，價格與參考號見上方信息，如需在線查詢最新款式請告訴我品牌和品類。'
+CHAT_TEXT = '您好，我是Feel智能助手，您可以給我商品具體名稱或者識別碼我來幫您查詢它們對應的價格。'
+
+# 關鍵詞意圖判斷（近似模型行為，足夠覆蓋壓測查詢）
+CHAT_WORDS = ('你好', '您好', '謝謝', '谢谢', '天氣', '天气', '你是誰', '你是谁', 'hello', 'hi', 'thanks', 'merci', 'bonjour')
+ONLINE_WORDS = ('在線', '在线', '上網', '上网', '網上', '网上', '搜索', 'online', 'search')
+PRICE_WORDS_RE = re.compile(r'多少錢|多少钱|價格多少|价格多少|價格|价格|價錢|价钱|報價|报价|how much|price|prix|combien', re.I)
+
+DISTRIBUTIONS = ('fixed', 'uniform', 'normal', 'lognormal', 'exponential')
+
+app = FastAPI()
+settings = argparse.Namespace(
+    latency=0.8, intent_latency=None, latency_dist='fixed', latency_spread=0.0,
+    chunks=20, chunk_delay=0.05, tail_ratio=0.0, tail_latency=0.0, error_rate=0.0,
+)
+counters = {'intent': 0, 'answer': 0, 'chat': 0, 'stream': 0, 'errors': 0}
+
+
+def _latency(base: Optional[float] = None) -> float:
+    """首個 token 前的延遲：按分佈抽樣，並按概率注入長尾"""
+    base = settings.latency if base is None else base
+    spread = settings.latency_spread
+    dist = settings.latency_dist
+    if dist == 'uniform':
+        value = random.uniform(base - spread, base + spread)
+    elif dist == 'normal':
+        value = random.gauss(base, spread)
+    elif dist == 'lognormal':
+        value = base * random.lognormvariate(0, spread)
+    elif dist == 'exponential':
+        value = random.expovariate(1 / base) if base > 0 else 0.0
+    else:
+        value = base
+    if settings.tail_ratio and random.random() < settings.tail_ratio:
+        value += settings.tail_latency
+    return max(0.0, value)
+
+
+def _classify(text: str) -> Dict[str, str]:
+    lowered = text.lower()
+    if not PRICE_WORDS_RE.search(lowered) and any(word in lowered for word in CHAT_WORDS):
+        return {'intent': 'chat', 'hint': '', 'message': CHAT_TEXT}
+    intent = 'query_price_online' if any(word in lowered for word in ONLINE_WORDS) else 'query_price'
+    hint = PRICE_WORDS_RE.sub(' ', text)
+    for word in ONLINE_WORDS:
+        hint = hint.replace(word, ' ')
+    return {'intent': intent, 'hint': ' '.join(hint.split()) or text, 'message': ''}
+
+
+def _split(text: str, parts: int) -> List[str]:
+    size = max(1, -(-len(text) // max(1, parts)))
+    return [text[i:i + size] for i in range(0, len(text), size)]
+
+
+def _completion(model: str, content: str) -> Dict[str, Any]:
+    return {
+        'id': 'chatcmpl-stub',
+        'object': 'chat.completion',
+        'created': int(time.time()),
+        'model': model,
+        'choices': [{'index': 0, 'message': {'role': 'assistant', 'content': content}, 'finish_reason': 'stop'}],
+        'usage': {'prompt_tokens': 0, 'completion_tokens': 0, 'total_tokens': 0},
+    }
+
+
+def _chunk(model: str, delta: Dict[str, Any], finish_reason=None) -> bytes:
+    payload = {
+        'id': 'chatcmpl-stub',
+        'object': 'chat.completion.chunk',
+        'created': int(time.time()),
+        'model': model,
+        'choices': [{'index': 0, 'delta': delta, 'finish_reason': finish_reason}],
+    }
+    return f"data: {json.dumps(payload, ensure_ascii=False)}\n\n".encode('utf-8')
+
+
+async def _stream(model: str):
+    await asyncio.sleep(_latency())
+    yield _chunk(model, {'role': 'assistant', 'content': ''})
+    for piece in _split(REPLY_TEXT, settings.chunks):
+        yield _chunk(model, {'content': piece})
+        await asyncio.sleep(settings.chunk_delay)
+    yield _chunk(model, {}, 'stop')
+    yield b"data: [DONE]\n\n"
+
+
+@app.post("/chat/completions")
+@app.post("/v1/chat/completions")
+async def chat_completions(request: Request):
+    body = await request.json()
+    model = body.get('model', 'deepseek-chat')
+    messages = body.get('messages', [])
+
+    if settings.error_rate and random.random() < settings.error_rate:
+        counters['errors'] += 1
+        return JSONResponse(
+            status_code=503,
+            content={'error': {'message': 'stub: injected error', 'type': 'server_error'}},
+        )
+
+    if body.get('response_format'):
+        user = next((m.get('content', '') for m in reversed(messages) if m.get('role') == 'user'), '')
+        result = _classify(user)
+        if sum(1 for m in messages if m.get('role') == 'system') <= 1:
+            counters['intent'] += 1
+            await asyncio.sleep(_latency(settings.intent_latency))
+        else:
+            counters['answer'] += 1
+            await asyncio.sleep(_latency() + settings.chunks * settings.chunk_delay)
+            result['message'] = result['message'] or REPLY_TEXT
+        return _completion(model, json.dumps(result, ensure_ascii=False))
+
+    if body.get('stream'):
+        counters['stream'] += 1
+        return StreamingResponse(_stream(model), media_type="text/event-stream")
+
+    counters['chat'] += 1
+    await asyncio.sleep(_latency() + settings.chunks * settings.chunk_delay)
+    return _completion(model, REPLY_TEXT)
+
+
+@app.get("/stats")
+async def stats():
+    return dict(counters)
+
+
+@app.post("/stats/reset")
+async def reset_stats():
+    for key in counters:
+        counters[key] = 0
+    return dict(counters)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='OpenAI 兼容的模擬 DeepSeek 服務')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8900)
+    parser.add_argument('--latency', type=float, default=settings.latency, help='首個 token 前的延遲（秒）')
+    parser.add_argument('--intent-latency', type=float, default=None, help='意圖分類的延遲（秒，默認同 --latency）')
+    parser.add_argument('--latency-dist', choices=DISTRIBUTIONS, default='fixed', help='延遲分佈')
+    parser.add_argument('--latency-spread', type=float, default=0.0, help='延遲分佈的離散程度（見說明）')
+    parser.add_argument('--chunks', type=int, default=settings.chunks, help='回覆分段數')
+    parser.add_argument('--chunk-delay', type=float, default=settings.chunk_delay, help='分段間隔（秒）')
+    parser.add_argument('--tail-ratio', type=float, default=0.0, help='注入長尾延遲的請求比例')
+    parser.add_argument('--tail-latency', type=float, default=0.0, help='長尾請求額外的延遲（秒）')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='返回 503 的請求比例')
+    parser.add_argument('--seed', type=int, default=None, help='隨機種子（用於復現）')
+    args = parser.parse_args()
+    if args.seed is not None:
+        random.seed(args.seed)
+    for name in vars(settings):
+        setattr(settings, name, getattr(args, name))
+    uvicorn.run(app, host=args.host, port=args.port, log_level='warning')
+
+
+if __name__ == '__main__':
+    main()
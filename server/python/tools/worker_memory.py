@@ -0,0 +1,53 @@
+# -*- coding: utf-8 -*-
+"""
+測量 gunicorn 各 worker 的內存佔用
+
+用法：
+    python tools/worker_memory.py <gunicorn 主進程 PID>
+
+PSS 將共享頁按進程數均攤，所有進程 PSS 之和即整組服務的實際內存；
+USS 為每個 worker 的獨佔內存，增加一個 worker 的邊際成本約等於其 USS。
+"""
+
+import sys
+from pathlib import Path
+
+# 確保可以導入本地模塊
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from services.runtime_stats import read_process_memory, list_child_pids
+
+
+def _mb(kb: int) -> str:
+    return f"{kb / 1024:8.1f} MB"
+
+
+def main() -> int:
+    if len(sys.argv) != 2 or not sys.argv[1].isdigit():
+        print(__doc__)
+        return 2
+
+    master = int(sys.argv[1])
+    pids = [master] + list_child_pids(master)
+    total_pss = 0
+    total_rss = 0
+
+    print(f"{'PID':>8} {'角色':<8} {'RSS':>11} {'PSS':>11} {'USS':>11} {'Shared':>11}")
+    for pid in pids:
+        mem = read_process_memory(pid)
+        if mem is None:
+            continue
+        role = 'master' if pid == master else 'worker'
+        total_pss += mem['pss_kb']
+        total_rss += mem['rss_kb']
+        print(
+            f"{pid:>8} {role:<8} {_mb(mem['rss_kb'])} {_mb(mem['pss_kb'])} "
+            f"{_mb(mem['uss_kb'])} {_mb(mem['shared_kb'])}"
+        )
+
+    print(f"\n進程數: {len(pids)}  RSS 合計: {_mb(total_rss).strip()}  實際佔用 (PSS 合計): {_mb(total_pss).strip()}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
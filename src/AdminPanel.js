@@ -205,7 +205,7 @@ const AdminPanel = ({ onLogout }) => {
         let errorDetail = '';
         try {
           const errorData = await response.json();
-          errorDetail = errorData.error || '';
+          errorDetail = errorData.error || errorData.detail || '';
         } catch (e) {
           errorDetail = `HTTP ${response.status}`;
         }
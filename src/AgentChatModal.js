@@ -115,11 +115,14 @@ export default function AgentChatModal({ open, onClose }) {
     { role: 'assistant', text: DEFAULT_GREETING },
   ]);
   const [loading, setLoading] = useState(false);
+  const [streaming, setStreaming] = useState(false);
   const [error, setError] = useState('');
   const [copiedIndex, setCopiedIndex] = useState(null);
   const [selectedImage, setSelectedImage] = useState(null);
   const [imagePreview, setImagePreview] = useState(null);
   const messagesRef = useRef(messages);
+  // 服务端会话 id：有会话时只发送新消息，历史由服务端保存
+  const sessionIdRef = useRef('');
   
   // 用于自动滚动到底部
   const messagesEndRef = useRef(null);
@@ -210,16 +213,123 @@ export default function AgentChatModal({ open, onClose }) {
     fileInputRef.current?.click();
   };
 
-  const requestAssistant = async ({ query, baseMessages }) => {
-    const history = toHistoryPayload(baseMessages);
-    const resp = await fetch(`${API_URL}/api/agent`, {
-      method: 'POST',
-      headers: { 'Content-Type': 'application/json' },
-      body: JSON.stringify({ query, messages: history }),
+  // 解析 SSE 文本块，返回完整事件和未结束的剩余部分
+  const parseSseEvents = (buffer) => {
+    const chunks = buffer.split('\n\n');
+    const rest = chunks.pop();
+    const events = chunks.map((chunk) => {
+      let event = 'message';
+      const dataLines = [];
+      chunk.split('\n').forEach((line) => {
+        if (line.startsWith('event:')) event = line.slice(6).trim();
+        else if (line.startsWith('data:')) dataLines.push(line.slice(5).trim());
+      });
+      let data = null;
+      try {
+        data = dataLines.length ? JSON.parse(dataLines.join('\n')) : null;
+      } catch {
+        data = null;
+      }
+      return { event, data };
     });
+    return { events, rest };
+  };
+
+  const postAgentStream = (payload) => fetch(`${API_URL}/api/agent/stream`, {
+    method: 'POST',
+    headers: { 'Content-Type': 'application/json', Accept: 'text/event-stream' },
+    body: JSON.stringify(payload),
+  });
+
+  // 流式请求：每收到一段回复调用 onDelta(已生成的全文)，返回最终回复
+  const requestAssistant = async ({ query, baseMessages, onDelta }) => {
+    const history = toHistoryPayload(baseMessages);
+    let resp = sessionIdRef.current
+      ? await postAgentStream({ query, session_id: sessionIdRef.current })
+      : null;
+    // 会话不存在（新对话 / 已过期 / 服务端重启）：附带完整历史新建会话
+    if (!resp || resp.status === 409) {
+      sessionIdRef.current = '';
+      resp = await postAgentStream({ query, messages: history, session_id: '' });
+    }
     if (!resp.ok) throw new Error(`HTTP ${resp.status}`);
-    const data = await resp.json();
-    return data?.message || '不知道';
+
+    // 不支持流式读取的环境：整体读取后解析
+    const reader = resp.body?.getReader ? resp.body.getReader() : null;
+    const decoder = new TextDecoder();
+    let buffer = reader ? '' : await resp.text();
+    let text = '';
+    let final = null;
+    let failed = false;
+
+    const handle = ({ event, data }) => {
+      if (data?.session_id) sessionIdRef.current = data.session_id;
+      if (event === 'delta' && data?.text) {
+        text += data.text;
+        onDelta?.(text);
+      } else if (event === 'done') {
+        final = data?.message || text;
+      } else if (event === 'error') {
+        failed = true;
+      }
+    };
+
+    if (!reader) {
+      parseSseEvents(`${buffer}\n\n`).events.forEach(handle);
+    } else {
+      for (;;) {
+        const { value, done } = await reader.read();
+        if (done) break;
+        buffer += decoder.decode(value, { stream: true });
+        const parsed = parseSseEvents(buffer);
+        buffer = parsed.rest;
+        parsed.events.forEach(handle);
+      }
+    }
+
+    if (final !== null) return final || '不知道';
+    if (failed && text) return `${text}\n\n（回复中断，请点击重新生成）`;
+    if (text) return text;
+    throw new Error('stream_incomplete');
+  };
+
+  // 请求助手回复：首段内容到达后追加一条助手消息并持续更新
+  const runAssistant = async ({ query, baseMessages }) => {
+    setLoading(true);
+    let started = false;
+    const showText = (text) => {
+      setMessages((prev) => {
+        if (!started) {
+          started = true;
+          return [...prev, { role: 'assistant', text }];
+        }
+        const next = prev.slice();
+        next[next.length - 1] = { ...next[next.length - 1], text };
+        return next;
+      });
+    };
+
+    try {
+      const reply = await requestAssistant({
+        query,
+        baseMessages,
+        onDelta: (text) => {
+          setStreaming(true);
+          showText(text);
+        },
+      });
+      showText(reply);
+    } catch (e) {
+      setError('服务异常，请稍后再试');
+      if (started) {
+        showText('不好意思，服务暂时不可用。');
+      } else {
+        setMessages((prev) => [...prev, { role: 'assistant', text: '不好意思，服务暂时不可用。' }]);
+      }
+    } finally {
+      setStreaming(false);
+      setLoading(false);
+    }
   };
 
   const sendText = async (text) => {
@@ -263,6 +373,8 @@ export default function AgentChatModal({ open, onClose }) {
           ? results.map(r => `📌 ${r.title}\n   🔗 ${r.link}`).join('\n\n')
           : '未找到相關圖片搜索結果。';
         setMessages((prev) => [...prev, { role: 'assistant', text: replyText }]);
+        // 图片搜索的对话不在服务端会话中，下一轮附带完整历史新建会话
+        sessionIdRef.current = '';
       } catch (e) {
         console.error('[ReverseImg]', e);
         setMessages((prev) => [...prev, { role: 'assistant', text: `圖片搜索失敗：${e.message}` }]);
@@ -275,23 +387,14 @@ export default function AgentChatModal({ open, onClose }) {
     const nextMessages = [...base, { role: 'user', text: query }];
     setMessages(nextMessages);
     setInput('');
-    setLoading(true);
-
-    try {
-      const reply = await requestAssistant({ query, baseMessages: nextMessages });
-      setMessages((prev) => [...prev, { role: 'assistant', text: reply }]);
-    } catch (e) {
-      setError('服务异常，请稍后再试');
-      setMessages((prev) => [...prev, { role: 'assistant', text: '不好意思，服务暂时不可用。' }]);
-    } finally {
-      setLoading(false);
-    }
+    await runAssistant({ query, baseMessages: nextMessages });
   };
 
   const handleClear = () => {
     if (loading) return;
     setError('');
     setCopiedIndex(null);
+    sessionIdRef.current = '';
     setMessages([{ role: 'assistant', text: DEFAULT_GREETING }]);
     setInput('');
     handleRemoveImage();
@@ -315,16 +418,9 @@ export default function AgentChatModal({ open, onClose }) {
 
     setError('');
     setMessages(trimmedBase);
-    setLoading(true);
-    try {
-      const reply = await requestAssistant({ query, baseMessages: trimmedBase });
-      setMessages((prev) => [...prev, { role: 'assistant', text: reply }]);
-    } catch {
-      setError('服务异常，请稍后再试');
-      setMessages((prev) => [...prev, { role: 'assistant', text: '不好意思，服务暂时不可用。' }]);
-    } finally {
-      setLoading(false);
-    }
+    // 服务端会话已包含被重新生成的这一轮，改为按裁剪后的历史新建会话
+    sessionIdRef.current = '';
+    await runAssistant({ query, baseMessages: trimmedBase });
   };
 
   const sendMessage = async () => {
@@ -404,8 +500,8 @@ export default function AgentChatModal({ open, onClose }) {
               </div>
             </div>
           ))}
-          {/* 加载中提示 */}
-          {loading && (
+          {/* 加载中提示（回复开始输出后隐藏） */}
+          {loading && !streaming && (
             <div className="flex justify-start">
               <div className={bubbleBase + ' bg-white text-ink-600 border-ink-200'}>
                 <span className="inline-flex items-center gap-2">
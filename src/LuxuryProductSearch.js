@@ -217,38 +217,88 @@ const LuxuryProductSearch = ({ onReturnToWelcome }) => {
     if (cachedVersion !== DATA_VERSION) {
       console.log('清除舊版本緩存...');
       localStorage.removeItem('luxury_products');
+      localStorage.removeItem('luxury_products_catalog_version');
       localStorage.setItem('luxury_products_version', DATA_VERSION);
     }
 
     // 1) 嘗試先從 localStorage 顯示舊數據（即時呈現）
+    let cached = null;
     try {
       const raw = localStorage.getItem('luxury_products');
       if (raw) {
         const parsed = JSON.parse(raw);
-        if (Array.isArray(parsed) && mounted) setProducts(parsed);
+        if (Array.isArray(parsed)) {
+          cached = parsed;
+          if (mounted) setProducts(parsed);
+        }
       }
     } catch (e) {
       console.warn('localStorage read failed', e);
     }
 
-    // 2) 後台從 API 拉取最新數據（slim=true 精簡字段）
-    fetch(`${API_URL}/api/products?slim=true`)
+    const saveToCache = (data, catalogVersion) => {
+      try {
+        localStorage.setItem('luxury_products', JSON.stringify(data));
+        localStorage.setItem('luxury_products_version', DATA_VERSION);
+        if (catalogVersion) {
+          localStorage.setItem('luxury_products_catalog_version', catalogVersion);
+        } else {
+          localStorage.removeItem('luxury_products_catalog_version');
+        }
+      } catch (e) {
+        console.warn('localStorage write failed', e);
+      }
+    };
+
+    // 2a) 全量拉取（slim=true 精簡字段）
+    const fetchFull = () => fetch(`${API_URL}/api/products?slim=true`)
       .then(res => {
         if (!res.ok) throw new Error('no server');
-        return res.json();
+        const catalogVersion = res.headers.get('X-Catalog-Version');
+        return res.json().then(data => ({ data, catalogVersion }));
       })
-      .then(data => {
+      .then(({ data, catalogVersion }) => {
         if (mounted && Array.isArray(data)) {
           setProducts(data);
           // 存入 localStorage 供下次快速顯示
-          try {
-            localStorage.setItem('luxury_products', JSON.stringify(data));
-            localStorage.setItem('luxury_products_version', DATA_VERSION);
-          } catch (e) {
-            console.warn('localStorage write failed', e);
-          }
+          saveToCache(data, catalogVersion);
         }
+      });
+
+    // 2b) 已有緩存時只拉取增量（新增/修改/刪除），版本過舊時服務端要求全量同步
+    const fetchChanges = (since) => fetch(`${API_URL}/api/products/changes?slim=true&since=${encodeURIComponent(since)}`)
+      .then(res => {
+        if (!res.ok) throw new Error('no server');
+        return res.json();
       })
+      .then(delta => {
+        if (delta.full_resync) return fetchFull();
+        if (!mounted) return;
+        if (!delta.upserted.length && !delta.deleted.length) {
+          saveToCache(cached, delta.version);
+          return;
+        }
+        const keyOf = (p) => String(p.produit || '').trim().toLowerCase();
+        const removed = new Set(delta.deleted.map(ref => String(ref).trim().toLowerCase()));
+        const upserts = new Map(delta.upserted.map(p => [keyOf(p), p]));
+        const merged = [];
+        cached.forEach(p => {
+          const key = keyOf(p);
+          if (removed.has(key)) return;
+          if (upserts.has(key)) {
+            merged.push(upserts.get(key));
+            upserts.delete(key);
+          } else {
+            merged.push(p);
+          }
+        });
+        upserts.forEach(p => merged.push(p));
+        setProducts(merged);
+        saveToCache(merged, delta.version);
+      });
+
+    const since = localStorage.getItem('luxury_products_catalog_version');
+    (cached && since ? fetchChanges(since) : fetchFull())
       .catch((err) => {
         console.warn('API fetch failed, using localStorage data', err);
       });
@@ -394,6 +444,9 @@ const LuxuryProductSearch = ({ onReturnToWelcome }) => {
     return raw.split(/,(?=https?:\/\/)/).map(url => url.trim()).filter(url => url);
   };
 
+  // 缩略图代理：按宽度缩放并缓存，避免网格中加载原图
+  const thumbnailUrl = (url, width) => `${API_URL}/api/img?w=${width}&url=${encodeURIComponent(url)}`;
+
   // 产品卡片组件
   const ProductCard = ({ product, index, keyPrefix = '' }) => {
     const imageUrls = getProductImageUrls(product);
@@ -425,11 +478,19 @@ const LuxuryProductSearch = ({ onReturnToWelcome }) => {
           {currentImageUrl ? (
             <>
               <img
-                src={currentImageUrl}
+                src={thumbnailUrl(currentImageUrl, 384)}
+                srcSet={`${thumbnailUrl(currentImageUrl, 384)} 1x, ${thumbnailUrl(currentImageUrl, 768)} 2x`}
                 alt={product.designation || '商品图片'}
                 loading="lazy"
                 className="w-full h-full object-cover transition-all duration-700 group-hover:scale-110"
                 onError={(e) => {
+                  // 代理失败时退回原图，原图也失败则隐藏
+                  if (e.target.dataset.fallback !== '1') {
+                    e.target.dataset.fallback = '1';
+                    e.target.removeAttribute('srcset');
+                    e.target.src = currentImageUrl;
+                    return;
+                  }
                   e.target.style.display = 'none';
                 }}
               />